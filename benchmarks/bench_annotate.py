@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark Annotate.annotate scaling.
+
+Times annotation of synthetic somaticsniper VCFs of increasing size, and
+reports the throughput of the raw VCF read. With the hash-indexed high
+confidence lookup the time per record should stay roughly constant as the
+record count grows.
+
+    python -m benchmarks.bench_annotate --sizes 10000 20000 40000 80000
+    python -m benchmarks.bench_annotate --buffer-sizes 65536 1048576
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from somaticsniper_tool.annotate import Annotate
+from somaticsniper_tool.vcf_batch import BATCH_BYTES
+
+HEADER = (
+    "##fileformat=VCFv4.1\n"
+    "##reference=file:///reference.fa\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR\n"
+)
+RECORD = (
+    "chr1\t{pos}\t.\t{ref}\t{alt}\t.\t.\t.\tGT:SS:SSC:MQ\t0/0:0:.:60\t0/1:2:{ssc}:60\n"
+)
+
+
+def write_inputs(dirname: str, size: int, hc_fraction: float, seed: int = 0):
+    rng = random.Random(seed)
+    raw_vcf = os.path.join(dirname, "raw_{}.vcf".format(size))
+    hc_file = "{}.SNPfilter.hc".format(raw_vcf)
+    with open(raw_vcf, 'w') as raw_fh, open(hc_file, 'w') as hc_fh:
+        raw_fh.write(HEADER)
+        hc_fh.write(HEADER)
+        for i in range(size):
+            ref, alt = rng.sample("ACGT", 2)
+            line = RECORD.format(
+                pos=100 + i * 10, ref=ref, alt=alt, ssc=rng.randint(0, 99)
+            )
+            raw_fh.write(line)
+            if rng.random() < hc_fraction:
+                hc_fh.write(line)
+    return raw_vcf, hc_file
+
+
+def time_annotate(raw_vcf: str, hc_file: str, repeat: int, buffer_size: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with Annotate(os.devnull, buffer_size=buffer_size) as annotate:
+            annotate(raw_vcf, hc_file)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=[10000, 20000, 40000, 80000, 160000]
+    )
+    parser.add_argument("--hc-fraction", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--buffer-sizes", nargs="+", type=int, default=[BATCH_BYTES])
+    args = parser.parse_args(argv)
+
+    print(
+        "{:>10} {:>10} {:>10} {:>14} {:>10}".format(
+            "records", "buffer", "seconds", "us/record", "MB/s"
+        )
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in args.sizes:
+            raw_vcf, hc_file = write_inputs(tmpdir, size, args.hc_fraction)
+            megabytes = os.path.getsize(raw_vcf) / 1e6
+            for buffer_size in args.buffer_sizes:
+                elapsed = time_annotate(raw_vcf, hc_file, args.repeat, buffer_size)
+                print(
+                    "{:>10} {:>10} {:>10.4f} {:>14.3f} {:>10.1f}".format(
+                        size,
+                        buffer_size,
+                        elapsed,
+                        elapsed / size * 1e6,
+                        megabytes / elapsed,
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
+
+# __END__
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark merge_outputs over many region VCFs.
+
+Writes synthetic per-region annotated VCFs in a shuffled (completion-like)
+order and reports the throughput of merging them in coordinate order, for
+each buffer size. Disjoint regions are copied whole; --overlap interleaves
+the positions of neighbouring regions, so they take the k-way merge.
+
+    python -m benchmarks.bench_merge --regions 128 --records 5000
+    python -m benchmarks.bench_merge --overlap --buffer-sizes 65536 1048576
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from somaticsniper_tool import utils
+
+HEADER = (
+    "##fileformat=VCFv4.1\n"
+    "##reference=file:///reference.fa\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR\n"
+)
+RECORD = (
+    "{chrom}\t{pos}\t.\tA\tG\t.\tREJECT\t.\tGT:SS:SSC:MQ\t0/0:0:.:60\t0/1:2:44:60\n"
+)
+
+
+def write_regions(
+    dirname: str, regions: int, records: int, overlap: bool = False, seed: int = 0
+):
+    rng = random.Random(seed)
+    contigs = ["chr{}".format(c) for c in list(range(1, 23)) + ["X", "Y"]]
+    per_contig = -(-regions // len(contigs))
+    files = []
+    for i in range(regions):
+        chrom = contigs[i // per_contig]
+        start = (i % per_contig) * records * 100
+        if overlap:
+            start = (i % per_contig) // 2 * records * 100 + i % 2 * 50
+        path = os.path.join(dirname, "{}-{}.annotated.vcf".format(chrom, start))
+        with open(path, 'w') as fh:
+            fh.write(HEADER)
+            for j in range(records):
+                fh.write(RECORD.format(chrom=chrom, pos=start + j * 100 + 1))
+        files.append(path)
+    rng.shuffle(files)
+    return files, {chrom: i for i, chrom in enumerate(contigs)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--regions", type=int, default=128)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--overlap", action="store_true")
+    parser.add_argument(
+        "--buffer-sizes",
+        nargs="+",
+        type=int,
+        default=[1 << 16, utils.MERGE_BUFFER_SIZE, 1 << 23],
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files, contig_order = write_regions(
+            tmpdir, args.regions, args.records, overlap=args.overlap
+        )
+        size = sum(os.path.getsize(f) for f in files)
+        merged = os.path.join(tmpdir, "merged.vcf")
+        print("regions: {}".format(args.regions))
+        print("records: {}".format(args.regions * args.records))
+        print("input MB: {:.1f}".format(size / 1e6))
+        print("{:>12} {:>10} {:>10}".format("buffer", "seconds", "MB/s"))
+        for buffer_size in args.buffer_sizes:
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                with open(merged, 'wb') as out_fh:
+                    utils.merge_outputs(
+                        files,
+                        out_fh,
+                        contig_order=contig_order,
+                        buffer_size=buffer_size,
+                    )
+                best = min(best, time.perf_counter() - start)
+            print(
+                "{:>12} {:>10.3f} {:>10.1f}".format(
+                    buffer_size, best, size / 1e6 / best
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
+
+# __END__
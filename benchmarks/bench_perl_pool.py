@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark perl script runs per process against the perl worker pool.
+
+Runs a stand-in filter script, which loads Getopt::Long and Pod::Usage and
+copies a small VCF like snpfilter.pl, once per region: as a new perl
+process per run, and on a PerlWorkerPool. Small regions are dominated by
+interpreter startup, which the pool pays once per worker.
+
+    python -m benchmarks.bench_perl_pool --regions 500 --threads 1 8
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from somaticsniper_tool import utils
+from somaticsniper_tool.metrics import RunMetrics
+from somaticsniper_tool.perl_pool import PerlWorkerPool
+
+SCRIPT = """
+use strict;
+use warnings;
+use Getopt::Long;
+use Pod::Usage;
+my $snp_file;
+GetOptions("snp-file=s" => \\$snp_file) or die "bad options\\n";
+open(my $in, '<', $snp_file) or die "Cannot open $snp_file\\n";
+open(my $out, '>', "$snp_file.SNPfilter") or die "Cannot write\\n";
+print $out $_ while <$in>;
+close $out;
+"""
+
+RECORD = "chr1\t{}\t.\tA\tG\t.\t.\t.\tGT:SS\t0/0:0\t0/1:2\n"
+
+
+def write_inputs(dirname: str, regions: int, records: int):
+    script = os.path.join(dirname, "filter.pl")
+    with open(script, 'w') as fh:
+        fh.write(SCRIPT)
+    vcfs = []
+    for region in range(regions):
+        vcf = os.path.join(dirname, "{}.vcf".format(region))
+        with open(vcf, 'w') as fh:
+            fh.writelines(RECORD.format(100 + i) for i in range(records))
+        vcfs.append(vcf)
+    return script, vcfs
+
+
+def time_runs(run, vcfs, threads: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(run, vcfs))
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--regions", type=int, default=500)
+    parser.add_argument("--records", type=int, default=50)
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 8])
+    args = parser.parse_args(argv)
+
+    print(
+        "{:>8} {:>10} {:>10} {:>12} {:>14}".format(
+            "threads", "mode", "seconds", "ms/region", "startup saved"
+        )
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        script, vcfs = write_inputs(tmpdir, args.regions, args.records)
+        for threads in args.threads:
+            elapsed = time_runs(
+                lambda vcf: utils.run_subprocess_command(
+                    "perl {} --snp-file {}".format(script, vcf),
+                    None,
+                    stream_output=True,
+                ),
+                vcfs,
+                threads,
+            )
+            print(
+                "{:>8} {:>10} {:>10.3f} {:>12.3f} {:>14}".format(
+                    threads, "process", elapsed, elapsed / args.regions * 1e3, "-"
+                )
+            )
+            pool = PerlWorkerPool(threads)
+            elapsed = time_runs(
+                lambda vcf: pool.run(script, ["--snp-file", vcf], None), vcfs, threads
+            )
+            pool.close(_metrics=RunMetrics())
+            print(
+                "{:>8} {:>10} {:>10.3f} {:>12.3f} {:>13.3f}s".format(
+                    threads,
+                    "pool",
+                    elapsed,
+                    elapsed / args.regions * 1e3,
+                    pool.report()["startup_seconds_saved"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
+
+# __END__
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Simulate region scheduling makespan.
+
+Replays the thread pool's behaviour (each free worker takes the next queued
+region) over GRCh38 chr1-chrY, with per-region runtime proportional to
+length plus noise, and compares submission orders.
+
+    python -m benchmarks.bench_scheduler --threads 8 16 24 32
+"""
+
+import argparse
+import heapq
+import random
+import statistics
+from typing import List
+
+from somaticsniper_tool import scheduler
+
+GRCH38 = {
+    "chr1": 248956422,
+    "chr2": 242193529,
+    "chr3": 198295559,
+    "chr4": 190214555,
+    "chr5": 181538259,
+    "chr6": 170805979,
+    "chr7": 159345973,
+    "chr8": 145138636,
+    "chr9": 138394717,
+    "chr10": 133797422,
+    "chr11": 135086622,
+    "chr12": 133275309,
+    "chr13": 114364328,
+    "chr14": 107043718,
+    "chr15": 101991189,
+    "chr16": 90338345,
+    "chr17": 83257441,
+    "chr18": 80373285,
+    "chr19": 58617616,
+    "chr20": 64444167,
+    "chr21": 46709983,
+    "chr22": 50818468,
+    "chrX": 156040895,
+    "chrY": 57227415,
+}
+# Seconds per megabase of region
+RATE = 6.0
+
+
+def makespan(durations: List[float], threads: int) -> float:
+    """Finish time of greedy list scheduling in the given order."""
+    workers = [0.0] * threads
+    for duration in durations:
+        heapq.heapreplace(workers, workers[0] + duration)
+    return max(workers)
+
+
+def simulate(threads: int, trials: int, noise: float, seed: int = 0):
+    rng = random.Random(seed)
+    mpileups = ["{}-1-{}.mpileup".format(c, n) for c, n in GRCH38.items()]
+    results = {"input (random)": [], "lexical": [], "longest-first": []}
+    bound = []
+    for _ in range(trials):
+        jitter = {m: rng.uniform(1 - noise, 1 + noise) for m in mpileups}
+        cost = {
+            m: RATE * scheduler.region_length(m) / 1e6 * jitter[m] for m in mpileups
+        }
+        shuffled = rng.sample(mpileups, len(mpileups))
+        orders = {
+            "input (random)": shuffled,
+            "lexical": sorted(mpileups),
+            # Region length is the only cost signal without real mpileups
+            "longest-first": scheduler.order_regions(shuffled, 'longest-first'),
+        }
+        for name, order in orders.items():
+            results[name].append(makespan([cost[m] for m in order], threads))
+        bound.append(max(sum(cost.values()) / threads, max(cost.values())))
+    return results, statistics.mean(bound)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", nargs="+", type=int, default=[8, 16, 24, 32])
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    print(
+        "{:>8} {:>16} {:>10} {:>10} {:>10}".format(
+            "threads", "order", "mean s", "worst s", "vs bound"
+        )
+    )
+    for threads in args.threads:
+        results, bound = simulate(threads, args.trials, args.noise)
+        for name, spans in results.items():
+            mean = statistics.mean(spans)
+            print(
+                "{:>8} {:>16} {:>10.0f} {:>10.0f} {:>10.2f}".format(
+                    threads, name, mean, max(spans), mean / bound
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
+
+# __END__
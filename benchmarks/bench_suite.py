@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite of the workflow's hot paths at increasing scale.
+
+Times Annotate.annotate, merge_outputs, tpe_submit_commands scheduling of
+no-op regions, and an end-to-end multi_somaticsniper.run with stub tools,
+see synthetic, at each scale: a multiple of the base input sizes below.
+Results are printed and written as JSON, for tracking regressions between
+commits on the same host.
+
+    python -m benchmarks.bench_suite --scales 1 10 100 --output results.json
+    python -m benchmarks.bench_suite --only annotate merge --repeat 5
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from benchmarks import synthetic
+from somaticsniper_tool import multi_somaticsniper, utils
+from somaticsniper_tool.annotate import Annotate
+
+# Sizes at scale 1
+ANNOTATE_RECORDS = 2000
+MERGE_REGIONS = 8
+MERGE_RECORDS = 500
+SCHEDULE_REGIONS = 24
+RUN_REGIONS = 4
+RUN_RECORDS = 200
+
+
+def best_of(repeat: int, fn: Callable[[], None]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_annotate(dirname: str, scale: int, args) -> Dict:
+    records = ANNOTATE_RECORDS * scale
+    raw_vcf = synthetic.write_sniper_vcf(
+        os.path.join(dirname, "raw.vcf"), "chr1", 1, 10 ** 9, records, seed=args.seed
+    )
+    hc_file = synthetic.write_hc(raw_vcf, raw_vcf + ".SNPfilter.hc", seed=args.seed)
+
+    def annotate():
+        with Annotate(os.devnull) as annotate:
+            annotate(raw_vcf, hc_file)
+
+    seconds = best_of(args.repeat, annotate)
+    return {
+        "records": records,
+        "seconds": seconds,
+        "us_per_record": seconds / records * 1e6,
+        "mb_per_second": os.path.getsize(raw_vcf) / 1e6 / seconds,
+    }
+
+
+def bench_merge(dirname: str, scale: int, args) -> Dict:
+    regions = MERGE_REGIONS * scale
+    files = [
+        synthetic.write_sniper_vcf(
+            os.path.join(dirname, "{}-{}.annotated.vcf".format(chrom, start)),
+            chrom,
+            start,
+            end,
+            MERGE_RECORDS,
+            seed=args.seed,
+        )
+        for chrom, start, end in synthetic.region_layout(regions)
+    ]
+    # In completion order, not coordinate order
+    files.reverse()
+    contig_order = synthetic.contig_order()
+    merged = os.path.join(dirname, "merged.vcf")
+
+    def merge():
+        with open(merged, 'wb') as out_fh:
+            utils.merge_outputs(files, out_fh, contig_order=contig_order)
+
+    seconds = best_of(args.repeat, merge)
+    size = sum(os.path.getsize(f) for f in files)
+    return {
+        "regions": len(files),
+        "records": len(files) * MERGE_RECORDS,
+        "seconds": seconds,
+        "mb_per_second": size / 1e6 / seconds,
+    }
+
+
+def bench_schedule(dirname: str, scale: int, args) -> Dict:
+    regions = [
+        synthetic.mpileup_name(*region)
+        for region in synthetic.region_layout(SCHEDULE_REGIONS * scale)
+    ]
+    run_args = multi_somaticsniper.process_argv(
+        ["--thread-count={}".format(args.threads), "--reference-path=reference.fa"]
+        + ["--tumor-bam=tumor.bam", "--normal-bam=normal.bam"]
+        + ["--mpileup={}".format(mpileup) for mpileup in regions]
+        + ["--schedule=longest-first"]
+    )
+
+    def schedule():
+        multi_somaticsniper.tpe_submit_commands(
+            run_args, fn=lambda mpileup, **kwargs: mpileup
+        )
+
+    seconds = best_of(args.repeat, schedule)
+    return {
+        "regions": len(regions),
+        "threads": args.threads,
+        "seconds": seconds,
+        "us_per_region": seconds / len(regions) * 1e6,
+    }
+
+
+def bench_run(dirname: str, scale: int, args) -> Dict:
+    stubs = synthetic.write_stubs(
+        dirname, profile=args.profile, records=RUN_RECORDS, seed=args.seed
+    )
+    mpileups = synthetic.write_regions(
+        dirname, RUN_REGIONS * scale, RUN_RECORDS * 4, seed=args.seed
+    )
+    reference = synthetic.write_reference(dirname)
+    metrics_json = os.path.join(dirname, "metrics.json")
+    argv = [
+        "--thread-count={}".format(args.threads),
+        "--reference-path={}".format(reference),
+        "--tumor-bam=tumor.bam",
+        "--normal-bam=normal.bam",
+        "--samtools={}".format(stubs["samtools"]),
+        "--somaticsniper={}".format(stubs["somaticsniper"]),
+        "--snpfilter={}".format(stubs["snpfilter"]),
+        "--highconfidence={}".format(stubs["highconfidence"]),
+        "--metrics-json={}".format(metrics_json),
+        "--loh",
+        "--gor",
+    ]
+    argv += ["--mpileup={}".format(mpileup) for mpileup in mpileups] + args.run_args
+    run_args = multi_somaticsniper.process_argv(argv)
+    cwd = os.getcwd()
+    # Region outputs are written to the working directory
+    os.chdir(dirname)
+    try:
+        seconds = best_of(1, lambda: multi_somaticsniper.run(run_args))
+    finally:
+        os.chdir(cwd)
+    with open(metrics_json) as fh:
+        report = json.load(fh)
+    return {
+        "regions": len(mpileups),
+        "threads": args.threads,
+        "profile": args.profile,
+        "seconds": seconds,
+        "regions_per_second": len(mpileups) / seconds,
+        "stage_seconds": {
+            stage: round(totals["wall_seconds"], 3)
+            for stage, totals in report["stage_totals"].items()
+        },
+    }
+
+
+BENCHMARKS = {
+    "annotate": bench_annotate,
+    "merge": bench_merge,
+    "schedule": bench_schedule,
+    "run": bench_run,
+}
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100])
+    parser.add_argument(
+        "--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS)
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument(
+        "--profile", choices=list(synthetic.PROFILES), default="realistic"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--run-args",
+        nargs=argparse.REMAINDER,
+        default=[],
+        help="Further multi_somaticsniper options of the end-to-end run, last.",
+    )
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    args = parser.parse_args(argv)
+    # Region logs would drown the table
+    logging.getLogger(multi_somaticsniper.__name__).setLevel(logging.WARNING)
+
+    results: List[Dict] = []
+    print("{:>10} {:>6} {:>10}  {}".format("benchmark", "scale", "seconds", "sizes"))
+    for name in args.only:
+        for scale in args.scales:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                result = dict(
+                    benchmark=name, scale=scale, **BENCHMARKS[name](tmpdir, scale, args)
+                )
+            results.append(result)
+            sizes = ", ".join(
+                "{}={}".format(key, value)
+                for key, value in result.items()
+                if key in ("records", "regions", "threads")
+            )
+            print(
+                "{:>10} {:>6} {:>10.3f}  {}".format(
+                    name, scale, result["seconds"], sizes
+                )
+            )
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(
+                {
+                    "environment": environment(),
+                    "args": {k: v for k, v in vars(args).items() if k != "output"},
+                    "results": results,
+                },
+                fh,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
+
+# __END__
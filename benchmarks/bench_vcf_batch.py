@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark VCF record batches against per-record split and join.
+
+For synthetic somaticsniper records, compares the memory blocks and bytes
+held by a batch of split records and by a RecordBatch, as counted by
+tracemalloc, and the peak traced memory and time of rewriting the FILTER
+column of every record.
+
+    python -m benchmarks.bench_vcf_batch --sizes 4096 65536
+"""
+
+import argparse
+import os
+import random
+import time
+import tracemalloc
+
+from somaticsniper_tool.vcf_batch import RecordBatch
+
+RECORD = (
+    "chr1\t{pos}\t.\t{ref}\t{alt}\t.\t.\t.\tGT:IGT:DP:DP4:BCOUNT:GQ:JGQ:VAQ:BQ:MQ:AMQ:"
+    "SS:SSC\t0/0:0/0:30:15,15,0,0:0,30,0,0:90:.:0:35:60:60:0:.\t"
+    "0/1:0/1:28:8,8,6,6:0,16,12,0:70:.:70:35:60:60,60:2:{ssc}\n"
+)
+
+
+def make_records(size: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    lines = []
+    for i in range(size):
+        ref, alt = rng.sample("ACGT", 2)
+        lines.append(
+            RECORD.format(pos=100 + i * 10, ref=ref, alt=alt, ssc=rng.randint(0, 99))
+        )
+    return "".join(lines).encode()
+
+
+def split_records(data: bytes):
+    return [line.split(b"\t") for line in data.splitlines(keepends=True)]
+
+
+def retained(build, data: bytes):
+    """Get memory blocks and bytes held by build(data), per tracemalloc."""
+    tracemalloc.start()
+    held = build(data)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del held
+    stats = snapshot.statistics("filename")
+    return sum(s.count for s in stats), sum(s.size for s in stats)
+
+
+def rewrite_split(data: bytes, out_fh):
+    for line in data.splitlines(keepends=True):
+        entries = line.split(b"\t")
+        entries[6] = b"REJECT"
+        out_fh.write(b"\t".join(entries))
+
+
+def rewrite_batch(data: bytes, out_fh):
+    batch = RecordBatch(data)
+    batch.write(out_fh, filters=[b"REJECT"] * len(batch))
+
+
+def rewrite(fn, data: bytes):
+    """Get the peak traced memory and seconds of fn rewriting data."""
+    with open(os.devnull, 'wb') as out_fh:
+        start = time.perf_counter()
+        fn(data, out_fh)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        fn(data, out_fh)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return peak, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[4096, 65536])
+    args = parser.parse_args(argv)
+
+    print(
+        "{:>8} {:>6} {:>10} {:>12} {:>12} {:>10}".format(
+            "records", "type", "blocks", "held bytes", "peak bytes", "seconds"
+        )
+    )
+    for size in args.sizes:
+        data = make_records(size)
+        for name, build, fn in (
+            ("split", split_records, rewrite_split),
+            ("batch", RecordBatch, rewrite_batch),
+        ):
+            blocks, held = retained(build, data)
+            peak, elapsed = rewrite(fn, data)
+            print(
+                "{:>8} {:>6} {:>10} {:>12} {:>12} {:>10.4f}".format(
+                    size, name, blocks, held, peak, elapsed
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
+
+# __END__
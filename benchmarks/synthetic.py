@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Seeded synthetic inputs and stub executables for the benchmarks.
+
+Generates region mpileups, somaticsniper VCFs and high confidence files
+over a GRCh38-shaped reference, and writes stand-ins for samtools,
+bam-somaticsniper and the snpfilter and highconfidence perl scripts. The
+stubs take their inputs and outputs like the real tools, write synthetic
+outputs with the same layout, and spend a fixed profile of sleep (I/O
+wait) and CPU seconds per run, so runs exercise the workflow's process
+handling and scheduling without real data. Equal seeds give equal files.
+
+Stubs import this module from the checkout they were written from, so
+the stubs themselves stay a few lines.
+"""
+
+import os
+import random
+import re
+import stat
+import sys
+import time
+from typing import Dict, Iterator, List, Tuple
+
+HEADER = (
+    "##fileformat=VCFv4.1\n"
+    "##reference=file:///reference.fa\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR\n"
+)
+RECORD = (
+    "{chrom}\t{pos}\t.\t{ref}\t{alt}\t.\t.\t.\tGT:IGT:DP:DP4:BCOUNT:GQ:JGQ:VAQ:BQ:"
+    "MQ:AMQ:SS:SSC\t0/0:0/0:30:15,15,0,0:0,30,0,0:90:.:0:35:60:60:0:.\t"
+    "0/1:0/1:28:8,8,6,6:0,16,12,0:70:.:70:35:{mq}:{mq}:2:{ssc}\n"
+)
+PILEUP = "{chrom}\t{pos}\t{ref}\t30\t{bases}\t{quals}\t28\t{bases}\t{quals}\n"
+# Indel call as snpfilter.pl reads it, scoring above its --min-indel-score
+INDEL_PILEUP = "{chrom}\t{pos}\t*\t*/+TT\t60\t60\t60\t28\t*\t+TT\t24\t4\t0\t0\t0\n"
+
+# Scaled down GRCh38 contigs, region runtimes only depend on record counts
+CONTIGS = {
+    "chr{}".format(name): length
+    for name, length in zip(
+        list(range(1, 23)) + ["X", "Y"],
+        [249, 242, 198, 190, 182, 171, 159, 145, 138, 134, 135, 133, 114, 107]
+        + [102, 90, 83, 80, 59, 64, 47, 51, 156, 57],
+    )
+}
+CONTIG_SCALE = 100000
+
+# Sleep and CPU seconds per stub run, by tool. "realistic" keeps the
+# proportions of whole-genome runs, where somaticsniper dominates, at a
+# fraction of the time
+PROFILES = {
+    "instant": {
+        "samtools": (0.0, 0.0),
+        "somaticsniper": (0.0, 0.0),
+        "snpfilter": (0.0, 0.0),
+        "highconfidence": (0.0, 0.0),
+    },
+    "realistic": {
+        "samtools": (0.02, 0.005),
+        "somaticsniper": (0.05, 0.04),
+        "snpfilter": (0.005, 0.01),
+        "highconfidence": (0.005, 0.005),
+    },
+}
+
+PYTHON_STUB = """#!{python}
+import sys
+sys.path.insert(0, {root!r})
+from benchmarks.synthetic import stub_main
+sys.exit(stub_main({tool!r}, sys.argv[1:], {sleep!r}, {cpu!r}, {records!r}, {seed!r}))
+"""
+
+# Run with `perl`, or on the perl worker pool with `do`, like the real scripts
+PERL_STUB = r"""use strict;
+use warnings;
+use Getopt::Long;
+my ($snp_file, $indel_file, $min_score, $min_mq) = ('', '', 0, 0);
+my ($min_indel_score, $indel_window) = (50, 10);
+GetOptions(
+    "snp-file=s" => \$snp_file,
+    "indel-file=s" => \$indel_file,
+    "min-somatic-score=i" => \$min_score,
+    "min-mapping-quality=i" => \$min_mq,
+    "min-indel-score=i" => \$min_indel_score,
+    "indel-win-size=i" => \$indel_window,
+) or die "bad options\n";
+select(undef, undef, undef, {sleep});
+my $cpu = (times)[0] + {cpu};
+while ((times)[0] < $cpu) {{}}
+my %indels;
+if ($indel_file) {{
+    open(my $pileup, '<', $indel_file) or die "Cannot open $indel_file\n";
+    while (<$pileup>) {{
+        my @f = split /\t/, $_, 6;
+        next if $f[2] ne '*' || ($f[4] =~ /^\d+$/ ? $f[4] : 0) < $min_indel_score;
+        $indels{{"$f[0]\t$f[1]"}} = 1;
+    }}
+    close $pileup;
+}}
+open(my $in, '<', $snp_file) or die "Cannot open $snp_file\n";
+my $suffix = $indel_file ? 'SNPfilter' : 'hc';
+open(my $out, '>', "$snp_file.$suffix") or die "Cannot write $snp_file.$suffix\n";
+while (my $line = <$in>) {{
+    if ($line !~ /^#/) {{
+        my @f = split /\t/, $line;
+        next if exists $indels{{"$f[0]\t$f[1]"}};
+        if (!$indel_file) {{
+            chomp(my $tumor = $f[10]);
+            my @values = split /:/, $tumor;
+            next if $values[-1] eq '.' || $values[-1] < $min_score;
+            next if $values[-4] < $min_mq;
+        }}
+    }}
+    print $out $line;
+}}
+close $out;
+"""
+
+
+def contig_order() -> Dict[str, int]:
+    return {chrom: i for i, chrom in enumerate(CONTIGS)}
+
+
+def region_layout(regions: int) -> List[Tuple[str, int, int]]:
+    """Split the contigs into about regions equal-length regions, in order."""
+    total = sum(CONTIGS.values()) * CONTIG_SCALE
+    size = max(1, total // regions)
+    layout = []
+    for chrom, length in CONTIGS.items():
+        length *= CONTIG_SCALE
+        for start in range(1, length + 1, size):
+            layout.append((chrom, start, min(start + size - 1, length)))
+    return layout[:regions]
+
+
+def mpileup_name(chrom: str, start: int, end: int) -> str:
+    return "{}-{}-{}.mpileup".format(chrom, start, end)
+
+
+def positions(rng: random.Random, start: int, end: int, count: int) -> List[int]:
+    """Get count sorted distinct positions in [start, end], spread evenly."""
+    count = min(count, end - start + 1)
+    step = (end - start + 1) / max(count, 1)
+    return [start + int(i * step + rng.random() * step) for i in range(count)]
+
+
+def sniper_records(
+    rng: random.Random, chrom: str, start: int, end: int, count: int
+) -> List[str]:
+    lines = []
+    for pos in positions(rng, start, end, count):
+        ref, alt = rng.sample("ACGT", 2)
+        lines.append(
+            RECORD.format(
+                chrom=chrom,
+                pos=pos,
+                ref=ref,
+                alt=alt,
+                mq=rng.choice((30, 60, 60, 60)),
+                ssc=rng.randint(0, 99),
+            )
+        )
+    return lines
+
+
+def write_sniper_vcf(
+    path: str, chrom: str, start: int, end: int, records: int, seed: int = 0
+) -> str:
+    """Write a somaticsniper VCF of records calls in chrom:start-end."""
+    rng = random.Random("{}:{}:{}:{}".format(seed, chrom, start, end))
+    with open(path, 'w') as fh:
+        fh.write(HEADER)
+        fh.writelines(sniper_records(rng, chrom, start, end, records))
+    return path
+
+
+def write_hc(vcf: str, path: str, fraction: float = 0.5, seed: int = 0) -> str:
+    """Write a high confidence file holding about fraction of vcf's records."""
+    rng = random.Random(seed)
+    with open(vcf) as in_fh, open(path, 'w') as out_fh:
+        for line in in_fh:
+            if line.startswith("#") or rng.random() < fraction:
+                out_fh.write(line)
+    return path
+
+
+def mpileup_lines(
+    chrom: str,
+    start: int,
+    end: int,
+    lines: int,
+    indel_fraction: float = 0.05,
+    seed: int = 0,
+) -> Iterator[str]:
+    """Get a two-sample mpileup of lines positions in chrom:start-end, with
+    indel calls, a '*' reference, at about indel_fraction of them."""
+    rng = random.Random("{}:{}:{}:{}".format(seed, chrom, start, end))
+    for pos in positions(rng, start, end, lines):
+        if rng.random() < indel_fraction:
+            yield INDEL_PILEUP.format(chrom=chrom, pos=pos)
+            continue
+        yield PILEUP.format(
+            chrom=chrom,
+            pos=pos,
+            ref=rng.choice("ACGT"),
+            bases="." * 28,
+            quals="I" * 28,
+        )
+
+
+def write_mpileup(path: str, chrom: str, start: int, end: int, lines: int, **kwargs):
+    """Write mpileup_lines to path."""
+    with open(path, 'w') as fh:
+        fh.writelines(mpileup_lines(chrom, start, end, lines, **kwargs))
+    return path
+
+
+def write_regions(dirname: str, regions: int, lines: int, seed: int = 0) -> List[str]:
+    """Write region mpileups over the contigs, return their paths in order."""
+    return [
+        write_mpileup(
+            os.path.join(dirname, mpileup_name(chrom, start, end)),
+            chrom,
+            start,
+            end,
+            lines,
+            seed=seed,
+        )
+        for chrom, start, end in region_layout(regions)
+    ]
+
+
+def write_reference(dirname: str) -> str:
+    """Write the .fai of a reference of the contigs, return the reference path."""
+    reference = os.path.join(dirname, "reference.fa")
+    with open(reference + ".fai", 'w') as fh:
+        offset = 0
+        for chrom, length in CONTIGS.items():
+            length *= CONTIG_SCALE
+            offset += len(chrom) + 2
+            fh.write("{}\t{}\t{}\t60\t61\n".format(chrom, length, offset))
+            offset += length + -(-length // 60)
+    return reference
+
+
+def write_stubs(
+    dirname: str, profile: str = "realistic", records: int = 200, seed: int = 0
+) -> Dict[str, str]:
+    """Write stub tools with a profile of PROFILES.
+    Accepts:
+        dirname (str): Directory for the stubs
+        profile (str): Sleep and CPU seconds per run, see PROFILES
+        records (int): Calls somaticsniper makes per region
+        seed (int): Seed of the calls
+    Returns:
+        Dict[str, str]: Stub path of each tool
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    stubs = {}
+    for tool in ("samtools", "somaticsniper"):
+        sleep, cpu = PROFILES[profile][tool]
+        path = os.path.join(dirname, tool)
+        with open(path, 'w') as fh:
+            fh.write(
+                PYTHON_STUB.format(
+                    python=sys.executable,
+                    root=root,
+                    tool=tool,
+                    sleep=sleep,
+                    cpu=cpu,
+                    records=records,
+                    seed=seed,
+                )
+            )
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+        stubs[tool] = path
+    for tool in ("snpfilter", "highconfidence"):
+        sleep, cpu = PROFILES[profile][tool]
+        path = os.path.join(dirname, "{}.pl".format(tool))
+        with open(path, 'w') as fh:
+            fh.write(PERL_STUB.format(sleep=sleep, cpu=cpu))
+        stubs[tool] = path
+    return stubs
+
+
+def spend(sleep: float, cpu: float):
+    """Wait sleep seconds, then run the CPU for cpu seconds."""
+    time.sleep(sleep)
+    end = time.process_time() + cpu
+    while time.process_time() < end:
+        pass
+
+
+def stub_main(
+    tool: str, argv: List[str], sleep: float, cpu: float, records: int, seed: int
+) -> int:
+    """Run a python stub tool, see write_stubs."""
+    spend(sleep, cpu)
+    if tool == "samtools" and argv[:1] == ["view"]:
+        # view -b <bam> <region>: a region "BAM" somaticsniper ignores
+        sys.stdout.write("{}\t{}\n".format(argv[-2], argv[-1]))
+        return 0
+    if tool == "samtools" and argv[:1] == ["mpileup"]:
+        region = argv[argv.index("-r") + 1]
+        chrom, start, end = re.match(r"(.+):(\d+)-(\d+)$", region).groups()
+        sys.stdout.writelines(
+            mpileup_lines(chrom, int(start), int(end), records * 4, seed=seed)
+        )
+        return 0
+    if tool == "somaticsniper":
+        output = argv[-1]
+        name = os.path.basename(output)[: -len(".vcf")]
+        chrom, start, end = re.match(r"(.+)-(\d+)-(\d+)$", name).groups()
+        write_sniper_vcf(output, chrom, int(start), int(end), records, seed=seed)
+        return 0
+    sys.stderr.write("{}: unsupported arguments {}\n".format(tool, argv))
+    return 1
+
+
+# __END__
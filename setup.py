@@ -207,7 +207,8 @@ setup(
     description="Somatic sniper utilities.",
     version=__pypi_version__,
     python_requires=">=3.7",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
+    package_data={"tests": ["data/*/*"]},
     install_requires=INSTALL_REQUIRES,
     tests_require=DEV_REQUIRES,
     cmdclass={
@@ -3,6 +3,9 @@
 import csv
 from enum import Enum
 from types import SimpleNamespace
+from typing import Set, Tuple
+
+from somaticsniper_tool.vcf_batch import BATCH_BYTES
 
 DI = SimpleNamespace(csv=csv, open=open)
 
@@ -13,9 +16,56 @@ class Filter(Enum):
     REJECT = """##FILTER=<ID=REJECT,Description="Rejected as an unconfident somatic mutation">"""
 
 
+FILTER_HEADERS = "".join(
+    "{}\n".format(f.value) for f in (Filter.PASS, Filter.REJECT, Filter.LOH)
+).encode()
+
+
+VariantKey = Tuple[bytes, bytes, bytes, bytes]
+
+
+def variant_key(line: bytes) -> VariantKey:
+    """Build normalized lookup key for a VCF record.
+    Accepts:
+        line (bytes): VCF record line
+    Returns:
+        VariantKey: (CHROM, POS, REF, ALT) tuple
+    Raises:
+        ValueError: If line has fewer than 5 fields
+    """
+    chrom, pos, _, ref, alt = line.split(b"\t", 5)[:5]
+    # ALT ends the line of a record of exactly 5 fields
+    return chrom, pos, ref, alt.rstrip(b"\r\n")
+
+
+def load_variant_keys(
+    vcf_file: str, buffer_size: int = BATCH_BYTES, _di=DI
+) -> Set[VariantKey]:
+    """Index the records of a VCF-like file by variant key.
+    Accepts:
+        vcf_file (str): Path to VCF-like file, e.g. high confidence file
+        buffer_size (int): Bytes read per block
+    Returns:
+        Set[VariantKey]: Keys of all non-header records, skipping blank or
+            short lines of fewer than 5 fields
+    """
+    with _di.open(vcf_file, 'rb', buffering=buffer_size) as fh:
+        return {
+            variant_key(line)
+            for line in fh
+            if not line.startswith(b"#") and line.count(b"\t") >= 4
+        }
+
+
 class Annotate:
-    def __init__(self, output_file: str, _di=DI):
+    """Write a somaticsniper VCF with FILTER set from high confidence calls.
+
+    Inputs are read, and output written, in blocks of buffer_size bytes.
+    """
+
+    def __init__(self, output_file: str, buffer_size: int = BATCH_BYTES, _di=DI):
         self.output_file = output_file
+        self.buffer_size = buffer_size
         self._di = _di
 
         self.output_fh = None
@@ -24,7 +74,9 @@ class Annotate:
         return self.annotate(*args, **kwargs)
 
     def __enter__(self):
-        self.output_fh = self._di.open(self.output_file, 'w')
+        self.output_fh = self._di.open(
+            self.output_file, 'wb', buffering=self.buffer_size
+        )
         return self
 
     def __exit__(self, type, value, traceback):
@@ -36,26 +88,22 @@ class Annotate:
             raw_vcf (str): Path to somatic sniper VCF
             post_filter (str): Path to high confidence file
         """
-        with _di.open(post_filter, 'r') as post_fh:
-            high_confident_lines = post_fh.readlines()
+        high_confident_keys = load_variant_keys(
+            post_filter, self.buffer_size, _di=_di
+        )
 
-        with _di.open(raw_vcf, 'r') as vcf_fh:
+        with _di.open(raw_vcf, 'rb', buffering=self.buffer_size) as vcf_fh:
             for line in vcf_fh:
-                if line.startswith("##reference"):
-                    self.output_fh.write(line)
-                    self.output_fh.write("{}\n".format(Filter.PASS.value))
-                    self.output_fh.write("{}\n".format(Filter.REJECT.value))
-                    self.output_fh.write("{}\n".format(Filter.LOH.value))
-                elif line.startswith("#"):
+                if line.startswith(b"#"):
                     self.output_fh.write(line)
-                elif line in high_confident_lines:
-                    entries = line.split("\t")
-                    entries[6] = "LOH"
-                    self.output_fh.write('\t'.join(entries))
-                else:
-                    entries = line.split("\t")
-                    entries[6] = "REJECT"
-                    self.output_fh.write("\t".join(entries))
+                    if line.startswith(b"##reference"):
+                        self.output_fh.write(FILTER_HEADERS)
+                    continue
+                # Only the columns up to FILTER are split off
+                entries = line.split(b"\t", 7)
+                key = entries[0], entries[1], entries[3], entries[4]
+                entries[6] = b"LOH" if key in high_confident_keys else b"REJECT"
+                self.output_fh.write(b"\t".join(entries))
 
 
 # __END__
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+asyncio stage runner with per-stage limits and shared resource budgets.
+
+Stage processes are awaited on one event loop instead of blocking a thread
+each in Popen.communicate, so the number of running processes is set per
+stage rather than by the thread count. Each stage run also takes its memory
+and I/O tokens from shared budgets, so regions overlap across stages without
+oversubscribing memory or disk. Semantics match
+utils.run_subprocess_command: a PopenReturn of decoded output, and
+ValueError with stderr on timeout or a nonzero exit. Resource usage of stage
+processes is added to the running metrics stage, see ChildUsage.
+"""
+
+import asyncio
+import contextvars
+import logging
+import shlex
+from contextlib import asynccontextmanager
+from resource import RUSAGE_CHILDREN, getrusage
+from types import SimpleNamespace
+from typing import Callable, Dict, NamedTuple, Optional
+
+from somaticsniper_tool.metrics import METRICS
+from somaticsniper_tool.utils import OUTPUT_CHUNK_SIZE, PopenReturn, output_tails
+
+logger = logging.getLogger(__name__)
+
+# Stages scheduled through the runner. Subprocess stages use run, in-process
+# stages use run_in_executor.
+STAGES = (
+    "mpileup",
+    "cache_restore",
+    "samtools_view",
+    "somaticsniper",
+    "snpfilter",
+    "highconfidence",
+    "annotate",
+    "postprocess",
+    "compress",
+)
+
+# I/O tokens taken by default: mpileups and views read both BAMs or the BAM
+# and write a temp copy, somaticsniper reads both temp copies
+DEFAULT_IO_TOKENS = {"mpileup": 2, "samtools_view": 2, "somaticsniper": 1}
+
+
+class StageLimits(NamedTuple):
+    concurrency: int
+    memory_mb: int = 0
+    io_tokens: int = 0
+
+
+def _decode(output: Optional[bytes]) -> Optional[str]:
+    return output.decode() if output is not None else None
+
+
+def parse_stage_values(values, minimum: int = 1) -> Dict[str, int]:
+    """Parse STAGE=N pairs.
+    Accepts:
+        values (List[str]): e.g. ["somaticsniper=16", "snpfilter=32"]
+        minimum (int): Smallest valid N
+    Returns:
+        Dict[str, int]: N by stage
+    """
+    parsed = {}
+    for value in values or ():
+        stage, _, number = value.partition("=")
+        if stage not in STAGES or not number.isdigit() or int(number) < minimum:
+            raise ValueError(
+                "Invalid stage value {!r}, expected one of {} as STAGE=N".format(
+                    value, ", ".join(STAGES)
+                )
+            )
+        parsed[stage] = int(number)
+    return parsed
+
+
+def parse_stage_limits(
+    concurrency, default: int, memory_mb=None, io_tokens=None
+) -> Dict[str, StageLimits]:
+    """Get limits of every stage from STAGE=N pairs.
+    Accepts:
+        concurrency (List[str]): Max concurrent runs by stage
+        default (int): Concurrency of stages not given
+        memory_mb (List[str]): Memory taken per run by stage, default 0
+        io_tokens (List[str]): I/O tokens taken per run by stage
+    Returns:
+        Dict[str, StageLimits]: Limits by stage
+    """
+    concurrency = parse_stage_values(concurrency)
+    memory_mb = parse_stage_values(memory_mb, minimum=0)
+    io_tokens = dict(DEFAULT_IO_TOKENS, **parse_stage_values(io_tokens, minimum=0))
+    return {
+        stage: StageLimits(
+            concurrency.get(stage, default),
+            memory_mb.get(stage, 0),
+            io_tokens.get(stage, 0),
+        )
+        for stage in STAGES
+    }
+
+
+class ResourcePool:
+    """Shared memory and I/O token budgets; None is unlimited.
+
+    Stages wait until their whole demand fits, so a stage never holds part of
+    a budget while waiting for the rest.
+    """
+
+    def __init__(
+        self, memory_mb: Optional[int] = None, io_tokens: Optional[int] = None
+    ):
+        self.available = {"memory_mb": memory_mb, "io_tokens": io_tokens}
+        self._condition = None
+
+    def check(self, stage: str, limits: StageLimits):
+        """Raise ValueError if a stage could never fit the budgets."""
+        for resource, total in self.available.items():
+            if total is not None and getattr(limits, resource) > total:
+                raise ValueError(
+                    "Stage {} needs {} {} but the budget is {}".format(
+                        stage, getattr(limits, resource), resource, total
+                    )
+                )
+
+    def _fits(self, limits: StageLimits) -> bool:
+        return all(
+            available is None or getattr(limits, resource) <= available
+            for resource, available in self.available.items()
+        )
+
+    def _take(self, limits: StageLimits, sign: int):
+        for resource, available in self.available.items():
+            if available is not None:
+                self.available[resource] = available - sign * getattr(limits, resource)
+
+    @asynccontextmanager
+    async def hold(self, limits: StageLimits):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._fits(limits))
+            self._take(limits, 1)
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._take(limits, -1)
+                self._condition.notify_all()
+
+
+class ChildUsage:
+    """Resource usage of reaped children, each claimed once.
+
+    asyncio reaps stage processes itself, so their usage is only seen summed
+    in resource.getrusage(RUSAGE_CHILDREN). A claim takes the usage added
+    since the previous claim: totals over a run are exact, but a claim also
+    holds children that finished meanwhile, e.g. another stage's.
+    """
+
+    def __init__(self, _getrusage=getrusage):
+        self._getrusage = _getrusage
+        self._last = _getrusage(RUSAGE_CHILDREN)
+
+    def claim(self) -> SimpleNamespace:
+        """Get usage of children reaped since the previous claim.
+
+        ru_maxrss is the largest child's, in the claim that saw it grow, and
+        0 otherwise.
+        """
+        usage = self._getrusage(RUSAGE_CHILDREN)
+        last, self._last = self._last, usage
+        return SimpleNamespace(
+            ru_utime=usage.ru_utime - last.ru_utime,
+            ru_stime=usage.ru_stime - last.ru_stime,
+            ru_maxrss=usage.ru_maxrss if usage.ru_maxrss > last.ru_maxrss else 0,
+            ru_inblock=usage.ru_inblock - last.ru_inblock,
+            ru_oublock=usage.ru_oublock - last.ru_oublock,
+        )
+
+
+class AsyncRunner:
+    """Run stages under per-stage concurrency and shared resource budgets.
+
+    Semaphores and conditions are created on first use so they bind to the
+    running loop.
+    """
+
+    def __init__(
+        self,
+        stage_limits: Dict[str, StageLimits],
+        memory_mb: Optional[int] = None,
+        io_tokens: Optional[int] = None,
+        _metrics=METRICS,
+    ):
+        self.stage_limits = stage_limits
+        self.child_usage = ChildUsage()
+        self._metrics = _metrics
+        self.pool = ResourcePool(memory_mb=memory_mb, io_tokens=io_tokens)
+        for stage, limits in stage_limits.items():
+            self.pool.check(stage, limits)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def capacity(self) -> int:
+        """Max stages running at once across all stages."""
+        return sum(limits.concurrency for limits in self.stage_limits.values())
+
+    def semaphore(self, stage: str) -> asyncio.Semaphore:
+        if stage not in self._semaphores:
+            self._semaphores[stage] = asyncio.Semaphore(
+                self.stage_limits[stage].concurrency
+            )
+        return self._semaphores[stage]
+
+    @asynccontextmanager
+    async def slot(self, stage: str):
+        """Hold a concurrency slot and the resources of one stage run."""
+        async with self.semaphore(stage), self.pool.hold(self.stage_limits[stage]):
+            yield
+
+    async def run_in_executor(self, stage: str, fn: Callable, *args):
+        """Run an in-process stage in the loop's default executor.
+
+        fn runs in the task's context, so in its group of utils.CHILDREN.
+        """
+        async with self.slot(stage):
+            context = contextvars.copy_context()
+            return await asyncio.get_event_loop().run_in_executor(
+                None, context.run, fn, *args
+            )
+
+    async def run(
+        self, cmd: str, timeout: Optional[int], stage: str, **kwargs
+    ) -> PopenReturn:
+        """Run command once a slot of its stage is free.
+        Accepts:
+            cmd (str): Command-string to run
+            timeout (int): Max seconds the command may run, excluding queueing
+            stage (str): Stage whose limits apply
+            stream_output (bool): See utils.run_subprocess_command
+            kwargs (dict): Additional arguments to create_subprocess_exec
+        Returns:
+            PopenReturn: NamedTuple with stdout and stderr attributes
+        """
+        stream_output = kwargs.pop("stream_output", False)
+        if stream_output:
+            kwargs.setdefault("stdout", asyncio.subprocess.PIPE)
+            kwargs.setdefault("stderr", asyncio.subprocess.PIPE)
+        async with self.slot(stage):
+            if kwargs.pop("shell", False):
+                # Do not split command for shell
+                p = await asyncio.create_subprocess_shell(cmd, **kwargs)
+            else:
+                p = await asyncio.create_subprocess_exec(*shlex.split(cmd), **kwargs)
+            try:
+                if stream_output:
+                    stdout, stderr = await self._stream(p, cmd, timeout)
+                else:
+                    try:
+                        stdout, stderr = await asyncio.wait_for(
+                            p.communicate(), timeout
+                        )
+                    except asyncio.TimeoutError:
+                        p.kill()
+                        stdout, stderr = await p.communicate()
+                        raise ValueError(_decode(stderr))
+                    stdout, stderr = _decode(stdout), _decode(stderr)
+            except asyncio.CancelledError:
+                # Region cancelled, e.g. failing fast, do not leave the command
+                if p.returncode is None:
+                    p.kill()
+                raise
+
+        self._metrics.add_child_usage(self.child_usage.claim())
+        if p.returncode != 0:
+            raise ValueError(stderr)
+        return PopenReturn(stdout=stdout, stderr=stderr)
+
+    @staticmethod
+    async def _stream(p, cmd: str, timeout: Optional[int]):
+        """Feed piped output of p to bounded tails, returns tail texts."""
+        tails = output_tails(cmd, p.stdout, p.stderr)
+
+        async def drain(reader, tail):
+            while True:
+                chunk = await reader.read(OUTPUT_CHUNK_SIZE)
+                if not chunk:
+                    tail.close()
+                    return
+                tail.feed(chunk)
+
+        drains = [
+            drain(reader, tail)
+            for reader, tail in zip((p.stdout, p.stderr), tails)
+            if tail is not None
+        ]
+        try:
+            await asyncio.wait_for(asyncio.gather(*drains, p.wait()), timeout)
+        except asyncio.TimeoutError:
+            p.kill()
+            await p.wait()
+            raise ValueError(tails[1].text() if tails[1] else None)
+        return tuple(tail.text() if tail else None for tail in tails)
+
+
+# __END__
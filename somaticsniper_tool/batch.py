@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Batch runs of many tumor/normal pairs on one shared thread pool.
+
+    somaticsniper_tool batch --manifest pairs.tsv --output-dir out \\
+        --thread-count 32 --reference-path ref.fa
+
+The manifest lists one pair per line, tab separated, skipping lines
+starting with #:
+
+    name    tumor_bam    normal_bam    mpileup[,mpileup...]
+
+or, for a .json manifest, a list of objects with those keys, "mpileups"
+holding a list. Regions of all pairs are queued on one pool in manifest
+order, and each pair is merged on the pool once its last region is done,
+so one pair's merge overlaps the next pairs' regions. Outputs, the merged
+VCF and the resume manifest of a pair are written to output_dir/name/.
+A failed pair does not stop the others, unless --fail-fast.
+"""
+
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from types import SimpleNamespace
+from typing import Dict, List, NamedTuple, Optional
+
+from somaticsniper_tool import metrics, scheduler, utils
+from somaticsniper_tool.bgzf_merge import BgzfMerge
+from somaticsniper_tool.checkpoint import MANIFEST_FILE, Manifest
+from somaticsniper_tool.incremental_merge import coordinate_order
+from somaticsniper_tool.multi_somaticsniper import (
+    MERGED_OUTPUT,
+    configure_somaticsniper,
+    fail_fast,
+    manifest_params,
+    multithread_somaticsniper,
+    perl_workers,
+    raise_for_exceptions,
+    region_kwargs,
+    resume_completed,
+    setup_logger,
+    setup_parser,
+)
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(futures=concurrent.futures, open=open, os=os)
+
+# Options of single pair runs that batch runs do not support
+UNSUPPORTED = (
+    "mpileup",
+    "tumor_bam",
+    "normal_bam",
+    "plan_regions",
+    "max_region_size",
+    "incremental_merge",
+    "queue_dir",
+    "straggler_factor",
+)
+
+PAIR_FIELDS = ("name", "tumor_bam", "normal_bam", "mpileups")
+
+
+class Pair(NamedTuple):
+    """A tumor/normal pair of a batch and its region mpileups."""
+
+    name: str
+    tumor_bam: str
+    normal_bam: str
+    mpileups: List[str]
+
+
+def parse_pair_line(line: str) -> Pair:
+    fields = line.rstrip("\n").split("\t")
+    if len(fields) != len(PAIR_FIELDS):
+        raise ValueError("expected {} tab separated fields".format(len(PAIR_FIELDS)))
+    name, tumor_bam, normal_bam, mpileups = fields
+    return Pair(name, tumor_bam, normal_bam, [m for m in mpileups.split(",") if m])
+
+
+def load_pairs(manifest_path: str, _di=DI) -> List[Pair]:
+    """Read pairs from a TSV, or .json, batch manifest.
+    Accepts:
+        manifest_path (str): Path to batch manifest
+    Returns:
+        List[Pair]: Pairs in manifest order
+    """
+    pairs = []
+    with _di.open(manifest_path) as fh:
+        if manifest_path.endswith(".json"):
+            for i, entry in enumerate(json.load(fh)):
+                try:
+                    pairs.append(Pair(*(entry[field] for field in PAIR_FIELDS)))
+                except (KeyError, TypeError):
+                    raise ValueError(
+                        "{}: pair {} needs {}".format(
+                            manifest_path, i, ", ".join(PAIR_FIELDS)
+                        )
+                    )
+        else:
+            for line_number, line in enumerate(fh, 1):
+                if not line.strip() or line.startswith("#"):
+                    continue
+                try:
+                    pairs.append(parse_pair_line(line))
+                except ValueError as e:
+                    raise ValueError("{}:{}: {}".format(manifest_path, line_number, e))
+    for pair in pairs:
+        if not pair.name or pair.name in (".", "..") or os.sep in pair.name:
+            raise ValueError("Pair name {!r} is not a directory name".format(pair.name))
+        if not pair.mpileups:
+            raise ValueError("Pair {} has no mpileups".format(pair.name))
+    counts = Counter(pair.name for pair in pairs)
+    repeated = [name for name, count in counts.items() if count > 1]
+    if repeated:
+        raise ValueError("Pair names repeated: {}".format(", ".join(repeated)))
+    return pairs
+
+
+class PairRun:
+    """Progress of one pair in a batch.
+    Accepts:
+        pair (Pair): The pair
+        run_args (namedtuple): Batch run args
+        output_dir (str): Batch output directory, the pair's is below it
+    """
+
+    def __init__(self, pair: Pair, run_args, output_dir: str):
+        self.pair = pair
+        self.output_dir = os.path.join(output_dir, pair.name)
+        self.run_args = run_args._replace(
+            tumor_bam=pair.tumor_bam, normal_bam=pair.normal_bam, mpileup=pair.mpileups
+        )
+        self.merged_output = os.path.join(self.output_dir, MERGED_OUTPUT)
+        if self.run_args.output_compression == "bgzf":
+            self.merged_output += ".gz"
+        self.results: Dict[str, str] = {}
+        self.exceptions: List[Exception] = []
+        self.outstanding = 0
+        self.merged = False
+        self.manifest: Optional[Manifest] = None
+        self.start: Optional[float] = None
+        self.end: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def run_region(self, fn, mpileup: str, **kwargs) -> str:
+        with self._lock:
+            if self.start is None:
+                self.start = time.time()
+        return fn(mpileup, output_dir=self.output_dir, **kwargs)
+
+    def merge(
+        self, contig_order: Dict[str, int], _utils=utils, _metrics=metrics.METRICS
+    ) -> str:
+        """Merge the pair's region outputs, see run_regions."""
+        with _metrics.stage(self.pair.name, "merge", outputs=(self.merged_output,)):
+            if self.run_args.output_compression == "bgzf":
+                with BgzfMerge(self.merged_output) as merger:
+                    mpileups = coordinate_order(list(self.results), contig_order)
+                    for i, mpileup in enumerate(mpileups):
+                        merger.append(self.results[mpileup], i == 0)
+            else:
+                with open(self.merged_output, 'wb') as out_fh:
+                    _utils.merge_outputs(
+                        list(self.results.values()), out_fh, contig_order=contig_order
+                    )
+        return self.merged_output
+
+    def summary(self) -> Dict:
+        return {
+            "regions": len(self.pair.mpileups),
+            "failed_regions": len(self.exceptions),
+            "seconds": self.end - self.start if self.end and self.start else None,
+            "merged_output": self.merged_output if self.merged else None,
+        }
+
+
+def run_batch(
+    run_args,
+    pairs: List[Pair],
+    fn=multithread_somaticsniper,
+    _di=DI,
+    _utils=utils,
+    _metrics=metrics.METRICS,
+) -> List[PairRun]:
+    """Run the regions of all pairs, and merge each pair, on one pool.
+    Accepts:
+        run_args (namedtuple): Batch run args, see process_argv
+        pairs (List[Pair]): Pairs in submission order
+        fn (Callable): Per-region workflow, given the pair's output_dir
+    Returns:
+        List[PairRun]: Runs of the pairs, with their exceptions
+    """
+    contig_order = _utils.load_contig_order("{}.fai".format(run_args.reference_path))
+    runs = [PairRun(pair, run_args, run_args.output_dir) for pair in pairs]
+    start = time.time()
+    pending = {}
+    _utils.CHILDREN.reset()
+    with _di.futures.ThreadPoolExecutor(max_workers=run_args.thread_count) as executor:
+
+        def submit_merge(pair_run: PairRun):
+            future = executor.submit(
+                pair_run.merge, contig_order, _utils=_utils, _metrics=_metrics
+            )
+            pending[future] = (pair_run, None)
+
+        for pair_run in runs:
+            _di.os.makedirs(pair_run.output_dir, exist_ok=True)
+            pair_run.manifest = Manifest(
+                os.path.join(pair_run.output_dir, MANIFEST_FILE),
+                manifest_params(pair_run.run_args),
+                resume=run_args.resume,
+            )
+            mpileups = resume_completed(
+                pair_run.manifest,
+                scheduler.order_regions(pair_run.pair.mpileups, run_args.schedule),
+                [],
+                pair_run.results.__setitem__,
+            )
+            kwargs = region_kwargs(pair_run.run_args)
+            for mpileup in mpileups:
+                future = executor.submit(pair_run.run_region, fn, mpileup, **kwargs)
+                pending[future] = (pair_run, mpileup)
+            pair_run.outstanding = len(mpileups)
+            if not mpileups:
+                submit_merge(pair_run)
+
+        failed_fast = False
+        while pending:
+            done, _ = _di.futures.wait(
+                pending, return_when=_di.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                pair_run, mpileup = pending.pop(future)
+                if future.cancelled():
+                    continue
+                try:
+                    result = future.result()
+                    if mpileup is None:
+                        pair_run.merged = True
+                        pair_run.end = time.time()
+                        logger.info("Merged pair %s: %s", pair_run.pair.name, result)
+                    else:
+                        logger.info(result)
+                        pair_run.manifest.record(mpileup, result)
+                        pair_run.results[mpileup] = result
+                except Exception as e:
+                    if failed_fast:
+                        # Failed by the cancellation
+                        continue
+                    pair_run.exceptions.append(e)
+                    logger.exception(e)
+                    if run_args.fail_fast:
+                        failed_fast = True
+                        fail_fast(pending, _utils=_utils)
+                if mpileup is None:
+                    continue
+                pair_run.outstanding -= 1
+                if pair_run.outstanding:
+                    continue
+                if pair_run.exceptions or failed_fast:
+                    pair_run.end = time.time()
+                else:
+                    submit_merge(pair_run)
+    # Killed commands are done once the executor is, allow new ones
+    _utils.CHILDREN.reset()
+
+    elapsed = time.time() - start
+    failed = [r.pair.name for r in runs if not r.merged]
+    _metrics.add_summary(
+        "batch",
+        {
+            "pairs": len(runs),
+            "pairs_failed": len(failed),
+            "seconds": elapsed,
+            "pairs_per_hour": len(runs) * 3600 / elapsed if elapsed else None,
+            "per_pair": {r.pair.name: r.summary() for r in runs},
+        },
+    )
+    logger.info(
+        "Batch of %s pairs took %.1f seconds, %s failed%s",
+        len(runs),
+        elapsed,
+        len(failed),
+        ": " + ", ".join(failed) if failed else "",
+    )
+    return runs
+
+
+def process_argv(argv: Optional[List] = None) -> namedtuple:
+    parser = setup_parser(batch=True)
+    parser.prog = "somaticsniper_tool batch"
+    batch_group = parser.add_argument_group("Batch of tumor/normal pairs")
+    batch_group.add_argument(
+        "--manifest",
+        required=True,
+        help="TSV, or .json, of pairs: name, tumor_bam, normal_bam and mpileups.",
+    )
+    batch_group.add_argument(
+        "--output-dir",
+        default=".",
+        help="Directory for the pairs' output directories, named as the pairs.",
+    )
+    args, unknown_args = parser.parse_known_args(argv)
+    given = [
+        "--" + name.replace("_", "-") for name in UNSUPPORTED if getattr(args, name)
+    ]
+    if given:
+        parser.error("batch runs take no {}".format(", ".join(given)))
+    if args.executor != "threads":
+        parser.error("batch runs need --executor threads")
+    args_dict = vars(args)
+    args_dict['extras'] = unknown_args
+    return namedtuple("RunArgs", list(args_dict.keys()))(**args_dict)
+
+
+def run(run_args, _metrics=metrics.METRICS) -> List[PairRun]:
+    _metrics.reset()
+    try:
+        configure_somaticsniper(run_args)
+        pairs = load_pairs(run_args.manifest)
+        with perl_workers(run_args, _metrics=_metrics):
+            runs = run_batch(run_args, pairs, _metrics=_metrics)
+        raise_for_exceptions([e for r in runs for e in r.exceptions])
+        return runs
+    finally:
+        if run_args.metrics_json:
+            _metrics.write(run_args.metrics_json)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    setup_logger()
+    args = process_argv(argv)
+    try:
+        run(args)
+    except Exception as e:
+        logger.exception(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# __END__
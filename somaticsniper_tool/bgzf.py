@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+BGZF block compression.
+
+BGZF files are series of gzip members of at most 64 KiB each, with the
+compressed member size in a gzip extra field, so they can be concatenated
+block by block and addressed with virtual offsets: the compressed offset of
+a block shifted left 16 bits, plus the offset within its uncompressed data.
+See the SAM specification, section 4.1.
+"""
+
+import logging
+import struct
+import zlib
+from types import SimpleNamespace
+from typing import IO, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(open=open)
+
+# Uncompressed bytes per block, as bgzip, leaving room for incompressible data
+MAX_BLOCK_DATA = 0xFF00
+
+# Empty block marking the end of a BGZF file
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# Magic, method, flags, mtime, extra flags, OS, extra length, then the BC
+# subfield: identifiers, length and the block size less one
+_HEADER = struct.Struct("<4sIBBH2sHH")
+_MAGIC = b"\x1f\x8b\x08\x04"
+_TRAILER = struct.Struct("<II")
+
+VirtualOffset = int
+
+
+def virtual_offset(block_offset: int, data_offset: int) -> VirtualOffset:
+    return block_offset << 16 | data_offset
+
+
+def compress_block(data: bytes, level: int = zlib.Z_DEFAULT_COMPRESSION) -> bytes:
+    """Compress up to MAX_BLOCK_DATA bytes into one BGZF block."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    size = _HEADER.size + len(deflated) + _TRAILER.size
+    header = _HEADER.pack(_MAGIC, 0, 0, 0xFF, 6, b"BC", 2, size - 1)
+    return header + deflated + _TRAILER.pack(zlib.crc32(data), len(data))
+
+
+def read_block(fh: IO) -> Optional[Tuple[bytes, bytes]]:
+    """Read the next block of a binary BGZF handle.
+    Returns:
+        Tuple[bytes, bytes]: Raw block and its data, None at end of file
+    """
+    header = fh.read(_HEADER.size)
+    if not header:
+        return None
+    if len(header) < _HEADER.size:
+        raise ValueError("Truncated BGZF block header")
+    magic, _, _, _, extra_length, subfield, _, block_size = _HEADER.unpack(header)
+    if magic != _MAGIC or extra_length != 6 or subfield != b"BC":
+        raise ValueError("Not a BGZF block")
+    body = fh.read(block_size + 1 - _HEADER.size)
+    if len(body) < block_size + 1 - _HEADER.size:
+        raise ValueError("Truncated BGZF block")
+    crc, data_size = _TRAILER.unpack(body[-_TRAILER.size :])
+    data = zlib.decompress(body[: -_TRAILER.size], -15)
+    if len(data) != data_size or zlib.crc32(data) != crc:
+        raise ValueError("Corrupt BGZF block")
+    return header + body, data
+
+
+def read_blocks(fh: IO) -> Iterator[Tuple[bytes, bytes]]:
+    """Iterate over the raw blocks and data of a binary BGZF handle."""
+    while True:
+        block = read_block(fh)
+        if block is None:
+            return
+        yield block
+
+
+class BgzfReader:
+    """Read the uncompressed data of a binary BGZF handle."""
+
+    def __init__(self, fh: IO):
+        self._blocks = read_blocks(fh)
+        self._buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes, all remaining data if size is negative."""
+        while size < 0 or len(self._buffer) < size:
+            block = next(self._blocks, None)
+            if block is None:
+                break
+            self._buffer += block[1]
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class BgzfWriter:
+    """Write data to a binary handle as BGZF blocks.
+
+    Blocks end at the last line break that fits, so lines shorter than a
+    block never span blocks.
+    """
+
+    def __init__(self, fh: IO, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        self.fh = fh
+        self.level = level
+        self.offset = 0
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def tell(self) -> VirtualOffset:
+        """Get the virtual offset of the next byte written.
+
+        At a block boundary this is the end of the block before it, which
+        readers resolve to the start of the next block.
+        """
+        return virtual_offset(self.offset, len(self._buffer))
+
+    def write(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= MAX_BLOCK_DATA:
+            cut = self._buffer.rfind(b"\n", 0, MAX_BLOCK_DATA) + 1 or MAX_BLOCK_DATA
+            block = compress_block(bytes(self._buffer[:cut]), self.level)
+            del self._buffer[:cut]
+            self._write(block)
+
+    def flush(self):
+        """End the current block, so following data starts a new one."""
+        if self._buffer:
+            block = compress_block(bytes(self._buffer), self.level)
+            self._buffer.clear()
+            self._write(block)
+
+    def write_block(self, block: bytes):
+        """Write a compressed block as is, after any buffered data."""
+        self.flush()
+        self._write(block)
+
+    def _write(self, block: bytes):
+        self.fh.write(block)
+        self.offset += len(block)
+
+    def close(self):
+        """Write buffered data and the end of file marker."""
+        self.write_block(EOF_BLOCK)
+
+
+def compress_vcf(
+    vcf_file: str,
+    output_file: str,
+    level: int = zlib.Z_DEFAULT_COMPRESSION,
+    chunk_size: int = 1 << 20,
+    _di=DI,
+) -> str:
+    """Compress a VCF to BGZF, with the header in blocks of its own.
+    Accepts:
+        vcf_file (str): Path to plain VCF
+        output_file (str): Path to BGZF output
+        level (int): zlib compression level
+    Returns:
+        output_file (str): Path to BGZF output
+    """
+    with _di.open(vcf_file, 'rb') as in_fh, _di.open(output_file, 'wb') as out_fh:
+        with BgzfWriter(out_fh, level=level) as writer:
+            first_record = b""
+            for line in iter(in_fh.readline, b""):
+                if not line.startswith(b"#"):
+                    first_record = line
+                    break
+                writer.write(line)
+            # Mergers copy record blocks and take header blocks from one file
+            writer.flush()
+            writer.write(first_record)
+            for chunk in iter(lambda: in_fh.read(chunk_size), b""):
+                writer.write(chunk)
+    logger.info("BGZF compressed %s -> %s", vcf_file, output_file)
+    return output_file
+
+
+# __END__
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Merge BGZF region outputs by copying their compressed blocks.
+
+Region outputs are compressed by their workers with compress_vcf, which
+keeps the header in blocks of its own and ends every block at a line break.
+Appending a region in coordinate order then copies its record blocks as
+they are, and the header blocks of the first region only. Records are
+indexed from the decompressed blocks as they are copied, and the tabix
+index is written next to the merged file on close.
+
+Sub-regions clipped to bounds only recompress the blocks that hold records
+outside their bounds, the overlap at their edges.
+"""
+
+import io
+import logging
+import math
+import zlib
+from types import SimpleNamespace
+from typing import Tuple
+
+from somaticsniper_tool import bgzf
+from somaticsniper_tool.incremental_merge import Bounds, IncrementalMerge
+from somaticsniper_tool.tabix import INDEX_SUFFIX, TabixIndex
+from somaticsniper_tool.vcf_batch import CHROM, RecordBatch
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(open=open)
+
+UNBOUNDED: Bounds = (-math.inf, math.inf)
+
+
+def split_header(data: bytes) -> Tuple[bytes, bytes]:
+    """Split block data into leading header lines and the records after."""
+    end = 0
+    while data.startswith(b"#", end):
+        end = data.find(b"\n", end) + 1 or len(data)
+    return data[:end], data[end:]
+
+
+class BgzfMerge:
+    """Concatenate BGZF VCFs into one, building its tabix index.
+    Accepts:
+        output_file (str): Path to merged BGZF VCF, indexed to output_file.tbi
+        level (int): zlib compression level of recompressed blocks
+    """
+
+    def __init__(
+        self, output_file: str, level: int = zlib.Z_DEFAULT_COMPRESSION, _di=DI
+    ):
+        self.output_file = output_file
+        self.level = level
+        self.index = TabixIndex()
+        self._di = _di
+        self._fh = None
+        self._writer = None
+
+    def __enter__(self):
+        self._fh = self._di.open(self.output_file, 'wb')
+        self._writer = bgzf.BgzfWriter(self._fh, level=self.level)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            self._writer.close()
+        finally:
+            self._fh.close()
+        if type is None:
+            self.index.write(self.output_file + INDEX_SUFFIX, _di=self._di)
+
+    def append(self, vcf_gz: str, with_header: bool, bounds: Bounds = UNBOUNDED):
+        """Copy the blocks of a BGZF VCF.
+        Accepts:
+            vcf_gz (str): Path to BGZF VCF written by bgzf.compress_vcf
+            with_header (bool): Copy its header blocks
+            bounds (Bounds): Inclusive range of positions to keep
+        """
+        lower, upper = bounds
+        clip = bounds != UNBOUNDED
+        with self._di.open(vcf_gz, 'rb') as fh:
+            for block, data in bgzf.read_blocks(fh):
+                if data.startswith(b"#"):
+                    header, data = split_header(data)
+                    if not data:
+                        if with_header:
+                            self._writer.write_block(block)
+                        continue
+                    # Header and records share the block, split them
+                    if with_header:
+                        self._writer.write_block(
+                            bgzf.compress_block(header, self.level)
+                        )
+                    block = None
+                elif not data:
+                    # End of file marker
+                    continue
+                if not data.endswith(b"\n"):
+                    raise ValueError(
+                        "{} has a record split across BGZF blocks".format(vcf_gz)
+                    )
+                batch = RecordBatch(data)
+                if clip:
+                    keep = [lower <= pos <= upper for pos in batch.pos]
+                    if not any(keep):
+                        continue
+                    if not all(keep):
+                        out_fh = io.BytesIO()
+                        batch.write(out_fh, keep=keep)
+                        batch = RecordBatch(out_fh.getvalue())
+                        block = None
+                if block is None:
+                    block = bgzf.compress_block(batch.buffer, self.level)
+                self._write_records(block, batch, vcf_gz)
+
+    def _write_records(self, block: bytes, batch: RecordBatch, vcf_gz: str):
+        self._writer.flush()
+        offset = self._writer.offset
+        next_offset = offset + len(block)
+        size = len(batch.buffer)
+        records = zip(batch.chroms(), batch.pos, batch.refs)
+        for i, (chrom, pos, ref) in enumerate(records):
+            if pos < 1:
+                raise ValueError("{} has a record without POS".format(vcf_gz))
+            line_end = batch.line_ends[i]
+            self.index.add(
+                chrom,
+                pos - 1,
+                pos - 1 + len(ref),
+                bgzf.virtual_offset(offset, batch.starts[CHROM][i]),
+                # Records ending their block end where the next block starts
+                bgzf.virtual_offset(next_offset, 0)
+                if line_end == size
+                else bgzf.virtual_offset(offset, line_end),
+            )
+        self._writer.write_block(block)
+
+
+class IncrementalBgzfMerge(IncrementalMerge):
+    """IncrementalMerge of BGZF region outputs into a BgzfMerge."""
+
+    merged_file: BgzfMerge
+
+    def _append(self, annotated_vcf: str, with_header: bool, mpileup: str):
+        self.merged_file.append(
+            annotated_vcf, with_header, self.bounds.get(mpileup, UNBOUNDED)
+        )
+        logger.info("Merged %s", annotated_vcf)
+
+
+# __END__
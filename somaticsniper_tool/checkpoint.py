@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Checkpoint manifest of completed regions, for --resume.
+
+Each completed region is appended as one JSON line with a fingerprint of
+its inputs and the size and mtime of its annotated VCF, so recording costs
+the same for every region however many are done. On resume a region is
+skipped only if its fingerprint still matches and its output is unchanged
+on disk.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(open=open, os=os)
+
+MANIFEST_FILE = "multi_somaticsniper.manifest.jsonl"
+MANIFEST_VERSION = 2
+
+
+def file_state(path: str, _di=DI) -> Dict[str, int]:
+    """Get size and mtime of a file, to tell whether it changed."""
+    stat = _di.os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def file_mtime(path: str, _di=DI) -> Optional[int]:
+    """Get mtime of a file, e.g. a perl script, None if missing."""
+    try:
+        return _di.os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def bam_index_mtime(bam: str, _di=DI) -> Optional[int]:
+    """Get mtime of a BAM's index, <bam>.bai, <name>.bai or <bam>.csi, if any."""
+    base, _ = _di.os.path.splitext(bam)
+    indexes = ("{}.bai".format(bam), "{}.bai".format(base), "{}.csi".format(bam))
+    for index in indexes:
+        try:
+            return _di.os.stat(index).st_mtime_ns
+        except OSError:
+            continue
+    return None
+
+
+class Manifest:
+    """Thread-safe record of completed regions, persisted as JSON lines.
+
+    params holds run-wide inputs shared by every region: sniper parameters,
+    BAM index mtimes and post-processing settings. sources maps a sub-region
+    mpileup to the mpileup it was split from, which is fingerprinted instead
+    since sub-region files are rewritten on every run. Without resume the
+    manifest of a previous run is truncated.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        params: Dict,
+        sources: Optional[Dict[str, str]] = None,
+        resume: bool = True,
+        _di=DI,
+    ):
+        self.path = path
+        self.params = params
+        self.sources = sources or {}
+        self._di = _di
+        self._lock = threading.Lock()
+        if resume:
+            self.regions = self._load()
+        else:
+            self.regions = {}
+            self._di.open(self.path, 'w').close()
+
+    def _load(self) -> Dict:
+        regions = {}
+        try:
+            with self._di.open(self.path) as fh:
+                for line_number, line in enumerate(fh, 1):
+                    try:
+                        entry = json.loads(line)
+                        if entry["version"] != MANIFEST_VERSION:
+                            raise ValueError("another version")
+                        regions[entry["mpileup"]] = entry
+                    except (ValueError, TypeError, KeyError):
+                        # e.g. a record torn by preemption
+                        logger.warning(
+                            "Ignoring line %s of manifest %s", line_number, self.path
+                        )
+        except FileNotFoundError:
+            pass
+        return regions
+
+    def fingerprint(self, mpileup: str) -> str:
+        """Hash region inputs: mpileup size/mtime and run-wide params."""
+        stat = self._di.os.stat(self.sources.get(mpileup, mpileup))
+        inputs = {
+            "mpileup": mpileup,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "params": self.params,
+        }
+        encoded = json.dumps(inputs, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def is_done(self, mpileup: str) -> Optional[str]:
+        """Get a region's output if it is recorded and verified, else None."""
+        entry = self.regions.get(mpileup)
+        if not entry:
+            return None
+        try:
+            if entry["fingerprint"] != self.fingerprint(mpileup):
+                logger.info("Inputs changed, recomputing %s", mpileup)
+                return None
+            if entry["state"] != file_state(entry["output"], _di=self._di):
+                logger.info("Output changed, recomputing %s", mpileup)
+                return None
+        except OSError:
+            logger.info("Missing input or output, recomputing %s", mpileup)
+            return None
+        return entry["output"]
+
+    def record(self, mpileup: str, output: str):
+        """Record a completed region, appending it to the manifest."""
+        entry = {
+            "version": MANIFEST_VERSION,
+            "mpileup": mpileup,
+            "fingerprint": self.fingerprint(mpileup),
+            "output": output,
+            "state": file_state(output, _di=self._di),
+        }
+        line = json.dumps(entry, sort_keys=True) + "\n"
+        with self._lock:
+            self.regions[mpileup] = entry
+            # A later record of a region replaces an earlier one on load
+            with self._di.open(self.path, 'a') as fh:
+                fh.write(line)
+
+
+# __END__
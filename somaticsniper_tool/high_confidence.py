@@ -1,13 +1,26 @@
 #!/usr/bin/env python3
 import logging
+from array import array
+from itertools import compress, islice
 from textwrap import dedent
+from types import SimpleNamespace
+from typing import IO, Iterable, List, Optional, Sequence
 
 from somaticsniper_tool import utils
+from somaticsniper_tool.perl_pool import PerlWorkerPool
+from somaticsniper_tool.vcf_batch import RecordBatch
 
 logger = logging.getLogger(__name__)
 
+DI = SimpleNamespace(open=open)
+
+MIN_SOMATIC_SCORE = 40
+MIN_MAPPING_QUALITY = 40
+
 
 class HighConfidence:
+    # Shared PerlWorkerPool to run the script on, set for the run
+    pool: Optional[PerlWorkerPool] = None
 
     COMMAND = dedent(
         """
@@ -16,17 +29,170 @@ class HighConfidence:
         """
     ).strip()
 
-    def __init__(self, timeout, high_confidence: str, input_file: str):
+    def __init__(
+        self,
+        timeout,
+        high_confidence: str,
+        input_file: str,
+        min_somatic_score: int = MIN_SOMATIC_SCORE,
+        min_mapping_quality: int = MIN_MAPPING_QUALITY,
+    ):
         self.timeout = timeout
         self.high_confidence = high_confidence
         self.input_file = input_file
+        self.min_somatic_score = min_somatic_score
+        self.min_mapping_quality = min_mapping_quality
 
-    def run(self, _utils=utils):
-        cmd = self.COMMAND.format(
+    def options(self) -> List[str]:
+        """Get the script options differing from its defaults.
+
+        Left out at their defaults, so default runs call the script as
+        before these options were configurable.
+        """
+        options = []
+        if self.min_somatic_score != MIN_SOMATIC_SCORE:
+            options += ["--min-somatic-score", str(self.min_somatic_score)]
+        if self.min_mapping_quality != MIN_MAPPING_QUALITY:
+            options += ["--min-mapping-quality", str(self.min_mapping_quality)]
+        return options
+
+    def build_command(self) -> str:
+        command = self.COMMAND.format(
             high_confidence=self.high_confidence, input_file=self.input_file
         )
-        _utils.run_subprocess_command(cmd, self.timeout)
+        return "\n".join([command, *self.options()])
+
+    def build_args(self) -> List[str]:
+        """Get the script and its arguments, as in build_command."""
+        return [self.high_confidence, "--snp-file", self.input_file, *self.options()]
+
+    def run(self, _utils=utils):
+        cmd = self.build_command()
+        if self.pool is not None:
+            script, *args = self.build_args()
+            self.pool.run(script, args, self.timeout)
+        else:
+            _utils.run_subprocess_command(cmd, self.timeout, stream_output=True)
         logger.info(cmd)
 
+    async def run_async(self, runner):
+        cmd = self.build_command()
+        if self.pool is not None:
+            script, *args = self.build_args()
+            await runner.run_in_executor(
+                "highconfidence", self.pool.run, script, args, self.timeout
+            )
+        else:
+            await runner.run(
+                cmd, self.timeout, stage="highconfidence", stream_output=True
+            )
+        logger.info(cmd)
+
+
+def _tumor_value(fields: List[bytes], key: bytes) -> float:
+    """Look up a tumor FORMAT value, treating missing values as 0 like perl."""
+    try:
+        idx = fields[8].split(b":").index(key)
+        return float(fields[10].rstrip(b"\r\n").split(b":")[idx])
+    except (IndexError, ValueError):
+        return 0.0
+
+
+def _to_float(value: Optional[bytes]) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _scores(values: List[Optional[bytes]]) -> array:
+    """Parse FORMAT values, treating missing values as 0 like perl."""
+    try:
+        return array('d', map(float, values))
+    except (TypeError, ValueError):
+        return array('d', map(_to_float, values))
+
+
+class NativeHighConfidence:
+    """In-process equivalent of highconfidence.pl.
+
+    Records are parsed in batches into somatic score and mapping quality
+    columns, and the thresholds are applied to whole columns at once. Headers
+    and passing records are written unchanged to <input_file>.hc.
+
+    run splits lines, with mask_lines, and the fused post-processing masks
+    RecordBatches, with mask. Both read the tumor sample's values, missing
+    ones as 0, and apply the thresholds in _passing.
+    """
+
+    BATCH_SIZE = 4096
+
+    def __init__(
+        self,
+        timeout,
+        high_confidence: str,
+        input_file: str,
+        min_somatic_score: int = MIN_SOMATIC_SCORE,
+        min_mapping_quality: int = MIN_MAPPING_QUALITY,
+    ):
+        self.timeout = timeout
+        self.high_confidence = high_confidence
+        self.input_file = input_file
+        self.min_somatic_score = min_somatic_score
+        self.min_mapping_quality = min_mapping_quality
+
+        self.output_file = "{}.hc".format(input_file)
+
+    def _passing(self, somatic_score: array, mapping_quality: array) -> List[bool]:
+        min_ssc = self.min_somatic_score
+        min_mq = self.min_mapping_quality
+        return [
+            ssc >= min_ssc and mq >= min_mq
+            for ssc, mq in zip(somatic_score, mapping_quality)
+        ]
+
+    def mask(
+        self, batch: RecordBatch, rows: Optional[Sequence[int]] = None
+    ) -> List[bool]:
+        """Return the threshold mask for rows of a batch, default all rows."""
+        return self._passing(
+            _scores(batch.sample_values(b"SSC", rows=rows)),
+            _scores(batch.sample_values(b"MQ", rows=rows)),
+        )
+
+    def mask_lines(self, records: List[bytes]) -> List[bool]:
+        """Return the threshold mask for a batch of VCF record lines."""
+        fields = [record.split(b"\t") for record in records]
+        return self._passing(
+            array('d', (_tumor_value(f, b"SSC") for f in fields)),
+            array('d', (_tumor_value(f, b"MQ") for f in fields)),
+        )
+
+    def filter_lines(self, lines: Iterable[bytes], out_fh: IO):
+        """Write header lines and passing records from lines to out_fh."""
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, self.BATCH_SIZE))
+            if not batch:
+                break
+            records = [line for line in batch if not line.startswith(b"#")]
+            if len(records) != len(batch):
+                # VCF headers precede all records, so writing them first
+                # keeps the input order
+                headers = (line for line in batch if line.startswith(b"#"))
+                out_fh.write(b"".join(headers))
+            out_fh.write(b"".join(compress(records, self.mask_lines(records))))
+
+    def run(self, _di=DI):
+        with _di.open(self.input_file, 'rb') as in_fh, _di.open(
+            self.output_file, 'wb'
+        ) as out_fh:
+            self.filter_lines(in_fh, out_fh)
+        logger.info(
+            "Native high confidence filter: %s -> %s",
+            self.input_file,
+            self.output_file,
+        )
+
 
 # __END__
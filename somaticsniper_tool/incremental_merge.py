@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Merge region outputs into the final VCF while other regions still run.
+
+Regions are merged in coordinate order. A finished region is appended as
+soon as every region before it has been appended; out-of-order completions
+wait on disk until the gap before them closes.
+"""
+
+import logging
+import math
+import queue
+import threading
+from typing import IO, Dict, List, Optional, Sequence, Tuple
+
+from somaticsniper_tool import metrics, region_split
+
+logger = logging.getLogger(__name__)
+
+Bounds = Tuple[float, float]
+
+
+def coordinate_order(
+    mpileups: Sequence[str], contig_order: Optional[Dict[str, int]] = None
+) -> List[str]:
+    """Sort region mpileups by contig rank, then start.
+
+    Unknown contigs follow known ones by name; names without a range follow
+    everything else in the given order.
+    """
+    contig_order = contig_order or {}
+    unknown = len(contig_order)
+
+    def key(mpileup):
+        try:
+            chrom, start, _ = region_split.parse_region(mpileup)
+        except ValueError:
+            return 1, unknown, "", 0
+        return 0, contig_order.get(chrom, unknown), chrom, start
+
+    return sorted(mpileups, key=key)
+
+
+class IncrementalMerge:
+    """Append region outputs to the merged VCF in order on a consumer thread.
+    Accepts:
+        mpileups (Sequence[str]): Region mpileups in merge order
+        merged_file (IO): Text file handle of merged output
+        bounds (Dict[str, Bounds]): Optional inclusive position range to keep
+            per region, e.g. region_split.clip_bounds for sub-regions
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        mpileups: Sequence[str],
+        merged_file: IO,
+        bounds: Optional[Dict[str, Bounds]] = None,
+    ):
+        self.order = list(mpileups)
+        self.merged_file = merged_file
+        self.bounds = bounds or {}
+
+        self.merged = 0
+        self.error = None
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._queue.put(self._STOP)
+        self._thread.join()
+        if type is None and self.error:
+            raise self.error
+        if type is None and self.merged != len(self.order):
+            raise ValueError(
+                "Merged {} of {} regions".format(self.merged, len(self.order))
+            )
+
+    def __call__(self, mpileup: str, annotated_vcf: str):
+        self.submit(mpileup, annotated_vcf)
+
+    def submit(self, mpileup: str, annotated_vcf: str):
+        """Hand a finished region's output to the merge thread."""
+        self._queue.put((mpileup, annotated_vcf))
+
+    def _consume(self):
+        done = {}
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            if self.error:
+                continue
+            mpileup, annotated_vcf = item
+            done[mpileup] = annotated_vcf
+            try:
+                while self.merged < len(self.order) and self.order[self.merged] in done:
+                    mpileup = self.order[self.merged]
+                    annotated_vcf = done.pop(mpileup)
+                    with metrics.METRICS.stage(
+                        metrics.RUN, "merge", inputs=(annotated_vcf,)
+                    ):
+                        self._append(annotated_vcf, self.merged == 0, mpileup)
+                    self.merged += 1
+            except Exception as e:
+                logger.exception(e)
+                self.error = e
+        if done:
+            logger.info("%s finished regions were not merged", len(done))
+
+    def _append(self, annotated_vcf: str, with_header: bool, mpileup: str):
+        lower, upper = self.bounds.get(mpileup, (-math.inf, math.inf))
+        clip = (lower, upper) != (-math.inf, math.inf)
+        with open(annotated_vcf) as fh:
+            for line in fh:
+                if line.startswith("#"):
+                    if with_header:
+                        self.merged_file.write(line)
+                elif not clip or lower <= int(line.split("\t", 2)[1]) <= upper:
+                    self.merged_file.write(line)
+        self.merged_file.flush()
+        logger.info("Merged %s", annotated_vcf)
+
+
+# __END__
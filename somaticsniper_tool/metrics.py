@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and resource instrumentation.
+
+Stages are timed with RunMetrics.stage. Child processes reaped while a stage
+is active in the same thread or asyncio task add their resource usage to it,
+see utils.RusagePopen and async_runner.ChildUsage.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ru_inblock/ru_oublock count 512-byte blocks
+BLOCK_SIZE = 512
+
+# Region name for run-level stages, e.g. the final merge
+RUN = "run"
+
+
+def _file_bytes(paths: Iterable[str]) -> int:
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except (OSError, TypeError):
+            pass
+    return total
+
+
+class RunMetrics:
+    """Collects stage records for a run and renders the JSON report."""
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self.summaries: Dict[str, Dict] = {}
+        self.start = time.time()
+        self._lock = threading.Lock()
+        # Context variables are per thread and per asyncio task
+        self._record = contextvars.ContextVar("stage_record", default=None)
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+            self.summaries = {}
+            self.start = time.time()
+
+    @contextmanager
+    def stage(
+        self,
+        region: str,
+        stage: str,
+        inputs: Iterable[str] = (),
+        outputs: Iterable[str] = (),
+    ):
+        """Time a stage of a region.
+        Accepts:
+            region (str): Region name, e.g. mpileup basename
+            stage (str): Stage name
+            inputs (Iterable[str]): Files read by the stage, for byte counts
+            outputs (Iterable[str]): Files written by the stage
+        """
+        record = {
+            "region": region,
+            "stage": stage,
+            "start": time.time() - self.start,
+            "wall_seconds": 0.0,
+            "thread_cpu_seconds": 0.0,
+            "child_user_seconds": 0.0,
+            "child_system_seconds": 0.0,
+            "child_max_rss_kb": 0,
+            "child_read_bytes": 0,
+            "child_write_bytes": 0,
+            "input_bytes": _file_bytes(inputs),
+            "output_bytes": 0,
+            "ok": False,
+        }
+        token = self._record.set(record)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield record
+            record["ok"] = True
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall_start
+            record["thread_cpu_seconds"] = time.thread_time() - cpu_start
+            record["output_bytes"] = _file_bytes(outputs)
+            self._record.reset(token)
+            with self._lock:
+                self.records.append(record)
+
+    def add_child_usage(self, rusage: Optional[resource.struct_rusage]):
+        """Add a reaped child's resource usage to the current stage, if any."""
+        record = self._record.get()
+        if record is None or rusage is None:
+            return
+        record["child_user_seconds"] += rusage.ru_utime
+        record["child_system_seconds"] += rusage.ru_stime
+        record["child_max_rss_kb"] = max(record["child_max_rss_kb"], rusage.ru_maxrss)
+        record["child_read_bytes"] += rusage.ru_inblock * BLOCK_SIZE
+        record["child_write_bytes"] += rusage.ru_oublock * BLOCK_SIZE
+
+    def add_summary(self, name: str, summary: Dict):
+        """Add a run-wide summary, e.g. of a shared worker pool, to the report."""
+        with self._lock:
+            self.summaries[name] = summary
+
+    def report(self) -> Dict:
+        """Summarize records per stage and region, with the critical path.
+
+        Stages of a region run one after another, so the critical path is
+        the region that finished last: its start offset, its stages, and any
+        work after it (e.g. the final merge).
+        """
+        with self._lock:
+            records = list(self.records)
+            summaries = dict(self.summaries)
+        wall = time.time() - self.start
+
+        stage_totals = defaultdict(lambda: defaultdict(float))
+        regions = defaultdict(
+            lambda: {"start": None, "end": 0.0, "wall_seconds": 0.0, "stages": {}}
+        )
+        for record in records:
+            totals = stage_totals[record["stage"]]
+            totals["count"] += 1
+            for key in (
+                "wall_seconds",
+                "thread_cpu_seconds",
+                "child_user_seconds",
+                "child_system_seconds",
+                "input_bytes",
+                "output_bytes",
+            ):
+                totals[key] += record[key]
+            totals["child_max_rss_kb"] = max(
+                totals["child_max_rss_kb"], record["child_max_rss_kb"]
+            )
+            if record["region"] == RUN:
+                continue
+            region = regions[record["region"]]
+            end = record["start"] + record["wall_seconds"]
+            if region["start"] is None or record["start"] < region["start"]:
+                region["start"] = record["start"]
+            region["end"] = max(region["end"], end)
+            region["wall_seconds"] += record["wall_seconds"]
+            region["stages"][record["stage"]] = (
+                region["stages"].get(record["stage"], 0.0) + record["wall_seconds"]
+            )
+
+        critical = {}
+        if regions:
+            name, region = max(regions.items(), key=lambda item: item[1]["end"])
+            critical = {
+                "region": name,
+                "region_start_seconds": region["start"],
+                "region_end_seconds": region["end"],
+                "region_stage_seconds": region["stages"],
+                "tail_seconds": max(0.0, wall - region["end"]),
+                "tail_stage_seconds": {
+                    r["stage"]: r["wall_seconds"]
+                    for r in records
+                    if r["region"] == RUN and r["start"] >= region["end"]
+                },
+            }
+        return {
+            "wall_seconds": wall,
+            "self_max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "stage_totals": {k: dict(v) for k, v in stage_totals.items()},
+            "regions": dict(regions),
+            "critical_path": critical,
+            "stages": records,
+            "summaries": summaries,
+        }
+
+    def write(self, path: str):
+        with open(path, 'w') as fh:
+            json.dump(self.report(), fh, indent=2, sort_keys=True)
+        logger.info("Wrote metrics report to %s", path)
+
+
+METRICS = RunMetrics()
+
+
+# __END__
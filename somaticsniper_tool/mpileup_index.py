@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped mpileup reader with a sparse position index.
+
+The index samples one line per block of block_size bytes: the position and
+byte offset of the first line starting in the block, plus the first line of
+every contig, with the sample range and end offset of each contig. Building
+it jumps from block to block, parsing about one line per block, and only
+scans the lines of blocks in which the contig changes. A position maps to
+a byte offset by bisecting the samples, then scanning forward from the
+sample before, at most one block of lines. It is saved next to the mpileup
+as a .mpi sidecar and reused while the mpileup's size and mtime are
+unchanged.
+
+Sidecar layout, little-endian:
+    header      MAGIC, mpileup size (Q), mpileup mtime_ns (q), samples (Q),
+                contigs (I), block size (I)
+    contigs     name length (H), name, first sample (Q), end sample (Q),
+                end offset (Q)
+    positions   samples x uint32
+    offsets     samples x uint64
+"""
+
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from types import SimpleNamespace
+from typing import Dict, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(open=open, os=os)
+
+MAGIC = b"MPI2"
+SIDECAR_SUFFIX = ".mpi"
+BLOCK_SIZE = 1 << 16
+_HEADER = struct.Struct("<4sQqQII")
+_CONTIG = struct.Struct("<QQQ")
+
+
+def _to_little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _next_line(data, offset: int, size: int) -> int:
+    """Get the offset of the line after the one at offset."""
+    newline = data.find(b"\n", offset)
+    return size if newline == -1 else newline + 1
+
+
+def _chrom(data, offset: int) -> bytes:
+    return data[offset : data.find(b"\t", offset)]
+
+
+def _position(data, offset: int) -> int:
+    tab = data.find(b"\t", offset)
+    return int(data[tab + 1 : data.find(b"\t", tab + 1)])
+
+
+def _samples(data, size: int, block_size: int) -> Iterator[Tuple[bytes, int]]:
+    """Get the (chrom, offset) of the first line of each block and contig."""
+    offset = 0
+    chrom = None
+    while offset < size:
+        chrom = _chrom(data, offset)
+        yield chrom, offset
+        # First line starting at or after the next block
+        target = offset + block_size
+        block_end = size if target >= size else _next_line(data, target - 1, size)
+        # Lines of a contig are together, so the last line of the block tells
+        # whether a contig starts within it
+        last_line = data.rfind(b"\n", offset, block_end - 1) + 1
+        if last_line > offset and _chrom(data, last_line) != chrom:
+            line = _next_line(data, offset, size)
+            while line < block_end:
+                line_chrom = _chrom(data, line)
+                if line_chrom != chrom:
+                    chrom = line_chrom
+                    yield chrom, line
+                line = _next_line(data, line, size)
+        offset = block_end
+
+
+class MpileupIndex:
+    """Sparse position index of a coordinate-sorted mpileup.
+
+    Offsets are looked up in the memory map, so use it as a context manager.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int,
+        contigs: Dict[bytes, Tuple[int, int, int]],
+        positions: array,
+        offsets: array,
+        block_size: int = BLOCK_SIZE,
+        _di=DI,
+    ):
+        self.path = path
+        self.size = size
+        self.contigs = contigs
+        self.positions = positions
+        self.offsets = offsets
+        self.block_size = block_size
+        self._di = _di
+        self._fh = None
+        self.data = None
+
+    @classmethod
+    def build(
+        cls, path: str, block_size: int = BLOCK_SIZE, _di=DI
+    ) -> "MpileupIndex":
+        """Index an mpileup, sampling one line per block of its memory map."""
+        contigs = {}
+        positions = array('I')
+        offsets = array('Q')
+        with _di.open(path, 'rb') as fh:
+            size = _di.os.fstat(fh.fileno()).st_size
+            if size:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    chrom = None
+                    for line_chrom, offset in _samples(data, size, block_size):
+                        if line_chrom != chrom:
+                            if chrom is not None:
+                                first = contigs[chrom][0]
+                                contigs[chrom] = (first, len(positions), offset)
+                            chrom = line_chrom
+                            contigs[chrom] = (len(positions), None, None)
+                        positions.append(_position(data, offset))
+                        offsets.append(offset)
+                    contigs[chrom] = (contigs[chrom][0], len(positions), size)
+        return cls(path, size, contigs, positions, offsets, block_size, _di=_di)
+
+    @classmethod
+    def open(cls, path: str, _di=DI) -> "MpileupIndex":
+        """Load the .mpi sidecar of path if current, else build and save it."""
+        sidecar = path + SIDECAR_SUFFIX
+        try:
+            return cls.load(path, sidecar, _di=_di)
+        except (OSError, ValueError, struct.error):
+            pass
+        index = cls.build(path, _di=_di)
+        try:
+            index.save(sidecar)
+        except OSError as e:
+            logger.warning("Could not save mpileup index %s: %s", sidecar, e)
+        return index
+
+    @classmethod
+    def load(cls, path: str, sidecar: str, _di=DI) -> "MpileupIndex":
+        """Load a sidecar, raising ValueError if it is stale or invalid."""
+        stat = _di.os.stat(path)
+        with _di.open(sidecar, 'rb') as fh:
+            magic, size, mtime_ns, rows, n_contigs, block_size = _HEADER.unpack(
+                fh.read(_HEADER.size)
+            )
+            if magic != MAGIC:
+                raise ValueError("Not an mpileup index: {}".format(sidecar))
+            if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                raise ValueError("Stale mpileup index: {}".format(sidecar))
+            contigs = {}
+            for _ in range(n_contigs):
+                (length,) = struct.unpack("<H", fh.read(2))
+                name = fh.read(length)
+                contigs[name] = _CONTIG.unpack(fh.read(_CONTIG.size))
+            positions = _from_little_endian('I', fh.read(4 * rows))
+            offsets = _from_little_endian('Q', fh.read(8 * rows))
+        if len(positions) != rows or len(offsets) != rows:
+            raise ValueError("Truncated mpileup index: {}".format(sidecar))
+        return cls(path, size, contigs, positions, offsets, block_size, _di=_di)
+
+    def save(self, sidecar: str):
+        stat = self._di.os.stat(self.path)
+        tmp_sidecar = "{}.tmp".format(sidecar)
+        with self._di.open(tmp_sidecar, 'wb') as fh:
+            fh.write(
+                _HEADER.pack(
+                    MAGIC,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    len(self.positions),
+                    len(self.contigs),
+                    self.block_size,
+                )
+            )
+            for name, rows in self.contigs.items():
+                fh.write(struct.pack("<H", len(name)) + name + _CONTIG.pack(*rows))
+            fh.write(_to_little_endian(self.positions))
+            fh.write(_to_little_endian(self.offsets))
+        self._di.os.replace(tmp_sidecar, sidecar)
+
+    def __enter__(self):
+        self._fh = self._di.open(self.path, 'rb')
+        if self.size:
+            self.data = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # Empty files cannot be mapped
+            self.data = b""
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = None
+        self._fh.close()
+
+    def _seek(self, chrom: bytes, value: float, past: bool) -> int:
+        """Get the offset of chrom's first line with position >= value, or
+        > value if past, or the contig's end."""
+        first, last, end = self.contigs[chrom]
+        bisect_samples = bisect.bisect_right if past else bisect.bisect_left
+        i = bisect_samples(self.positions, value, first, last)
+        # Sample i is the first past value, so the line is after sample i - 1
+        offset = self.offsets[max(i - 1, first)]
+        limit = self.offsets[i] if i < last else end
+        while offset < limit:
+            position = _position(self.data, offset)
+            if position > value or (position == value and not past):
+                return offset
+            offset = _next_line(self.data, offset, limit)
+        return limit
+
+    def byte_range(self, chrom: bytes, start: float, end: float) -> Tuple[int, int]:
+        """Get byte offsets [begin, end) of lines in a position range."""
+        if chrom not in self.contigs:
+            return 0, 0
+        begin = self._seek(chrom, start, past=False)
+        return begin, max(begin, self._seek(chrom, end, past=True))
+
+    def view(self, chrom: bytes, start: float, end: float) -> memoryview:
+        """Get the lines of a position range without copying them.
+
+        Release the view before closing the index.
+        """
+        begin, end = self.byte_range(chrom, start, end)
+        return memoryview(self.data)[begin:end]
+
+    def lines(self, chrom: bytes, start: float, end: float) -> Iterator[bytes]:
+        begin, end = self.byte_range(chrom, start, end)
+        while begin < end:
+            line_end = _next_line(self.data, begin, end)
+            yield self.data[begin:line_end]
+            begin = line_end
+
+
+# __END__
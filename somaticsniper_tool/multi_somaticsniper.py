@@ -6,7 +6,9 @@ Multithreading SomaticSniper
 """
 
 import argparse
+import asyncio
 import concurrent.futures
+import functools
 import logging
 import os
 import pathlib
@@ -16,19 +18,69 @@ import sys
 import tempfile
 import threading
 import time
+import uuid
 from collections import namedtuple
+from contextlib import ExitStack, contextmanager
 from logging.config import dictConfig
 from textwrap import dedent
 from types import SimpleNamespace
-from typing import Callable, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Generator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
 
-from somaticsniper_tool import utils
+from somaticsniper_tool import (
+    bgzf,
+    metrics,
+    region_planner,
+    region_split,
+    scheduler,
+    utils,
+)
 from somaticsniper_tool._version import __pypi_version__
 from somaticsniper_tool.annotate import Annotate
-from somaticsniper_tool.high_confidence import HighConfidence
-from somaticsniper_tool.samtools import SamtoolsView
-from somaticsniper_tool.snp_filter import SnpFilter
+from somaticsniper_tool.async_runner import (
+    DEFAULT_IO_TOKENS,
+    STAGES,
+    AsyncRunner,
+    parse_stage_limits,
+)
+from somaticsniper_tool.bgzf_merge import UNBOUNDED, BgzfMerge, IncrementalBgzfMerge
+from somaticsniper_tool.checkpoint import (
+    MANIFEST_FILE,
+    Manifest,
+    bam_index_mtime,
+    file_mtime,
+)
+from somaticsniper_tool.high_confidence import (
+    MIN_MAPPING_QUALITY,
+    MIN_SOMATIC_SCORE,
+    HighConfidence,
+    NativeHighConfidence,
+)
+from somaticsniper_tool.incremental_merge import IncrementalMerge, coordinate_order
+from somaticsniper_tool.perl_pool import PerlWorkerPool
+from somaticsniper_tool.post_process import PostProcess
+from somaticsniper_tool.samtools import (
+    SamtoolsMpileup,
+    SamtoolsView,
+    SamtoolsViewStream,
+)
+from somaticsniper_tool.sniper_cache import SniperCache
+from somaticsniper_tool.snp_filter import (
+    INDEL_WINDOW,
+    MIN_INDEL_SCORE,
+    NativeSnpFilter,
+    SnpFilter,
+)
 from somaticsniper_tool.somatic_sniper import SomaticSniper
+from somaticsniper_tool.stragglers import StragglerMonitor
+from somaticsniper_tool.work_queue import LEASE_SECONDS, WorkQueue
 
 __version__ = __pypi_version__
 
@@ -37,6 +89,12 @@ logger = logging.getLogger(__name__)
 
 DI = SimpleNamespace(futures=concurrent.futures, open=open, os=os,)
 
+MERGED_OUTPUT = "multi_somaticsniper_merged.vcf"
+SPLIT_MPILEUP_DIR = "split_mpileups"
+PLANNED_MPILEUP_DIR = "planned_mpileups"
+
+OUTPUT_COMPRESSIONS = ("none", "bgzf")
+
 
 def setup_logger():
     """
@@ -55,9 +113,11 @@ def setup_logger():
     return logger
 
 
-def setup_parser() -> argparse.ArgumentParser:
+def setup_parser(batch: bool = False) -> argparse.ArgumentParser:
     """
     Loads the parser.
+
+    BAMs are given per pair in batch runs, see batch.
     """
     # Main parser
     parser = argparse.ArgumentParser()
@@ -69,10 +129,9 @@ def setup_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--mpileup",
         action="append",
-        required=True,
         help='A list of normal-tumor samtools mpileup files on different region. \
             Created by "samtools mpileup -f". The file name must contain region. \
-            e.g. chr1-1-248956422.mpileup',
+            e.g. chr1-1-248956422.mpileup. Required unless --plan-regions.',
     )
 
     somatic_sniper_group = parser.add_argument_group(
@@ -82,10 +141,10 @@ def setup_parser() -> argparse.ArgumentParser:
         "--reference-path", required=True, help="Reference path."
     )
     somatic_sniper_group.add_argument(
-        "--tumor-bam", required=True, help="Tumor bam file."
+        "--tumor-bam", required=not batch, help="Tumor bam file."
     )
     somatic_sniper_group.add_argument(
-        "--normal-bam", required=True, help="Normal bam file."
+        "--normal-bam", required=not batch, help="Normal bam file."
     )
 
     somatic_sniper_flags = parser.add_argument_group("Optional somaticsniper flags.")
@@ -181,6 +240,212 @@ def setup_parser() -> argparse.ArgumentParser:
     runtime_group.add_argument(
         "--samtools", default="/usr/local/bin/samtools", help="Path to samtools",
     )
+    runtime_group.add_argument(
+        "--stream-views",
+        action="store_true",
+        help="Stream samtools views to somaticsniper through named pipes \
+            instead of writing temporary BAM copies. Not with --executor \
+            async.",
+    )
+
+    post_process_group = parser.add_argument_group("Post-processing")
+    post_process_group.add_argument(
+        "--snpfilter-engine",
+        default="perl",
+        choices=('perl', 'native'),
+        help="Run snpfilter perl script, or the in-process python equivalent.",
+    )
+    post_process_group.add_argument(
+        "--highconfidence-engine",
+        default="perl",
+        choices=('perl', 'native'),
+        help="Run highconfidence perl script, or the in-process python equivalent.",
+    )
+    post_process_group.add_argument(
+        "--perl-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Run the perl engines on N persistent perl interpreters shared \
+            by all regions, instead of starting perl for every script run. \
+            0 starts perl per run.",
+    )
+    post_process_group.add_argument(
+        "--min-somatic-score",
+        default=MIN_SOMATIC_SCORE,
+        type=int,
+        help="High confidence calls require at least this tumor somatic score.",
+    )
+    post_process_group.add_argument(
+        "--min-mapping-quality",
+        default=MIN_MAPPING_QUALITY,
+        type=int,
+        help="High confidence calls require at least this tumor mapping quality.",
+    )
+    post_process_group.add_argument(
+        "--min-indel-score",
+        default=MIN_INDEL_SCORE,
+        type=int,
+        help="snpfilter ignores indels with a lower consensus quality.",
+    )
+    post_process_group.add_argument(
+        "--indel-win-size",
+        dest="indel_window",
+        default=INDEL_WINDOW,
+        type=int,
+        help="snpfilter drops SNPs within this many bases of an indel.",
+    )
+    post_process_group.add_argument(
+        "--fused-postprocess",
+        action="store_true",
+        help="Filter and annotate in a single in-process pass, without \
+            intermediate files. Uses the native engines.",
+    )
+    scheduling_group = parser.add_argument_group("Stage scheduling")
+    scheduling_group.add_argument(
+        "--executor",
+        default="threads",
+        choices=("threads", "async"),
+        help="Run regions on --thread-count threads, or as stage tasks on one \
+            event loop under the per-stage limits below.",
+    )
+    scheduling_group.add_argument(
+        "--stage-limit",
+        action="append",
+        metavar="STAGE=N",
+        help="Max concurrent runs of a stage with --executor async, e.g. \
+            somaticsniper=16 or snpfilter=32. Stages: {}. Defaults to \
+            --thread-count each.".format(
+            ", ".join(STAGES)
+        ),
+    )
+    scheduling_group.add_argument(
+        "--stage-memory",
+        action="append",
+        metavar="STAGE=MB",
+        help="Memory reserved per run of a stage from --memory-budget-mb. \
+            Defaults to 0.",
+    )
+    scheduling_group.add_argument(
+        "--stage-io",
+        action="append",
+        metavar="STAGE=TOKENS",
+        help="I/O tokens taken per run of a stage from --io-tokens. Defaults to \
+            {}, 0 otherwise.".format(
+            ", ".join("{}={}".format(*item) for item in DEFAULT_IO_TOKENS.items())
+        ),
+    )
+    scheduling_group.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=None,
+        help="Memory shared by running stages with --executor async. Unlimited \
+            by default.",
+    )
+    scheduling_group.add_argument(
+        "--io-tokens",
+        type=int,
+        default=None,
+        help="I/O tokens shared by running stages with --executor async. \
+            Unlimited by default.",
+    )
+    scheduling_group.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Stop at the first failed region: cancel queued regions and kill \
+            the commands of running ones.",
+    )
+    scheduling_group.add_argument(
+        "--straggler-factor",
+        type=float,
+        default=None,
+        metavar="F",
+        help="With --executor threads, split a region running F times longer \
+            than the median of finished regions of its size, and race the \
+            sub-regions against it. Off by default.",
+    )
+    scheduling_group.add_argument(
+        "--queue-dir",
+        default=None,
+        help="Publish regions to a work queue in this directory on shared \
+            storage, for 'somaticsniper_tool worker' processes on any host to \
+            run, and merge their results. Regions are not run here.",
+    )
+    scheduling_group.add_argument(
+        "--queue-lease-seconds",
+        type=float,
+        default=LEASE_SECONDS,
+        help="Requeue regions whose --queue-dir worker has not renewed its \
+            claim for this many seconds.",
+    )
+    parser.add_argument(
+        "--schedule",
+        default="input",
+        choices=scheduler.SCHEDULES,
+        help="Region submission order. longest-first submits the regions with \
+            the largest mpileups first.",
+    )
+    parser.add_argument(
+        "--max-region-size",
+        type=int,
+        default=None,
+        help="Split region mpileups longer than this many bases into balanced \
+            sub-regions, processed independently and stitched back in order.",
+    )
+    parser.add_argument(
+        "--plan-regions",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Instead of --mpileup, plan about N regions of equal read counts \
+            from the reference .fai and the BAM .bai/.csi indexes, and write \
+            each region's mpileup with samtools in its worker.",
+    )
+    parser.add_argument(
+        "--skip-dash-contigs",
+        action="store_true",
+        help="With --plan-regions, leave out contigs with '-' in their name, \
+            e.g. HLA contigs, which region names cannot hold. Without it, \
+            planning fails if such contigs hold reads.",
+    )
+    parser.add_argument(
+        "--incremental-merge",
+        action="store_true",
+        help="Append each region to the merged VCF, in coordinate order, as soon \
+            as it and all regions before it are done.",
+    )
+    parser.add_argument(
+        "--output-compression",
+        default="none",
+        choices=OUTPUT_COMPRESSIONS,
+        help="bgzf compresses each region's output in its worker, and merges \
+            by concatenating the compressed blocks into a tabix indexed \
+            multi_somaticsniper_merged.vcf.gz.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Reuse somaticsniper outputs for unchanged regions, BAMs, reference \
+            and somaticsniper parameters from this directory.",
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        default=50.0,
+        help="Evict least recently used cache entries beyond this size.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip regions recorded as done in the run manifest whose inputs \
+            and outputs are unchanged.",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        default=None,
+        help="Write per-stage timing and resource usage, with the critical \
+            path, to this JSON file.",
+    )
     parser.add_argument(
         "--version", action='version', version=__version__,
     )
@@ -204,6 +469,11 @@ def process_argv(argv: Optional[List] = None) -> namedtuple:
     else:
         args, unknown_args = parser.parse_known_args()
 
+    if not args.mpileup and not args.plan_regions:
+        parser.error("one of the arguments --mpileup --plan-regions is required")
+    if args.stream_views and args.executor == "async":
+        parser.error("argument --stream-views: not allowed with --executor async")
+
     args_dict = vars(args)
     args_dict['extras'] = unknown_args
 
@@ -211,103 +481,918 @@ def process_argv(argv: Optional[List] = None) -> namedtuple:
     return run_args(**args_dict)
 
 
-def multithread_somaticsniper(
-    mpileup: str,
-    timeout: int = None,
-    samtools: str = None,
-    normal_bam: str = None,
-    tumor_bam: str = None,
-    snpfilter: str = None,
-    high_confidence: str = None,
-    _annotate=Annotate,
-    _highconfidence=HighConfidence,
-    _samtools=SamtoolsView,
-    _somaticsniper=SomaticSniper,
-    _snpfilter=SnpFilter,
-    _utils=utils,
+def annotated_vcf_name(
+    mpileup: str, output_dir: Optional[str] = None, _utils=utils
+) -> str:
+    """Get annotated VCF output path for a region mpileup."""
+    _, basename = _utils.get_region_from_name(mpileup)
+    if output_dir:
+        basename = os.path.join(output_dir, basename)
+    return "{}.annotated.vcf".format(basename)
+
+
+def compress_output(
+    annotated_vcf_file: str,
+    basename: str,
+    output_compression: str = "none",
+    _bgzf=bgzf,
+    _os=os,
+    _metrics=metrics.METRICS,
 ) -> str:
-    """Run multithreaded somaticsniper workflow.
+    """Compress an annotated VCF as output_compression, replacing it.
+    Returns:
+        output_file (str): Path to the compressed, or unchanged, VCF
+    """
+    if output_compression == "none":
+        return annotated_vcf_file
+    output_file = "{}.gz".format(annotated_vcf_file)
+    with _metrics.stage(
+        basename, "compress", inputs=(annotated_vcf_file,), outputs=(output_file,)
+    ):
+        _bgzf.compress_vcf(annotated_vcf_file, output_file)
+    _os.remove(annotated_vcf_file)
+    return output_file
+
+
+def manifest_params(run_args, _somaticsniper=SomaticSniper) -> dict:
+    """Get run-wide inputs that invalidate every completed region on change.
+
+    Every option that changes a region's annotated output is included:
+    sniper parameters, BAMs, post-processing engines, the perl scripts run,
+    cutoffs and output compression. Timeouts, samtools and stream_views do
+    not change outputs.
+    """
+    params = {
+        "somaticsniper": {
+            attr: getattr(_somaticsniper, attr)
+            for attr in _somaticsniper.ARGS
+            if attr != "timeout"
+        },
+        "normal_bam": run_args.normal_bam,
+        "normal_bam_index_mtime": bam_index_mtime(run_args.normal_bam),
+        "tumor_bam": run_args.tumor_bam,
+        "tumor_bam_index_mtime": bam_index_mtime(run_args.tumor_bam),
+        "min_somatic_score": run_args.min_somatic_score,
+        "min_mapping_quality": run_args.min_mapping_quality,
+        "min_indel_score": run_args.min_indel_score,
+        "indel_window": run_args.indel_window,
+        "fused_postprocess": run_args.fused_postprocess,
+        # Region outputs are merged as plain text or as BGZF blocks
+        "output_compression": run_args.output_compression,
+    }
+    if run_args.fused_postprocess:
+        # Runs the native engines whatever the engine options
+        return params
+    for engine, script in (
+        ("snpfilter_engine", run_args.snpfilter),
+        ("highconfidence_engine", run_args.highconfidence),
+    ):
+        params[engine] = getattr(run_args, engine)
+        if params[engine] == "perl":
+            params[engine + "_script"] = script
+            params[engine + "_script_mtime"] = file_mtime(script)
+    return params
+
+
+class Stage(NamedTuple):
+    """A stage of a region's workflow, run by RegionWorkflow.run or run_async.
+
+    run is called, in the runner's executor when run async, unless
+    run_async is given, which is awaited with the runner. The stage's
+    result is sent back into the workflow.
+    """
+
+    name: str
+    run: Callable
+    run_async: Optional[Callable] = None
+    inputs: Sequence[str] = ()
+    # None for the stage's result, if any, once it is done
+    outputs: Optional[Sequence[str]] = None
+    # Stages that report their own metrics
+    timed: bool = True
+
+
+class RegionWorkflow:
+    """Somaticsniper workflow of a region, as a sequence of stages.
+
+    The stages are defined once, in stages, and run one after another on
+    the calling thread by run, or as tasks under the stage limits of an
+    AsyncRunner by run_async. Between stages the region's group of
+    utils.CHILDREN is checked, so a killed region stops at the next stage
+    even while in-process stages run.
+    Accepts:
+        mpileup (str): Path to mpileup file
+        output_compression (str): Compress the annotated vcf, see compress_output
+        mpileup_reference (str): Reference to write the mpileup of a planned
+            region with first, see region_planner
+        output_dir (str): Directory for outputs, instead of the working
+            directory, e.g. a batch pair's
+        stream_views (bool): Stream views through named pipes, not with
+            run_async
+    """
+
+    def __init__(
+        self,
+        mpileup: str,
+        timeout: int = None,
+        samtools: str = None,
+        normal_bam: str = None,
+        tumor_bam: str = None,
+        snpfilter: str = None,
+        high_confidence: str = None,
+        snpfilter_engine: str = "perl",
+        highconfidence_engine: str = "perl",
+        min_somatic_score: int = MIN_SOMATIC_SCORE,
+        min_mapping_quality: int = MIN_MAPPING_QUALITY,
+        min_indel_score: int = MIN_INDEL_SCORE,
+        indel_window: int = INDEL_WINDOW,
+        fused_postprocess: bool = False,
+        stream_views: bool = False,
+        output_compression: str = "none",
+        mpileup_reference: Optional[str] = None,
+        output_dir: Optional[str] = None,
+        _annotate=Annotate,
+        _highconfidence=HighConfidence,
+        _native_highconfidence=NativeHighConfidence,
+        _samtools=SamtoolsView,
+        _samtools_stream=SamtoolsViewStream,
+        _mpileup=SamtoolsMpileup,
+        _somaticsniper=SomaticSniper,
+        _snpfilter=SnpFilter,
+        _native_snpfilter=NativeSnpFilter,
+        _postprocess=PostProcess,
+        _utils=utils,
+        _metrics=metrics.METRICS,
+    ):
+        self.mpileup = mpileup
+        self.timeout = timeout
+        self.samtools = samtools
+        self.normal_bam = normal_bam
+        self.tumor_bam = tumor_bam
+        self.snpfilter = snpfilter
+        self.high_confidence = high_confidence
+        self.min_somatic_score = min_somatic_score
+        self.min_mapping_quality = min_mapping_quality
+        self.min_indel_score = min_indel_score
+        self.indel_window = indel_window
+        self.fused_postprocess = fused_postprocess
+        self.stream_views = stream_views
+        self.output_compression = output_compression
+        self.mpileup_reference = mpileup_reference
+        self.output_dir = output_dir
+        self._annotate = _annotate
+        self._highconfidence = _highconfidence
+        if highconfidence_engine == "native":
+            self._highconfidence = _native_highconfidence
+        self._samtools = _samtools_stream if stream_views else _samtools
+        self._mpileup = _mpileup
+        self._somaticsniper = _somaticsniper
+        self._snpfilter = _snpfilter
+        if snpfilter_engine == "native":
+            self._snpfilter = _native_snpfilter
+        self._postprocess = _postprocess
+        self._utils = _utils
+        self._metrics = _metrics
+
+        self.region, self.basename = _utils.get_region_from_name(mpileup)
+        if output_dir:
+            # Outputs and metrics of the region are named under output_dir
+            self.basename = os.path.join(output_dir, self.basename)
+
+    def stages(self) -> Generator[Stage, Any, str]:
+        """Yield the region's stages, each sent back its result.
+        Returns:
+            annotated_vcf_file (str): Path to annotated vcf
+        Raises:
+            ValueError: Once the region's group of utils.CHILDREN is killed,
+                e.g. when a split of the straggling region finished first
+        """
+        if self.mpileup_reference:
+            mpileup = self._mpileup(
+                self.timeout,
+                self.samtools,
+                self.mpileup_reference,
+                self.normal_bam,
+                self.tumor_bam,
+                self.region,
+                self.mpileup,
+            )
+            yield Stage(
+                "mpileup", mpileup.run, mpileup.run_async, outputs=(self.mpileup,)
+            )
+
+        # In-process stages cannot be killed, so stop between stages instead
+        self._utils.CHILDREN.check()
+        somatic_sniper = self._somaticsniper(self.basename)
+        cache_key = somatic_sniper.cache_key(
+            self.region, self.normal_bam, self.tumor_bam
+        )
+        somatic_sniper_vcf = None
+        if cache_key is not None:
+
+            def restore():
+                if somatic_sniper.restore(cache_key):
+                    return somatic_sniper.output_file
+
+            somatic_sniper_vcf = yield Stage("cache_restore", restore)
+
+        if somatic_sniper_vcf is None:
+            with ExitStack() as views:
+                somatic_sniper_vcf = yield from self._somaticsniper_stages(
+                    somatic_sniper, cache_key, views
+                )
+
+        annotated_vcf_file = annotated_vcf_name(
+            self.mpileup, output_dir=self.output_dir, _utils=self._utils
+        )
+        self._utils.CHILDREN.check()
+        if self.fused_postprocess:
+            post_process = self._postprocess(
+                self.mpileup,
+                min_somatic_score=self.min_somatic_score,
+                min_mapping_quality=self.min_mapping_quality,
+                min_indel_score=self.min_indel_score,
+                indel_window=self.indel_window,
+            )
+            annotated_vcf_file = yield Stage(
+                "postprocess",
+                functools.partial(post_process, somatic_sniper_vcf, annotated_vcf_file),
+                inputs=(somatic_sniper_vcf, self.mpileup),
+                outputs=(annotated_vcf_file,),
+            )
+        else:
+            yield from self._filter_stages(somatic_sniper_vcf, annotated_vcf_file)
+
+        self._utils.CHILDREN.check()
+        output_file = yield Stage(
+            "compress",
+            functools.partial(
+                compress_output,
+                annotated_vcf_file,
+                self.basename,
+                self.output_compression,
+                _metrics=self._metrics,
+            ),
+            timed=False,
+        )
+        return output_file
+
+    def _somaticsniper_stages(
+        self, somatic_sniper, cache_key: Optional[str], views: ExitStack
+    ) -> Generator[Stage, Any, str]:
+        """Yield the views and somaticsniper stages, views closed by views."""
+        bam_views = [
+            self._samtools(self.timeout, self.samtools, bam, self.region)
+            for bam in (self.normal_bam, self.tumor_bam)
+        ]
+
+        def write_views() -> List[str]:
+            return [views.enter_context(view) for view in bam_views]
+
+        async def write_views_async(runner) -> List[str]:
+            for view in bam_views:
+                views.callback(view.close)
+            return await asyncio.gather(
+                *(view.write_view_async(runner) for view in bam_views)
+            )
+
+        normal_view, tumor_view = yield Stage(
+            "samtools_view", write_views, write_views_async, outputs=()
+        )
+
+        def run_somaticsniper() -> str:
+            output_file = somatic_sniper.run(
+                normal_bam=normal_view, tumor_bam=tumor_view, cache_key=cache_key
+            )
+            # Streamed views finish with somaticsniper, reap them here
+            views.close()
+            return output_file
+
+        async def run_somaticsniper_async(runner) -> str:
+            output_file = await somatic_sniper.run_async(
+                normal_view, tumor_view, runner, cache_key=cache_key
+            )
+            views.close()
+            return output_file
+
+        return (
+            yield Stage("somaticsniper", run_somaticsniper, run_somaticsniper_async)
+        )
+
+    def _filter_stages(
+        self, somatic_sniper_vcf: str, annotated_vcf_file: str
+    ) -> Generator[Stage, Any, None]:
+        """Yield the staged snpfilter, highconfidence and annotate stages."""
+        snp_filter_output = "{}.SNPfilter".format(somatic_sniper_vcf)
+        snp_filter = self._snpfilter(
+            self.timeout,
+            self.snpfilter,
+            somatic_sniper_vcf,
+            self.mpileup,
+            min_indel_score=self.min_indel_score,
+            indel_window=self.indel_window,
+        )
+        yield Stage(
+            "snpfilter",
+            snp_filter.run,
+            getattr(snp_filter, "run_async", None),
+            inputs=(somatic_sniper_vcf, self.mpileup),
+            outputs=(snp_filter_output,),
+        )
+
+        self._utils.CHILDREN.check()
+        high_confidence_output = "{}.hc".format(snp_filter_output)
+        high_confidence = self._highconfidence(
+            self.timeout,
+            self.high_confidence,
+            snp_filter_output,
+            min_somatic_score=self.min_somatic_score,
+            min_mapping_quality=self.min_mapping_quality,
+        )
+        yield Stage(
+            "highconfidence",
+            high_confidence.run,
+            getattr(high_confidence, "run_async", None),
+            inputs=(snp_filter_output,),
+            outputs=(high_confidence_output,),
+        )
+
+        self._utils.CHILDREN.check()
+
+        def annotate():
+            with self._annotate(annotated_vcf_file) as annotate:
+                annotate(somatic_sniper_vcf, high_confidence_output)
+
+        yield Stage(
+            "annotate",
+            annotate,
+            inputs=(somatic_sniper_vcf, high_confidence_output),
+            outputs=(annotated_vcf_file,),
+        )
+
+    @contextmanager
+    def _timed(self, stage: Stage):
+        """Record a stage's metrics, see metrics.RunMetrics.stage."""
+        if not stage.timed:
+            yield None
+            return
+        outputs = [] if stage.outputs is None else stage.outputs
+        with self._metrics.stage(
+            self.basename, stage.name, inputs=stage.inputs, outputs=outputs
+        ):
+            yield outputs
+
+    @staticmethod
+    def _done(stage: Stage, outputs: Optional[list], result):
+        if stage.outputs is None and outputs is not None and result:
+            outputs.append(result)
+
+    def run(self) -> str:
+        """Run the stages one after another on the calling thread.
+        Returns:
+            annotated_vcf_file (str): Path to annotated vcf
+        """
+        stages = self.stages()
+        try:
+            result = None
+            while True:
+                try:
+                    stage = stages.send(result)
+                except StopIteration as done:
+                    return done.value
+                with self._timed(stage) as outputs:
+                    result = stage.run()
+                    self._done(stage, outputs, result)
+        finally:
+            # Closes views of a failed stage
+            stages.close()
+
+    async def run_async(self, runner: AsyncRunner) -> str:
+        """Run the stages as tasks under the stage limits of runner.
+
+        In-process stages run in the runner's executor.
+        Accepts:
+            runner (AsyncRunner): Runs stage commands under per-stage limits
+        Returns:
+            annotated_vcf_file (str): Path to annotated vcf
+        """
+        if self.stream_views:
+            raise ValueError("Streamed views cannot be run async")
+        stages = self.stages()
+        try:
+            result = None
+            while True:
+                try:
+                    stage = stages.send(result)
+                except StopIteration as done:
+                    return done.value
+                with self._timed(stage) as outputs:
+                    if stage.run_async is not None:
+                        result = await stage.run_async(runner)
+                    else:
+                        result = await runner.run_in_executor(stage.name, stage.run)
+                    self._done(stage, outputs, result)
+        finally:
+            stages.close()
+
+
+def multithread_somaticsniper(mpileup: str, **kwargs) -> str:
+    """Run multithreaded somaticsniper workflow of a region.
     Accepts:
-        run_args (namespace): argparse namespace
         mpileup (str): Path to mpileup file
+        kwargs (dict): See RegionWorkflow
     Returns:
         annotated_vcf_file (str): Path to annotated vcf
+    Raises:
+        ValueError: Once the region's group of utils.CHILDREN is killed,
+            e.g. when a split of the straggling region finished first
     """
+    return RegionWorkflow(mpileup, **kwargs).run()
 
-    region, basename = _utils.get_region_from_name(mpileup)
 
-    somatic_sniper = _somaticsniper(basename)
-    with _samtools(timeout, samtools, normal_bam, region) as normal_view, _samtools(
-        timeout, samtools, tumor_bam, region
-    ) as tumor_view:
-        somatic_sniper_vcf = somatic_sniper.run(
-            normal_bam=normal_view, tumor_bam=tumor_view
-        )
+async def async_somaticsniper(
+    mpileup: str, runner: AsyncRunner = None, **kwargs
+) -> str:
+    """Run somaticsniper workflow of a region as a coroutine.
+
+    Same stages as multithread_somaticsniper, each run as a task under the
+    stage limits of runner, so regions overlap across stages.
+    Accepts:
+        mpileup (str): Path to mpileup file
+        runner (AsyncRunner): Runs stage commands under per-stage limits
+        kwargs (dict): See RegionWorkflow, without stream_views
+    Returns:
+        annotated_vcf_file (str): Path to annotated vcf
+    """
+    return await RegionWorkflow(mpileup, **kwargs).run_async(runner)
+
+
+def region_kwargs(run_args) -> dict:
+    """Get per-region workflow kwargs from run args."""
+    return dict(
+        timeout=run_args.timeout,
+        samtools=run_args.samtools,
+        normal_bam=run_args.normal_bam,
+        tumor_bam=run_args.tumor_bam,
+        snpfilter=run_args.snpfilter,
+        high_confidence=run_args.highconfidence,
+        snpfilter_engine=run_args.snpfilter_engine,
+        highconfidence_engine=run_args.highconfidence_engine,
+        min_somatic_score=run_args.min_somatic_score,
+        min_mapping_quality=run_args.min_mapping_quality,
+        min_indel_score=run_args.min_indel_score,
+        indel_window=run_args.indel_window,
+        fused_postprocess=run_args.fused_postprocess,
+        stream_views=run_args.stream_views,
+        output_compression=run_args.output_compression,
+        mpileup_reference=run_args.reference_path if run_args.plan_regions else None,
+    )
 
-    snp_filter_output = "{}.SNPfilter".format(somatic_sniper_vcf)
-    snp_filter = _snpfilter(timeout, snpfilter, somatic_sniper_vcf, mpileup)
-    snp_filter.run()
 
-    high_confidence_output = "{}.hc".format(snp_filter_output)
-    high_confidence = _highconfidence(timeout, high_confidence, snp_filter_output)
-    high_confidence.run()
+def resume_completed(
+    manifest: Manifest,
+    mpileups: List[str],
+    annotated_vcfs: List[str],
+    on_result: Optional[Callable[[str, str], None]] = None,
+) -> List[str]:
+    """Collect regions verified as done by manifest, return the rest."""
+    pending = []
+    for region_mpileup in mpileups:
+        result = manifest.is_done(region_mpileup)
+        if result is None:
+            pending.append(region_mpileup)
+            continue
+        logger.info("Resuming with completed region %s", result)
+        annotated_vcfs.append(result)
+        if on_result:
+            on_result(region_mpileup, result)
+    return pending
 
-    annotated_vcf_file = "{}.annotated.vcf".format(basename)
-    with _annotate(annotated_vcf_file) as annotate:
-        annotate(somatic_sniper_vcf, high_confidence_output)
 
-    return annotated_vcf_file
+def fail_fast(futures, monitor: Optional[StragglerMonitor] = None, _utils=utils):
+    """Cancel queued regions and kill the commands of running ones."""
+    cancelled = sum(future.cancel() for future in futures)
+    if monitor:
+        monitor.stop()
+    killed = _utils.CHILDREN.kill()
+    logger.error(
+        "Failing fast: cancelled %s queued regions, killed %s running commands",
+        cancelled,
+        killed,
+    )
 
 
 def tpe_submit_commands(
-    run_args, fn: Callable = multithread_somaticsniper, _di=DI
+    run_args,
+    fn: Callable = multithread_somaticsniper,
+    mpileups: Optional[List[str]] = None,
+    on_result: Optional[Callable[[str, str], None]] = None,
+    manifest: Optional[Manifest] = None,
+    _di=DI,
+    _utils=utils,
 ) -> List[str]:
     """run commands on number of threads
+
+    With run_args.fail_fast, the first failed region cancels the rest, see
+    fail_fast. With run_args.straggler_factor, straggling regions race a
+    split of themselves, see stragglers.StragglerMonitor.
     Accepts:
+        run_args (namespace): argparse namespace
+        fn (Callable): Per-region workflow
+        mpileups (List[str]): Region mpileups, defaults to run_args.mpileup
+        on_result (Callable): Called with (mpileup, result) as regions finish
+        manifest (Manifest): Skip regions verified as done, record new ones
     Returns:
+        annotated_vcfs (List[str]): Completed outputs, in completion order
+        exceptions (List[Exception]): Region failures, only the first
+            with run_args.fail_fast
     """
-    mpileups = run_args.mpileup
+    mpileups = scheduler.order_regions(
+        mpileups or run_args.mpileup, run_args.schedule
+    )
     annotated_vcfs = []
     exceptions = []
-    with _di.futures.ThreadPoolExecutor(max_workers=run_args.thread_count) as executor:
-        futures = [
-            executor.submit(
-                fn,
-                region_mpileup,
-                timeout=run_args.timeout,
-                samtools=run_args.samtools,
-                normal_bam=run_args.normal_bam,
-                tumor_bam=run_args.tumor_bam,
-                snpfilter=run_args.snpfilter,
-                high_confidence=run_args.highconfidence,
+    if manifest:
+        mpileups = resume_completed(manifest, mpileups, annotated_vcfs, on_result)
+    kwargs = region_kwargs(run_args)
+    with _di.futures.ThreadPoolExecutor(
+        max_workers=run_args.thread_count
+    ) as executor, ExitStack() as stack:
+        monitor = None
+        target = fn
+        if run_args.straggler_factor:
+            monitor = stack.enter_context(
+                StragglerMonitor(
+                    executor, fn, kwargs, run_args.straggler_factor, SPLIT_MPILEUP_DIR
+                )
             )
+            target = monitor.run
+        futures = {
+            executor.submit(target, region_mpileup, **kwargs): region_mpileup
             for region_mpileup in mpileups
-        ]
+        }
         for future in _di.futures.as_completed(futures):
+            if future.cancelled():
+                continue
+            region_mpileup = futures[future]
             try:
-                result = future.result()
+                if monitor:
+                    result = monitor.result(region_mpileup, future)
+                else:
+                    result = future.result()
                 logger.info(result)
+                if manifest:
+                    manifest.record(region_mpileup, result)
                 annotated_vcfs.append(result)
+                if on_result:
+                    on_result(region_mpileup, result)
             except Exception as e:
+                if run_args.fail_fast and exceptions:
+                    # Failed by the cancellation
+                    logger.debug("Region %s stopped: %s", region_mpileup, e)
+                    continue
                 exceptions.append(e)
                 logger.exception(e)
+                if run_args.fail_fast:
+                    fail_fast(futures, monitor, _utils=_utils)
+    # Killed commands are done once the executor is, allow new ones
+    _utils.CHILDREN.reset()
     return annotated_vcfs, exceptions
 
 
-def run(run_args, _somaticsniper=SomaticSniper, _utils=utils):
+def async_submit_commands(
+    run_args,
+    fn: Callable = async_somaticsniper,
+    mpileups: Optional[List[str]] = None,
+    on_result: Optional[Callable[[str, str], None]] = None,
+    manifest: Optional[Manifest] = None,
+) -> List[str]:
+    """Run regions as coroutines on one event loop, see tpe_submit_commands.
 
-    # Update class attributes
-    _somaticsniper._initialize_args(args=run_args)
+    Stages are limited by run_args.stage_limit, defaulting to
+    run_args.thread_count each, and take run_args.stage_memory and
+    run_args.stage_io from the memory_budget_mb and io_tokens budgets.
+    Regions are admitted in schedule order, at most as many at once as there
+    are stage slots, which bounds temp views. With run_args.fail_fast, the
+    first failed region cancels the others, killing their commands.
+    Accepts:
+        run_args (namespace): argparse namespace
+        fn (Callable): Per-region coroutine
+        mpileups (List[str]): Region mpileups, defaults to run_args.mpileup
+        on_result (Callable): Called with (mpileup, result) as regions finish
+        manifest (Manifest): Skip regions verified as done, record new ones
+    Returns:
+        annotated_vcfs (List[str]): Completed outputs, in completion order
+        exceptions (List[Exception]): Region failures, only the first
+            with run_args.fail_fast
+    """
+    mpileups = scheduler.order_regions(
+        mpileups or run_args.mpileup, run_args.schedule
+    )
+    annotated_vcfs = []
+    exceptions = []
+    if manifest:
+        mpileups = resume_completed(manifest, mpileups, annotated_vcfs, on_result)
+    runner = AsyncRunner(
+        parse_stage_limits(
+            run_args.stage_limit,
+            run_args.thread_count,
+            memory_mb=run_args.stage_memory,
+            io_tokens=run_args.stage_io,
+        ),
+        memory_mb=run_args.memory_budget_mb,
+        io_tokens=run_args.io_tokens,
+    )
+    kwargs = region_kwargs(run_args)
+
+    async def submit_all():
+        loop = asyncio.get_event_loop()
+        regions = asyncio.Semaphore(runner.capacity)
+        tasks = []
 
-    annotated_vcfs, exceptions = tpe_submit_commands(run_args)
+        async def submit(region_mpileup):
+            async with regions:
+                try:
+                    result = await fn(region_mpileup, **kwargs, runner=runner)
+                    logger.info(result)
+                    if manifest:
+                        await loop.run_in_executor(
+                            None, manifest.record, region_mpileup, result
+                        )
+                    annotated_vcfs.append(result)
+                    if on_result:
+                        on_result(region_mpileup, result)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if run_args.fail_fast and exceptions:
+                        logger.debug("Region %s stopped: %s", region_mpileup, e)
+                        return
+                    exceptions.append(e)
+                    logger.exception(e)
+                    if run_args.fail_fast:
+                        cancelled = sum(
+                            task.cancel()
+                            for task in tasks
+                            if task is not asyncio.current_task()
+                        )
+                        logger.error(
+                            "Failing fast: cancelled %s other regions", cancelled
+                        )
+
+        tasks.extend(asyncio.ensure_future(submit(m)) for m in mpileups)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(submit_all())
+    return annotated_vcfs, exceptions
+
+
+def queue_submit_commands(
+    run_args,
+    fn: Optional[Callable] = None,
+    mpileups: Optional[List[str]] = None,
+    on_result: Optional[Callable[[str, str], None]] = None,
+    manifest: Optional[Manifest] = None,
+    _queue=WorkQueue,
+    _os=os,
+) -> List[str]:
+    """Run regions on workers of run_args.queue_dir, see tpe_submit_commands.
+
+    Workers run multithread_somaticsniper in this working directory, which
+    must be on the shared storage like the mpileups. With run_args.fail_fast,
+    the first failed region drops queued regions and cancels running ones.
+    Accepts:
+        run_args (namespace): argparse namespace
+        fn (Callable): Unused, workers run multithread_somaticsniper
+        mpileups (List[str]): Region mpileups, defaults to run_args.mpileup
+        on_result (Callable): Called with (mpileup, result) as regions finish
+        manifest (Manifest): Skip regions verified as done, record new ones
+    Returns:
+        annotated_vcfs (List[str]): Completed outputs, in completion order
+        exceptions (List[Exception]): Region failures
+    """
+    mpileups = scheduler.order_regions(
+        mpileups or run_args.mpileup, run_args.schedule
+    )
+    annotated_vcfs = []
+    exceptions = []
+    if manifest:
+        mpileups = resume_completed(manifest, mpileups, annotated_vcfs, on_result)
+    if not mpileups:
+        return annotated_vcfs, exceptions
+    queue = _queue(run_args.queue_dir, lease_seconds=run_args.queue_lease_seconds)
+    run_id = uuid.uuid4().hex
+    tasks = queue.publish(
+        dict(run_args._asdict(), run_id=run_id, work_dir=_os.getcwd()), mpileups
+    )
+    try:
+        for region_mpileup, result, error in queue.results(tasks):
+            if error is not None:
+                e = ValueError("{}: {}".format(region_mpileup, error))
+                exceptions.append(e)
+                logger.error(e)
+                if run_args.fail_fast:
+                    dropped = queue.cancel(run_id)
+                    logger.error(
+                        "Failing fast: dropped %s queued regions, cancelled running "
+                        "ones",
+                        dropped,
+                    )
+                    break
+                continue
+            logger.info(result)
+            if manifest:
+                manifest.record(region_mpileup, result)
+            annotated_vcfs.append(result)
+            if on_result:
+                on_result(region_mpileup, result)
+    finally:
+        queue.stop(run_id)
+    return annotated_vcfs, exceptions
+
+
+def raise_for_exceptions(exceptions: List[Exception]):
     if exceptions:
         for e in exceptions:
             logger.error(e)
         raise ValueError("Exceptions raised during processing.")
 
-    merged_output = "multi_somaticsniper_merged.vcf"
-    with open(merged_output, 'w') as out_fh:
-        _utils.merge_outputs(annotated_vcfs, out_fh)
+
+def sub_region_bounds(split_mpileups: dict) -> dict:
+    """Get the positions each sub-region keeps, see region_split.clip_bounds."""
+    bounds = {}
+    for subs in split_mpileups.values():
+        if len(subs) > 1:
+            bounds.update(zip(subs, region_split.clip_bounds(subs)))
+    return bounds
+
+
+def plan_mpileups(run_args, _planner=region_planner, _os=os) -> dict:
+    """Plan regions from the BAM indexes, see region_planner.plan_bam_regions.
+    Returns:
+        dict: Mpileup path, in PLANNED_MPILEUP_DIR, of each planned region,
+            mapped to itself as a region without sub-regions
+    """
+    regions = _planner.plan_bam_regions(
+        "{}.fai".format(run_args.reference_path),
+        [run_args.normal_bam, run_args.tumor_bam],
+        run_args.plan_regions,
+        max_region_size=run_args.max_region_size,
+        skip_dash_contigs=run_args.skip_dash_contigs,
+    )
+    _os.makedirs(PLANNED_MPILEUP_DIR, exist_ok=True)
+    mpileups = [
+        _os.path.join(PLANNED_MPILEUP_DIR, region_split.sub_region_name(region))
+        for region in regions
+    ]
+    return {mpileup: [mpileup] for mpileup in mpileups}
+
+
+@contextmanager
+def perl_workers(run_args, _metrics=metrics.METRICS):
+    """Share run_args.perl_workers perl interpreters between the perl engines."""
+    if not run_args.perl_workers:
+        yield None
+        return
+    pool = PerlWorkerPool(run_args.perl_workers)
+    SnpFilter.pool = HighConfidence.pool = pool
+    try:
+        yield pool
+    finally:
+        SnpFilter.pool = HighConfidence.pool = None
+        pool.close(_metrics=_metrics)
+
+
+def configure_somaticsniper(run_args, _somaticsniper=SomaticSniper):
+    """Set SomaticSniper class attributes and cache from run args."""
+    _somaticsniper._initialize_args(args=run_args)
+    _somaticsniper.cache = (
+        SniperCache(run_args.cache_dir, int(run_args.cache_max_gb * 1024 ** 3))
+        if run_args.cache_dir
+        else None
+    )
+
+
+def run(
+    run_args, _somaticsniper=SomaticSniper, _utils=utils, _metrics=metrics.METRICS
+):
+
+    _metrics.reset()
+    try:
+        with perl_workers(run_args, _metrics=_metrics):
+            run_regions(
+                run_args,
+                _somaticsniper=_somaticsniper,
+                _utils=_utils,
+                _metrics=_metrics,
+            )
+    finally:
+        if run_args.metrics_json:
+            _metrics.write(run_args.metrics_json)
+
+
+def run_regions(
+    run_args, _somaticsniper=SomaticSniper, _utils=utils, _metrics=metrics.METRICS
+):
+
+    # Update class attributes
+    configure_somaticsniper(run_args, _somaticsniper=_somaticsniper)
+
+    if run_args.plan_regions:
+        split_mpileups = plan_mpileups(run_args)
+        # Planned mpileups are written by their workers, fingerprint the BAM
+        sources = {mpileup: run_args.tumor_bam for mpileup in split_mpileups}
+    else:
+        split_mpileups = {
+            mpileup: region_split.split_mpileup(
+                mpileup,
+                run_args.max_region_size,
+                SPLIT_MPILEUP_DIR,
+                indel_window=run_args.indel_window,
+            )
+            if run_args.max_region_size
+            else [mpileup]
+            for mpileup in run_args.mpileup
+        }
+        sources = {
+            sub: mpileup
+            for mpileup, subs in split_mpileups.items()
+            for sub in subs
+            if sub != mpileup
+        }
+    work_units = [sub for subs in split_mpileups.values() for sub in subs]
+
+    # Always record completed regions, so a failed run can be resumed. Each
+    # record is one appended line, see checkpoint
+    manifest = Manifest(
+        MANIFEST_FILE,
+        manifest_params(run_args, _somaticsniper=_somaticsniper),
+        sources=sources,
+        resume=run_args.resume,
+    )
+
+    if run_args.queue_dir:
+        submit = queue_submit_commands
+    elif run_args.executor == "async":
+        submit = async_submit_commands
+    else:
+        submit = tpe_submit_commands
+    contig_order = _utils.load_contig_order("{}.fai".format(run_args.reference_path))
+    merged_output = MERGED_OUTPUT
+    bgzf_output = run_args.output_compression == "bgzf"
+    if bgzf_output:
+        merged_output += ".gz"
+
+    if run_args.incremental_merge:
+        bounds = sub_region_bounds(split_mpileups)
+        merge_order = coordinate_order(work_units, contig_order)
+        if bgzf_output:
+            merged_file = BgzfMerge(merged_output)
+            incremental_merge = IncrementalBgzfMerge
+        else:
+            merged_file = open(merged_output, 'w')
+            incremental_merge = IncrementalMerge
+        with merged_file as out_fh, incremental_merge(
+            merge_order, out_fh, bounds=bounds
+        ) as merger:
+            _, exceptions = submit(
+                run_args, mpileups=work_units, on_result=merger, manifest=manifest
+            )
+            raise_for_exceptions(exceptions)
+        return
+
+    # Outputs by region, straggler outputs are not named after their region
+    results = {}
+    _, exceptions = submit(
+        run_args, mpileups=work_units, on_result=results.__setitem__, manifest=manifest
+    )
+    raise_for_exceptions(exceptions)
+
+    if bgzf_output:
+        # Sub-regions are clipped while their blocks are copied, no stitching
+        bounds = sub_region_bounds(split_mpileups)
+        with _metrics.stage(
+            metrics.RUN, "merge", outputs=(merged_output,)
+        ), BgzfMerge(merged_output) as merger:
+            for i, mpileup in enumerate(coordinate_order(work_units, contig_order)):
+                merger.append(results[mpileup], i == 0, bounds.get(mpileup, UNBOUNDED))
+        return
+
+    with _metrics.stage(metrics.RUN, "merge", outputs=(merged_output,)):
+        annotated_vcfs = []
+        for mpileup, subs in split_mpileups.items():
+            if len(subs) == 1:
+                annotated_vcfs.append(results[mpileup])
+                continue
+            stitched = annotated_vcf_name(mpileup)
+            with open(stitched, 'wb') as out_fh:
+                region_split.stitch_outputs(
+                    subs, [results[sub] for sub in subs], out_fh
+                )
+            annotated_vcfs.append(stitched)
+
+        with open(merged_output, 'wb') as out_fh:
+            _utils.merge_outputs(annotated_vcfs, out_fh, contig_order=contig_order)
 
 
 def main(argv=None) -> int:
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Persistent perl interpreters for the snpfilter and highconfidence scripts.
+
+Each worker runs DRIVER, which reads one request per line on stdin: the
+script path and its arguments, tab separated. It runs the script with
+`do` under those @ARGV, with the script's STDOUT and STDERR captured, and
+replies on its own stdout with a status line, "OK <bytes>" or
+"ERR <bytes>", followed by the captured output. exit() in a script ends
+the request, not the worker. Scripts are compiled afresh per request, in
+a package of their own, so file-scoped and package variables start clean,
+while loaded modules are reused. After each request every handle left
+open in the script's package is closed, flushing output that a separate
+perl would flush at exit, and the package is deleted.
+
+Workers that crash or exceed a request's timeout are killed and replaced
+by the next request. While it runs a request, a worker is tracked in
+utils.CHILDREN under the caller's group, so killing the group kills it.
+"""
+
+import logging
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from somaticsniper_tool import utils
+from somaticsniper_tool.metrics import METRICS
+from somaticsniper_tool.utils import OUTPUT_CHUNK_SIZE, OutputTail
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(subprocess=subprocess)
+
+DRIVER = r"""
+# Compiled before the pragmas and lexicals below, so scripts see neither,
+# as with `do`
+sub run_script {
+    eval shift;
+    die $@ if $@;
+}
+
+use strict;
+use warnings;
+
+BEGIN {
+    # Scripts exit when done, end the request instead of the worker
+    *CORE::GLOBAL::exit = sub { die bless { code => $_[0] // 0 }, 'Worker::Exit' };
+}
+# Load the modules scripts commonly use once, others load on first use
+eval { require Getopt::Long; require Pod::Usage; 1 };
+
+# Close the handles of a script's package and its subpackages, then drop them
+sub clear_package {
+    my ($package) = @_;
+    no strict 'refs';
+    my $stash = \%{"${package}::"};
+    for my $name (keys %$stash) {
+        if ($name =~ /::$/) {
+            clear_package($package . '::' . substr($name, 0, -2));
+            next;
+        }
+        my $glob = \$stash->{$name};
+        close(*{$$glob}{IO}) if ref $glob eq 'GLOB' && *{$$glob}{IO};
+    }
+    my ($parent, $leaf) = $package =~ /^(.*)::(\w+)$/;
+    delete ${"${parent}::"}{"${leaf}::"};
+}
+
+open(my $reply, '>&', \*STDOUT) or die "Cannot dup STDOUT: $!";
+binmode $reply;
+$reply->autoflush(1);
+# CPU seconds taken to start, which each script run would otherwise repeat
+my ($user, $system) = times;
+printf $reply "READY %.3f\n", $user + $system;
+
+my $requests = 0;
+while (my $request = <STDIN>) {
+    chomp $request;
+    my ($script, @args) = split /\t/, $request, -1;
+    my ($stdout, $stderr) = ('', '');
+    my $package = 'Worker::Script' . ++$requests;
+    my $ok = eval {
+        local @ARGV = @args;
+        local $0 = $script;
+        local *STDOUT;
+        local *STDERR;
+        open(STDOUT, '>', \$stdout) or die "Cannot capture STDOUT: $!";
+        open(STDERR, '>', \$stderr) or die "Cannot capture STDERR: $!";
+        open(my $fh, '<', $script) or die "Cannot read $script\n";
+        my $code = do { local $/; <$fh> };
+        close $fh;
+        run_script(qq{package $package;\n#line 1 "$script"\n$code\n});
+        1;
+    };
+    my $error = $@;
+    clear_package($package);
+    if (!$ok && ref $error eq 'Worker::Exit') {
+        $ok = $error->{code} == 0;
+        $error = "exit status $error->{code}\n";
+    }
+    my $output = $stdout . $stderr . ($ok ? '' : $error);
+    printf $reply "%s %d\n%s", $ok ? 'OK' : 'ERR', length($output), $output;
+}
+"""
+
+READY = b"READY"
+
+
+class PerlWorker:
+    """A perl interpreter running DRIVER.
+    Accepts:
+        perl (str): Path to perl
+        startup_timeout (int): Max seconds to wait for the driver to start
+    """
+
+    def __init__(self, perl: str = "perl", startup_timeout: int = 60, _di=DI):
+        self.process = _di.subprocess.Popen(
+            [perl, "-e", DRIVER], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        self.alive = True
+        self._buffer = bytearray()
+        deadline = time.monotonic() + startup_timeout
+        ready, startup_seconds = self._read_line(deadline).split()
+        if ready != READY:
+            self.kill()
+            raise ValueError("perl worker failed to start")
+        self.startup_seconds = float(startup_seconds)
+
+    def _fill(self, deadline: Optional[float]):
+        fd = self.process.stdout.fileno()
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                self.kill()
+                raise ValueError("perl worker timed out")
+        chunk = os.read(fd, OUTPUT_CHUNK_SIZE)
+        if not chunk:
+            self.kill()
+            raise ValueError("perl worker exited unexpectedly")
+        self._buffer += chunk
+
+    def _read_line(self, deadline: Optional[float]) -> bytes:
+        while b"\n" not in self._buffer:
+            self._fill(deadline)
+        end = self._buffer.index(b"\n") + 1
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return line
+
+    def _read(self, size: int, deadline: Optional[float]) -> bytes:
+        while len(self._buffer) < size:
+            self._fill(deadline)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def call(self, script: str, args: List[str], timeout: Optional[int]) -> bytes:
+        """Run a perl script in the worker.
+        Accepts:
+            script (str): Path to perl script
+            args (List[str]): Script arguments, without tabs or line breaks
+            timeout (int): Max seconds the script may run
+        Returns:
+            bytes: Script STDOUT then STDERR
+        Raises:
+            ValueError: With the script's output if it failed, or if the
+                worker died or timed out, after killing it
+        """
+        words = [script, *args]
+        if any("\t" in word or "\n" in word for word in words):
+            raise ValueError("perl worker arguments cannot hold tabs or newlines")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self.process.stdin.write("\t".join(words).encode() + b"\n")
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            self.kill()
+            raise ValueError("perl worker exited unexpectedly")
+        status, size = self._read_line(deadline).split()
+        output = self._read(int(size), deadline)
+        tail = OutputTail("{} output".format(os.path.basename(script)))
+        tail.feed(output)
+        tail.close()
+        if status != b"OK":
+            raise ValueError(tail.text())
+        return output
+
+    def kill(self):
+        self.alive = False
+        self.process.kill()
+        self.process.wait()
+        self._close_pipes()
+
+    def close(self):
+        """Stop the worker once its current request is done."""
+        if not self.alive:
+            return
+        self.alive = False
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._close_pipes()
+
+    def _close_pipes(self):
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                # Closed all the same, flushing a request the dead worker
+                # never read
+                pass
+
+
+class PerlWorkerPool:
+    """Up to size PerlWorkers shared by threads, started on demand.
+    Accepts:
+        size (int): Max workers, and so max concurrent scripts
+        perl (str): Path to perl
+    """
+
+    def __init__(
+        self, size: int, perl: str = "perl", _worker=PerlWorker, _utils=utils
+    ):
+        self.size = size
+        self.perl = perl
+        self._worker = _worker
+        self._utils = _utils
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.workers_started = 0
+        self.restarts = 0
+        self.requests = 0
+        self.startup_seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def run(self, script: str, args: List[str], timeout: Optional[int]) -> bytes:
+        """Run a perl script on an idle worker, see PerlWorker.call.
+
+        Raises ValueError if the caller's group of CHILDREN was killed.
+        """
+        children = self._utils.CHILDREN
+        with self._slots:
+            children.check()
+            worker = self._checkout()
+            # Killed with the caller's group, then replaced at checkin
+            children.add(worker.process)
+            try:
+                return worker.call(os.path.abspath(script), args, timeout)
+            finally:
+                children.discard(worker.process)
+                self._checkin(worker)
+
+    def _checkout(self) -> PerlWorker:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        worker = self._worker(self.perl)
+        with self._lock:
+            self.workers_started += 1
+            self.startup_seconds += worker.startup_seconds
+        return worker
+
+    def _checkin(self, worker: PerlWorker):
+        with self._lock:
+            self.requests += 1
+            if not worker.alive:
+                self.restarts += 1
+                logger.warning("Replacing perl worker %s", worker.process.pid)
+                return
+        self._idle.put(worker)
+
+    def report(self) -> Dict:
+        """Summarize requests, restarts and interpreter startup time saved.
+
+        Each request would otherwise start its own interpreter, taking the
+        mean CPU time the pool's workers took to start.
+        """
+        with self._lock:
+            started = self.workers_started
+            mean_startup = self.startup_seconds / started if started else 0.0
+            return {
+                "workers": self.size,
+                "workers_started": started,
+                "restarts": self.restarts,
+                "requests": self.requests,
+                "mean_startup_seconds": mean_startup,
+                "startup_seconds_saved": max(self.requests - started, 0)
+                * mean_startup,
+            }
+
+    def close(self, _metrics=METRICS):
+        """Stop idle workers and report the pool's use."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        report = self.report()
+        _metrics.add_summary("perl_workers", report)
+        logger.info(
+            "Perl workers ran %s scripts on %s interpreters, saving about %.2f "
+            "seconds of startup",
+            report["requests"],
+            report["workers_started"],
+            report["startup_seconds_saved"],
+        )
+
+
+# __END__
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Fused SnpFilter -> HighConfidence -> Annotate post-processing.
+
+Reads the somaticsniper VCF once and streams record batches through the
+indel proximity filter and the high confidence thresholds as generator
+stages, writing the annotated VCF directly. No .SNPfilter or .hc
+intermediates are written.
+"""
+
+import logging
+from itertools import compress
+from types import SimpleNamespace
+from typing import IO, Iterable, Iterator, List, Tuple
+
+from somaticsniper_tool.annotate import FILTER_HEADERS
+from somaticsniper_tool.high_confidence import (
+    MIN_MAPPING_QUALITY,
+    MIN_SOMATIC_SCORE,
+    NativeHighConfidence,
+)
+from somaticsniper_tool.snp_filter import (
+    INDEL_WINDOW,
+    MIN_INDEL_SCORE,
+    IndelIndex,
+    NativeSnpFilter,
+)
+from somaticsniper_tool.vcf_batch import RecordBatch, VcfReader
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(open=open)
+
+# A batch and the records of it still passing; headers are written separately
+Tagged = Tuple[RecordBatch, List[bool]]
+
+
+def indel_filter_stage(
+    batches: Iterable[RecordBatch], indels: IndelIndex, window: int = INDEL_WINDOW
+) -> Iterator[Tagged]:
+    """Tag records within the snpfilter indel window as failing."""
+    for batch in batches:
+        yield batch, NativeSnpFilter.mask(batch, indels, window)
+
+
+def high_confidence_stage(
+    tagged: Iterable[Tagged], high_confidence: NativeHighConfidence
+) -> Iterator[Tagged]:
+    """Tag records still passing that miss the high confidence thresholds."""
+    for batch, passed in tagged:
+        candidates = list(compress(range(len(batch)), passed))
+        for i, keep in zip(candidates, high_confidence.mask(batch, candidates)):
+            if not keep:
+                passed[i] = False
+        yield batch, passed
+
+
+def annotate_stage(tagged: Iterable[Tagged], out_fh: IO):
+    """Write annotated records, as Annotate does for staged outputs."""
+    for batch, passed in tagged:
+        batch.write(out_fh, filters=[b"LOH" if p else b"REJECT" for p in passed])
+
+
+class PostProcess:
+    """Single-pass post-processing of a region's somaticsniper VCF."""
+
+    def __init__(
+        self,
+        indel_mpileup_file: str,
+        min_somatic_score: int = MIN_SOMATIC_SCORE,
+        min_mapping_quality: int = MIN_MAPPING_QUALITY,
+        min_indel_score: int = MIN_INDEL_SCORE,
+        indel_window: int = INDEL_WINDOW,
+    ):
+        self.indel_mpileup_file = indel_mpileup_file
+        self.min_somatic_score = min_somatic_score
+        self.min_mapping_quality = min_mapping_quality
+        self.min_indel_score = min_indel_score
+        self.indel_window = indel_window
+
+    def __call__(self, *args, **kwargs):
+        return self.run(*args, **kwargs)
+
+    def run(self, raw_vcf: str, output_file: str, _di=DI) -> str:
+        """Filter and annotate somaticsniper VCF.
+        Accepts:
+            raw_vcf (str): Path to somatic sniper VCF
+            output_file (str): Path to annotated output VCF
+        Returns:
+            output_file (str): Path to annotated output VCF
+        """
+        indels = IndelIndex.from_pileup(
+            self.indel_mpileup_file, min_score=self.min_indel_score, _di=_di
+        )
+        high_confidence = NativeHighConfidence(
+            None,
+            None,
+            raw_vcf,
+            min_somatic_score=self.min_somatic_score,
+            min_mapping_quality=self.min_mapping_quality,
+        )
+        with _di.open(raw_vcf, 'rb') as in_fh, _di.open(output_file, 'wb') as out_fh:
+            reader = VcfReader(in_fh)
+            for line in reader.headers:
+                out_fh.write(line)
+                if line.startswith(b"##reference"):
+                    out_fh.write(FILTER_HEADERS)
+            tagged = indel_filter_stage(reader, indels, self.indel_window)
+            tagged = high_confidence_stage(tagged, high_confidence)
+            annotate_stage(tagged, out_fh)
+        logger.info("Fused post-processing: %s -> %s", raw_vcf, output_file)
+        return output_file
+
+
+# __END__
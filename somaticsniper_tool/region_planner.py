@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Plan regions of equal work from the BAM indexes.
+
+The linear index of a .bai, or the leaf bins of a .csi, hold the virtual
+offset of the first read in each 16 kb window, so the compressed bytes
+between consecutive windows track the reads they hold. Window bytes are
+scaled to reads by each reference's mapped read count, from its index
+pseudo-bin, and the normal and tumor densities are summed and cut into
+regions of about equal reads. Planned regions are named like region
+mpileups, see region_split.sub_region_name, and run as any other region
+once their mpileup is written. Those names separate the contig from the
+range with '-', so contigs with '-' in their name, e.g. HLA-A*01:01:01:01,
+cannot be planned: planning fails if they hold reads, unless they are
+skipped on request.
+"""
+
+import logging
+import os
+import struct
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from somaticsniper_tool import metrics
+from somaticsniper_tool.bgzf import BgzfReader
+from somaticsniper_tool.region_split import Region, plan_sub_regions
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(open=open, os=os)
+
+BAM_MAGIC = b"BAM\x01"
+BAI_MAGIC = b"BAI\x01"
+CSI_MAGIC = b"CSI\x01"
+
+# Windows of the .bai linear index, and of planned region boundaries
+WINDOW_SHIFT = 14
+BAI_DEPTH = 5
+
+_INT = struct.Struct("<i")
+_BAI_BIN = struct.Struct("<Ii")
+_CSI_BIN = struct.Struct("<IQi")
+_CSI_HEADER = struct.Struct("<4siii")
+
+Density = Dict[str, List[float]]
+
+
+class ReferenceIndex(NamedTuple):
+    """Index of one BAM reference, offsets as compressed file offsets."""
+
+    min_shift: int
+    # First read of each window, 0 for windows without one
+    offsets: List[int]
+    end: int
+    mapped: Optional[int]
+
+
+def pseudo_bin(depth: int) -> int:
+    """Get the bin holding a reference's offset range and read counts."""
+    return ((1 << 3 * (depth + 1)) - 1) // 7 + 1
+
+
+def load_contig_lengths(fai_path: str, _di=DI) -> List[Tuple[str, int]]:
+    """Read contig names and lengths, in reference order, from a fasta index."""
+    with _di.open(fai_path) as fh:
+        return [
+            (name, int(length))
+            for name, length, *_ in (line.split("\t") for line in fh if line.strip())
+        ]
+
+
+def read_bam_references(bam: str, _di=DI) -> List[str]:
+    """Read reference names, in index order, from a BAM header."""
+    with _di.open(bam, 'rb') as fh:
+        reader = BgzfReader(fh)
+        if reader.read(4) != BAM_MAGIC:
+            raise ValueError("{} is not a BAM file".format(bam))
+        (l_text,) = _INT.unpack(reader.read(4))
+        reader.read(l_text)
+        (n_ref,) = _INT.unpack(reader.read(4))
+        names = []
+        for _ in range(n_ref):
+            (l_name,) = _INT.unpack(reader.read(4))
+            names.append(reader.read(l_name).rstrip(b"\0").decode())
+            reader.read(4)
+        return names
+
+
+def find_bam_index(bam: str, _di=DI) -> str:
+    """Get the path of a BAM's .bai or .csi index."""
+    base, _ = _di.os.path.splitext(bam)
+    for path in (bam + ".bai", base + ".bai", bam + ".csi"):
+        if _di.os.path.exists(path):
+            return path
+    raise ValueError("No .bai or .csi index found for {}".format(bam))
+
+
+def _parse_bins(
+    data: bytes, at: int, bin_struct: struct.Struct, depth: int
+) -> Tuple[int, int, Optional[int], Dict[int, int]]:
+    """Parse the bins of a reference.
+    Returns:
+        Tuple: Offset after the bins, offset after the last read, mapped
+            reads, and the virtual offset of each .csi bin's first read
+    """
+    (n_bin,) = _INT.unpack_from(data, at)
+    at += _INT.size
+    end = 0
+    mapped = None
+    first_reads = {}
+    for _ in range(n_bin):
+        fields = bin_struct.unpack_from(data, at)
+        at += bin_struct.size
+        bin_id, n_chunk = fields[0], fields[-1]
+        if len(fields) == 3:
+            first_reads[bin_id] = fields[1]
+        chunks = struct.unpack_from("<{}Q".format(2 * n_chunk), data, at)
+        at += 16 * n_chunk
+        if bin_id == pseudo_bin(depth):
+            # Offset range of the reference, then mapped and unmapped reads
+            if n_chunk == 2:
+                end = max(end, chunks[1])
+                mapped = chunks[2]
+        elif chunks:
+            end = max(end, *chunks[1::2])
+    return at, end >> 16, mapped, first_reads
+
+
+def parse_bai(data: bytes) -> List[ReferenceIndex]:
+    if not data.startswith(BAI_MAGIC):
+        raise ValueError("Not a BAI index")
+    (n_ref,) = _INT.unpack_from(data, 4)
+    at = 8
+    refs = []
+    for _ in range(n_ref):
+        at, end, mapped, _ = _parse_bins(data, at, _BAI_BIN, BAI_DEPTH)
+        (n_intv,) = _INT.unpack_from(data, at)
+        at += _INT.size
+        offsets = struct.unpack_from("<{}Q".format(n_intv), data, at)
+        at += 8 * n_intv
+        refs.append(
+            ReferenceIndex(WINDOW_SHIFT, [o >> 16 for o in offsets], end, mapped)
+        )
+    return refs
+
+
+def parse_csi(data: bytes) -> List[ReferenceIndex]:
+    magic, min_shift, depth, l_aux = _CSI_HEADER.unpack_from(data)
+    if magic != CSI_MAGIC:
+        raise ValueError("Not a CSI index")
+    at = _CSI_HEADER.size + l_aux
+    (n_ref,) = _INT.unpack_from(data, at)
+    at += _INT.size
+    first_leaf = ((1 << 3 * depth) - 1) // 7
+    refs = []
+    for _ in range(n_ref):
+        at, end, mapped, first_reads = _parse_bins(data, at, _CSI_BIN, depth)
+        windows = {
+            bin_id - first_leaf: offset >> 16
+            for bin_id, offset in first_reads.items()
+            if first_leaf <= bin_id < pseudo_bin(depth) - 1
+        }
+        offsets = [0] * (max(windows, default=-1) + 1)
+        for window, offset in windows.items():
+            offsets[window] = offset
+        refs.append(ReferenceIndex(min_shift, offsets, end, mapped))
+    return refs
+
+
+def load_bam_index(index_path: str, _di=DI) -> List[ReferenceIndex]:
+    """Read a .bai, or BGZF compressed .csi, index."""
+    with _di.open(index_path, 'rb') as fh:
+        if index_path.endswith(".csi"):
+            return parse_csi(BgzfReader(fh).read())
+        return parse_bai(fh.read())
+
+
+def window_weights(ref: ReferenceIndex) -> List[int]:
+    """Get the compressed bytes of reads starting in each window."""
+    offsets = list(ref.offsets) + [ref.end]
+    # Windows without reads end where the next read starts
+    for i in range(len(offsets) - 2, -1, -1):
+        if not offsets[i]:
+            offsets[i] = offsets[i + 1]
+    return [max(stop - start, 0) for start, stop in zip(offsets, offsets[1:])]
+
+
+def _resample(weights: List[float], min_shift: int) -> List[float]:
+    """Rebin window weights from 1 << min_shift to 1 << WINDOW_SHIFT bases."""
+    if min_shift > WINDOW_SHIFT:
+        n = 1 << min_shift - WINDOW_SHIFT
+        return [weight / n for weight in weights for _ in range(n)]
+    n = 1 << WINDOW_SHIFT - min_shift
+    return [sum(weights[i : i + n]) for i in range(0, len(weights), n)]
+
+
+def read_density(bam: str, _di=DI) -> Density:
+    """Estimate reads per window of each reference from a BAM's index.
+    Accepts:
+        bam (str): Path to BAM, indexed as bam.bai, bam.csi or base.bai
+    Returns:
+        Density: Reference name to reads in each 1 << WINDOW_SHIFT window
+    """
+    names = read_bam_references(bam, _di=_di)
+    index = load_bam_index(find_bam_index(bam, _di=_di), _di=_di)
+    density = {}
+    for name, ref in zip(names, index):
+        weights = window_weights(ref)
+        total = sum(weights)
+        if ref.mapped is not None and total:
+            weights = [weight * ref.mapped / total for weight in weights]
+        elif ref.mapped and weights:
+            # All reads in one block, spread them over the windows
+            weights = [ref.mapped / len(weights)] * len(weights)
+        density[name] = _resample(weights, ref.min_shift)
+    return density
+
+
+def plan_regions(
+    contigs: List[Tuple[str, int]], density: Density, count: int
+) -> List[Region]:
+    """Cut contigs into regions of about equal reads.
+
+    Regions end at window boundaries once they hold total / count reads, and
+    a contig's last region merges into the one before it if it holds less
+    than half that, so about count regions are planned. Contigs without
+    reads are skipped.
+    Accepts:
+        contigs (List[Tuple[str, int]]): Contig names and lengths in order
+        density (Density): Reads per window of each contig
+        count (int): Number of regions to aim for
+    Returns:
+        List[Region]: Regions in contig order
+    """
+    total = sum(sum(density.get(name, ())) for name, _ in contigs)
+    if total <= 0:
+        raise ValueError("No mapped reads found in the BAM indexes")
+    target = total / count
+    window = 1 << WINDOW_SHIFT
+    regions = []
+    for name, length in contigs:
+        windows = density.get(name, ())
+        if not sum(windows):
+            continue
+        contig_regions = []
+        start = 1
+        reads = 0.0
+        for i, weight in enumerate(windows):
+            reads += weight
+            end = min((i + 1) * window, length)
+            if reads >= target and end < length:
+                contig_regions.append([start, end, reads])
+                start = end + 1
+                reads = 0.0
+            if end >= length:
+                break
+        if contig_regions and reads < target / 2:
+            contig_regions[-1][1] = length
+        else:
+            contig_regions.append([start, length, reads])
+        regions.extend((name, start, end) for start, end, _ in contig_regions)
+    return regions
+
+
+def plan_bam_regions(
+    fai_path: str,
+    bams: List[str],
+    count: int,
+    max_region_size: Optional[int] = None,
+    skip_dash_contigs: bool = False,
+    _di=DI,
+    _metrics=metrics.METRICS,
+) -> List[Region]:
+    """Plan regions of about equal reads across BAMs, see plan_regions.
+
+    The regions planned and the contigs skipped are added to the run summary.
+    Accepts:
+        fai_path (str): Path to reference .fai
+        bams (List[str]): Paths to indexed BAMs, e.g. normal and tumor
+        count (int): Number of regions to aim for
+        max_region_size (int): Split regions longer than this many bases
+        skip_dash_contigs (bool): Skip contigs with '-' in their name that
+            hold reads, instead of failing
+    Returns:
+        List[Region]: Regions in reference order
+    Raises:
+        ValueError: If contigs with '-' in their name hold reads and
+            skip_dash_contigs is not set
+    """
+    density = defaultdict(list)
+    for bam in bams:
+        for name, weights in read_density(bam, _di=_di).items():
+            summed = density[name]
+            summed.extend([0.0] * (len(weights) - len(summed)))
+            for i, weight in enumerate(weights):
+                summed[i] += weight
+    contigs = []
+    skipped = []
+    for name, length in load_contig_lengths(fai_path, _di=_di):
+        # Region mpileup names separate contig and range with "-"
+        if "-" in name:
+            # Contigs without reads are not planned anyway
+            if sum(density.get(name, ())):
+                skipped.append(name)
+            continue
+        contigs.append((name, length))
+    if skipped and not skip_dash_contigs:
+        raise ValueError(
+            "Cannot plan regions of contigs with '-' in their name, which "
+            "hold reads: {}. Pass --skip-dash-contigs to leave their reads "
+            "out of the calls.".format(", ".join(skipped))
+        )
+    for name in skipped:
+        logger.warning("Skipping contig %s, its name contains '-'", name)
+    regions = plan_regions(contigs, density, count)
+    if max_region_size:
+        regions = [
+            sub
+            for region in regions
+            for sub in plan_sub_regions(region, max_region_size)
+        ]
+    _metrics.add_summary(
+        "region_planner", {"regions": len(regions), "skipped_contigs": len(skipped)}
+    )
+    logger.info("Planned %s regions from %s", len(regions), ", ".join(bams))
+    return regions
+
+
+# __END__
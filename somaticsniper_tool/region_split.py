@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Split oversized region mpileups into sub-regions and stitch their results.
+
+Sub-region mpileups are named like the inputs, e.g. chr1-1-124478211.mpileup,
+so they flow through get_region_from_name and multithread_somaticsniper
+unchanged.
+"""
+
+import logging
+import math
+import os
+from types import SimpleNamespace
+from typing import IO, List, Tuple
+
+from somaticsniper_tool import utils
+from somaticsniper_tool.mpileup_index import MpileupIndex
+from somaticsniper_tool.snp_filter import INDEL_WINDOW
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(open=open, os=os)
+
+Region = Tuple[str, int, int]
+
+
+def parse_region(mpileup: str) -> Region:
+    """Get (chrom, start, end) from mpileup filename.
+    Accepts:
+        mpileup (str): Path to mpileup file, e.g. chr1-1-248956422.mpileup
+    Returns:
+        Region: Chromosome, 1-based start and inclusive end
+    """
+    region, _ = utils.get_region_from_name(mpileup)
+    chrom, span = region.rsplit(":", 1)
+    start, end = span.split("-")
+    return chrom, int(start), int(end)
+
+
+def plan_sub_regions(region: Region, max_region_size: int) -> List[Region]:
+    """Split region into balanced sub-regions no longer than max_region_size."""
+    chrom, start, end = region
+    length = end - start + 1
+    count = max(1, math.ceil(length / max_region_size))
+    step = math.ceil(length / count)
+    return [
+        (chrom, sub_start, min(sub_start + step - 1, end))
+        for sub_start in range(start, end + 1, step)
+    ]
+
+
+def sub_region_name(region: Region) -> str:
+    return "{}-{}-{}.mpileup".format(*region)
+
+
+def split_mpileup(
+    mpileup: str,
+    max_region_size: int,
+    out_dir: str,
+    indel_window: int = INDEL_WINDOW,
+    _di=DI,
+    _index=MpileupIndex,
+) -> List[str]:
+    """Split a region mpileup at line boundaries.
+
+    Sub-region byte ranges are looked up in the mpileup's MpileupIndex and
+    copied straight from its memory map. Lines within the snpfilter indel
+    window of a sub-region edge are written to both neighbours, so indels
+    across an edge still filter nearby SNPs.
+    Accepts:
+        mpileup (str): Path to region mpileup
+        max_region_size (int): Max sub-region length in bases
+        out_dir (str): Directory for sub-region mpileups
+        indel_window (int): snpfilter indel window in bases
+    Returns:
+        List[str]: Sub-region mpileup paths in coordinate order, or [mpileup]
+            if the region is small enough or its name carries no range
+    """
+    try:
+        region = parse_region(mpileup)
+    except ValueError:
+        return [mpileup]
+    sub_regions = plan_sub_regions(region, max_region_size)
+    if len(sub_regions) == 1:
+        return [mpileup]
+
+    _di.os.makedirs(out_dir, exist_ok=True)
+    paths = [_di.os.path.join(out_dir, sub_region_name(r)) for r in sub_regions]
+    window = indel_window
+    last = len(sub_regions) - 1
+    with _index.open(mpileup) as index:
+        chrom = region[0].encode()
+        for i, (path, (_, start, end)) in enumerate(zip(paths, sub_regions)):
+            # Outer edges are open, so no line of the region mpileup is lost
+            lower = start - window if i > 0 else -math.inf
+            upper = end + window if i < last else math.inf
+            with _di.open(path, 'wb') as fh, index.view(chrom, lower, upper) as view:
+                fh.write(view)
+    logger.info("Split %s into %s sub-regions", mpileup, len(paths))
+    return paths
+
+
+def clip_bounds(sub_mpileups: List[str]) -> List[Tuple[float, float]]:
+    """Get the position range to keep from each sub-region's output.
+
+    Sub-region views share the reads that span an edge, so records outside a
+    sub-region's own range are dropped at inner edges to avoid duplicates.
+    Accepts:
+        sub_mpileups (List[str]): Sub-region mpileups in coordinate order
+    Returns:
+        List[Tuple[float, float]]: Inclusive (lower, upper) bounds
+    """
+    last = len(sub_mpileups) - 1
+    bounds = []
+    for i, mpileup in enumerate(sub_mpileups):
+        _, start, end = parse_region(mpileup)
+        bounds.append((start if i > 0 else -math.inf, end if i < last else math.inf))
+    return bounds
+
+
+def stitch_outputs(sub_mpileups: List[str], annotated_vcfs: List[str], out_fh: IO):
+    """Concatenate sub-region annotated VCFs in order, clipped at inner edges.
+    Accepts:
+        sub_mpileups (List[str]): Sub-region mpileups in coordinate order
+        annotated_vcfs (List[str]): Matching annotated VCF paths
+        out_fh (IO): Binary file handle of stitched output
+    """
+    bounds = clip_bounds(sub_mpileups)
+    for i, (vcf, (lower, upper)) in enumerate(zip(annotated_vcfs, bounds)):
+        with open(vcf, 'rb') as fh:
+            for line in fh:
+                if line.startswith(b"#"):
+                    if i == 0:
+                        out_fh.write(line)
+                    continue
+                if lower <= int(line.split(b"\t", 2)[1]) <= upper:
+                    out_fh.write(line)
+
+
+# __END__
@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 
 import logging
+import os
+import shlex
+import shutil
+import subprocess
 import tempfile
+import threading
 from types import SimpleNamespace
 
 from somaticsniper_tool import utils
+from somaticsniper_tool.metrics import METRICS
 
 logger = logging.getLogger(__name__)
 
-DI = SimpleNamespace(tempfile=tempfile)
+DI = SimpleNamespace(
+    open=open,
+    os=os,
+    subprocess=SimpleNamespace(Popen=utils.RusagePopen),
+    tempfile=tempfile,
+)
 
 
 class SamtoolsView:
@@ -34,19 +45,195 @@ class SamtoolsView:
         return self.temp_view_name
 
     def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
         self.temp_view_fh.close()
 
+    def build_command(self) -> str:
+        return self.COMMAND_STR.format(
+            samtools=self.samtools, bam_path=self.bam_file, region=self.region
+        )
+
     def write_view(self):
+        cmd = self.build_command()
+        self._utils.run_subprocess_command(
+            cmd, self.timeout, stdout=self.temp_view_fh, stream_output=True
+        )
+        logger.info(cmd)
+        self.temp_view_fh.seek(0)
+
+    async def write_view_async(self, runner) -> str:
+        """Write the view through an AsyncRunner, returns the temp view path."""
+        cmd = self.build_command()
+        await runner.run(
+            cmd,
+            self.timeout,
+            stage="samtools_view",
+            stdout=self.temp_view_fh,
+            stream_output=True,
+        )
+        logger.info(cmd)
+        self.temp_view_fh.seek(0)
+        return self.temp_view_name
+
+
+class SamtoolsViewStream:
+    """Stream view of BAM file through a named pipe, without a temp copy."""
+
+    COMMAND_STR = SamtoolsView.COMMAND_STR
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(
+        self, timeout, samtools: str, bam_file: str, region: str, _utils=utils, _di=DI
+    ):
+        self.timeout = timeout
+        self.samtools = samtools
+        self.bam_file = bam_file
+        self.region = region
+
+        self._di = _di
+
+        self.temp_dir = _di.tempfile.mkdtemp()
+        self.fifo_name = _di.os.path.join(self.temp_dir, "view.bam")
+        self.bytes_streamed = 0
+
+        self.process = None
+        self.pump_thread = None
+        self.pump_error = None
+
+    def __enter__(self):
         cmd = self.COMMAND_STR.format(
             samtools=self.samtools, bam_path=self.bam_file, region=self.region
         )
-        popen_return = self._utils.run_subprocess_command(
-            cmd, self.timeout, stdout=self.temp_view_fh
+        self._di.os.mkfifo(self.fifo_name)
+        self.process = self._di.subprocess.Popen(
+            shlex.split(cmd), stdout=subprocess.PIPE
         )
         logger.info(cmd)
-        logger.debug(popen_return.stdout)
-        logger.debug(popen_return.stderr)
-        self.temp_view_fh.seek(0)
+        self.pump_thread = threading.Thread(target=self.pump, daemon=True)
+        self.pump_thread.start()
+        return self.fifo_name
+
+    def __exit__(self, type, value, traceback):
+        try:
+            self.close(raise_errors=type is None)
+        finally:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def pump(self):
+        """Copy samtools stdout into the named pipe."""
+        try:
+            # Blocks until the reader opens the other end
+            with open(self.fifo_name, 'wb', buffering=0) as fifo:
+                while True:
+                    chunk = self.process.stdout.read1(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    fifo.write(chunk)
+                    self.bytes_streamed += len(chunk)
+        except OSError as e:
+            self.pump_error = e
+        finally:
+            self.process.stdout.close()
+
+    def close(self, raise_errors: bool = True):
+        """Wait for samtools and the pump, unblocking them if no reader came."""
+        self.pump_thread.join(timeout=1)
+        if self.pump_thread.is_alive() and not self.process.stdout.closed:
+            try:
+                # Unblock a pump still waiting for a reader to open the pipe
+                fd = os.open(self.fifo_name, os.O_RDONLY | os.O_NONBLOCK)
+                os.close(fd)
+            except OSError:
+                pass
+        self.pump_thread.join(timeout=self.timeout)
+        try:
+            returncode = self.process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            returncode = self.process.wait()
+        METRICS.add_child_usage(getattr(self.process, "rusage", None))
+
+        logger.info(
+            "Streamed %s bytes of %s %s; temp BAM copy avoided.",
+            self.bytes_streamed,
+            self.bam_file,
+            self.region,
+        )
+        if raise_errors and (returncode != 0 or self.pump_error):
+            raise ValueError(
+                "samtools view stream of {} {} failed: returncode {}, {}".format(
+                    self.bam_file, self.region, returncode, self.pump_error
+                )
+            )
+
+
+class SamtoolsMpileup:
+    """Write the normal-tumor mpileup of a region, e.g. for a planned region.
+
+    Written to a temp file renamed into place, so output_file only ever
+    exists complete.
+    """
+
+    COMMAND_STR = (
+        "{samtools} mpileup -f {reference_path} -r {region} {normal_bam} {tumor_bam}"
+    )
+
+    def __init__(
+        self,
+        timeout,
+        samtools: str,
+        reference_path: str,
+        normal_bam: str,
+        tumor_bam: str,
+        region: str,
+        output_file: str,
+        _utils=utils,
+        _di=DI,
+    ):
+        self.timeout = timeout
+        self.samtools = samtools
+        self.reference_path = reference_path
+        self.normal_bam = normal_bam
+        self.tumor_bam = tumor_bam
+        self.region = region
+        self.output_file = output_file
+
+        self._utils = _utils
+        self._di = _di
+
+        self.temp_file = "{}.tmp".format(output_file)
+
+    def build_command(self) -> str:
+        return self.COMMAND_STR.format(
+            samtools=self.samtools,
+            reference_path=self.reference_path,
+            region=self.region,
+            normal_bam=self.normal_bam,
+            tumor_bam=self.tumor_bam,
+        )
+
+    def run(self) -> str:
+        cmd = self.build_command()
+        with self._di.open(self.temp_file, 'wb') as out_fh:
+            self._utils.run_subprocess_command(
+                cmd, self.timeout, stdout=out_fh, stream_output=True
+            )
+        logger.info(cmd)
+        self._di.os.replace(self.temp_file, self.output_file)
+        return self.output_file
+
+    async def run_async(self, runner) -> str:
+        """Write the mpileup through an AsyncRunner."""
+        cmd = self.build_command()
+        with self._di.open(self.temp_file, 'wb') as out_fh:
+            await runner.run(
+                cmd, self.timeout, stage="mpileup", stdout=out_fh, stream_output=True
+            )
+        logger.info(cmd)
+        self._di.os.replace(self.temp_file, self.output_file)
+        return self.output_file
 
 
 # __END__
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Region ordering for the thread pool.
+
+The executor hands queued regions to whichever worker frees up first, so
+submitting the most expensive regions first (longest processing time first)
+keeps a large region from starting last and running alone at the end.
+"""
+
+import os
+from types import SimpleNamespace
+from typing import List, Tuple
+
+from somaticsniper_tool.region_split import parse_region
+
+DI = SimpleNamespace(os=os)
+
+SCHEDULES = ('input', 'longest-first')
+
+
+def region_length(mpileup: str) -> int:
+    """Get region length in bases from mpileup filename.
+    Accepts:
+        mpileup (str): Path to mpileup file, e.g. chr1-1-248956422.mpileup
+    Returns:
+        int: Region length, 0 if the name has no start-end range
+    """
+    try:
+        _, start, end = parse_region(mpileup)
+    except ValueError:
+        return 0
+    return end - start + 1
+
+
+def estimate_region_cost(mpileup: str, _di=DI) -> Tuple[int, int]:
+    """Estimate relative cost of a region.
+
+    Mpileup size tracks read depth across the region, so it is the primary
+    estimate; region length breaks ties and stands in for missing files.
+    Accepts:
+        mpileup (str): Path to mpileup file
+    Returns:
+        Tuple[int, int]: Sortable (mpileup bytes, region length) cost
+    """
+    try:
+        size = _di.os.path.getsize(mpileup)
+    except OSError:
+        size = 0
+    return size, region_length(mpileup)
+
+
+def order_regions(mpileups: List[str], schedule: str = 'input', _di=DI) -> List[str]:
+    """Order mpileups for submission.
+    Accepts:
+        mpileups (List[str]): Paths to region mpileups
+        schedule (str): One of SCHEDULES
+    Returns:
+        List[str]: Mpileups in submission order
+    """
+    if schedule == 'longest-first':
+        return sorted(
+            mpileups, key=lambda m: estimate_region_cost(m, _di=_di), reverse=True
+        )
+    return list(mpileups)
+
+
+# __END__
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache of per-region somaticsniper VCFs.
+
+Entries are keyed by a hash of the region, the identity of the input BAMs
+and reference, and the full somaticsniper parameter set, so reruns that only
+change downstream filter settings reuse the raw calls. Entry mtimes are
+bumped on every hit and the least recently used entries are evicted once
+the cache grows past its size limit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from types import SimpleNamespace
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(os=os, shutil=shutil)
+
+ENTRY_SUFFIX = ".vcf"
+
+
+def file_identity(path: str, _di=DI) -> Dict:
+    """Identify a file by resolved path, size and mtime."""
+    stat = _di.os.stat(path)
+    return {
+        "path": _di.os.path.realpath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def cache_key(region: str, inputs: Dict[str, str], params: Dict, _di=DI) -> str:
+    """Hash a region, its input files and the somaticsniper parameters.
+    Accepts:
+        region (str): Samtools region
+        inputs (Dict[str, str]): Input files by role, e.g. normal_bam
+        params (Dict): somaticsniper parameters
+    Returns:
+        str: sha256 hex digest
+    """
+    key = {
+        "region": region,
+        "inputs": {k: file_identity(v, _di=_di) for k, v in inputs.items()},
+        "params": params,
+    }
+    encoded = json.dumps(key, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class SniperCache:
+    """Size-limited LRU directory of somaticsniper output files."""
+
+    def __init__(self, cache_dir: str, max_bytes: int, _di=DI):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._di = _di
+        self._lock = threading.Lock()
+        _di.os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, key: str) -> str:
+        return self._di.os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def get(self, key: str, output_file: str) -> bool:
+        """Copy a cached entry to output_file.
+        Returns:
+            bool: True on a cache hit
+        """
+        entry = self.entry_path(key)
+        try:
+            # Copy rather than link, so rewriting output_file never
+            # corrupts the entry
+            self._di.shutil.copyfile(entry, output_file)
+            self._di.os.utime(entry)
+        except FileNotFoundError:
+            return False
+        logger.info("Cache hit %s -> %s", entry, output_file)
+        return True
+
+    def put(self, key: str, output_file: str):
+        """Store output_file under key, then evict down to the size limit."""
+        entry = self.entry_path(key)
+        tmp_entry = "{}.{}.tmp".format(entry, threading.get_ident())
+        self._di.shutil.copyfile(output_file, tmp_entry)
+        self._di.os.replace(tmp_entry, entry)
+        logger.info("Cached %s as %s", output_file, entry)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under max_bytes."""
+        with self._lock:
+            entries = []
+            for name in self._di.os.listdir(self.cache_dir):
+                if not name.endswith(ENTRY_SUFFIX):
+                    continue
+                path = self._di.os.path.join(self.cache_dir, name)
+                try:
+                    stat = self._di.os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    self._di.os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                logger.info("Evicted %s from cache", path)
+
+
+# __END__
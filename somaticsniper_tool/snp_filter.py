@@ -1,13 +1,33 @@
 #!/usr/bin/env python3
+import bisect
 import logging
+import sys
+from array import array
+from collections import defaultdict
+from itertools import repeat
+from operator import add, gt, le, not_, sub
 from textwrap import dedent
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Sequence
 
 from somaticsniper_tool import utils
+from somaticsniper_tool.perl_pool import PerlWorkerPool
+from somaticsniper_tool.vcf_batch import RecordBatch
 
 logger = logging.getLogger(__name__)
 
+DI = SimpleNamespace(open=open)
+
+# snpfilter.pl defaults: indels with a lower consensus quality are ignored,
+# and SNPs within the window of a remaining indel are dropped
+MIN_INDEL_SCORE = 50
+INDEL_WINDOW = 10
+
 
 class SnpFilter:
+    # Shared PerlWorkerPool to run the script on, set for the run
+    pool: Optional[PerlWorkerPool] = None
+
     COMMAND = dedent(
         """
         perl {snpfilter}
@@ -16,20 +36,227 @@ class SnpFilter:
         """
     ).strip()
 
-    def __init__(self, timeout, snpfilter: str, vcf_file: str, indel_mpileup_file: str):
+    def __init__(
+        self,
+        timeout,
+        snpfilter: str,
+        vcf_file: str,
+        indel_mpileup_file: str,
+        min_indel_score: int = MIN_INDEL_SCORE,
+        indel_window: int = INDEL_WINDOW,
+    ):
         self.snpfilter = snpfilter
         self.vcf_file = vcf_file
         self.indel_mpileup_file = indel_mpileup_file
         self.timeout = timeout
+        self.min_indel_score = min_indel_score
+        self.indel_window = indel_window
 
-    def run(self, _utils=utils):
-        cmd = self.COMMAND.format(
+    def options(self) -> List[str]:
+        """Get the script options differing from its defaults.
+
+        Left out at their defaults, so default runs call the script as
+        before these options were configurable.
+        """
+        options = []
+        if self.min_indel_score != MIN_INDEL_SCORE:
+            options += ["--min-indel-score", str(self.min_indel_score)]
+        if self.indel_window != INDEL_WINDOW:
+            options += ["--indel-win-size", str(self.indel_window)]
+        return options
+
+    def build_command(self) -> str:
+        command = self.COMMAND.format(
             snpfilter=self.snpfilter,
             vcf_file=self.vcf_file,
             indel_file=self.indel_mpileup_file,
         )
-        _utils.run_subprocess_command(cmd, self.timeout)
+        return "\n".join([command, *self.options()])
+
+    def build_args(self) -> List[str]:
+        """Get the script and its arguments, as in build_command."""
+        return [
+            self.snpfilter,
+            "--snp-file",
+            self.vcf_file,
+            "--indel-file",
+            self.indel_mpileup_file,
+            *self.options(),
+        ]
+
+    def run(self, _utils=utils):
+        cmd = self.build_command()
+        if self.pool is not None:
+            script, *args = self.build_args()
+            self.pool.run(script, args, self.timeout)
+        else:
+            _utils.run_subprocess_command(cmd, self.timeout, stream_output=True)
         logger.info(cmd)
 
+    async def run_async(self, runner):
+        cmd = self.build_command()
+        if self.pool is not None:
+            script, *args = self.build_args()
+            await runner.run_in_executor(
+                "snpfilter", self.pool.run, script, args, self.timeout
+            )
+        else:
+            await runner.run(cmd, self.timeout, stage="snpfilter", stream_output=True)
+        logger.info(cmd)
+
+
+def _score(fields: List[bytes]) -> int:
+    """Get a pileup line's consensus quality, 0 if missing as in perl."""
+    try:
+        return int(fields[4])
+    except (IndexError, ValueError):
+        return 0
+
+
+def _position(fields: List[bytes]) -> int:
+    """Get POS of split record fields, -1 if missing or invalid, as RecordBatch."""
+    try:
+        return int(fields[1])
+    except (IndexError, ValueError):
+        return -1
+
+
+class IndelIndex:
+    """Sorted per-contig index of indel positions from a pileup file.
+
+    Mirrors snpfilter.pl: a pileup line is an indel call when its reference
+    column is '*', and the call is kept when its consensus quality, the
+    fifth column, is at least the minimum indel score.
+    """
+
+    def __init__(self, positions: Dict[bytes, array]):
+        self.positions = positions
+        # positions with a trailing sentinel, by contig
+        self._bounded: Dict[bytes, array] = {}
+
+    @classmethod
+    def from_pileup(
+        cls, pileup_file: str, min_score: int = MIN_INDEL_SCORE, _di=DI
+    ) -> "IndelIndex":
+        """Build index in a single streaming pass over the pileup.
+        Accepts:
+            pileup_file (str): Path to (m)pileup file
+            min_score (int): Min consensus quality of indels to index
+        Returns:
+            IndelIndex
+        """
+        positions = defaultdict(lambda: array('q'))
+        with _di.open(pileup_file, 'rb') as fh:
+            for line in fh:
+                fields = line.split(b"\t", 5)
+                if len(fields) > 2 and fields[2] == b"*":
+                    if _score(fields) >= min_score:
+                        positions[fields[0]].append(int(fields[1]))
+        for chrom, pos in positions.items():
+            positions[chrom] = array('q', sorted(pos))
+        return cls(dict(positions))
+
+    def near(self, chrom: bytes, pos: int, window: int) -> bool:
+        """Return True if an indel lies within window bases of pos."""
+        positions = self.positions.get(chrom)
+        if not positions:
+            return False
+        i = bisect.bisect_left(positions, pos - window)
+        return i < len(positions) and positions[i] <= pos + window
+
+    def near_positions(
+        self, chrom: bytes, positions: Sequence[int], window: int
+    ) -> Iterator[bool]:
+        """Like near, for many positions on one contig."""
+        if not self.positions.get(chrom):
+            return repeat(False, len(positions))
+        if chrom not in self._bounded:
+            # An indel past every position keeps the bisected indexes in range
+            self._bounded[chrom] = self.positions[chrom] + array('q', [sys.maxsize])
+        indels = self._bounded[chrom]
+        lows = map(sub, positions, repeat(window))
+        highs = map(add, positions, repeat(window))
+        found = map(indels.__getitem__, map(bisect.bisect_left, repeat(indels), lows))
+        return map(le, found, highs)
+
+
+class NativeSnpFilter:
+    """In-process equivalent of snpfilter.pl.
+
+    Drops SNP records within indel_window bases of an indel scoring at
+    least min_indel_score and writes the remaining lines, headers included,
+    byte for byte to <vcf_file>.SNPfilter.
+    """
+
+    def __init__(
+        self,
+        timeout,
+        snpfilter: str,
+        vcf_file: str,
+        indel_mpileup_file: str,
+        min_indel_score: int = MIN_INDEL_SCORE,
+        indel_window: int = INDEL_WINDOW,
+    ):
+        self.snpfilter = snpfilter
+        self.vcf_file = vcf_file
+        self.indel_mpileup_file = indel_mpileup_file
+        self.timeout = timeout
+        self.min_indel_score = min_indel_score
+        self.indel_window = indel_window
+
+        self.output_file = "{}.SNPfilter".format(vcf_file)
+
+    @staticmethod
+    def dropped(indels: IndelIndex, chrom: bytes, pos: int, window: int) -> bool:
+        """Return True for a record within window bases of an indel.
+
+        Records without a position, pos -1, are kept. Decides each record of
+        run, and of mask but for batches of sorted positions.
+        """
+        return pos >= 0 and indels.near(chrom, pos, window)
+
+    @classmethod
+    def mask(
+        cls, batch: RecordBatch, indels: IndelIndex, window: int = INDEL_WINDOW
+    ) -> List[bool]:
+        """Return False for records within window bases of an indel.
+
+        For batches of the fused post-processing; run filters line by line,
+        as parsing whole batches costs more than it saves for one stage.
+        """
+        ids = batch.chrom_ids
+        if any(map(gt, ids, ids[1:])) or min(batch.pos, default=0) < 0:
+            # Contigs not in runs, or records without a position
+            return [
+                not cls.dropped(indels, chrom, pos, window)
+                for chrom, pos in zip(batch.chroms(), batch.pos)
+            ]
+        keep = []
+        start = 0
+        for chrom_id, chrom in enumerate(batch.chrom_names):
+            end = bisect.bisect_right(ids, chrom_id, start)
+            near = indels.near_positions(chrom, batch.pos[start:end], window)
+            keep.extend(map(not_, near))
+            start = end
+        return keep
+
+    def run(self, _di=DI):
+        indels = IndelIndex.from_pileup(
+            self.indel_mpileup_file, min_score=self.min_indel_score, _di=_di
+        )
+        with _di.open(self.vcf_file, 'rb') as in_fh, _di.open(
+            self.output_file, 'wb'
+        ) as out_fh:
+            for line in in_fh:
+                if not line.startswith(b"#"):
+                    fields = line.split(b"\t", 2)
+                    pos = _position(fields)
+                    if self.dropped(indels, fields[0], pos, self.indel_window):
+                        continue
+                out_fh.write(line)
+        logger.info(
+            "Native SNP filter: %s -> %s", self.vcf_file, self.output_file,
+        )
+
 
 # __END__
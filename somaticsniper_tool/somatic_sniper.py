@@ -1,12 +1,12 @@
 #!/usr/bin/env python3
 
+import asyncio
 import logging
-from subprocess import PIPE
 from textwrap import dedent
 from types import SimpleNamespace
-from typing import List, NamedTuple
+from typing import List, NamedTuple, Optional
 
-from somaticsniper_tool import utils
+from somaticsniper_tool import sniper_cache, utils
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +32,21 @@ class SomaticSniper:
         """
     ).strip()
 
+    # Class attributes set from CLI args by _initialize_args
+    ARGS = (
+        'somaticsniper_bin',
+        'map_q',
+        'base_q',
+        'pps',
+        'theta',
+        'nhap',
+        'pd',
+        'out_format',
+        'flags',
+        'reference_path',
+        'timeout',
+    )
+
     # Args from CLI
     somaticsniper_bin: str = None
     map_q: int = None
@@ -45,18 +60,83 @@ class SomaticSniper:
     reference_path: str = None
     timeout: int = None
 
+    # Optional result cache, see sniper_cache
+    cache: sniper_cache.SniperCache = None
+
     def __init__(self, output: str):
         self.output_file = "{output}.vcf".format(output=output)
 
-    def run(self, normal_bam: str, tumor_bam: str, _utils=utils) -> str:
+    def cache_key(self, region: str, normal_bam: str, tumor_bam: str) -> Optional[str]:
+        """Get result cache key of a region, or None without a cache.
+        Accepts:
+            region (str): Samtools region
+            normal_bam (str): Path to full normal bam, not a region view
+            tumor_bam (str): Path to full tumor bam, not a region view
+        Returns:
+            str: Cache key
+        """
+        if self.cache is None:
+            return None
+        params = {
+            attr: getattr(self, attr)
+            for attr in self.ARGS
+            if attr not in ('reference_path', 'timeout')
+        }
+        inputs = {
+            "normal_bam": normal_bam,
+            "tumor_bam": tumor_bam,
+            "reference": self.reference_path,
+        }
+        return sniper_cache.cache_key(region, inputs, params)
+
+    def restore(self, cache_key: Optional[str]) -> bool:
+        """Restore output_file from the cache, returns True on a hit."""
+        if cache_key is None:
+            return False
+        return self.cache.get(cache_key, self.output_file)
+
+    def run(
+        self,
+        normal_bam: str,
+        tumor_bam: str,
+        cache_key: Optional[str] = None,
+        _utils=utils,
+    ) -> str:
         """Runs somatic sniper command.
+
+        Callers restore cached results before writing the region views, see
+        restore, so the command always runs.
         Accepts:
             normal_bam (str): Path to normal bam input
             tumor_bam (str): Path to tumor bam input
+            cache_key (str): Result cache key to store the output under, see
+                cache_key
         Returns:
             output_file (str): Path to somaticsniper output file
         """
-        cmd = self.COMMAND.format(
+        cmd = self.build_command(normal_bam, tumor_bam)
+        _utils.run_subprocess_command(cmd, self.timeout, stream_output=True)
+        logger.info(cmd)
+        if cache_key is not None:
+            self.cache.put(cache_key, self.output_file)
+        return self.output_file
+
+    async def run_async(
+        self, normal_bam: str, tumor_bam: str, runner, cache_key: Optional[str] = None
+    ) -> str:
+        """Runs somatic sniper command through an AsyncRunner, see run."""
+        loop = asyncio.get_event_loop()
+        cmd = self.build_command(normal_bam, tumor_bam)
+        await runner.run(cmd, self.timeout, stage="somaticsniper", stream_output=True)
+        logger.info(cmd)
+        if cache_key is not None:
+            await loop.run_in_executor(
+                None, self.cache.put, cache_key, self.output_file
+            )
+        return self.output_file
+
+    def build_command(self, normal_bam: str, tumor_bam: str) -> str:
+        return self.COMMAND.format(
             somaticsniper_bin=self.somaticsniper_bin,
             map_q=self.map_q,
             base_q=self.base_q,
@@ -71,33 +151,13 @@ class SomaticSniper:
             normal_bam=normal_bam,
             output_file=self.output_file,
         )
-        popen_return = _utils.run_subprocess_command(
-            cmd, self.timeout, stdout=PIPE, stderr=PIPE
-        )
-        logger.info(cmd)
-        logger.debug(popen_return.stdout)
-        logger.debug(popen_return.stderr)
-        return self.output_file
 
     @classmethod
     def _initialize_args(cls, args: NamedTuple = None, **kwargs):
         """Set class props from kwargs."""
-        attrs = (
-            'somaticsniper_bin',
-            'map_q',
-            'base_q',
-            'pps',
-            'theta',
-            'nhap',
-            'pd',
-            'out_format',
-            'flags',
-            'reference_path',
-            'timeout',
-        )
         args_dict = args._asdict() if args else {}
         args_dict.update(kwargs)
-        for attr in attrs:
+        for attr in cls.ARGS:
             val = args_dict.get(attr, None)
             setattr(cls, attr, val)
 
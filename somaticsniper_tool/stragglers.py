@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Speculative splitting of straggling regions on the thread pool.
+
+Regions are grouped into size classes, powers of two of their mpileup
+bytes, or of their length for mpileups not yet written. Once min_samples
+regions of a class have finished, a region of that class running longer
+than factor times their median runtime is split into sub-regions, see
+region_split.split_mpileup, which are queued on the same executor and race
+the original. Whichever finishes first wins: the original's output, or the
+sub-region outputs stitched together. The loser's running commands are
+killed, see utils.ChildProcesses.
+"""
+
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, List, Tuple
+
+from somaticsniper_tool import region_split, scheduler, utils
+from somaticsniper_tool.bgzf_merge import BgzfMerge
+from somaticsniper_tool.snp_filter import INDEL_WINDOW
+
+logger = logging.getLogger(__name__)
+
+MIN_SAMPLES = 3
+SPLIT_WAYS = 4
+POLL_SECONDS = 1.0
+
+ORIGINAL = "original"
+SPLIT = "split"
+
+
+def size_class(mpileup: str) -> int:
+    """Get a region's size class, the bit length of its estimated cost."""
+    size, length = scheduler.estimate_region_cost(mpileup)
+    return (size or length).bit_length()
+
+
+def split_output_name(mpileup: str, output_compression: str = "none") -> str:
+    """Get the path of a straggler's stitched sub-region outputs."""
+    basename, _ = os.path.splitext(os.path.basename(mpileup))
+    name = "{}.split.annotated.vcf".format(basename)
+    return name + ".gz" if output_compression == "bgzf" else name
+
+
+class StragglerMonitor:
+    """Race split sub-regions against regions straggling on executor.
+
+    Submit regions with run, and get each finished region's result from
+    result. Use as a context manager around the executor's regions, so
+    sub-regions are stopped before the executor shuts down.
+    Accepts:
+        executor (Executor): Executor running the regions
+        fn (Callable): Per-region workflow
+        kwargs (dict): Workflow kwargs, see region_kwargs
+        factor (float): Runtime, relative to the class median, of stragglers
+        out_dir (str): Directory for sub-region mpileups
+        min_samples (int): Finished regions of a class needed for a median
+        split_ways (int): Sub-regions per straggler
+        poll_seconds (float): Seconds between straggler checks
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        fn: Callable,
+        kwargs: dict,
+        factor: float,
+        out_dir: str,
+        min_samples: int = MIN_SAMPLES,
+        split_ways: int = SPLIT_WAYS,
+        poll_seconds: float = POLL_SECONDS,
+        _utils=utils,
+        _clock=time.monotonic,
+    ):
+        self.executor = executor
+        self.fn = fn
+        self.kwargs = kwargs
+        self.factor = factor
+        self.out_dir = out_dir
+        self.min_samples = min_samples
+        self.split_ways = split_ways
+        self.poll_seconds = poll_seconds
+        self._utils = _utils
+        self._clock = _clock
+        self._lock = threading.Lock()
+        self._running: Dict[str, Tuple[float, int]] = {}
+        self._runtimes: Dict[int, List[float]] = defaultdict(list)
+        self._speculations: Dict[str, Future] = {}
+        self._subs: Dict[str, List[str]] = {}
+        self._sub_futures: Dict[str, List[Future]] = {}
+        self._sub_regions = set()
+        self._winners: Dict[str, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def run(self, mpileup: str, **kwargs) -> str:
+        """Run fn on a region, timing it and grouping its commands."""
+        start = self._clock()
+        region_class = size_class(mpileup)
+        with self._lock:
+            self._running[mpileup] = (start, region_class)
+        try:
+            with self._utils.CHILDREN.group(mpileup):
+                result = self.fn(mpileup, **kwargs)
+        finally:
+            with self._lock:
+                del self._running[mpileup]
+        with self._lock:
+            self._runtimes[region_class].append(self._clock() - start)
+        return result
+
+    def stragglers(self) -> List[str]:
+        """Get running regions over factor times their class median runtime."""
+        now = self._clock()
+        found = []
+        with self._lock:
+            for mpileup, (start, region_class) in self._running.items():
+                if mpileup in self._speculations or mpileup in self._sub_regions:
+                    continue
+                runtimes = self._runtimes[region_class]
+                if len(runtimes) < self.min_samples:
+                    continue
+                if now - start > self.factor * statistics.median(runtimes):
+                    found.append(mpileup)
+        return found
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            for mpileup in self.stragglers():
+                try:
+                    self.speculate(mpileup)
+                except Exception as e:
+                    logger.warning("Cannot split straggler %s: %s", mpileup, e)
+
+    def speculate(self, mpileup: str):
+        """Split a straggling region and queue its sub-regions."""
+        speculation = Future()
+        with self._lock:
+            if mpileup in self._speculations or mpileup in self._winners:
+                return
+            self._speculations[mpileup] = speculation
+        length = scheduler.region_length(mpileup)
+        subs = [mpileup]
+        # Planned regions have no mpileup to split until they are done
+        if length and not self.kwargs.get("mpileup_reference"):
+            subs = region_split.split_mpileup(
+                mpileup,
+                math.ceil(length / self.split_ways),
+                self.out_dir,
+                indel_window=self.kwargs.get("indel_window", INDEL_WINDOW),
+            )
+        if len(subs) == 1:
+            speculation.cancel()
+            return
+        logger.warning(
+            "Region %s is straggling, racing %s sub-regions against it",
+            mpileup,
+            len(subs),
+        )
+        with self._lock:
+            self._sub_regions.update(subs)
+            self._subs[mpileup] = subs
+            futures = self._sub_futures[mpileup] = []
+            for sub in subs:
+                futures.append(self.executor.submit(self.run, sub, **self.kwargs))
+        remaining = [len(futures)]
+
+        def sub_done(_):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self._finish(mpileup, subs, futures)
+
+        for future in futures:
+            future.add_done_callback(sub_done)
+
+    def _claim(self, mpileup: str, winner: str) -> bool:
+        with self._lock:
+            return self._winners.setdefault(mpileup, winner) == winner
+
+    def _finish(self, mpileup: str, subs: List[str], futures: List[Future]):
+        speculation = self._speculations[mpileup]
+        failed = [f for f in futures if f.cancelled() or f.exception() is not None]
+        if failed:
+            if self._winners.get(mpileup) != ORIGINAL:
+                logger.warning("Split of straggler %s failed", mpileup)
+            speculation.cancel()
+            return
+        if not self._claim(mpileup, SPLIT):
+            speculation.cancel()
+            return
+        try:
+            speculation.set_result(
+                self._stitch(mpileup, subs, [f.result() for f in futures])
+            )
+        except Exception as e:
+            speculation.set_exception(e)
+        killed = self._utils.CHILDREN.kill(mpileup)
+        logger.info(
+            "Split of straggler %s finished first, killed %s commands", mpileup, killed
+        )
+
+    def _stitch(self, mpileup: str, subs: List[str], results: List[str]) -> str:
+        output_compression = self.kwargs.get("output_compression", "none")
+        output = split_output_name(mpileup, output_compression)
+        if output_compression == "bgzf":
+            with BgzfMerge(output) as merger:
+                for i, (result, bounds) in enumerate(
+                    zip(results, region_split.clip_bounds(subs))
+                ):
+                    merger.append(result, i == 0, bounds)
+        else:
+            with open(output, 'wb') as out_fh:
+                region_split.stitch_outputs(subs, results, out_fh)
+        return output
+
+    def _abandon(self, mpileup: str):
+        """Stop the sub-regions of a straggler that finished first."""
+        with self._lock:
+            futures = self._sub_futures.get(mpileup, [])
+            subs = self._subs.get(mpileup, [])
+        for future in futures:
+            future.cancel()
+        for sub in subs:
+            self._utils.CHILDREN.kill(sub)
+
+    def result(self, mpileup: str, future: Future) -> str:
+        """Get a finished region's result, the original's or its split's.
+        Accepts:
+            mpileup (str): Region submitted with run
+            future (Future): The region's finished future
+        Returns:
+            str: Output of whichever of the region and its split won
+        """
+        if self._claim(mpileup, ORIGINAL):
+            if mpileup in self._speculations:
+                self._abandon(mpileup)
+            return future.result()
+        return self._speculations[mpileup].result()
+
+    def stop(self):
+        """Stop checking for stragglers and stop any sub-regions."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        for mpileup in list(self._speculations):
+            if self._claim(mpileup, ORIGINAL):
+                self._abandon(mpileup)
+
+
+# __END__
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tabix (.tbi) index of a BGZF-compressed VCF.
+
+Records are added in file order with their 0-based, half-open reference
+span and the virtual offsets of their start and end. Each contig gets the
+binning index of the SAM specification, section 5.3, with chunks of
+adjacent records in the same bin merged, a 16 kb linear index, and the
+pseudo-bin htslib uses for per-contig offsets and record counts. The
+index is written BGZF compressed, as tabix does.
+"""
+
+import struct
+from types import SimpleNamespace
+from typing import Dict, List
+
+from somaticsniper_tool.bgzf import BgzfWriter, VirtualOffset
+
+DI = SimpleNamespace(open=open)
+
+INDEX_SUFFIX = ".tbi"
+MAGIC = b"TBI\x01"
+
+# tabix -p vcf: format, sequence, begin and end columns, meta character and
+# lines to skip
+_CONF = struct.Struct("<6i")
+VCF_CONF = (2, 1, 2, 0, ord("#"), 0)
+
+MIN_SHIFT = 14
+DEPTH = 5
+# Bin holding a contig's offset range and record counts
+PSEUDO_BIN = ((1 << 3 * (DEPTH + 1)) - 1) // 7 + 1
+
+
+def reg2bin(beg: int, end: int) -> int:
+    """Get the smallest bin holding the 0-based, half-open span [beg, end)."""
+    end -= 1
+    for level in range(DEPTH, 0, -1):
+        shift = MIN_SHIFT + 3 * (DEPTH - level)
+        if beg >> shift == end >> shift:
+            return ((1 << 3 * level) - 1) // 7 + (beg >> shift)
+    return 0
+
+
+class _ContigIndex:
+    def __init__(self):
+        self.bins: Dict[int, List[List[int]]] = {}
+        self.linear: List[int] = []
+        self.first = None
+        self.last = None
+        self.records = 0
+
+    def add(self, beg: int, end: int, start: VirtualOffset, stop: VirtualOffset):
+        chunks = self.bins.setdefault(reg2bin(beg, end), [])
+        if chunks and chunks[-1][1] == start:
+            chunks[-1][1] = stop
+        else:
+            chunks.append([start, stop])
+        last_window = (end - 1) >> MIN_SHIFT
+        if len(self.linear) <= last_window:
+            self.linear.extend([None] * (last_window + 1 - len(self.linear)))
+        for window in range(beg >> MIN_SHIFT, last_window + 1):
+            if self.linear[window] is None:
+                self.linear[window] = start
+        if self.first is None:
+            self.first = start
+        self.last = stop
+        self.records += 1
+
+    def pack(self) -> bytes:
+        bins = sorted(self.bins.items())
+        bins.append((PSEUDO_BIN, [[self.first, self.last], [self.records, 0]]))
+        parts = [struct.pack("<i", len(bins))]
+        for bin_id, chunks in bins:
+            parts.append(struct.pack("<Ii", bin_id, len(chunks)))
+            parts.extend(struct.pack("<QQ", *chunk) for chunk in chunks)
+        # Windows without records point at the record before them, or at the
+        # contig's first record
+        linear = []
+        offset = self.first
+        for window_offset in self.linear:
+            offset = window_offset if window_offset is not None else offset
+            linear.append(offset)
+        parts.append(struct.pack("<i{}Q".format(len(linear)), len(linear), *linear))
+        return b"".join(parts)
+
+
+class TabixIndex:
+    """Tabix index built from VCF records added in file order."""
+
+    def __init__(self):
+        self.contigs: Dict[bytes, _ContigIndex] = {}
+
+    def add(
+        self,
+        chrom: bytes,
+        beg: int,
+        end: int,
+        start: VirtualOffset,
+        stop: VirtualOffset,
+    ):
+        """Index a record.
+        Accepts:
+            chrom (bytes): Contig name
+            beg (int): 0-based start, POS - 1 for VCF
+            end (int): Exclusive end, beg + len(REF) for VCF
+            start (VirtualOffset): Virtual offset of the record's first byte
+            stop (VirtualOffset): Virtual offset after the record
+        """
+        if chrom not in self.contigs:
+            self.contigs[chrom] = _ContigIndex()
+        self.contigs[chrom].add(beg, max(end, beg + 1), start, stop)
+
+    def pack(self) -> bytes:
+        names = b"".join(name + b"\0" for name in self.contigs)
+        parts = [
+            MAGIC,
+            struct.pack("<i", len(self.contigs)),
+            _CONF.pack(*VCF_CONF),
+            struct.pack("<i", len(names)),
+            names,
+        ]
+        parts.extend(contig.pack() for contig in self.contigs.values())
+        return b"".join(parts)
+
+    def write(self, path: str, _di=DI):
+        with _di.open(path, 'wb') as fh, BgzfWriter(fh) as writer:
+            writer.write(self.pack())
+
+
+# __END__
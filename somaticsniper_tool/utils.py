@@ -1,12 +1,183 @@
 #!/usr/bin/env python3
 
+import contextvars
+import heapq
+import logging
 import os
+import selectors
 import shlex
 import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from itertools import repeat
+from operator import itemgetter, methodcaller
 from types import SimpleNamespace
-from typing import IO, List, NamedTuple, Optional
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
-DI = SimpleNamespace(open=open, os=os, subprocess=subprocess)
+from somaticsniper_tool.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class ChildProcesses:
+    """Running RusagePopen children, by group, so a run can kill them.
+
+    Groups, e.g. regions, are set per thread or asyncio task with group.
+    Killed groups stay cancelled until reset: starting another child in
+    them raises ValueError.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running: Dict[subprocess.Popen, Optional[str]] = {}
+        self._cancelled = set()
+        self._all_cancelled = False
+        self._group = contextvars.ContextVar("child_group", default=None)
+
+    @contextmanager
+    def group(self, name: str):
+        """Put children started in this thread or task in group name."""
+        token = self._group.set(name)
+        try:
+            yield
+        finally:
+            self._group.reset(token)
+
+    def _is_cancelled(self, group: Optional[str]) -> bool:
+        return self._all_cancelled or (group is not None and group in self._cancelled)
+
+    def check(self):
+        """Raise ValueError if children of the current group were killed."""
+        group = self._group.get()
+        with self._lock:
+            if self._is_cancelled(group):
+                raise ValueError("Cancelled commands of {}".format(group or "run"))
+
+    def add(self, p: subprocess.Popen):
+        group = self._group.get()
+        with self._lock:
+            if not self._is_cancelled(group):
+                self._running[p] = group
+                return
+        # Killed while starting
+        p.kill()
+
+    def discard(self, p: subprocess.Popen):
+        with self._lock:
+            self._running.pop(p, None)
+
+    def kill(self, group: Optional[str] = None) -> int:
+        """Kill running children of group, or of every group if None.
+        Returns:
+            int: Number of children killed
+        """
+        with self._lock:
+            if group is None:
+                self._all_cancelled = True
+            else:
+                self._cancelled.add(group)
+            killed = [
+                p
+                for p, p_group in self._running.items()
+                if group is None or p_group == group
+            ]
+        for p in killed:
+            try:
+                p.kill()
+            except OSError:
+                pass
+        return len(killed)
+
+    def reset(self):
+        """Allow children in every group again."""
+        with self._lock:
+            self._cancelled.clear()
+            self._all_cancelled = False
+
+
+CHILDREN = ChildProcesses()
+
+
+class RusagePopen(subprocess.Popen):
+    """Popen that keeps the child's resource usage when it is reaped.
+
+    wait and poll reap the child with os.wait4, which Popen's own wait, and
+    so communicate, goes through. Running children are tracked in CHILDREN
+    until reaped.
+    """
+
+    rusage = None
+    # Longest sleep between os.wait4 polls while waiting with a timeout
+    MAX_POLL_SECONDS = 0.05
+
+    def __init__(self, *args, **kwargs):
+        CHILDREN.check()
+        self._reap_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+        CHILDREN.add(self)
+
+    def _reap(self, blocking: bool) -> bool:
+        """Reap the child if done, or until done if blocking.
+        Returns:
+            bool: Whether the child is reaped
+        """
+        # Another thread waiting for the child holds the lock until reaped
+        if not self._reap_lock.acquire(blocking):
+            return False
+        try:
+            if self.returncode is not None:
+                return True
+            try:
+                pid, status, rusage = os.wait4(self.pid, 0 if blocking else os.WNOHANG)
+            except ChildProcessError:
+                # Child already reaped elsewhere; mirror Popen's behaviour
+                pid, status, rusage = self.pid, 0, None
+            if pid != self.pid:
+                return False
+            self.rusage = rusage
+            if os.WIFSIGNALED(status):
+                self.returncode = -os.WTERMSIG(status)
+            else:
+                self.returncode = os.WEXITSTATUS(status)
+            CHILDREN.discard(self)
+            return True
+        finally:
+            self._reap_lock.release()
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        """Wait for the child to end, keeping its resource usage.
+        Raises:
+            subprocess.TimeoutExpired: If the child runs past timeout seconds
+        """
+        if timeout is None:
+            self._reap(blocking=True)
+            return self.returncode
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while not self._reap(blocking=False):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            delay = min(delay * 2, remaining, self.MAX_POLL_SECONDS)
+            time.sleep(delay)
+        return self.returncode
+
+    def poll(self) -> Optional[int]:
+        """Reap the child if it is done, so rusage is kept."""
+        self._reap(blocking=False)
+        return self.returncode
+
+
+DI = SimpleNamespace(open=open, os=os, subprocess=SimpleNamespace(Popen=RusagePopen))
+
+MERGE_BUFFER_SIZE = 1 << 20
+
+# Streamed output: lines kept for error messages, and the longest line kept
+TAIL_LINES = 200
+MAX_LINE_BYTES = 4096
+OUTPUT_CHUNK_SIZE = 1 << 16
 
 
 class PopenReturn(NamedTuple):
@@ -14,6 +185,92 @@ class PopenReturn(NamedTuple):
     stderr: Optional[str]
 
 
+class OutputTail:
+    """Log output lines as they arrive, keeping only the last lines.
+
+    Memory is bounded by max_lines * max_line_bytes: longer lines are logged
+    and kept in max_line_bytes pieces.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_lines: int = TAIL_LINES,
+        max_line_bytes: int = MAX_LINE_BYTES,
+    ):
+        self.name = name
+        self.max_line_bytes = max_line_bytes
+        self.lines = deque(maxlen=max_lines)
+        self._partial = b""
+
+    def feed(self, chunk: bytes):
+        *lines, self._partial = (self._partial + chunk).split(b"\n")
+        for line in lines:
+            self._emit(line)
+        while len(self._partial) > self.max_line_bytes:
+            self._emit(self._partial[: self.max_line_bytes])
+            self._partial = self._partial[self.max_line_bytes :]
+
+    def close(self):
+        if self._partial:
+            self._emit(self._partial)
+            self._partial = b""
+
+    def _emit(self, line: bytes):
+        for start in range(0, max(len(line), 1), self.max_line_bytes):
+            text = line[start : start + self.max_line_bytes].decode(errors="replace")
+            logger.debug("%s: %s", self.name, text)
+            self.lines.append(text + "\n")
+
+    def text(self) -> str:
+        return "".join(self.lines)
+
+
+def output_tails(cmd: str, stdout, stderr) -> Tuple[Optional[OutputTail], ...]:
+    """Get tails for the piped streams of a process, None if not piped."""
+    words = cmd.split()
+    program = os.path.basename(words[0]) if words else cmd
+    return tuple(
+        OutputTail("{} {}".format(program, name)) if pipe is not None else None
+        for name, pipe in (("stdout", stdout), ("stderr", stderr))
+    )
+
+
+def _stream_output(p: subprocess.Popen, tails, timeout: Optional[int]):
+    """Feed piped output of p to tails until EOF, then wait for p.
+
+    Raises subprocess.TimeoutExpired once timeout seconds have passed.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def remaining():
+        if deadline is None:
+            return None
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise subprocess.TimeoutExpired(p.args, timeout)
+        return left
+
+    with selectors.DefaultSelector() as selector:
+        for pipe, tail in zip((p.stdout, p.stderr), tails):
+            if tail is not None:
+                selector.register(pipe, selectors.EVENT_READ, tail)
+        while selector.get_map():
+            for key, _ in selector.select(remaining()):
+                chunk = os.read(key.fd, OUTPUT_CHUNK_SIZE)
+                if chunk:
+                    key.data.feed(chunk)
+                else:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    key.data.close()
+    p.wait(timeout=remaining())
+
+
+def _tail_text(tail: Optional[OutputTail]) -> Optional[str]:
+    return tail.text() if tail is not None else None
+
+
 def get_region_from_name(file_path: str, _di=DI) -> str:
     """Get region from mpileup filename
     e.g. chr1-1-248956422.mpileup
@@ -30,21 +287,31 @@ def get_region_from_name(file_path: str, _di=DI) -> str:
     return region, base
 
 
-def run_subprocess_command(cmd: str, timeout: int, _di=DI, **kwargs) -> PopenReturn:
+def run_subprocess_command(
+    cmd: str, timeout: int, _di=DI, stream_output: bool = False, **kwargs
+) -> PopenReturn:
     """Run command via Popen.
     Accepts:
         cmd (str): Command-string to run
         timeout (int): Max seconds to wait for command
+        stream_output (bool): Log stdout and stderr lines as they arrive and
+            keep only their last TAIL_LINES lines, instead of buffering all
+            output. Streams redirected in kwargs are left alone.
         kwargs (dict): Additional arguments to Popen
     Returns:
         PopenReturn: NamedTuple with stdout and stderr attributes
     """
 
+    if stream_output:
+        kwargs.setdefault("stdout", subprocess.PIPE)
+        kwargs.setdefault("stderr", subprocess.PIPE)
     if kwargs.get("shell", False):
         # Do not split command for shell
         p = _di.subprocess.Popen(cmd, **kwargs)
     else:
         p = _di.subprocess.Popen(shlex.split(cmd), **kwargs)
+    if stream_output:
+        return _run_streamed(p, cmd, timeout)
     try:
         stdout, stderr = p.communicate(timeout=timeout)
     except subprocess.TimeoutExpired:
@@ -52,6 +319,7 @@ def run_subprocess_command(cmd: str, timeout: int, _di=DI, **kwargs) -> PopenRet
         stdout, stderr = p.communicate()
         raise ValueError(stderr.decode())
 
+    METRICS.add_child_usage(getattr(p, "rusage", None))
     if p.returncode != 0:
         raise ValueError(stderr.decode())
 
@@ -69,19 +337,234 @@ def run_subprocess_command(cmd: str, timeout: int, _di=DI, **kwargs) -> PopenRet
     return PopenReturn(stdout=stdout, stderr=stderr)
 
 
-def merge_outputs(files: List[str], merged_file: IO, _di=DI):
-    """Add non-comment lines from list of files to output file.
+def _run_streamed(p: subprocess.Popen, cmd: str, timeout: int) -> PopenReturn:
+    """Stream output of p into tails, see run_subprocess_command."""
+    stdout_tail, stderr_tail = output_tails(cmd, p.stdout, p.stderr)
+    try:
+        _stream_output(p, (stdout_tail, stderr_tail), timeout)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        p.wait()
+        raise ValueError(_tail_text(stderr_tail))
+    finally:
+        for pipe in (p.stdout, p.stderr):
+            if pipe is not None:
+                pipe.close()
+
+    METRICS.add_child_usage(getattr(p, "rusage", None))
+    if p.returncode != 0:
+        raise ValueError(_tail_text(stderr_tail))
+    return PopenReturn(stdout=_tail_text(stdout_tail), stderr=_tail_text(stderr_tail))
+
+
+def load_contig_order(fai_path: str, _di=DI) -> Dict[str, int]:
+    """Read contig order from a reference fasta index.
     Accepts:
-        files: List of file paths
-        merged_file (IO): File handler of output file
+        fai_path (str): Path to .fai file
+    Returns:
+        Dict[str, int]: Contig name to rank, empty if the index is missing
     """
-    first = True
-    for out in files:
-        with _di.open(out) as fh:
-            for line in fh:
-                if first or not line.startswith("#"):
-                    merged_file.write(line)
-        first = False
+    try:
+        with _di.open(fai_path) as fh:
+            return {line.split("\t", 1)[0]: i for i, line in enumerate(fh)}
+    except OSError:
+        return {}
+
+
+RecordKey = Tuple[int, str, int]
+
+# Record bytes are decoded for key parsing and encoded back unchanged
+_ERRORS = "surrogateescape"
+
+
+def header_size(fh: IO, chunk_size: int = MERGE_BUFFER_SIZE) -> int:
+    """Get the size of the header lines at the start of a binary handle.
+
+    Only the line breaks of lines starting with "#" are searched for, so
+    records after the header are never scanned. Leaves fh after the data read.
+    """
+    data = b""
+    end = 0
+    while True:
+        if data.startswith(b"#", end):
+            newline = data.find(b"\n", end)
+            if newline != -1:
+                end = newline + 1
+                continue
+        elif end < len(data):
+            return end
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            return len(data)
+        data += chunk
+
+
+def _record_key(line: bytes, contig_order: Dict[str, int]) -> RecordKey:
+    chrom, pos = line.decode(errors=_ERRORS).split("\t", 2)[:2]
+    return contig_order.get(chrom, len(contig_order)), chrom, int(pos)
+
+
+def _record_span(
+    fh: IO, contig_order: Dict[str, int], chunk_size: int = MERGE_BUFFER_SIZE
+) -> Optional[Tuple[RecordKey, RecordKey]]:
+    """Get the keys of the first and last records from the position of fh.
+
+    Reads the first record and the end of the file, skipping blank lines,
+    then seeks back.
+    Returns:
+        Tuple[RecordKey, RecordKey]: First and last keys, None without records
+    """
+    start = fh.tell()
+    first = fh.readline()
+    while first.isspace():
+        first = fh.readline()
+    if not first:
+        fh.seek(start)
+        return None
+    end = tail_start = fh.seek(0, os.SEEK_END)
+    while True:
+        tail_start = max(start, tail_start - chunk_size)
+        fh.seek(tail_start)
+        tail = fh.read(end - tail_start).rstrip()
+        last_start = tail.rfind(b"\n") + 1
+        if last_start or tail_start == start:
+            break
+    fh.seek(start)
+    return (
+        _record_key(first, contig_order),
+        _record_key(tail[last_start:], contig_order),
+    )
+
+
+def _line_blocks(fh: IO, chunk_size: int = MERGE_BUFFER_SIZE) -> Iterator[List[str]]:
+    """Yield decoded lines of a binary handle, without line breaks, in blocks."""
+    carry = b""
+    for chunk in iter(lambda: fh.read(chunk_size), b""):
+        chunk = carry + chunk
+        cut = chunk.rfind(b"\n")
+        carry = chunk[cut + 1 :]
+        if cut != -1:
+            yield chunk[:cut].decode(errors=_ERRORS).split("\n")
+    if carry:
+        yield [carry.decode(errors=_ERRORS)]
+
+
+def _sorted_records(
+    fh: IO,
+    contig_order: Dict[str, int],
+    index: int,
+    chunk_size: int = MERGE_BUFFER_SIZE,
+) -> Iterator[Tuple[int, str, int, int, str]]:
+    """Yield (rank, chrom, pos, index, line) for records of a sorted binary VCF.
+
+    Keys are parsed a block at a time, skipping blank lines. Records of
+    equal position sort by input index, as in a stable merge.
+    """
+    unknown = len(contig_order)
+    for lines in _line_blocks(fh, chunk_size):
+        lines = list(filter(str.strip, lines))
+        parts = list(map(methodcaller("split", "\t", 2), lines))
+        chroms = list(map(itemgetter(0), parts))
+        ranks = {chrom: contig_order.get(chrom, unknown) for chrom in set(chroms)}
+        yield from zip(
+            map(ranks.__getitem__, chroms),
+            chroms,
+            map(int, map(itemgetter(1), parts)),
+            repeat(index),
+            lines,
+        )
+
+
+def _write_lines(merged_file: IO, lines: List[str]):
+    if lines:
+        merged_file.write("{}\n".format("\n".join(lines)).encode(errors=_ERRORS))
+
+
+def _copy_records(fh: IO, merged_file: IO, chunk_size: int = MERGE_BUFFER_SIZE):
+    """Copy the rest of fh in chunks, ending it with a line break."""
+    chunk = b"\n"
+    for chunk in iter(lambda: fh.read(chunk_size), b""):
+        merged_file.write(chunk)
+    if not chunk.endswith(b"\n"):
+        merged_file.write(b"\n")
+
+
+def _merge_records(
+    inputs: List[Tuple[int, IO]],
+    merged_file: IO,
+    contig_order: Dict[str, int],
+    buffer_size: int = MERGE_BUFFER_SIZE,
+):
+    """Heap merge the records of (input index, handle) inputs."""
+    buffered = []
+    buffered_size = 0
+    streams = [_sorted_records(fh, contig_order, i, buffer_size) for i, fh in inputs]
+    for line in map(itemgetter(4), heapq.merge(*streams)):
+        buffered.append(line)
+        buffered_size += len(line) + 1
+        if buffered_size >= buffer_size:
+            _write_lines(merged_file, buffered)
+            buffered = []
+            buffered_size = 0
+    _write_lines(merged_file, buffered)
+
+
+def merge_outputs(
+    files: List[str],
+    merged_file: IO,
+    contig_order: Optional[Dict[str, int]] = None,
+    buffer_size: int = MERGE_BUFFER_SIZE,
+    _di=DI,
+):
+    """Merge VCFs into a single coordinate-sorted output.
+
+    Inputs are read as bytes, in buffer_size blocks, from past their header,
+    found with one scan and a seek. Inputs are grouped by overlapping record
+    ranges, from their first and last records. Groups are written in
+    coordinate order: a single input, as a region output, is copied whole,
+    and overlapping inputs go through a streaming heap-based k-way merge,
+    holding one decoded block per input. Records sort by contig, in
+    contig_order with unknown contigs after by name, then position. The
+    header is taken from the first file. Blank lines are dropped from merged
+    groups, and copied as they are with a single input.
+    Accepts:
+        files: List of file paths, each coordinate-sorted
+        merged_file (IO): Binary file handler of output file, merged bytes
+            are written to it, so it must be opened 'wb'. A text handle
+            raises TypeError
+        contig_order (Dict[str, int]): Contig ranks, e.g. from load_contig_order
+        buffer_size (int): Bytes read per block, and buffered between writes
+    """
+    contig_order = contig_order or {}
+    with ExitStack() as stack:
+        handles = [stack.enter_context(_di.open(out, 'rb')) for out in files]
+        offsets = [header_size(fh, buffer_size) for fh in handles]
+        if handles:
+            handles[0].seek(0)
+            merged_file.write(handles[0].read(offsets[0]))
+        spans = []
+        for fh, offset in zip(handles, offsets):
+            fh.seek(offset)
+            spans.append(_record_span(fh, contig_order, buffer_size))
+
+        # Each group holds its last key and inputs. Records of equal keys go
+        # to the earlier input, so ranges sharing a key are merged too
+        groups = []
+        for (first, last), i, fh in sorted(
+            ((span, i, fh) for i, (span, fh) in enumerate(zip(spans, handles)) if span),
+            key=itemgetter(0),
+        ):
+            if groups and first <= groups[-1][0]:
+                groups[-1][0] = max(groups[-1][0], last)
+                groups[-1][1].append((i, fh))
+            else:
+                groups.append([last, [(i, fh)]])
+
+        for _, inputs in groups:
+            if len(inputs) == 1:
+                _copy_records(inputs[0][1], merged_file, buffer_size)
+            else:
+                _merge_records(inputs, merged_file, contig_order, buffer_size)
 
 
 # __END__
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Columnar batches of VCF records.
+
+A batch keeps a chunk of whole record lines as one bytes buffer, the start
+offset of every column in one array per column, and the variant key columns:
+POS as integers, CHROM and FORMAT as indexes into the batch's distinct
+values, and REF and ALT as bytes, which for SNVs are interpreter-shared
+single bytes. Other columns are read as memoryview slices of the buffer,
+and a batch is written back with records dropped or their FILTER column
+replaced by writing the bytes around it. Whole-batch operations map over
+the arrays, so their per-record work runs in C.
+
+Parsing a batch costs more than splitting its lines, so batches are used
+only where one parse is shared: by the stages of the fused post-processing,
+and by BgzfMerge, which clips and indexes the records of a block. The staged
+filters and Annotate read line by line, deciding each record as the batch
+masks do, see NativeSnpFilter.dropped and NativeHighConfidence.
+"""
+
+from array import array
+from itertools import accumulate, chain, compress, repeat
+from operator import add, gt, itemgetter, methodcaller, sub
+from typing import IO, Iterator, List, Optional, Sequence, Tuple
+
+CHROM, POS, ID, REF, ALT, QUAL, FILTER, INFO, FORMAT, NORMAL, TUMOR = range(11)
+COLUMNS = TUMOR + 1
+
+# Bytes read per batch; batches end at the last complete line
+BATCH_BYTES = 1 << 20
+
+VariantKey = Tuple[bytes, int, bytes, bytes]
+
+
+def _encode(values: List[bytes]) -> Tuple[List[bytes], array]:
+    """Dictionary-encode values as distinct values and an index per value."""
+    names = list(dict.fromkeys(values))
+    ids = {name: i for i, name in enumerate(names)}
+    return names, array('I', map(ids.__getitem__, values))
+
+
+def _index(keys: List[bytes], key: bytes) -> Optional[int]:
+    return keys.index(key) if key in keys else None
+
+
+def _split_values(samples: List[bytes]) -> Iterator[List[bytes]]:
+    return map(methodcaller("split", b":"), samples)
+
+
+class RecordBatch:
+    """VCF records of one buffer with column offsets and positions.
+
+    Missing trailing columns are empty, and TUMOR extends to the end of the
+    line. POS is -1 where it is missing or not an integer.
+    """
+
+    __slots__ = (
+        "buffer",
+        "view",
+        "starts",
+        "content_ends",
+        "line_ends",
+        "pos",
+        "chrom_names",
+        "chrom_ids",
+        "refs",
+        "alts",
+        "format_names",
+        "format_ids",
+    )
+
+    def __init__(self, buffer: bytes):
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        if not self._parse_regular():
+            self._parse_lines()
+
+    def _set_columns(self, chroms, refs, alts, formats):
+        self.chrom_names, self.chrom_ids = _encode(chroms)
+        self.refs = refs
+        self.alts = alts
+        self.format_names, self.format_ids = _encode(formats)
+
+    def _parse_regular(self) -> bool:
+        """Parse a buffer of 11-column lines in bulk, False if irregular."""
+        buffer = self.buffer
+        size = len(buffer)
+        newlines = buffer.count(b"\n")
+        terminated = buffer.endswith(b"\n")
+        lines = newlines + (not terminated)
+        if not size or b"\r" in buffer:
+            return False
+        parts = buffer.replace(b"\n", b"\t").split(b"\t")
+        if len(parts) != COLUMNS * lines + terminated:
+            return False
+        try:
+            pos = array('q', map(int, parts[POS::COLUMNS]))
+        except ValueError:
+            return False
+        # Offset of every field: the sum of the preceding fields and separators
+        offsets = array(
+            'I', accumulate(chain((0,), map(add, map(len, parts), repeat(1))))
+        )
+        line_ends = offsets[COLUMNS::COLUMNS]
+        line_ends[-1] = size
+        # Lines must end where every 11th field does
+        last_bytes = bytes(map(buffer.__getitem__, map(sub, line_ends, repeat(1))))
+        if last_bytes.count(b"\n") != newlines:
+            return False
+        rows = COLUMNS * lines
+        self.starts = tuple(offsets[c:rows:COLUMNS] for c in range(COLUMNS))
+        self.content_ends = array('I', map(sub, line_ends, repeat(1)))
+        if not terminated:
+            self.content_ends[-1] = size
+        self.line_ends = line_ends
+        self.pos = pos
+        self._set_columns(*(parts[c:rows:COLUMNS] for c in (CHROM, REF, ALT, FORMAT)))
+        return True
+
+    def _parse_lines(self):
+        buffer = self.buffer
+        self.starts = tuple(array('I') for _ in range(COLUMNS))
+        self.content_ends = array('I')
+        self.line_ends = array('I')
+        self.pos = array('q')
+        size = len(buffer)
+        start = 0
+        while start < size:
+            end = buffer.find(b"\n", start)
+            end = size if end == -1 else end + 1
+            content_end = end
+            while content_end > start and buffer[content_end - 1] in b"\r\n":
+                content_end -= 1
+            column = start
+            for c, starts in enumerate(self.starts):
+                if c:
+                    tab = buffer.find(b"\t", column, content_end)
+                    # Missing columns are empty, as a column ends one byte
+                    # before the next starts
+                    column = content_end + 1 if tab == -1 else tab + 1
+                starts.append(column)
+            self.content_ends.append(content_end)
+            self.line_ends.append(end)
+            try:
+                self.pos.append(int(self.column(len(self.pos), POS)))
+            except ValueError:
+                self.pos.append(-1)
+            start = end
+        self._set_columns(
+            *(
+                list(map(buffer.__getitem__, map(slice, self.starts[c], self.ends(c))))
+                for c in (CHROM, REF, ALT, FORMAT)
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.pos)
+
+    def ends(self, column: int) -> Sequence[int]:
+        """Get the end offsets of a column."""
+        if column == TUMOR:
+            return self.content_ends
+        return array('I', map(sub, self.starts[column + 1], repeat(1)))
+
+    def span(self, i: int, column: int) -> Tuple[int, int]:
+        """Get buffer offsets [start, end) of a column of record i."""
+        start = self.starts[column][i]
+        if column < TUMOR:
+            end = self.starts[column + 1][i] - 1
+        else:
+            end = self.content_ends[i]
+        return start, max(start, end)
+
+    def column(self, i: int, column: int) -> memoryview:
+        start, end = self.span(i, column)
+        return self.view[start:end]
+
+    def columns(self, column: int) -> Iterator[memoryview]:
+        """Iterate over a column of every record."""
+        spans = map(slice, self.starts[column], self.ends(column))
+        return map(self.view.__getitem__, spans)
+
+    def chrom(self, i: int) -> bytes:
+        return self.chrom_names[self.chrom_ids[i]]
+
+    def chroms(self) -> Iterator[bytes]:
+        return map(self.chrom_names.__getitem__, self.chrom_ids)
+
+    def filter(self, i: int) -> memoryview:
+        return self.column(i, FILTER)
+
+    def line(self, i: int) -> memoryview:
+        return self.view[self.starts[CHROM][i] : self.line_ends[i]]
+
+    def key(self, i: int) -> VariantKey:
+        return self.chrom(i), self.pos[i], self.refs[i], self.alts[i]
+
+    def keys(self) -> Iterator[VariantKey]:
+        """Iterate over the variant keys of every record."""
+        return zip(self.chroms(), self.pos, self.refs, self.alts)
+
+    def sample_values(
+        self, key: bytes, sample: int = TUMOR, rows: Optional[Sequence[int]] = None
+    ) -> List[Optional[bytes]]:
+        """Get a FORMAT key's value in a sample column, None where missing.
+        Accepts:
+            key (bytes): FORMAT key, e.g. b"SSC"
+            sample (int): Sample column, NORMAL or TUMOR
+            rows (Sequence[int]): Records to look up, default all
+        Returns:
+            List[Optional[bytes]]: Value of each record
+        """
+        starts, ends = self.starts[sample], self.ends(sample)
+        format_ids = self.format_ids
+        if rows is not None:
+            starts = map(starts.__getitem__, rows)
+            ends = map(ends.__getitem__, rows)
+            format_ids = map(format_ids.__getitem__, rows)
+        samples = list(map(self.buffer.__getitem__, map(slice, starts, ends)))
+        if sample == TUMOR and b"\t" in b"".join(samples):
+            # TUMOR extends to the end of the line, past any extra columns
+            samples = [tumor.split(b"\t", 1)[0] for tumor in samples]
+        indexes = [_index(name.split(b":"), key) for name in self.format_names]
+        if len(indexes) == 1 and indexes[0] is not None:
+            try:
+                return list(map(itemgetter(indexes[0]), _split_values(samples)))
+            except IndexError:
+                # A sample with fewer values than FORMAT keys
+                pass
+        return [
+            values[index] if index is not None and index < len(values) else None
+            for values, index in zip(
+                _split_values(samples), map(indexes.__getitem__, format_ids)
+            )
+        ]
+
+    def write(
+        self,
+        out_fh: IO,
+        keep: Optional[Sequence[bool]] = None,
+        filters: Optional[Sequence[bytes]] = None,
+    ):
+        """Write records to a binary file handle.
+        Accepts:
+            out_fh (IO): Binary file handle
+            keep (Sequence[bool]): Records to write, default all
+            filters (Sequence[bytes]): FILTER of each record, default unchanged
+        """
+        if filters is None:
+            if keep is None:
+                out_fh.write(self.view)
+            else:
+                lines = map(slice, self.starts[CHROM], self.line_ends)
+                out_fh.writelines(compress(map(self.view.__getitem__, lines), keep))
+            return
+        if not len(self):
+            return
+        if any(map(gt, self.starts[FILTER], self.content_ends)):
+            raise ValueError("VCF record has no FILTER column")
+        view_slice = self.view.__getitem__
+        filter_ends = self.ends(FILTER)
+        if keep is None:
+            # Records are contiguous, so the bytes from the tab after one
+            # FILTER to the start of the next are a single slice
+            gap_starts = chain(self.starts[CHROM][:1], filter_ends)
+            gaps = map(slice, gap_starts, self.starts[FILTER])
+            out_fh.writelines(chain.from_iterable(zip(map(view_slice, gaps), filters)))
+            out_fh.write(self.view[filter_ends[-1] : self.line_ends[-1]])
+            return
+        # Each record is written as the bytes before FILTER, the new FILTER
+        # and the bytes from the tab after FILTER to the end of the line
+        before = map(slice, self.starts[CHROM], self.starts[FILTER])
+        after = map(slice, filter_ends, self.line_ends)
+        records = zip(map(view_slice, before), filters, map(view_slice, after))
+        out_fh.writelines(chain.from_iterable(compress(records, keep)))
+
+
+class VcfReader:
+    """Read a binary VCF handle as its header lines, then record batches."""
+
+    def __init__(self, fh: IO, batch_bytes: int = BATCH_BYTES):
+        self.fh = fh
+        self.batch_bytes = batch_bytes
+        self.headers: List[bytes] = []
+        self._carry = b""
+        for line in iter(fh.readline, b""):
+            if not line.startswith(b"#"):
+                self._carry = line
+                break
+            self.headers.append(line)
+
+    def __iter__(self) -> Iterator[RecordBatch]:
+        carry, self._carry = self._carry, b""
+        while True:
+            chunk = self.fh.read(self.batch_bytes)
+            if not chunk:
+                break
+            chunk = carry + chunk
+            cut = chunk.rfind(b"\n") + 1
+            carry = chunk[cut:]
+            if cut:
+                yield RecordBatch(chunk[:cut])
+        if carry:
+            yield RecordBatch(carry)
+
+
+# __END__
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Work queue of regions on a shared filesystem, for workers on many hosts.
+
+The coordinator publishes the run's arguments to run.json and one task
+file per region to pending/. A worker claims a task by renaming it into
+claimed/, which only one worker can do, and touches its claim while the
+region runs. Results are posted to done/ or failed/. Files are written in
+tmp/ and renamed into place, so readers never see partial files. Claims
+not touched for lease_seconds, from workers that died, are moved back to
+pending/.
+
+The coordinator writes stop, holding the run id, when the run is over,
+and cancel to make workers kill their running commands, see
+utils.ChildProcesses. It touches run.json while it waits for results, and
+a run that is neither stopped nor untouched for lease_seconds is live:
+another run is not published over it.
+
+    queue_dir/
+        run.json
+        pending/000000-chr1-1-100.mpileup
+        claimed/
+        done/
+        failed/
+        tmp/
+        stop
+        cancel
+
+Clocks of the coordinator and the file server are compared for leases,
+so lease_seconds must exceed any skew between them.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from somaticsniper_tool import utils
+
+logger = logging.getLogger(__name__)
+
+DI = SimpleNamespace(open=open, os=os)
+
+RUN_FILE = "run.json"
+STOP_FILE = "stop"
+CANCEL_FILE = "cancel"
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+TMP = "tmp"
+STATES = (PENDING, CLAIMED, DONE, FAILED, TMP)
+
+LEASE_SECONDS = 120
+POLL_SECONDS = 1.0
+MAX_ATTEMPTS = 3
+
+# (mpileup, result, error) posted for a task
+TaskResult = Tuple[str, Optional[str], Optional[str]]
+
+
+def worker_name() -> str:
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue:
+    """Region tasks in queue_dir, shared by a coordinator and its workers.
+    Accepts:
+        queue_dir (str): Directory on storage shared by all hosts
+        lease_seconds (float): Seconds a claim may go untouched
+    """
+
+    def __init__(self, queue_dir: str, lease_seconds: float = LEASE_SECONDS, _di=DI):
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self._di = _di
+
+    def path(self, *parts: str) -> str:
+        return self._di.os.path.join(self.queue_dir, *parts)
+
+    def _write_json(self, path: str, data):
+        tmp = self.path(TMP, "{}.{}".format(uuid.uuid4().hex, os.path.basename(path)))
+        with self._di.open(tmp, 'w') as fh:
+            json.dump(data, fh)
+        self._di.os.replace(tmp, path)
+
+    def _read_json(self, path: str):
+        with self._di.open(path) as fh:
+            return json.load(fh)
+
+    def _read_text(self, name: str) -> Optional[str]:
+        try:
+            with self._di.open(self.path(name)) as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, path: str) -> bool:
+        try:
+            self._di.os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def list_tasks(self, state: str) -> List[str]:
+        """Get task names in a state, in submission order."""
+        try:
+            return sorted(self._di.os.listdir(self.path(state)))
+        except FileNotFoundError:
+            return []
+
+    # Coordinator
+
+    def live_run(self) -> Optional[str]:
+        """Get the id of the published run if it is live, else None.
+
+        A run is live until stopped, or until its coordinator, e.g. one that
+        died, leaves run.json untouched for lease_seconds.
+        """
+        try:
+            run_id = self._read_json(self.path(RUN_FILE))["run_id"]
+            touched = self._di.os.stat(self.path(RUN_FILE)).st_mtime
+        except (FileNotFoundError, ValueError):
+            return None
+        if self.stopped(run_id) or time.time() - touched >= self.lease_seconds:
+            return None
+        return run_id
+
+    def publish(self, run: dict, mpileups: List[str]) -> Dict[str, str]:
+        """Clear the queue and publish a run and its regions.
+        Accepts:
+            run (dict): JSON serializable run args, given a "run_id"
+            mpileups (List[str]): Region mpileups in claim order
+        Returns:
+            Dict[str, str]: Region mpileup of each task name
+        Raises:
+            ValueError: If another run of the queue is live, see live_run
+        """
+        live_run = self.live_run()
+        if live_run is not None:
+            raise ValueError(
+                "Run {} of {} is not over, wait for it or use another "
+                "--queue-dir".format(live_run, self.queue_dir)
+            )
+        for name in (STOP_FILE, CANCEL_FILE, RUN_FILE):
+            self._remove(self.path(name))
+        for state in STATES:
+            self._di.os.makedirs(self.path(state), exist_ok=True)
+            for name in self.list_tasks(state):
+                self._remove(self.path(state, name))
+        self._write_json(self.path(RUN_FILE), run)
+        tasks = {}
+        for i, mpileup in enumerate(mpileups):
+            task = "{:06d}-{}".format(i, os.path.basename(mpileup))
+            self._write_json(self.path(PENDING, task), {"mpileup": mpileup})
+            tasks[task] = mpileup
+        logger.info("Published %s regions to %s", len(tasks), self.queue_dir)
+        return tasks
+
+    def requeue_stale(self, attempts: Counter, max_attempts: int = MAX_ATTEMPTS):
+        """Move claims older than the lease back to pending, or fail them."""
+        now = time.time()
+        for task in self.list_tasks(CLAIMED):
+            claim = self.path(CLAIMED, task)
+            try:
+                if now - self._di.os.stat(claim).st_mtime < self.lease_seconds:
+                    continue
+                attempts[task] += 1
+                if attempts[task] < max_attempts:
+                    self._di.os.rename(claim, self.path(PENDING, task))
+                    logger.warning("Requeued %s, its worker stopped renewing it", task)
+                    continue
+                mpileup = self._read_json(claim)["mpileup"]
+            except FileNotFoundError:
+                # Posted meanwhile
+                continue
+            self._write_json(
+                self.path(FAILED, task),
+                {
+                    "mpileup": mpileup,
+                    "error": "Claimed {} times without a result".format(max_attempts),
+                },
+            )
+            self._remove(claim)
+
+    def results(
+        self,
+        tasks: Dict[str, str],
+        poll_seconds: float = POLL_SECONDS,
+        max_attempts: int = MAX_ATTEMPTS,
+    ) -> Iterator[TaskResult]:
+        """Wait for workers to post tasks, requeuing those of dead workers.
+        Accepts:
+            tasks (Dict[str, str]): Published tasks, see publish
+            poll_seconds (float): Seconds between checks for results
+            max_attempts (int): Claims of a task before it fails
+        Returns:
+            Iterator[TaskResult]: (mpileup, result, error) as tasks finish,
+                error None for done tasks
+        """
+        remaining = set(tasks)
+        attempts = Counter()
+        while remaining:
+            # List in the order tasks move, so none is missed in transit
+            seen = set(self.list_tasks(PENDING)) | set(self.list_tasks(CLAIMED))
+            for state in (DONE, FAILED):
+                for task in self.list_tasks(state):
+                    seen.add(task)
+                    if task not in remaining:
+                        continue
+                    remaining.discard(task)
+                    data = self._read_json(self.path(state, task))
+                    yield data["mpileup"], data.get("result"), data.get("error")
+            for task in sorted(remaining - seen):
+                remaining.discard(task)
+                yield tasks[task], None, "Removed from the queue as {}".format(task)
+            if remaining:
+                self.requeue_stale(attempts, max_attempts)
+                self.renew_run()
+                time.sleep(poll_seconds)
+
+    def renew_run(self):
+        """Keep the published run live, see live_run."""
+        try:
+            self._di.os.utime(self.path(RUN_FILE))
+        except FileNotFoundError:
+            pass
+
+    def cancel(self, run_id: str) -> int:
+        """Drop pending tasks and make workers kill running ones.
+        Returns:
+            int: Number of pending tasks dropped
+        """
+        dropped = sum(
+            self._remove(self.path(PENDING, task)) for task in self.list_tasks(PENDING)
+        )
+        self._write_json(self.path(CANCEL_FILE), run_id)
+        return dropped
+
+    def stop(self, run_id: str):
+        """Tell workers the run is over."""
+        self._write_json(self.path(STOP_FILE), run_id)
+
+    # Workers
+
+    def stopped(self, run_id: str) -> bool:
+        return self._read_text(STOP_FILE) == json.dumps(run_id)
+
+    def cancelled(self, run_id: str) -> bool:
+        return self._read_text(CANCEL_FILE) == json.dumps(run_id)
+
+    def wait_for_run(self, poll_seconds: float = POLL_SECONDS) -> dict:
+        """Wait for a run that is not over to be published, return its args."""
+        while True:
+            try:
+                run = self._read_json(self.path(RUN_FILE))
+            except (FileNotFoundError, ValueError):
+                run = None
+            if run is not None and not self.stopped(run["run_id"]):
+                return run
+            time.sleep(poll_seconds)
+
+    def claim(self) -> Optional[Tuple[str, str]]:
+        """Claim the first pending task.
+        Returns:
+            Tuple[str, str]: Task name and region mpileup, None if none pending
+        """
+        for task in self.list_tasks(PENDING):
+            claim = self.path(CLAIMED, task)
+            try:
+                self._di.os.rename(self.path(PENDING, task), claim)
+                # Start the lease now, rename keeps the publish time
+                self._di.os.utime(claim)
+                return task, self._read_json(claim)["mpileup"]
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+        return None
+
+    def renew(self, task: str):
+        try:
+            self._di.os.utime(self.path(CLAIMED, task))
+        except FileNotFoundError:
+            pass
+
+    def post(
+        self,
+        task: str,
+        mpileup: str,
+        result: Optional[str] = None,
+        error: Optional[str] = None,
+        worker: Optional[str] = None,
+    ):
+        """Post a claimed task's result, or error, and release the claim."""
+        state = DONE if error is None else FAILED
+        self._write_json(
+            self.path(state, task),
+            {"mpileup": mpileup, "result": result, "error": error, "worker": worker},
+        )
+        self._remove(self.path(CLAIMED, task))
+
+
+class QueueWorker:
+    """Run regions claimed from a WorkQueue on threads, until the run stops.
+    Accepts:
+        queue (WorkQueue): Queue of the run
+        run_id (str): Run to serve, see WorkQueue.wait_for_run
+        fn (Callable): Per-region workflow, called with the region mpileup
+        threads (int): Regions run at once
+        poll_seconds (float): Seconds between checks for tasks and stop
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        run_id: str,
+        fn: Callable[[str], str],
+        threads: int = 1,
+        poll_seconds: float = POLL_SECONDS,
+        name: Optional[str] = None,
+        _utils=utils,
+    ):
+        self.queue = queue
+        self.run_id = run_id
+        self.fn = fn
+        self.threads = threads
+        self.poll_seconds = poll_seconds
+        self.name = name or worker_name()
+        self._utils = _utils
+        self._lock = threading.Lock()
+        self._claims = set()
+        self._done = threading.Event()
+        self.regions = 0
+
+    def _run_tasks(self):
+        while not self._done.is_set():
+            claimed = self.queue.claim()
+            if claimed is None:
+                self._done.wait(self.poll_seconds)
+                continue
+            task, mpileup = claimed
+            with self._lock:
+                self._claims.add(task)
+            try:
+                with self._utils.CHILDREN.group(mpileup):
+                    result = self.fn(mpileup)
+                self.queue.post(task, mpileup, result=result, worker=self.name)
+                logger.info("Posted %s for %s", result, mpileup)
+            except Exception as e:
+                logger.exception(e)
+                self.queue.post(task, mpileup, error=str(e), worker=self.name)
+            with self._lock:
+                self._claims.discard(task)
+                self.regions += 1
+
+    def serve(self) -> int:
+        """Run regions until the coordinator stops the run.
+        Returns:
+            int: Number of regions run
+        """
+        logger.info("Worker %s serving %s", self.name, self.queue.queue_dir)
+        workers = [
+            threading.Thread(target=self._run_tasks, daemon=True)
+            for _ in range(self.threads)
+        ]
+        for thread in workers:
+            thread.start()
+        renew_seconds = min(self.poll_seconds, self.queue.lease_seconds / 4)
+        cancelled = False
+        try:
+            while any(thread.is_alive() for thread in workers):
+                if self.queue.stopped(self.run_id):
+                    self._done.set()
+                if not cancelled and self.queue.cancelled(self.run_id):
+                    cancelled = True
+                    logger.warning("Run cancelled, killing running commands")
+                    self._utils.CHILDREN.kill()
+                with self._lock:
+                    claims = list(self._claims)
+                for task in claims:
+                    self.queue.renew(task)
+                time.sleep(renew_seconds)
+        finally:
+            self._done.set()
+            for thread in workers:
+                thread.join()
+            self._utils.CHILDREN.reset()
+        return self.regions
+
+
+# __END__
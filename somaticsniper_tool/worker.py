@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Worker of a --queue-dir run, see work_queue.
+
+    somaticsniper_tool worker --queue-dir /shared/queue --thread-count 8
+
+Waits for a coordinator to publish a run to the queue, then runs its
+regions with multithread_somaticsniper until the coordinator stops the run.
+Relative paths of the run are resolved against the run's working directory,
+where region outputs are written, without changing the worker's own. Start
+any number of workers, on any hosts that share the queue directory, the
+working directory and the inputs at the same paths.
+"""
+
+import argparse
+import functools
+import logging
+import os
+import sys
+from collections import namedtuple
+from typing import List, Optional
+
+from somaticsniper_tool import metrics
+from somaticsniper_tool.multi_somaticsniper import (
+    configure_somaticsniper,
+    multithread_somaticsniper,
+    perl_workers,
+    region_kwargs,
+    setup_logger,
+)
+from somaticsniper_tool.work_queue import (
+    POLL_SECONDS,
+    QueueWorker,
+    WorkQueue,
+    worker_name,
+)
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = "metrics"
+
+# Run args holding paths, relative to the run's work_dir
+PATH_ARGS = (
+    "reference_path",
+    "normal_bam",
+    "tumor_bam",
+    "snpfilter",
+    "highconfidence",
+    "cache_dir",
+)
+# Run args holding commands, looked up on PATH unless given as paths
+COMMAND_ARGS = ("samtools", "somaticsniper_bin")
+
+
+def setup_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="somaticsniper_tool worker")
+    parser.add_argument(
+        "--queue-dir", required=True, help="Work queue directory of the run."
+    )
+    parser.add_argument(
+        "--thread-count",
+        type=int,
+        default=None,
+        help="Regions run at once. Defaults to the run's --thread-count.",
+    )
+    parser.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=POLL_SECONDS,
+        help="Seconds between checks for a run, regions and the run's end.",
+    )
+    return parser
+
+
+def resolve_paths(run_args, _os=os):
+    """Get run_args with relative paths resolved against run_args.work_dir."""
+    paths = {}
+    for name in PATH_ARGS + COMMAND_ARGS:
+        value = getattr(run_args, name)
+        if value and (name in PATH_ARGS or _os.sep in value):
+            paths[name] = _os.path.join(run_args.work_dir, value)
+    return run_args._replace(**paths)
+
+
+def run_region(mpileup: str, work_dir: str, **kwargs) -> str:
+    """Run a queued region, its mpileup and outputs in the run's work_dir.
+    Accepts:
+        mpileup (str): Path to mpileup file, relative to work_dir
+        work_dir (str): Working directory of the run
+        kwargs (dict): See multithread_somaticsniper
+    Returns:
+        annotated_vcf_file (str): Path to annotated vcf, in work_dir
+    """
+    return multithread_somaticsniper(
+        os.path.join(work_dir, mpileup), output_dir=work_dir, **kwargs
+    )
+
+
+def run_worker(args, _queue=WorkQueue, _worker=QueueWorker, _os=os) -> int:
+    """Serve one run of args.queue_dir.
+    Returns:
+        int: Number of regions run
+    """
+    # Paths relative to where the worker started, not the run's work_dir
+    queue = _queue(_os.path.abspath(args.queue_dir))
+    run = queue.wait_for_run(args.poll_seconds)
+    queue.lease_seconds = run["queue_lease_seconds"]
+    run_args = resolve_paths(namedtuple("RunArgs", list(run))(**run), _os=_os)
+    metrics_json = None
+    if run_args.metrics_json:
+        _os.makedirs(queue.path(METRICS_DIR), exist_ok=True)
+        metrics_json = queue.path(METRICS_DIR, "{}.json".format(worker_name()))
+    configure_somaticsniper(run_args)
+    metrics.METRICS.reset()
+    try:
+        with perl_workers(run_args):
+            worker = _worker(
+                queue,
+                run_args.run_id,
+                functools.partial(
+                    run_region, work_dir=run_args.work_dir, **region_kwargs(run_args)
+                ),
+                threads=args.thread_count or run_args.thread_count,
+                poll_seconds=args.poll_seconds,
+            )
+            regions = worker.serve()
+    finally:
+        if metrics_json:
+            metrics.METRICS.write(metrics_json)
+    logger.info("Ran %s regions", regions)
+    return regions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    setup_logger()
+    args = setup_parser().parse_args(argv)
+    try:
+        run_worker(args)
+    except Exception as e:
+        logger.exception(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# __END__
@@ -0,0 +1,18 @@
+#!/bin/sh
+# Regenerate the perl script fixtures of this directory from region.vcf and
+# region.indel.pileup with the somatic-sniper scripts, which the Dockerfile
+# installs in /scripts:
+#
+#   docker run --rm -v "$PWD/tests/data/region:/data" --entrypoint sh \
+#       quay.io/ncigdc/somaticsniper-tool:latest /data/regenerate.sh
+#
+# Set SCRIPTS to use scripts installed elsewhere.
+set -eu
+
+SCRIPTS=${SCRIPTS:-/scripts}
+cd "$(dirname "$0")"
+
+# Writes region.vcf.SNPfilter
+perl "$SCRIPTS/snpfilter.pl" --snp-file region.vcf --indel-file region.indel.pileup
+# Writes region.vcf.SNPfilter.hc
+perl "$SCRIPTS/highconfidence.pl" --snp-file region.vcf.SNPfilter
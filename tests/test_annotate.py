@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import csv
+import os
+import tempfile
 import unittest
 from types import SimpleNamespace
 from unittest import mock
@@ -37,8 +39,96 @@ class Test_Annotate(ThisTestCase):
         with self.CLASS_OBJ(outfile, _di=self.mocks):
             pass
 
-        self.mocks.open.assert_called_once_with(outfile, 'w')
+        self.mocks.open.assert_called_once_with(
+            outfile, 'wb', buffering=MOD.BATCH_BYTES
+        )
         self.mocks.open.return_value.close.assert_called_once_with()
 
 
+class Test_load_variant_keys(ThisTestCase):
+    def test_keys_are_chrom_pos_ref_alt(self):
+        self.mocks.open = mock.mock_open(
+            read_data=b"#CHROM\nchr1\t100\t.\tA\tG\t.\tPASS\t.\tGT\t0/0\t0/1\n"
+        )
+        found = MOD.load_variant_keys("in.vcf", _di=self.mocks)
+        self.assertEqual(found, {(b"chr1", b"100", b"A", b"G")})
+
+    def test_blank_and_short_lines_skipped(self):
+        self.mocks.open = mock.mock_open(
+            read_data=b"#CHROM\n\nchr1\t100\t.\tA\tG\nchr1\t200\t.\tC\n"
+            b"\n#trailing\tcomment\t.\tA\tG\nchr2\t5\t.\tT\tC\t.\n\n"
+        )
+        found = MOD.load_variant_keys("in.vcf", _di=self.mocks)
+        self.assertEqual(
+            found, {(b"chr1", b"100", b"A", b"G"), (b"chr2", b"5", b"T", b"C")}
+        )
+
+    def test_variant_key_of_short_line_raises(self):
+        for line in (b"\n", b"chr1\t100\t.\tA\n"):
+            with self.subTest(line=line):
+                with self.assertRaises(ValueError):
+                    MOD.variant_key(line)
+
+
+class Test_Annotate_annotate(ThisTestCase):
+    HEADER = (
+        "##fileformat=VCFv4.1\n"
+        "##reference=file:///ref.fa\n"
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR\n"
+    )
+    RECORDS = [
+        "chr1\t100\t.\tA\tG\t.\t.\t.\tGT\t0/0\t0/1\n",
+        "chr1\t200\t.\tC\tT\t.\t.\t.\tGT\t0/0\t0/1\n",
+        "chr2\t100\t.\tA\tG\t.\t.\t.\tGT\t0/0\t0/1\n",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.raw_vcf = os.path.join(self.tmpdir.name, "raw.vcf")
+        self.hc_file = os.path.join(self.tmpdir.name, "raw.vcf.SNPfilter.hc")
+        self.out_file = os.path.join(self.tmpdir.name, "out.vcf")
+        with open(self.raw_vcf, 'w') as fh:
+            fh.write(self.HEADER + "".join(self.RECORDS))
+        with open(self.hc_file, 'w') as fh:
+            fh.write(self.HEADER + self.RECORDS[1])
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def _annotate(self, **kwargs):
+        with MOD.Annotate(self.out_file, **kwargs) as annotate:
+            annotate(self.raw_vcf, self.hc_file)
+        with open(self.out_file) as fh:
+            return fh.read().splitlines()
+
+    def test_filter_headers_added_after_reference(self):
+        found = self._annotate()
+        self.assertEqual(found[1], "##reference=file:///ref.fa")
+        self.assertEqual(
+            found[2:5],
+            [MOD.Filter.PASS.value, MOD.Filter.REJECT.value, MOD.Filter.LOH.value],
+        )
+
+    def test_records_labelled_by_high_confidence_membership(self):
+        found = [line.split("\t")[6] for line in self._annotate()[6:]]
+        self.assertEqual(found, ["REJECT", "LOH", "REJECT"])
+
+    def test_output_independent_of_buffer_size(self):
+        expected = self._annotate()
+        for buffer_size in (2, 16):
+            with self.subTest(buffer_size=buffer_size):
+                self.assertEqual(self._annotate(buffer_size=buffer_size), expected)
+
+    def test_records_otherwise_unchanged(self):
+        found = self._annotate()[6:]
+        for raw, out in zip(self.RECORDS, found):
+            with self.subTest(raw=raw):
+                raw_entries = raw.rstrip("\n").split("\t")
+                out_entries = out.split("\t")
+                del raw_entries[6], out_entries[6]
+                self.assertEqual(raw_entries, out_entries)
+
+
 # __END__
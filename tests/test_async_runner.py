@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+
+from somaticsniper_tool import async_runner as MOD
+from somaticsniper_tool import metrics, utils
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.runner = MOD.AsyncRunner(MOD.parse_stage_limits(None, 2))
+
+    def _run(self, *args, **kwargs):
+        return asyncio.run(self.runner.run(*args, **kwargs))
+
+
+class Test_parse_stage_limits(ThisTestCase):
+    def test_defaults_and_overrides(self):
+        found = MOD.parse_stage_limits(
+            ["snpfilter=32"],
+            4,
+            memory_mb=["somaticsniper=2048"],
+            io_tokens=["samtools_view=3"],
+        )
+        self.assertEqual(found["snpfilter"], MOD.StageLimits(32, 0, 0))
+        self.assertEqual(found["somaticsniper"], MOD.StageLimits(4, 2048, 1))
+        self.assertEqual(found["samtools_view"], MOD.StageLimits(4, 0, 3))
+        self.assertEqual(set(found), set(MOD.STAGES))
+
+    def test_invalid_raises(self):
+        for value in ("unknown=1", "snpfilter", "snpfilter=0", "snpfilter=x"):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    MOD.parse_stage_limits([value], 4)
+
+    def test_zero_memory_and_io_allowed(self):
+        found = MOD.parse_stage_limits(None, 1, io_tokens=["samtools_view=0"])
+        self.assertEqual(found["samtools_view"].io_tokens, 0)
+
+
+class TestAsyncRunner(ThisTestCase):
+    def test_output_decoded_like_run_subprocess_command(self):
+        found = self._run(
+            "sh -c 'echo out; echo err >&2'",
+            10,
+            stage="snpfilter",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self.assertEqual(found, MOD.PopenReturn(stdout="out\n", stderr="err\n"))
+
+    def test_stream_output_keeps_bounded_tails(self):
+        found = self._run(
+            "sh -c 'seq 1 1000; echo err >&2'",
+            10,
+            stage="snpfilter",
+            stream_output=True,
+        )
+        self.assertEqual(
+            found.stdout.splitlines(), [str(i) for i in range(801, 1001)]
+        )
+        self.assertEqual(found.stderr, "err\n")
+
+    def test_stream_output_nonzero_exit_raises_with_stderr_tail(self):
+        with self.assertRaisesRegex(ValueError, "bad"):
+            self._run(
+                "sh -c 'echo bad >&2; exit 3'",
+                10,
+                stage="snpfilter",
+                stream_output=True,
+            )
+
+    def test_stream_output_timeout_raises(self):
+        with self.assertRaises(ValueError):
+            self._run("sleep 10", 0.2, stage="snpfilter", stream_output=True)
+
+    def test_uncaptured_output_is_none(self):
+        found = self._run("true", 10, stage="snpfilter")
+        self.assertEqual(found, MOD.PopenReturn(stdout=None, stderr=None))
+
+    def test_nonzero_exit_raises_with_stderr(self):
+        with self.assertRaisesRegex(ValueError, "bad"):
+            self._run(
+                "sh -c 'echo bad >&2; exit 3'",
+                10,
+                stage="snpfilter",
+                stderr=asyncio.subprocess.PIPE,
+            )
+
+    def test_timeout_kills_and_raises(self):
+        start = time.monotonic()
+        with self.assertRaises(ValueError):
+            self._run(
+                "sleep 10", 0.2, stage="snpfilter", stderr=asyncio.subprocess.PIPE
+            )
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_stage_limit_caps_concurrent_processes(self):
+        runner = MOD.AsyncRunner(
+            {"snpfilter": MOD.StageLimits(1), "somaticsniper": MOD.StageLimits(2)}
+        )
+
+        async def timed(stage):
+            await runner.run("sleep 0.2", 10, stage=stage)
+            return time.monotonic()
+
+        async def main():
+            start = time.monotonic()
+            ends = await asyncio.gather(
+                *(timed(stage) for stage in ("snpfilter", "snpfilter", "somaticsniper"))
+            )
+            return [end - start for end in ends]
+
+        snpfilter_1, snpfilter_2, somaticsniper = asyncio.run(main())
+        # Second snpfilter waits for the first; somaticsniper runs alongside
+        self.assertGreaterEqual(max(snpfilter_1, snpfilter_2), 0.4)
+        self.assertLess(somaticsniper, 0.4)
+
+    def test_in_process_stage_runs_in_task_child_group(self):
+        children = utils.ChildProcesses()
+
+        def group():
+            return children._group.get()
+
+        async def main():
+            with children.group("chr1-1-10.mpileup"):
+                return await self.runner.run_in_executor("snpfilter", group)
+
+        self.assertEqual(asyncio.run(main()), "chr1-1-10.mpileup")
+
+    def test_child_usage_added_to_stage(self):
+        run_metrics = metrics.RunMetrics()
+        runner = MOD.AsyncRunner(MOD.parse_stage_limits(None, 1), _metrics=run_metrics)
+
+        async def main():
+            with run_metrics.stage("chr1-1-10", "snpfilter"):
+                await runner.run(
+                    "sh -c 'i=0; while [ $i -lt 100000 ]; do i=$((i+1)); done'",
+                    30,
+                    stage="snpfilter",
+                )
+
+        asyncio.run(main())
+        (record,) = run_metrics.records
+        self.assertGreater(
+            record["child_user_seconds"] + record["child_system_seconds"], 0
+        )
+
+
+class TestChildUsage(ThisTestCase):
+    def usage(self, seconds, maxrss):
+        return SimpleNamespace(
+            ru_utime=seconds,
+            ru_stime=seconds / 2,
+            ru_maxrss=maxrss,
+            ru_inblock=int(seconds * 8),
+            ru_oublock=int(seconds * 4),
+        )
+
+    def test_claims_usage_since_previous_claim(self):
+        usages = [self.usage(1, 100), self.usage(3, 500), self.usage(4, 500)]
+        child_usage = MOD.ChildUsage(_getrusage=lambda who: usages.pop(0))
+
+        first, second = child_usage.claim(), child_usage.claim()
+
+        self.assertEqual(
+            (first.ru_utime, first.ru_stime, first.ru_inblock, first.ru_oublock),
+            (2, 1, 16, 8),
+        )
+        self.assertEqual(first.ru_maxrss, 500)
+        self.assertEqual((second.ru_utime, second.ru_maxrss), (1, 0))
+
+
+class TestResourceBudgets(ThisTestCase):
+    def _overlap(self, runner, stages):
+        async def main():
+            await asyncio.gather(
+                *(runner.run("sleep 0.2", 10, stage=stage) for stage in stages)
+            )
+
+        start = time.monotonic()
+        asyncio.run(main())
+        # Two 0.2s runs one after another take at least 0.4s
+        return time.monotonic() - start < 0.35
+
+    def test_memory_budget_serializes_stages(self):
+        limits = {
+            "somaticsniper": MOD.StageLimits(2, memory_mb=600),
+            "snpfilter": MOD.StageLimits(2, memory_mb=600),
+        }
+        unlimited = MOD.AsyncRunner(limits)
+        self.assertTrue(self._overlap(unlimited, ("somaticsniper", "snpfilter")))
+        budget = MOD.AsyncRunner(limits, memory_mb=1000)
+        self.assertFalse(self._overlap(budget, ("somaticsniper", "snpfilter")))
+
+    def test_io_tokens_shared_across_stages(self):
+        limits = {
+            "samtools_view": MOD.StageLimits(2, io_tokens=2),
+            "somaticsniper": MOD.StageLimits(2, io_tokens=1),
+        }
+        runner = MOD.AsyncRunner(limits, io_tokens=2)
+        self.assertFalse(self._overlap(runner, ("samtools_view", "somaticsniper")))
+
+    def test_demand_over_budget_raises(self):
+        with self.assertRaises(ValueError):
+            MOD.AsyncRunner(
+                {"somaticsniper": MOD.StageLimits(1, memory_mb=2048)}, memory_mb=1024
+            )
+
+
+# __END__
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import unittest
+
+from somaticsniper_tool import batch as MOD
+from somaticsniper_tool.metrics import RunMetrics
+
+HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\n"
+
+
+def annotate_region(mpileup, output_dir=None, **kwargs):
+    """Stand-in workflow, writing one record at the region's start."""
+    if "bad" in mpileup:
+        raise ValueError(mpileup)
+    name = os.path.basename(mpileup)[: -len(".mpileup")]
+    chrom, start, _ = name.split("-")
+    output = os.path.join(output_dir, name + ".annotated.vcf")
+    with open(output, 'w') as fh:
+        fh.write(HEADER)
+        fh.write("{}\t{}\t.\tA\tT\n".format(chrom, start))
+    return output
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.reference = os.path.join(self.tmpdir.name, "ref.fa")
+        with open(self.reference + ".fai", 'w') as fh:
+            fh.write("chr1\t1000\t6\t60\t61\nchr2\t1000\t1024\t60\t61\n")
+        self.manifest = os.path.join(self.tmpdir.name, "pairs.tsv")
+        self.metrics = RunMetrics()
+
+    def mpileups(self, *names):
+        paths = [os.path.join(self.tmpdir.name, name) for name in names]
+        for path in paths:
+            open(path, 'w').close()
+        return paths
+
+    def write_manifest(self, text):
+        with open(self.manifest, 'w') as fh:
+            fh.write(text)
+
+    def process_argv(self, *extra):
+        return MOD.process_argv(
+            [
+                "--thread-count=2",
+                "--reference-path={}".format(self.reference),
+                "--manifest={}".format(self.manifest),
+                "--output-dir={}".format(self.tmpdir.name),
+            ]
+            + list(extra)
+        )
+
+
+class Test_load_pairs(ThisTestCase):
+    def test_tsv_pairs_loaded_in_order(self):
+        self.write_manifest(
+            "# name\ttumor\tnormal\tmpileups\n"
+            "p2\tt2.bam\tn2.bam\tchr1-1-9.mpileup,chr2-1-9.mpileup\n"
+            "\n"
+            "p1\tt1.bam\tn1.bam\tchr1-1-9.mpileup\n"
+        )
+
+        found = MOD.load_pairs(self.manifest)
+
+        self.assertEqual(
+            found,
+            [
+                MOD.Pair(
+                    "p2", "t2.bam", "n2.bam", ["chr1-1-9.mpileup", "chr2-1-9.mpileup"]
+                ),
+                MOD.Pair("p1", "t1.bam", "n1.bam", ["chr1-1-9.mpileup"]),
+            ],
+        )
+
+    def test_json_pairs_loaded(self):
+        path = os.path.join(self.tmpdir.name, "pairs.json")
+        pair = {
+            "name": "p1",
+            "tumor_bam": "t1.bam",
+            "normal_bam": "n1.bam",
+            "mpileups": ["chr1-1-9.mpileup"],
+        }
+        with open(path, 'w') as fh:
+            json.dump([pair], fh)
+
+        self.assertEqual(MOD.load_pairs(path), [MOD.Pair(**pair)])
+
+    def test_invalid_manifests_raise(self):
+        cases = {
+            "fields": "p1\tt1.bam\tn1.bam\n",
+            "name": "../p1\tt1.bam\tn1.bam\tchr1-1-9.mpileup\n",
+            "mpileups": "p1\tt1.bam\tn1.bam\t\n",
+            "repeated": "p1\tt.bam\tn.bam\tchr1-1-9.mpileup\n" * 2,
+        }
+        for case, text in cases.items():
+            with self.subTest(case=case):
+                self.write_manifest(text)
+                with self.assertRaises(ValueError):
+                    MOD.load_pairs(self.manifest)
+
+
+class Test_run_batch(ThisTestCase):
+    def test_pairs_merged_in_own_directories(self):
+        pairs = [
+            MOD.Pair(
+                "p1",
+                "t1.bam",
+                "n1.bam",
+                self.mpileups("chr2-5-9.mpileup", "chr1-3-4.mpileup"),
+            ),
+            MOD.Pair("p2", "t2.bam", "n2.bam", self.mpileups("chr1-7-9.mpileup")),
+        ]
+
+        runs = MOD.run_batch(
+            self.process_argv(), pairs, fn=annotate_region, _metrics=self.metrics
+        )
+
+        self.assertEqual([r.exceptions for r in runs], [[], []])
+        with open(os.path.join(self.tmpdir.name, "p1", MOD.MERGED_OUTPUT)) as fh:
+            self.assertEqual(
+                fh.read(), HEADER + "chr1\t3\t.\tA\tT\nchr2\t5\t.\tA\tT\n"
+            )
+        with open(runs[1].merged_output) as fh:
+            self.assertEqual(fh.read(), HEADER + "chr1\t7\t.\tA\tT\n")
+        summary = self.metrics.summaries["batch"]
+        self.assertEqual(summary["pairs"], 2)
+        self.assertEqual(summary["pairs_failed"], 0)
+        self.assertEqual(summary["per_pair"]["p1"]["regions"], 2)
+        self.assertEqual(
+            summary["per_pair"]["p2"]["merged_output"], runs[1].merged_output
+        )
+
+    def test_failed_pair_not_merged_others_are(self):
+        bad, good = self.mpileups("bad.mpileup", "chr1-1-2.mpileup")
+        pairs = [
+            MOD.Pair("p1", "t1.bam", "n1.bam", [good, bad]),
+            MOD.Pair("p2", "t2.bam", "n2.bam", self.mpileups("chr1-7-9.mpileup")),
+        ]
+
+        with self.assertLogs(MOD.logger, "ERROR"):
+            runs = MOD.run_batch(
+                self.process_argv(), pairs, fn=annotate_region, _metrics=self.metrics
+            )
+
+        self.assertEqual([str(e) for e in runs[0].exceptions], [bad])
+        self.assertFalse(os.path.exists(runs[0].merged_output))
+        self.assertTrue(os.path.exists(runs[1].merged_output))
+        summary = self.metrics.summaries["batch"]
+        self.assertEqual(summary["pairs_failed"], 1)
+        self.assertEqual(summary["per_pair"]["p1"]["failed_regions"], 1)
+
+    def test_resumed_pair_reuses_completed_regions(self):
+        mpileups = self.mpileups("chr1-1-2.mpileup")
+        pairs = [MOD.Pair("p1", "t1.bam", "n1.bam", mpileups)]
+        run_args = self.process_argv("--resume")
+        MOD.run_batch(run_args, pairs, fn=annotate_region, _metrics=self.metrics)
+        calls = []
+
+        def fn(mpileup, **kwargs):
+            calls.append(mpileup)
+            return annotate_region(mpileup, **kwargs)
+
+        (pair_run,) = MOD.run_batch(run_args, pairs, fn=fn, _metrics=self.metrics)
+
+        self.assertEqual(calls, [])
+        self.assertTrue(pair_run.merged)
+
+
+class Test_process_argv(ThisTestCase):
+    def test_bams_come_from_manifest(self):
+        found = self.process_argv()
+
+        self.assertEqual(found.manifest, self.manifest)
+        self.assertIsNone(found.tumor_bam)
+
+    def test_single_pair_options_rejected(self):
+        for extra in (
+            ("--tumor-bam", "t.bam"),
+            ("--mpileup", "chr1-1-2.mpileup"),
+            ("--executor", "async"),
+            ("--queue-dir", "queue"),
+        ):
+            with self.subTest(extra=extra), self.assertRaises(SystemExit):
+                self.process_argv(*extra)
+
+
+# __END__
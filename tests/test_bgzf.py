@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import gzip
+import io
+import os
+import tempfile
+import unittest
+
+from somaticsniper_tool import bgzf as MOD
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+
+class Test_compress_block(ThisTestCase):
+    def test_empty_block_is_eof_marker(self):
+        self.assertEqual(MOD.compress_block(b""), MOD.EOF_BLOCK)
+
+    def test_read_block_roundtrip(self):
+        data = b"chr1\t100\t.\tA\tG\n" * 10
+        block = MOD.compress_block(data)
+        self.assertEqual(gzip.decompress(block), data)
+        self.assertEqual(MOD.read_block(io.BytesIO(block)), (block, data))
+
+    def test_corrupt_block_raises(self):
+        block = bytearray(MOD.compress_block(b"chr1\t100\n"))
+        block[-8] ^= 0xFF
+        with self.assertRaises(ValueError):
+            MOD.read_block(io.BytesIO(bytes(block)))
+
+    def test_truncated_block_raises(self):
+        block = MOD.compress_block(b"chr1\t100\n")
+        with self.assertRaises(ValueError):
+            MOD.read_block(io.BytesIO(block[:-1]))
+
+
+class TestBgzfReader(ThisTestCase):
+    def test_reads_span_blocks(self):
+        data = os.urandom(3 * MOD.MAX_BLOCK_DATA + 5)
+        out_fh = io.BytesIO()
+        with MOD.BgzfWriter(out_fh) as writer:
+            writer.write(data)
+        reader = MOD.BgzfReader(io.BytesIO(out_fh.getvalue()))
+        found = [reader.read(4), reader.read(MOD.MAX_BLOCK_DATA + 1), reader.read()]
+        self.assertEqual(b"".join(found), data)
+        self.assertEqual(
+            [len(chunk) for chunk in found[:2]], [4, MOD.MAX_BLOCK_DATA + 1]
+        )
+        self.assertEqual(reader.read(1), b"")
+
+
+class TestBgzfWriter(ThisTestCase):
+    def test_blocks_end_at_line_breaks(self):
+        lines = [b"chr1\t%05d\t.\tA\tG\n" % i for i in range(20000)]
+        out_fh = io.BytesIO()
+        with MOD.BgzfWriter(out_fh) as writer:
+            offsets = []
+            for line in lines:
+                offsets.append(writer.tell())
+                writer.write(line)
+        data = out_fh.getvalue()
+        self.assertEqual(gzip.decompress(data), b"".join(lines))
+        blocks = list(MOD.read_blocks(io.BytesIO(data)))
+        self.assertGreater(len(blocks), 2)
+        self.assertEqual(blocks[-1], (MOD.EOF_BLOCK, b""))
+        for _, block_data in blocks[:-1]:
+            self.assertLessEqual(len(block_data), MOD.MAX_BLOCK_DATA)
+            self.assertTrue(block_data.endswith(b"\n"))
+
+        # Virtual offsets address the start of each line, possibly as the end
+        # of the block before it
+        data_starts = {}
+        offset = data_start = 0
+        for block, block_data in blocks:
+            data_starts[offset] = data_start
+            offset += len(block)
+            data_start += len(block_data)
+        found = [data_starts[v >> 16] + (v & 0xFFFF) for v in offsets]
+        expected = [len(line) * i for i, line in enumerate(lines)]
+        self.assertEqual(found, expected)
+
+
+class Test_compress_vcf(ThisTestCase):
+    def test_header_in_blocks_of_its_own(self):
+        header = b"##fileformat=VCFv4.1\n#CHROM\tPOS\n"
+        records = b"chr1\t100\t.\tA\tG\n" * 3
+        with open(self.path("in.vcf"), 'wb') as fh:
+            fh.write(header + records)
+        found = MOD.compress_vcf(
+            self.path("in.vcf"), self.path("out.vcf.gz"), chunk_size=7
+        )
+        self.assertEqual(found, self.path("out.vcf.gz"))
+        with open(found, 'rb') as fh:
+            data = [data for _, data in MOD.read_blocks(fh)]
+        self.assertEqual(data, [header, records, b""])
+
+    def test_header_only(self):
+        header = b"##fileformat=VCFv4.1\n#CHROM\tPOS\n"
+        with open(self.path("in.vcf"), 'wb') as fh:
+            fh.write(header)
+        found = MOD.compress_vcf(self.path("in.vcf"), self.path("out.vcf.gz"))
+        with open(found, 'rb') as fh:
+            data = [data for _, data in MOD.read_blocks(fh)]
+        self.assertEqual(data, [header, b""])
+
+
+# __END__
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from somaticsniper_tool import bgzf
+from somaticsniper_tool import bgzf_merge as MOD
+from somaticsniper_tool.tabix import PSEUDO_BIN
+from tests.test_tabix import parse_index
+
+
+class ThisTestCase(unittest.TestCase):
+    HEADER = b"##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\n"
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output = self.path("merged.vcf.gz")
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def _records(self, chrom, positions):
+        return [b"%s\t%d\t.\tAC\tA\n" % (chrom, p) for p in positions]
+
+    def _vcf_gz(self, name, records):
+        path = self.path(name)
+        with open(path, 'wb') as fh:
+            fh.write(self.HEADER)
+            fh.writelines(records)
+        return bgzf.compress_vcf(path, path + ".gz")
+
+    def _blocks(self, path):
+        with open(path, 'rb') as fh:
+            return list(bgzf.read_blocks(fh))
+
+    def assertIndexed(self, records):
+        """Check the index's chunks address exactly each contig's records."""
+        data = {}
+        next_block = {}
+        offset = 0
+        for block, data[offset] in self._blocks(self.output):
+            next_block[offset] = offset + len(block)
+            offset += len(block)
+        with open(self.output + ".tbi", 'rb') as fh:
+            contigs = parse_index(gzip.decompress(fh.read()))["contigs"]
+        for chrom, (bins, _) in contigs.items():
+            found = []
+            for bin_id, chunks in bins.items():
+                if bin_id == PSEUDO_BIN:
+                    continue
+                for start, stop in chunks:
+                    block, within = start >> 16, start & 0xFFFF
+                    while bgzf.virtual_offset(block, within) < stop:
+                        end = data[block].index(b"\n", within) + 1
+                        found.append(data[block][within:end])
+                        within = end
+                        if within == len(data[block]):
+                            block, within = next_block[block], 0
+            expected = [r for r in records if r.startswith(chrom + b"\t")]
+            self.assertEqual(sorted(found), sorted(expected))
+            self.assertEqual(bins[PSEUDO_BIN][1], (len(expected), 0))
+
+
+class TestBgzfMerge(ThisTestCase):
+    def test_blocks_copied_without_recompressing(self):
+        first = self._records(b"chr1", [100, 200])
+        second = self._records(b"chr1", [300]) + self._records(b"chr2", [5])
+        vcfs = [self._vcf_gz("a.vcf", first), self._vcf_gz("b.vcf", second)]
+        with MOD.BgzfMerge(self.output) as merger:
+            merger.append(vcfs[0], True)
+            merger.append(vcfs[1], False)
+
+        with open(self.output, 'rb') as fh:
+            self.assertEqual(
+                gzip.decompress(fh.read()), self.HEADER + b"".join(first + second)
+            )
+        blocks = [block for block, _ in self._blocks(self.output)]
+        expected = [block for block, _ in self._blocks(vcfs[0])][:-1]
+        expected += [block for block, _ in self._blocks(vcfs[1])][1:]
+        self.assertEqual(blocks, expected)
+        self.assertIndexed(first + second)
+
+    def test_sub_regions_clipped_to_bounds(self):
+        first = self._records(b"chr1", range(100, 300, 10))
+        second = self._records(b"chr1", range(250, 400, 10))
+        with mock.patch.object(bgzf, "MAX_BLOCK_DATA", 64):
+            vcfs = [self._vcf_gz("a.vcf", first), self._vcf_gz("b.vcf", second)]
+        with MOD.BgzfMerge(self.output) as merger:
+            merger.append(vcfs[0], True, (-float("inf"), 259))
+            merger.append(vcfs[1], False, (260, float("inf")))
+
+        expected = self._records(b"chr1", range(100, 400, 10))
+        with open(self.output, 'rb') as fh:
+            found = gzip.decompress(fh.read())
+        self.assertEqual(found, self.HEADER + b"".join(expected))
+        self.assertIndexed(expected)
+
+    def test_header_sharing_a_block_with_records_split(self):
+        records = self._records(b"chr1", [100, 200])
+        with open(self.path("a.vcf.gz"), 'wb') as fh:
+            fh.write(bgzf.compress_block(self.HEADER + b"".join(records)))
+            fh.write(bgzf.EOF_BLOCK)
+        with MOD.BgzfMerge(self.output) as merger:
+            merger.append(self.path("a.vcf.gz"), True)
+        data = [data for _, data in self._blocks(self.output)]
+        self.assertEqual(data, [self.HEADER, b"".join(records), b""])
+        self.assertIndexed(records)
+
+    def test_record_split_across_blocks_raises(self):
+        with open(self.path("a.vcf.gz"), 'wb') as fh:
+            fh.write(bgzf.compress_block(b"chr1\t100\t.\tA"))
+            fh.write(bgzf.compress_block(b"\tG\n"))
+        with self.assertRaises(ValueError), MOD.BgzfMerge(self.output) as merger:
+            merger.append(self.path("a.vcf.gz"), True)
+        self.assertFalse(os.path.exists(self.output + ".tbi"))
+
+
+class TestIncrementalBgzfMerge(ThisTestCase):
+    def test_out_of_order_regions_merged_in_order(self):
+        order = ["chr1-1-10.mpileup", "chr1-11-20.mpileup", "chr2-1-10.mpileup"]
+        records = {
+            "chr1-1-10.mpileup": self._records(b"chr1", [1, 5, 12]),
+            "chr1-11-20.mpileup": self._records(b"chr1", [9, 15]),
+            "chr2-1-10.mpileup": self._records(b"chr2", [3]),
+        }
+        bounds = {"chr1-1-10.mpileup": (1, 10), "chr1-11-20.mpileup": (11, 20)}
+        with MOD.BgzfMerge(self.output) as out_fh, MOD.IncrementalBgzfMerge(
+            order, out_fh, bounds=bounds
+        ) as merger:
+            for mpileup in reversed(order):
+                merger(mpileup, self._vcf_gz(mpileup + ".vcf", records[mpileup]))
+
+        expected = self._records(b"chr1", [1, 5, 15]) + self._records(b"chr2", [3])
+        with open(self.output, 'rb') as fh:
+            found = gzip.decompress(fh.read())
+        self.assertEqual(found, self.HEADER + b"".join(expected))
+        self.assertIndexed(expected)
+
+
+# __END__
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+from somaticsniper_tool import checkpoint as MOD
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, MOD.MANIFEST_FILE)
+        self.mpileup = self._file("chr1-1-100.mpileup", "chr1\t1\tA\n")
+        self.output = self._file("chr1-1-100.annotated.vcf", "#CHROM\n")
+        self.params = {"map_q": 1}
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def _file(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+    def _recorded(self, params=None):
+        MOD.Manifest(self.path, self.params).record(self.mpileup, self.output)
+        return MOD.Manifest(self.path, params or self.params)
+
+
+class TestManifest(ThisTestCase):
+    def test_recorded_region_is_done_after_reload(self):
+        found = self._recorded().is_done(self.mpileup)
+        self.assertEqual(found, self.output)
+
+    def test_changed_params_are_stale(self):
+        self.assertIsNone(self._recorded({"map_q": 2}).is_done(self.mpileup))
+
+    def test_changed_mpileup_is_stale(self):
+        manifest = self._recorded()
+        self._file("chr1-1-100.mpileup", "chr1\t1\tA\nchr1\t2\tC\n")
+        self.assertIsNone(manifest.is_done(self.mpileup))
+
+    def test_changed_or_missing_output_is_stale(self):
+        manifest = self._recorded()
+        self._file("chr1-1-100.annotated.vcf", "#CHROM\nchr1\n")
+        self.assertIsNone(manifest.is_done(self.mpileup))
+        os.remove(self.output)
+        self.assertIsNone(manifest.is_done(self.mpileup))
+
+    def test_without_resume_manifest_starts_empty(self):
+        self._recorded()
+        manifest = MOD.Manifest(self.path, self.params, resume=False)
+        self.assertIsNone(manifest.is_done(self.mpileup))
+
+    def test_unreadable_manifest_is_ignored(self):
+        self._file(MOD.MANIFEST_FILE, "{")
+        self.assertEqual(MOD.Manifest(self.path, self.params).regions, {})
+
+    def test_records_appended_and_torn_record_ignored(self):
+        manifest = MOD.Manifest(self.path, self.params)
+        other = self._file("chr2-1-100.mpileup", "chr2\t1\tA\n")
+        for mpileup in (self.mpileup, other, self.mpileup):
+            manifest.record(mpileup, self.output)
+        with open(self.path) as fh:
+            self.assertEqual(len(fh.readlines()), 3)
+        with open(self.path, 'a') as fh:
+            fh.write('{"version": ')
+
+        found = MOD.Manifest(self.path, self.params)
+
+        self.assertEqual(set(found.regions), {self.mpileup, other})
+        self.assertEqual(found.is_done(other), self.output)
+
+    def test_sub_region_fingerprints_source_mpileup(self):
+        sub = os.path.join(self.tmpdir.name, "chr1-1-50.mpileup")
+        manifest = MOD.Manifest(self.path, self.params, sources={sub: self.mpileup})
+        manifest.record(sub, self.output)
+        self.assertEqual(manifest.is_done(sub), self.output)
+
+
+class Test_bam_index_mtime(ThisTestCase):
+    def test_bam_bai_bai_and_csi_are_found(self):
+        for index in ("normal.bam.bai", "normal.bai", "normal.bam.csi"):
+            with self.subTest(index=index):
+                path = self._file(index, "")
+                bam = os.path.join(self.tmpdir.name, "normal.bam")
+                self.assertEqual(MOD.bam_index_mtime(bam), os.stat(path).st_mtime_ns)
+                os.remove(path)
+
+    def test_missing_index_is_none(self):
+        self.assertIsNone(MOD.bam_index_mtime("/does/not/exist.bam"))
+
+
+# __END__
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 
+import asyncio
+import filecmp
+import os
+import shlex
+import shutil
+import tempfile
 import unittest
 from types import SimpleNamespace
 from unittest import mock
 
 from somaticsniper_tool import high_confidence as MOD
+from somaticsniper_tool.vcf_batch import RecordBatch
 
 
 class ThisTestCase(unittest.TestCase):
@@ -27,6 +34,8 @@ class TestHighConfidene(ThisTestCase):
             "timeout": self.timeout,
             "high_confidence": self.high_confidence,
             "input_file": self.input_file,
+            "min_somatic_score": MOD.MIN_SOMATIC_SCORE,
+            "min_mapping_quality": MOD.MIN_MAPPING_QUALITY,
         }
         found = self.CLASS_OBJ(self.timeout, self.high_confidence, self.input_file)
         for k, v in expected.items():
@@ -42,8 +51,168 @@ class TestHighConfidene(ThisTestCase):
         )
         high_confidence.run(_utils=self.mocks.utils)
         self.mocks.utils.run_subprocess_command.assert_called_once_with(
-            expected, self.timeout
+            expected, self.timeout, stream_output=True
         )
 
+    def test_only_options_differing_from_defaults_passed(self):
+        cases = (
+            ({}, []),
+            ({"min_somatic_score": 30}, ["--min-somatic-score", "30"]),
+            ({"min_mapping_quality": 20}, ["--min-mapping-quality", "20"]),
+            (
+                {"min_somatic_score": 30, "min_mapping_quality": 20},
+                ["--min-somatic-score", "30", "--min-mapping-quality", "20"],
+            ),
+        )
+        for kwargs, expected in cases:
+            with self.subTest(**kwargs):
+                high_confidence = self.CLASS_OBJ(
+                    self.timeout, self.high_confidence, self.input_file, **kwargs
+                )
+                args = high_confidence.build_args()
+                self.assertEqual(args[3:], expected)
+                found = shlex.split(high_confidence.build_command())[1:]
+                self.assertEqual(found, args)
+
+    def test_run_async_runs_command_in_highconfidence_stage(self):
+        runner = mock.Mock()
+        runner.run.return_value = asyncio.sleep(0)
+        high_confidence = self.CLASS_OBJ(
+            self.timeout, self.high_confidence, self.input_file
+        )
+        asyncio.run(high_confidence.run_async(runner))
+        runner.run.assert_called_once_with(
+            high_confidence.build_command(),
+            self.timeout,
+            stage="highconfidence",
+            stream_output=True,
+        )
+
+    def test_pool_runs_script_with_command_args(self):
+        pool = mock.Mock()
+        high_confidence = self.CLASS_OBJ(
+            self.timeout, self.high_confidence, self.input_file
+        )
+        with mock.patch.object(self.CLASS_OBJ, "pool", pool):
+            high_confidence.run(_utils=self.mocks.utils)
+
+        self.mocks.utils.run_subprocess_command.assert_not_called()
+        script, *args = shlex.split(high_confidence.build_command())[1:]
+        pool.run.assert_called_once_with(script, args, self.timeout)
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data", "region")
+# Installed by the Dockerfile; see data/region/regenerate.sh
+HIGHCONFIDENCE_PL = os.environ.get(
+    "HIGHCONFIDENCE_PL", "/scripts/highconfidence.pl"
+)
+
+
+class TestNativeHighConfidence(ThisTestCase):
+    CLASS_OBJ = MOD.NativeHighConfidence
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.tmpdir.name, "region.vcf.SNPfilter")
+        shutil.copy(os.path.join(DATA_DIR, "region.vcf.SNPfilter"), self.input_file)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def _record(self, ssc, mq):
+        return "\t".join(
+            [
+                "chr1",
+                "100",
+                ".",
+                "A",
+                "G",
+                ".",
+                ".",
+                ".",
+                "GT:MQ:SS:SSC",
+                "0/0:60:0:.",
+                "0/1:{}:2:{}\n".format(mq, ssc),
+            ]
+        ).encode()
+
+    def test_mask_applies_both_thresholds(self):
+        obj = self.CLASS_OBJ(3600, "highconfidence.pl", self.input_file)
+        records = [
+            self._record(40, 40),
+            self._record(39, 60),
+            self._record(60, 39),
+            self._record(".", 60),
+        ]
+        batch = RecordBatch(b"".join(records))
+        self.assertEqual(obj.mask(batch), [True, False, False, False])
+        self.assertEqual(obj.mask(batch, rows=[1, 0]), [False, True])
+        self.assertEqual(obj.mask_lines(records), [True, False, False, False])
+
+    def test_mask_lines_matches_batch_mask(self):
+        obj = self.CLASS_OBJ(3600, "highconfidence.pl", self.input_file)
+        passing = self._record(40, 40)
+        records = [
+            passing,
+            # Extra column past TUMOR
+            passing.replace(b"\n", b"\textra\n"),
+            # Other FORMAT orders and missing keys in one batch
+            b"chr1\t2\t.\tA\tG\t.\t.\t.\tSSC:MQ\t.:.\t45:50\n",
+            b"chr1\t3\t.\tA\tG\t.\t.\t.\tGT:MQ\t.\t0/1:60\n",
+            # Fewer values than FORMAT keys, and no sample columns
+            b"chr1\t4\t.\tA\tG\t.\t.\t.\tGT:MQ:SS:SSC\t.\t0/1:60\n",
+            b"chr1\t5\t.\tA\tG\n",
+            self._record("x", 60),
+            self._record("1e2", "60.5"),
+        ]
+        expected = [True, True, True, False, False, False, False, True]
+
+        self.assertEqual(obj.mask_lines(records), expected)
+        self.assertEqual(obj.mask(RecordBatch(b"".join(records))), expected)
+
+    def test_output_is_byte_identical_to_fixture(self):
+        obj = self.CLASS_OBJ(3600, "highconfidence.pl", self.input_file)
+        obj.run()
+        expected = os.path.join(DATA_DIR, "region.vcf.SNPfilter.hc")
+        self.assertEqual(obj.output_file, "{}.hc".format(self.input_file))
+        self.assertTrue(filecmp.cmp(obj.output_file, expected, shallow=False))
+
+    def test_output_independent_of_batch_size(self):
+        obj = self.CLASS_OBJ(3600, "highconfidence.pl", self.input_file)
+        obj.BATCH_SIZE = 3
+        obj.run()
+        expected = os.path.join(DATA_DIR, "region.vcf.SNPfilter.hc")
+        self.assertTrue(filecmp.cmp(obj.output_file, expected, shallow=False))
+
+    @unittest.skipUnless(
+        os.path.exists(HIGHCONFIDENCE_PL), "highconfidence.pl not installed"
+    )
+    def test_fixture_is_perl_script_output(self):
+        MOD.HighConfidence(3600, HIGHCONFIDENCE_PL, self.input_file).run()
+        expected = os.path.join(DATA_DIR, "region.vcf.SNPfilter.hc")
+        found = "{}.hc".format(self.input_file)
+        self.assertTrue(filecmp.cmp(found, expected, shallow=False))
+
+    @unittest.skipUnless(
+        os.path.exists(HIGHCONFIDENCE_PL), "highconfidence.pl not installed"
+    )
+    def test_output_is_byte_identical_to_perl_script(self):
+        # The perl script must also accept the options passed when not default
+        for kwargs in ({}, {"min_somatic_score": 60, "min_mapping_quality": 20}):
+            with self.subTest(**kwargs):
+                obj = self.CLASS_OBJ(3600, HIGHCONFIDENCE_PL, self.input_file, **kwargs)
+                obj.run()
+                native_output = "{}.native".format(obj.output_file)
+                os.rename(obj.output_file, native_output)
+
+                MOD.HighConfidence(
+                    3600, HIGHCONFIDENCE_PL, self.input_file, **kwargs
+                ).run()
+                self.assertTrue(
+                    filecmp.cmp(obj.output_file, native_output, shallow=False)
+                )
+
 
 # __END__
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import tempfile
+import unittest
+
+from somaticsniper_tool import incremental_merge as MOD
+
+
+class ThisTestCase(unittest.TestCase):
+    HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\n"
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def _vcf(self, mpileup, positions):
+        chrom = mpileup.split("-")[0]
+        path = os.path.join(self.tmpdir.name, mpileup.replace(".mpileup", ".vcf"))
+        with open(path, 'w') as fh:
+            fh.write(self.HEADER)
+            fh.writelines("{}\t{}\tx\n".format(chrom, p) for p in positions)
+        return path
+
+
+class Test_coordinate_order(ThisTestCase):
+    def test_sorted_by_contig_rank_then_start(self):
+        mpileups = [
+            "chr2-1-10.mpileup",
+            "/a/chr10-1-10.mpileup",
+            "chr1-11-20.mpileup",
+            "chrUn.mpileup",
+            "/b/chr1-1-10.mpileup",
+        ]
+        found = MOD.coordinate_order(mpileups, {"chr1": 0, "chr2": 1, "chr10": 2})
+        expected = [
+            "/b/chr1-1-10.mpileup",
+            "chr1-11-20.mpileup",
+            "chr2-1-10.mpileup",
+            "/a/chr10-1-10.mpileup",
+            "chrUn.mpileup",
+        ]
+        self.assertEqual(found, expected)
+
+
+class Test_IncrementalMerge(ThisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = ["chr1-1-10.mpileup", "chr1-11-20.mpileup", "chr2-1-10.mpileup"]
+        self.vcfs = {
+            "chr1-1-10.mpileup": self._vcf("chr1-1-10.mpileup", [1, 5, 12]),
+            "chr1-11-20.mpileup": self._vcf("chr1-11-20.mpileup", [9, 15]),
+            "chr2-1-10.mpileup": self._vcf("chr2-1-10.mpileup", [3]),
+        }
+
+    def test_out_of_order_completions_held_back(self):
+        out_fh = io.StringIO()
+        with self.assertRaises(ValueError):
+            with MOD.IncrementalMerge(self.order, out_fh) as merger:
+                merger("chr2-1-10.mpileup", self.vcfs["chr2-1-10.mpileup"])
+                merger("chr1-11-20.mpileup", self.vcfs["chr1-11-20.mpileup"])
+        # Region 0 never finished, so nothing could be merged
+        self.assertEqual(out_fh.getvalue(), "")
+        self.assertEqual(merger.merged, 0)
+
+    def test_regions_appended_in_order_with_one_header(self):
+        out_fh = io.StringIO()
+        with MOD.IncrementalMerge(self.order, out_fh) as merger:
+            for mpileup in reversed(self.order):
+                merger(mpileup, self.vcfs[mpileup])
+        found = out_fh.getvalue().splitlines()
+        self.assertEqual(found[:2], ["##fileformat=VCFv4.1", "#CHROM\tPOS"])
+        positions = [line.split("\t")[:2] for line in found[2:]]
+        expected = [
+            ["chr1", "1"],
+            ["chr1", "5"],
+            ["chr1", "12"],
+            ["chr1", "9"],
+            ["chr1", "15"],
+            ["chr2", "3"],
+        ]
+        self.assertEqual(positions, expected)
+
+    def test_bounds_clip_region_records(self):
+        out_fh = io.StringIO()
+        bounds = {
+            "chr1-1-10.mpileup": (float("-inf"), 10),
+            "chr1-11-20.mpileup": (11, float("inf")),
+        }
+        with MOD.IncrementalMerge(self.order, out_fh, bounds=bounds) as merger:
+            for mpileup in self.order:
+                merger(mpileup, self.vcfs[mpileup])
+        records = out_fh.getvalue().splitlines()[2:]
+        positions = [line.split("\t")[1] for line in records]
+        self.assertEqual(positions, ["1", "5", "15", "3"])
+
+    def test_incomplete_merge_raises(self):
+        with self.assertRaises(ValueError):
+            with MOD.IncrementalMerge(self.order, io.StringIO()) as merger:
+                merger("chr1-1-10.mpileup", self.vcfs["chr1-1-10.mpileup"])
+
+
+# __END__
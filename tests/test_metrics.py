@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+
+from somaticsniper_tool import metrics as MOD
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.metrics = MOD.RunMetrics()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def _file(self, name, size):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'wb') as fh:
+            fh.write(b"x" * size)
+        return path
+
+
+class TestStage(ThisTestCase):
+    def test_record_has_bytes_and_status(self):
+        in_file = self._file("in.vcf", 10)
+        out_file = os.path.join(self.tmpdir.name, "out.vcf")
+        with self.metrics.stage("chr1-1-10", "snpfilter", (in_file,), (out_file,)):
+            with open(out_file, 'wb') as fh:
+                fh.write(b"x" * 4)
+        record = self.metrics.records[0]
+        self.assertEqual(record["input_bytes"], 10)
+        self.assertEqual(record["output_bytes"], 4)
+        self.assertTrue(record["ok"])
+
+    def test_failed_stage_is_recorded(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.stage("chr1-1-10", "annotate"):
+                raise ValueError("boom")
+        self.assertFalse(self.metrics.records[0]["ok"])
+
+    def test_child_usage_added_to_current_thread_stage_only(self):
+        usage = SimpleNamespace(
+            ru_utime=1.5, ru_stime=0.5, ru_maxrss=100, ru_inblock=2, ru_oublock=4
+        )
+        self.metrics.add_child_usage(usage)
+        with self.metrics.stage("chr1-1-10", "somaticsniper"):
+            other = threading.Thread(target=self.metrics.add_child_usage, args=(usage,))
+            other.start()
+            other.join()
+            self.metrics.add_child_usage(usage)
+        record = self.metrics.records[0]
+        self.assertEqual(record["child_user_seconds"], 1.5)
+        self.assertEqual(record["child_system_seconds"], 0.5)
+        self.assertEqual(record["child_max_rss_kb"], 100)
+        self.assertEqual(record["child_read_bytes"], 2 * MOD.BLOCK_SIZE)
+        self.assertEqual(record["child_write_bytes"], 4 * MOD.BLOCK_SIZE)
+
+
+class TestReport(ThisTestCase):
+    def _record(self, region, stage, start, wall):
+        self.metrics.records.append(
+            {
+                "region": region,
+                "stage": stage,
+                "start": start,
+                "wall_seconds": wall,
+                "thread_cpu_seconds": 0.0,
+                "child_user_seconds": 0.0,
+                "child_system_seconds": 0.0,
+                "child_max_rss_kb": 0,
+                "input_bytes": 0,
+                "output_bytes": 0,
+            }
+        )
+
+    def test_critical_path_is_last_finishing_region(self):
+        self._record("a", "somaticsniper", 0.0, 5.0)
+        self._record("a", "snpfilter", 5.0, 1.0)
+        self._record("b", "somaticsniper", 0.0, 2.0)
+        self._record(MOD.RUN, "merge", 6.0, 0.5)
+        found = self.metrics.report()
+        critical = found["critical_path"]
+        self.assertEqual(critical["region"], "a")
+        self.assertEqual(critical["region_end_seconds"], 6.0)
+        self.assertEqual(
+            critical["region_stage_seconds"], {"somaticsniper": 5.0, "snpfilter": 1.0}
+        )
+        self.assertEqual(critical["tail_stage_seconds"], {"merge": 0.5})
+        self.assertEqual(found["stage_totals"]["somaticsniper"]["count"], 2)
+        self.assertNotIn(MOD.RUN, found["regions"])
+
+    def test_write_is_json(self):
+        self._record("a", "somaticsniper", 0.0, 1.0)
+        path = os.path.join(self.tmpdir.name, "metrics.json")
+        self.metrics.write(path)
+        with open(path) as fh:
+            found = json.load(fh)
+        self.assertEqual(found["critical_path"]["region"], "a")
+
+    def test_summaries_reported_until_reset(self):
+        self.metrics.add_summary("perl_workers", {"requests": 3})
+        self.assertEqual(
+            self.metrics.report()["summaries"], {"perl_workers": {"requests": 3}}
+        )
+        self.metrics.reset()
+        self.assertEqual(self.metrics.report()["summaries"], {})
+
+
+# __END__
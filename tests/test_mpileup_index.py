@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+from somaticsniper_tool import mpileup_index as MOD
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.lines = [
+            "chr1\t{}\tA\t1\t.\tI\n".format(pos).encode() for pos in range(1, 201, 5)
+        ] + [b"chr2\t7\t*\t1\t.\tI\n", b"chr2\t9\tC\t1\t.\tI"]
+        self.path = self._write("chr1-1-200.mpileup", self.lines)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def _write(self, name, lines):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'wb') as fh:
+            fh.write(b"".join(lines))
+        return path
+
+    def _expected(self, chrom, start, end):
+        return [
+            line
+            for line in self.lines
+            if line.split(b"\t")[0] == chrom
+            and start <= int(line.split(b"\t")[1]) <= end
+        ]
+
+
+class TestMpileupIndex(ThisTestCase):
+    def test_ranges_match_linear_scan(self):
+        cases = (
+            (b"chr1", 1, 200),
+            (b"chr1", 3, 3),
+            (b"chr1", 6, 6),
+            (b"chr1", 50, 120),
+            (b"chr1", 500, 600),
+            (b"chr2", 0, 8),
+            (b"chr2", 8, float("inf")),
+            (b"chr2", 9, 9),
+            (b"chr3", 1, 10),
+        )
+        # Samples of every line, of blocks within and across contigs, and one
+        for block_size in (1, 16, 64, 100, MOD.BLOCK_SIZE):
+            index = MOD.MpileupIndex.build(self.path, block_size=block_size)
+            with index:
+                for chrom, start, end in cases:
+                    with self.subTest(
+                        block_size=block_size, chrom=chrom, start=start, end=end
+                    ):
+                        found = list(index.lines(chrom, start, end))
+                        self.assertEqual(found, self._expected(chrom, start, end))
+                        with index.view(chrom, start, end) as view:
+                            self.assertEqual(bytes(view), b"".join(found))
+
+    def test_one_sample_per_block_and_contig(self):
+        block_size = 100
+        index = MOD.MpileupIndex.build(self.path, block_size=block_size)
+
+        size = os.path.getsize(self.path)
+        self.assertLessEqual(len(index.positions), -(-size // block_size) + 1)
+        self.assertLess(len(index.positions), len(self.lines) // 3)
+        self.assertEqual(list(index.contigs), [b"chr1", b"chr2"])
+        chr2 = index.contigs[b"chr2"]
+        self.assertEqual(index.positions[chr2[0]], 7)
+        self.assertEqual(chr2[1:], (len(index.positions), size))
+
+    def test_open_saves_and_reuses_sidecar(self):
+        built = MOD.MpileupIndex.open(self.path)
+        sidecar = self.path + MOD.SIDECAR_SUFFIX
+        self.assertTrue(os.path.exists(sidecar))
+        loaded = MOD.MpileupIndex.load(self.path, sidecar)
+        self.assertEqual(loaded.size, built.size)
+        self.assertEqual(loaded.block_size, built.block_size)
+        self.assertEqual(loaded.contigs, built.contigs)
+        self.assertEqual(loaded.positions, built.positions)
+        self.assertEqual(loaded.offsets, built.offsets)
+
+    def test_stale_sidecar_rebuilt(self):
+        MOD.MpileupIndex.open(self.path)
+        self.lines = self.lines[:3]
+        self._write("chr1-1-200.mpileup", self.lines)
+        with MOD.MpileupIndex.open(self.path) as index:
+            self.assertEqual(list(index.lines(b"chr1", 1, 200)), self.lines)
+
+    def test_empty_mpileup(self):
+        path = self._write("chr1-1-2.mpileup", [])
+        with MOD.MpileupIndex.open(path) as index:
+            self.assertEqual(list(index.lines(b"chr1", 1, 2)), [])
+            self.assertEqual(index.byte_range(b"chr1", 1, 2), (0, 0))
+
+
+# __END__
@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 
+import asyncio
+import concurrent.futures
+import filecmp
+import functools
+import gzip
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
 import unittest
 from types import SimpleNamespace
 from unittest import mock
 
 from somaticsniper_tool import multi_somaticsniper as MOD
+from somaticsniper_tool.work_queue import QueueWorker, WorkQueue
 
 
 class ThisTestCase(unittest.TestCase):
@@ -19,7 +31,12 @@ class ThisTestCase(unittest.TestCase):
             HIGHCONFIDENCE=mock.MagicMock(spec_set=MOD.HighConfidence),
             ANNOTATE=mock.MagicMock(spec_set=MOD.Annotate),
             SNPFILTER=mock.MagicMock(spec_set=MOD.SnpFilter),
+            NATIVE_SNPFILTER=mock.MagicMock(spec_set=MOD.NativeSnpFilter),
+            NATIVE_HIGHCONFIDENCE=mock.MagicMock(spec_set=MOD.NativeHighConfidence),
+            POSTPROCESS=mock.MagicMock(spec_set=MOD.PostProcess),
+            SAMTOOLS_STREAM=mock.MagicMock(spec_set=MOD.SamtoolsViewStream),
         )
+        self.mocks.SOMATICSNIPER.return_value.cache_key.return_value = None
 
     def tearDown(self):
         super().tearDown()
@@ -59,6 +76,22 @@ class Test_process_argv(ThisTestCase):
             with self.subTest(m=m):
                 self.assertTrue(m in mpileups)
 
+    def test_plan_regions_replaces_mpileup(self):
+        args_list = self.args_list[:2] + self.args_list[4:]
+        with self.assertRaises(SystemExit):
+            MOD.process_argv(args_list)
+
+        found = MOD.process_argv(args_list + ["--plan-regions", "8"])
+        self.assertEqual(found.plan_regions, 8)
+        self.assertIsNone(found.mpileup)
+        self.assertFalse(found.skip_dash_contigs)
+
+    def test_stream_views_rejected_with_async_executor(self):
+        found = MOD.process_argv(self.args_list + ["--stream-views"])
+        self.assertTrue(found.stream_views)
+        with self.assertRaises(SystemExit):
+            MOD.process_argv(self.args_list + ["--stream-views", "--executor=async"])
+
 
 class Test_tpe_submit_commands(ThisTestCase):
     def setUp(self):
@@ -69,6 +102,21 @@ class Test_tpe_submit_commands(ThisTestCase):
             tumor_bam="/foo/bar/tumor.bam",
             snpfilter="snp_filter.pl",
             highconfidence="highconfidence.pl",
+            snpfilter_engine="perl",
+            highconfidence_engine="perl",
+            min_somatic_score=40,
+            min_mapping_quality=40,
+            min_indel_score=50,
+            indel_window=10,
+            fused_postprocess=False,
+            stream_views=False,
+            output_compression="none",
+            plan_regions=None,
+            skip_dash_contigs=False,
+            fail_fast=False,
+            straggler_factor=None,
+            reference_path="/foo/bar/ref.fa",
+            schedule="input",
             mpileup=["chr1-2-3.mpileup", "chr4-5-6.mpileup"],
             thread_count=42,
             timeout=3600,
@@ -105,6 +153,16 @@ class Test_tpe_submit_commands(ThisTestCase):
                     tumor_bam=self.run_args.tumor_bam,
                     snpfilter=self.run_args.snpfilter,
                     high_confidence=self.run_args.highconfidence,
+                    snpfilter_engine=self.run_args.snpfilter_engine,
+                    highconfidence_engine=self.run_args.highconfidence_engine,
+                    min_somatic_score=self.run_args.min_somatic_score,
+                    min_mapping_quality=self.run_args.min_mapping_quality,
+                    min_indel_score=self.run_args.min_indel_score,
+                    indel_window=self.run_args.indel_window,
+                    fused_postprocess=self.run_args.fused_postprocess,
+                    stream_views=self.run_args.stream_views,
+                    output_compression=self.run_args.output_compression,
+                    mpileup_reference=None,
                 )
                 for region in self.run_args.mpileup
             ],
@@ -112,6 +170,181 @@ class Test_tpe_submit_commands(ThisTestCase):
         )
 
 
+class Test_tpe_submit_commands_on_result(ThisTestCase):
+    def test_on_result_called_with_mpileup_and_result(self):
+        run_args = SimpleNamespace(
+            samtools="samtools",
+            normal_bam="/foo/bar/normal.bam",
+            tumor_bam="/foo/bar/tumor.bam",
+            snpfilter="snp_filter.pl",
+            highconfidence="highconfidence.pl",
+            snpfilter_engine="perl",
+            highconfidence_engine="perl",
+            min_somatic_score=40,
+            min_mapping_quality=40,
+            min_indel_score=50,
+            indel_window=10,
+            fused_postprocess=False,
+            stream_views=False,
+            output_compression="none",
+            plan_regions=None,
+            skip_dash_contigs=False,
+            fail_fast=False,
+            straggler_factor=None,
+            reference_path="/foo/bar/ref.fa",
+            schedule="input",
+            mpileup=["chr1-2-3.mpileup", "chr4-5-6.mpileup"],
+            thread_count=2,
+            timeout=3600,
+        )
+        on_result = mock.Mock()
+        found, exceptions = MOD.tpe_submit_commands(
+            run_args, fn=lambda m, **kwargs: m + ".vcf", on_result=on_result
+        )
+        self.assertEqual(exceptions, [])
+        on_result.assert_has_calls(
+            [mock.call(m, m + ".vcf") for m in run_args.mpileup], any_order=True
+        )
+
+
+class Test_tpe_submit_commands_manifest(ThisTestCase):
+    def test_verified_regions_skipped_and_new_regions_recorded(self):
+        run_args = SimpleNamespace(
+            schedule="input",
+            mpileup=["chr1-2-3.mpileup", "chr4-5-6.mpileup"],
+            thread_count=2,
+            timeout=3600,
+            samtools="samtools",
+            normal_bam="/foo/bar/normal.bam",
+            tumor_bam="/foo/bar/tumor.bam",
+            snpfilter="snp_filter.pl",
+            highconfidence="highconfidence.pl",
+            snpfilter_engine="perl",
+            highconfidence_engine="perl",
+            min_somatic_score=40,
+            min_mapping_quality=40,
+            min_indel_score=50,
+            indel_window=10,
+            fused_postprocess=False,
+            stream_views=False,
+            output_compression="none",
+            plan_regions=None,
+            skip_dash_contigs=False,
+            fail_fast=False,
+            straggler_factor=None,
+            reference_path="/foo/bar/ref.fa",
+        )
+        manifest = mock.MagicMock(spec_set=MOD.Manifest)
+        manifest.is_done.side_effect = lambda m: (
+            "chr1-2-3.annotated.vcf" if m == "chr1-2-3.mpileup" else None
+        )
+        fn = mock.Mock(return_value="chr4-5-6.annotated.vcf")
+        on_result = mock.Mock()
+        found, exceptions = MOD.tpe_submit_commands(
+            run_args, fn=fn, on_result=on_result, manifest=manifest
+        )
+        self.assertEqual(exceptions, [])
+        self.assertEqual(
+            sorted(found), ["chr1-2-3.annotated.vcf", "chr4-5-6.annotated.vcf"]
+        )
+        self.assertEqual(fn.call_count, 1)
+        manifest.record.assert_called_once_with(
+            "chr4-5-6.mpileup", "chr4-5-6.annotated.vcf"
+        )
+        self.assertEqual(on_result.call_count, 2)
+
+
+class Test_tpe_submit_commands_fail_fast(ThisTestCase):
+    def test_first_failure_cancels_and_kills_other_regions(self):
+        run_args = SimpleNamespace(
+            samtools="samtools",
+            normal_bam="/foo/bar/normal.bam",
+            tumor_bam="/foo/bar/tumor.bam",
+            snpfilter="snp_filter.pl",
+            highconfidence="highconfidence.pl",
+            snpfilter_engine="perl",
+            highconfidence_engine="perl",
+            min_somatic_score=40,
+            min_mapping_quality=40,
+            min_indel_score=50,
+            indel_window=10,
+            fused_postprocess=False,
+            stream_views=False,
+            output_compression="none",
+            plan_regions=None,
+            skip_dash_contigs=False,
+            fail_fast=True,
+            straggler_factor=None,
+            reference_path="/foo/bar/ref.fa",
+            schedule="input",
+            mpileup=["chr{}-1-2.mpileup".format(i) for i in range(1, 5)],
+            thread_count=2,
+            timeout=3600,
+        )
+        started = []
+
+        def fn(mpileup, **kwargs):
+            started.append(mpileup)
+            if mpileup.startswith("chr1-"):
+                time.sleep(0.2)
+                raise ValueError(mpileup)
+            MOD.utils.run_subprocess_command("sleep 30", None)
+
+        start = time.monotonic()
+        with self.assertLogs(MOD.logger, "ERROR"):
+            found, exceptions = MOD.tpe_submit_commands(run_args, fn=fn)
+
+        self.assertLess(time.monotonic() - start, 20)
+        self.assertEqual(found, [])
+        self.assertEqual([str(e) for e in exceptions], ["chr1-1-2.mpileup"])
+        self.assertNotIn("chr4-1-2.mpileup", started)
+
+
+class Test_queue_submit_commands(ThisTestCase):
+    def test_regions_run_by_queue_worker(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        run_args = MOD.process_argv(
+            [
+                "--thread-count=2",
+                "--mpileup=chr1-2-3.mpileup",
+                "--mpileup=chr4-5-6.mpileup",
+                "--reference-path=/foo/bar/ref.fa",
+                "--tumor-bam=/foo/bar/tumor.bam",
+                "--normal-bam=/foo/bar/normal.bam",
+                "--queue-dir={}".format(tmpdir.name),
+            ]
+        )
+        queue = WorkQueue(tmpdir.name)
+        runs = []
+
+        def fn(mpileup):
+            if mpileup.startswith("chr4"):
+                raise ValueError("no reads")
+            return mpileup + ".vcf"
+
+        def serve():
+            run = queue.wait_for_run(poll_seconds=0.01)
+            runs.append(run)
+            QueueWorker(queue, run["run_id"], fn, poll_seconds=0.01).serve()
+
+        worker = threading.Thread(target=serve)
+        worker.start()
+        on_result = mock.Mock()
+        with self.assertLogs(MOD.logger, "ERROR"):
+            found, exceptions = MOD.queue_submit_commands(
+                run_args, on_result=on_result
+            )
+        worker.join(10)
+
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(found, ["chr1-2-3.mpileup.vcf"])
+        self.assertEqual([str(e) for e in exceptions], ["chr4-5-6.mpileup: no reads"])
+        on_result.assert_called_once_with("chr1-2-3.mpileup", "chr1-2-3.mpileup.vcf")
+        self.assertEqual(runs[0]["work_dir"], os.getcwd())
+        self.assertEqual(runs[0]["mpileup"], run_args.mpileup)
+
+
 class Test_Multithread_Somaticsniper(ThisTestCase):
     def setUp(self):
         super().setUp()
@@ -156,6 +389,7 @@ class Test_Multithread_Somaticsniper(ThisTestCase):
     def test_samtools_views_called_with_expected_bams(self):
 
         mock_somatic_sniper = mock.MagicMock(spec_set=MOD.SomaticSniper)
+        mock_somatic_sniper.cache_key.return_value = None
         self.mocks.SOMATICSNIPER.return_value = mock_somatic_sniper
 
         region = "chr1:2-3"
@@ -188,6 +422,32 @@ class Test_Multithread_Somaticsniper(ThisTestCase):
         ]
         self.mocks.SAMTOOLS.assert_has_calls(expected_calls, self.args["timeout"])
 
+    def test_stream_views_uses_streaming_samtools_view(self):
+        region = "chr1:2-3"
+        basename = "chr1-2-3"
+        self.mocks.UTILS.get_region_from_name.return_value = region, basename
+
+        found = MOD.multithread_somaticsniper(
+            self.mpileup,
+            **self.args,
+            stream_views=True,
+            _annotate=self.mocks.ANNOTATE,
+            _highconfidence=self.mocks.HIGHCONFIDENCE,
+            _samtools=self.mocks.SAMTOOLS,
+            _samtools_stream=self.mocks.SAMTOOLS_STREAM,
+            _somaticsniper=self.mocks.SOMATICSNIPER,
+            _snpfilter=self.mocks.SNPFILTER,
+            _utils=self.mocks.UTILS,
+        )
+        self.mocks.SAMTOOLS.assert_not_called()
+        self.mocks.SAMTOOLS_STREAM.assert_has_calls(
+            [
+                mock.call(self.args["timeout"], self.args["samtools"], bam, region)
+                for bam in (self.args["normal_bam"], self.args["tumor_bam"])
+            ],
+            any_order=True,
+        )
+
     def test_somaticsniper_run_called_with_samtools_views(self):
         normal_bam_path = "normal.bam"
         tumor_bam_path = "tumor.bam"
@@ -201,6 +461,7 @@ class Test_Multithread_Somaticsniper(ThisTestCase):
         self.mocks.SAMTOOLS.side_effect = [mock_normal_samtools, mock_tumor_samtools]
 
         mock_somatic_sniper = mock.MagicMock(spec_set=MOD.SomaticSniper)
+        mock_somatic_sniper.cache_key.return_value = None
         self.mocks.SOMATICSNIPER.return_value = mock_somatic_sniper
 
         found = MOD.multithread_somaticsniper(
@@ -213,7 +474,56 @@ class Test_Multithread_Somaticsniper(ThisTestCase):
             _snpfilter=self.mocks.SNPFILTER,
         )
         mock_somatic_sniper.run.assert_called_once_with(
-            normal_bam=normal_bam_path, tumor_bam=tumor_bam_path,
+            normal_bam=normal_bam_path, tumor_bam=tumor_bam_path, cache_key=None
+        )
+
+    def test_cache_hit_skips_samtools_views_and_somaticsniper(self):
+        mock_somatic_sniper = mock.MagicMock(spec_set=MOD.SomaticSniper("chr1-2-3"))
+        mock_somatic_sniper.cache_key.return_value = "key"
+        mock_somatic_sniper.restore.return_value = True
+        mock_somatic_sniper.output_file = "chr1-2-3.vcf"
+        self.mocks.SOMATICSNIPER.return_value = mock_somatic_sniper
+
+        found = MOD.multithread_somaticsniper(
+            self.mpileup,
+            **self.args,
+            _annotate=self.mocks.ANNOTATE,
+            _highconfidence=self.mocks.HIGHCONFIDENCE,
+            _samtools=self.mocks.SAMTOOLS,
+            _somaticsniper=self.mocks.SOMATICSNIPER,
+            _snpfilter=self.mocks.SNPFILTER,
+        )
+        mock_somatic_sniper.restore.assert_called_once_with("key")
+        self.mocks.SAMTOOLS.assert_not_called()
+        mock_somatic_sniper.run.assert_not_called()
+        self.mocks.SNPFILTER.assert_called_once_with(
+            self.args["timeout"],
+            self.args["snpfilter"],
+            "chr1-2-3.vcf",
+            self.mpileup,
+            min_indel_score=MOD.MIN_INDEL_SCORE,
+            indel_window=MOD.INDEL_WINDOW,
+        )
+
+    def test_cache_miss_restores_once_then_runs_somaticsniper(self):
+        mock_somatic_sniper = mock.MagicMock(spec_set=MOD.SomaticSniper("chr1-2-3"))
+        mock_somatic_sniper.cache_key.return_value = "key"
+        mock_somatic_sniper.restore.return_value = False
+        mock_somatic_sniper.run.return_value = "chr1-2-3.vcf"
+        self.mocks.SOMATICSNIPER.return_value = mock_somatic_sniper
+
+        MOD.multithread_somaticsniper(
+            self.mpileup,
+            **self.args,
+            _annotate=self.mocks.ANNOTATE,
+            _highconfidence=self.mocks.HIGHCONFIDENCE,
+            _samtools=self.mocks.SAMTOOLS,
+            _somaticsniper=self.mocks.SOMATICSNIPER,
+            _snpfilter=self.mocks.SNPFILTER,
+        )
+        mock_somatic_sniper.restore.assert_called_once_with("key")
+        mock_somatic_sniper.run.assert_called_once_with(
+            normal_bam=mock.ANY, tumor_bam=mock.ANY, cache_key="key"
         )
 
     def test_snpfilter_called_with_expected_args(self):
@@ -235,10 +545,44 @@ class Test_Multithread_Somaticsniper(ThisTestCase):
         )
 
         self.mocks.SNPFILTER.assert_called_once_with(
-            self.args["timeout"], self.args["snpfilter"], out_vcf, self.mpileup
+            self.args["timeout"],
+            self.args["snpfilter"],
+            out_vcf,
+            self.mpileup,
+            min_indel_score=MOD.MIN_INDEL_SCORE,
+            indel_window=MOD.INDEL_WINDOW,
         )
         mock_snpfilter.run.assert_called_once_with()
 
+    def test_native_snpfilter_used_for_native_engine(self):
+        out_vcf = "somatic_sniper.vcf"
+        self.mocks.SOMATICSNIPER.return_value.run.return_value = out_vcf
+
+        found = MOD.multithread_somaticsniper(
+            self.mpileup,
+            **self.args,
+            snpfilter_engine="native",
+            min_indel_score=30,
+            indel_window=5,
+            _annotate=self.mocks.ANNOTATE,
+            _highconfidence=self.mocks.HIGHCONFIDENCE,
+            _samtools=self.mocks.SAMTOOLS,
+            _somaticsniper=self.mocks.SOMATICSNIPER,
+            _snpfilter=self.mocks.SNPFILTER,
+            _native_snpfilter=self.mocks.NATIVE_SNPFILTER,
+        )
+
+        self.mocks.SNPFILTER.assert_not_called()
+        self.mocks.NATIVE_SNPFILTER.assert_called_once_with(
+            self.args["timeout"],
+            self.args["snpfilter"],
+            out_vcf,
+            self.mpileup,
+            min_indel_score=30,
+            indel_window=5,
+        )
+        self.mocks.NATIVE_SNPFILTER.return_value.run.assert_called_once_with()
+
     def test_highconfidence_called_with_expected_args(self):
 
         out_vcf = "somatic_sniper.vcf"
@@ -258,10 +602,42 @@ class Test_Multithread_Somaticsniper(ThisTestCase):
             _snpfilter=self.mocks.SNPFILTER,
         )
         self.mocks.HIGHCONFIDENCE.assert_called_once_with(
-            self.args["timeout"], self.args["high_confidence"], snpfilter_out
+            self.args["timeout"],
+            self.args["high_confidence"],
+            snpfilter_out,
+            min_somatic_score=MOD.MIN_SOMATIC_SCORE,
+            min_mapping_quality=MOD.MIN_MAPPING_QUALITY,
         )
         mock_high_confidence.run.assert_called_once_with()
 
+    def test_native_highconfidence_used_for_native_engine(self):
+        out_vcf = "somatic_sniper.vcf"
+        snpfilter_out = "{}.SNPfilter".format(out_vcf)
+        self.mocks.SOMATICSNIPER.return_value.run.return_value = out_vcf
+
+        found = MOD.multithread_somaticsniper(
+            self.mpileup,
+            **self.args,
+            highconfidence_engine="native",
+            min_somatic_score=30,
+            min_mapping_quality=20,
+            _annotate=self.mocks.ANNOTATE,
+            _highconfidence=self.mocks.HIGHCONFIDENCE,
+            _native_highconfidence=self.mocks.NATIVE_HIGHCONFIDENCE,
+            _samtools=self.mocks.SAMTOOLS,
+            _somaticsniper=self.mocks.SOMATICSNIPER,
+            _snpfilter=self.mocks.SNPFILTER,
+        )
+        self.mocks.HIGHCONFIDENCE.assert_not_called()
+        self.mocks.NATIVE_HIGHCONFIDENCE.assert_called_once_with(
+            self.args["timeout"],
+            self.args["high_confidence"],
+            snpfilter_out,
+            min_somatic_score=30,
+            min_mapping_quality=20,
+        )
+        self.mocks.NATIVE_HIGHCONFIDENCE.return_value.run.assert_called_once_with()
+
     def test_annotate_context_called_with_expected_args(self):
         region = "foo:bar"
         basename = "foo-bar"
@@ -314,5 +690,429 @@ class Test_Multithread_Somaticsniper(ThisTestCase):
         )
         mock_annotate.assert_called_once_with(out_vcf, high_confidence_out)
 
+    def test_fused_postprocess_replaces_staged_filters(self):
+        region = "foo:bar"
+        basename = "foo-bar"
+        self.mocks.UTILS.get_region_from_name.return_value = region, basename
+        out_vcf = "somatic_sniper.vcf"
+        annotated_file = "{}.annotated.vcf".format(basename)
+        self.mocks.SOMATICSNIPER.return_value.run.return_value = out_vcf
+        self.mocks.POSTPROCESS.return_value.return_value = annotated_file
+
+        found = MOD.multithread_somaticsniper(
+            self.mpileup,
+            **self.args,
+            min_somatic_score=30,
+            min_mapping_quality=20,
+            min_indel_score=30,
+            indel_window=5,
+            fused_postprocess=True,
+            _annotate=self.mocks.ANNOTATE,
+            _highconfidence=self.mocks.HIGHCONFIDENCE,
+            _samtools=self.mocks.SAMTOOLS,
+            _somaticsniper=self.mocks.SOMATICSNIPER,
+            _snpfilter=self.mocks.SNPFILTER,
+            _postprocess=self.mocks.POSTPROCESS,
+            _utils=self.mocks.UTILS,
+        )
+        self.assertEqual(found, annotated_file)
+        self.mocks.POSTPROCESS.assert_called_once_with(
+            self.mpileup,
+            min_somatic_score=30,
+            min_mapping_quality=20,
+            min_indel_score=30,
+            indel_window=5,
+        )
+        self.mocks.POSTPROCESS.return_value.assert_called_once_with(
+            out_vcf, annotated_file
+        )
+        self.mocks.SNPFILTER.assert_not_called()
+        self.mocks.HIGHCONFIDENCE.assert_not_called()
+        self.mocks.ANNOTATE.assert_not_called()
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data", "region")
+
+
+class StubToolsTestCase(ThisTestCase):
+    """Run region pipelines end to end with stand-in binaries."""
+
+    def setUp(self):
+        super().setUp()
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+        # "samtools view -b <bam> <region>" emits the bam; somaticsniper
+        # writes the fixture VCF to its last argument
+        self.samtools = self._script("samtools", 'cat "$3"')
+        self.sniper = self._script(
+            "bam-somaticsniper",
+            'echo "$@" >> sniper.calls; for last; do :; done; cp {} "$last"'.format(
+                os.path.join(DATA_DIR, "region.vcf")
+            ),
+        )
+        for name in ("normal.bam", "tumor.bam", "ref.fa"):
+            with open(name, 'w') as fh:
+                fh.write(name)
+        MOD.SomaticSniper._initialize_args(
+            somaticsniper_bin=self.sniper, flags=[], reference_path="ref.fa"
+        )
+        self.mpileup = "chr1-1-30000.mpileup"
+        shutil.copy(os.path.join(DATA_DIR, "region.indel.pileup"), self.mpileup)
+        self.args = dict(
+            timeout=60,
+            samtools=self.samtools,
+            normal_bam="normal.bam",
+            tumor_bam="tumor.bam",
+            snpfilter_engine="native",
+            highconfidence_engine="native",
+        )
+
+    def tearDown(self):
+        super().tearDown()
+        MOD.SomaticSniper._initialize_args()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def _script(self, name, body):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as fh:
+            fh.write("#!/bin/sh\n{}\n".format(body))
+        os.chmod(path, stat.S_IRWXU)
+        return path
+
+
+class Test_async_somaticsniper(StubToolsTestCase):
+    def test_output_matches_threaded_pipeline(self):
+        expected = MOD.multithread_somaticsniper(self.mpileup, **self.args)
+        os.rename(expected, "threaded.vcf")
+        runner = MOD.AsyncRunner(MOD.parse_stage_limits(None, 1))
+        found = asyncio.run(
+            MOD.async_somaticsniper(self.mpileup, **self.args, runner=runner)
+        )
+        self.assertEqual(found, expected)
+        self.assertTrue(filecmp.cmp(found, "threaded.vcf", shallow=False))
+
+    def test_bgzf_output_compression(self):
+        expected = MOD.multithread_somaticsniper(self.mpileup, **self.args)
+        os.rename(expected, "plain.vcf")
+        with open("plain.vcf", 'rb') as fh:
+            plain = fh.read()
+        runner = MOD.AsyncRunner(MOD.parse_stage_limits(None, 1))
+        for found in (
+            MOD.multithread_somaticsniper(
+                self.mpileup, **self.args, output_compression="bgzf"
+            ),
+            asyncio.run(
+                MOD.async_somaticsniper(
+                    self.mpileup, **self.args, output_compression="bgzf", runner=runner
+                )
+            ),
+        ):
+            self.assertEqual(found, expected + ".gz")
+            self.assertFalse(os.path.exists(expected))
+            with open(found, 'rb') as fh:
+                self.assertEqual(gzip.decompress(fh.read()), plain)
+
+    def test_planned_region_mpileup_written_first(self):
+        expected = MOD.multithread_somaticsniper(self.mpileup, **self.args)
+        os.rename(expected, "given.vcf")
+        # "samtools mpileup -f <ref> -r <region> <normal> <tumor>" emits the
+        # fixture pileup
+        self.args["samtools"] = self._script(
+            "samtools",
+            'if [ "$1" = mpileup ]; then cat {}; else cat "$3"; fi'.format(
+                os.path.join(DATA_DIR, "region.indel.pileup")
+            ),
+        )
+        os.mkdir(MOD.PLANNED_MPILEUP_DIR)
+        planned = os.path.join(MOD.PLANNED_MPILEUP_DIR, self.mpileup)
+        runner = MOD.AsyncRunner(MOD.parse_stage_limits(None, 1))
+        for run in (
+            lambda: MOD.multithread_somaticsniper(
+                planned, **self.args, mpileup_reference="ref.fa"
+            ),
+            lambda: asyncio.run(
+                MOD.async_somaticsniper(
+                    planned, **self.args, mpileup_reference="ref.fa", runner=runner
+                )
+            ),
+        ):
+            found = run()
+            self.assertEqual(found, expected)
+            self.assertTrue(filecmp.cmp(found, "given.vcf", shallow=False))
+            self.assertTrue(filecmp.cmp(planned, self.mpileup, shallow=False))
+            os.remove(planned)
+
+    def test_output_dir_and_metrics_match_threaded_pipeline(self):
+        found = {}
+        for executor, run in (
+            ("threads", MOD.multithread_somaticsniper),
+            (
+                "async",
+                lambda mpileup, **kwargs: asyncio.run(
+                    MOD.async_somaticsniper(
+                        mpileup,
+                        runner=MOD.AsyncRunner(MOD.parse_stage_limits(None, 1)),
+                        **kwargs
+                    )
+                ),
+            ),
+        ):
+            os.mkdir(executor)
+            run_metrics = MOD.metrics.RunMetrics()
+            output = run(
+                self.mpileup,
+                **self.args,
+                output_compression="bgzf",
+                output_dir=executor,
+                _metrics=run_metrics,
+            )
+            self.assertEqual(
+                output, os.path.join(executor, "chr1-1-30000.annotated.vcf.gz")
+            )
+            found[executor] = [
+                (record["region"], record["stage"], record["output_bytes"] > 0)
+                for record in run_metrics.records
+            ]
+        self.assertEqual(
+            found["async"],
+            [(r.replace("threads", "async"), *rest) for r, *rest in found["threads"]],
+        )
+        self.assertIn(
+            (os.path.join("async", "chr1-1-30000"), "compress", True), found["async"]
+        )
+
+    def test_stream_views_rejected(self):
+        runner = MOD.AsyncRunner(MOD.parse_stage_limits(None, 1))
+        with self.assertRaisesRegex(ValueError, "Streamed views"):
+            asyncio.run(
+                MOD.async_somaticsniper(
+                    self.mpileup, **self.args, stream_views=True, runner=runner
+                )
+            )
+        self.assertFalse(os.path.exists("sniper.calls"))
+
+
+class Test_straggler_cancellation(StubToolsTestCase):
+    """Race a split against an original held in an in-process stage."""
+
+    def tearDown(self):
+        super().tearDown()
+        MOD.utils.CHILDREN.reset()
+
+    def test_split_wins_while_original_in_native_stage(self):
+        release = threading.Event()
+        original = self.mpileup[: -len(".mpileup")]
+
+        class HeldSnpFilter(MOD.NativeSnpFilter):
+            def run(self):
+                if os.path.basename(self.vcf_file).startswith(original + "."):
+                    release.wait(30)
+                super().run()
+
+        fn = functools.partial(
+            MOD.multithread_somaticsniper, _native_snpfilter=HeldSnpFilter
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            with MOD.StragglerMonitor(
+                executor, fn, self.args, 2, "split", poll_seconds=60
+            ) as monitor:
+                future = executor.submit(monitor.run, self.mpileup, **self.args)
+                monitor.speculate(self.mpileup)
+                split_output = monitor._speculations[self.mpileup].result(30)
+                release.set()
+                with self.assertRaisesRegex(ValueError, "Cancelled"):
+                    future.result(30)
+                found = monitor.result(self.mpileup, future)
+
+        self.assertEqual(found, split_output)
+        self.assertFalse(os.path.exists(original + ".annotated.vcf"))
+
+    def test_async_region_stops_after_killed_native_stage(self):
+        class KilledSnpFilter(MOD.NativeSnpFilter):
+            def run(self):
+                MOD.utils.CHILDREN.kill("region")
+                super().run()
+
+        async def run_region():
+            with MOD.utils.CHILDREN.group("region"):
+                return await MOD.async_somaticsniper(
+                    self.mpileup,
+                    **self.args,
+                    runner=MOD.AsyncRunner(MOD.parse_stage_limits(None, 1)),
+                    _native_snpfilter=KilledSnpFilter,
+                )
+
+        with self.assertRaisesRegex(ValueError, "Cancelled commands of region"):
+            asyncio.run(run_region())
+        self.assertFalse(os.path.exists("chr1-1-30000.annotated.vcf"))
+
+
+class Test_run_resume(StubToolsTestCase):
+    """Resume whole runs, changing options that change region outputs."""
+
+    def setUp(self):
+        super().setUp()
+        with open("ref.fa.fai", 'w') as fh:
+            fh.write("chr1\t30000\t6\t60\t61\n")
+        # Keeps every record, unlike the native engine
+        self.snpfilter = os.path.join(self.tmpdir.name, "snpfilter.pl")
+        with open(self.snpfilter, 'w') as fh:
+            fh.write(
+                "my %args = @ARGV;\n"
+                "open(my $in, '<', $args{'--snp-file'}) or die;\n"
+                "open(my $out, '>', \"$args{'--snp-file'}.SNPfilter\") or die;\n"
+                "print $out $_ while <$in>;\n"
+            )
+
+    def run_main(self, *extra):
+        MOD.run(
+            MOD.process_argv(
+                [
+                    "--thread-count=1",
+                    "--mpileup={}".format(self.mpileup),
+                    "--reference-path=ref.fa",
+                    "--tumor-bam=tumor.bam",
+                    "--normal-bam=normal.bam",
+                    "--samtools={}".format(self.samtools),
+                    "--somaticsniper={}".format(self.sniper),
+                    "--snpfilter={}".format(self.snpfilter),
+                    "--highconfidence-engine=native",
+                    "--loh",
+                    "--resume",
+                ]
+                + list(extra)
+            )
+        )
+        with open("sniper.calls") as fh:
+            return len(fh.readlines())
+
+    def test_unchanged_options_resume_region(self):
+        self.assertEqual(self.run_main("--snpfilter-engine=native"), 1)
+        with open(MOD.MERGED_OUTPUT, 'rb') as fh:
+            merged = fh.read()
+
+        self.assertEqual(self.run_main("--snpfilter-engine=native"), 1)
+        with open(MOD.MERGED_OUTPUT, 'rb') as fh:
+            self.assertEqual(fh.read(), merged)
+
+    def test_changed_engines_recompute_region(self):
+        self.assertEqual(self.run_main("--snpfilter-engine=native"), 1)
+        with open(MOD.MERGED_OUTPUT, 'rb') as fh:
+            native = fh.read()
+
+        self.assertEqual(self.run_main("--snpfilter-engine=perl"), 2)
+        with open(MOD.MERGED_OUTPUT, 'rb') as fh:
+            self.assertNotEqual(fh.read(), native)
+        self.assertEqual(self.run_main("--fused-postprocess"), 3)
+        with open(MOD.MERGED_OUTPUT, 'rb') as fh:
+            self.assertEqual(fh.read(), native)
+
+    def test_changed_output_compression_recomputes_region(self):
+        self.assertEqual(self.run_main("--snpfilter-engine=native"), 1)
+        with open(MOD.MERGED_OUTPUT, 'rb') as fh:
+            plain = fh.read()
+
+        self.assertEqual(
+            self.run_main("--snpfilter-engine=native", "--output-compression=bgzf"), 2
+        )
+        with open(MOD.MERGED_OUTPUT + ".gz", 'rb') as fh:
+            self.assertEqual(gzip.decompress(fh.read()), plain)
+
+
+class Test_async_submit_commands(ThisTestCase):
+    def test_regions_run_and_failures_collected(self):
+        run_args = SimpleNamespace(
+            samtools="samtools",
+            normal_bam="/foo/bar/normal.bam",
+            tumor_bam="/foo/bar/tumor.bam",
+            snpfilter="snp_filter.pl",
+            highconfidence="highconfidence.pl",
+            snpfilter_engine="perl",
+            highconfidence_engine="perl",
+            min_somatic_score=40,
+            min_mapping_quality=40,
+            min_indel_score=50,
+            indel_window=10,
+            fused_postprocess=False,
+            stream_views=False,
+            output_compression="none",
+            plan_regions=None,
+            skip_dash_contigs=False,
+            fail_fast=False,
+            straggler_factor=None,
+            reference_path="/foo/bar/ref.fa",
+            schedule="input",
+            mpileup=["chr1-2-3.mpileup", "chr4-5-6.mpileup"],
+            thread_count=2,
+            stage_limit=None,
+            stage_memory=None,
+            stage_io=None,
+            memory_budget_mb=None,
+            io_tokens=None,
+            timeout=3600,
+        )
+
+        async def fn(mpileup, runner=None, **kwargs):
+            self.assertIsInstance(runner, MOD.AsyncRunner)
+            if mpileup.startswith("chr4"):
+                raise ValueError(mpileup)
+            return mpileup + ".vcf"
+
+        on_result = mock.Mock()
+        found, exceptions = MOD.async_submit_commands(
+            run_args, fn=fn, on_result=on_result
+        )
+        self.assertEqual(found, ["chr1-2-3.mpileup.vcf"])
+        self.assertEqual(len(exceptions), 1)
+        on_result.assert_called_once_with("chr1-2-3.mpileup", "chr1-2-3.mpileup.vcf")
+
+    def test_fail_fast_cancels_other_regions(self):
+        run_args = SimpleNamespace(
+            samtools="samtools",
+            normal_bam="/foo/bar/normal.bam",
+            tumor_bam="/foo/bar/tumor.bam",
+            snpfilter="snp_filter.pl",
+            highconfidence="highconfidence.pl",
+            snpfilter_engine="perl",
+            highconfidence_engine="perl",
+            min_somatic_score=40,
+            min_mapping_quality=40,
+            min_indel_score=50,
+            indel_window=10,
+            fused_postprocess=False,
+            stream_views=False,
+            output_compression="none",
+            plan_regions=None,
+            skip_dash_contigs=False,
+            fail_fast=True,
+            straggler_factor=None,
+            reference_path="/foo/bar/ref.fa",
+            schedule="input",
+            mpileup=["chr1-2-3.mpileup", "chr4-5-6.mpileup"],
+            thread_count=2,
+            stage_limit=None,
+            stage_memory=None,
+            stage_io=None,
+            memory_budget_mb=None,
+            io_tokens=None,
+            timeout=3600,
+        )
+
+        async def fn(mpileup, runner=None, **kwargs):
+            if mpileup.startswith("chr1"):
+                await asyncio.sleep(0.2)
+                raise ValueError(mpileup)
+            await runner.run("sleep 30", None, "somaticsniper")
+            return mpileup + ".vcf"
+
+        start = time.monotonic()
+        found, exceptions = MOD.async_submit_commands(run_args, fn=fn)
+
+        self.assertLess(time.monotonic() - start, 20)
+        self.assertEqual(found, [])
+        self.assertEqual([str(e) for e in exceptions], ["chr1-2-3.mpileup"])
+
 
 # __END__
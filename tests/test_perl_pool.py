@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from somaticsniper_tool import perl_pool as MOD
+from somaticsniper_tool import utils
+
+SCRIPTS = {
+    # Writes its --snp-file upper cased to <snp-file>.out, like the filters
+    "filter.pl": """
+        use strict;
+        use warnings;
+        use Getopt::Long;
+        my $snp_file;
+        GetOptions("snp-file=s" => \\$snp_file) or die "bad options\\n";
+        open(my $in, '<', $snp_file) or die "Cannot open $snp_file\\n";
+        open(my $out, '>', "$snp_file.out") or die "Cannot write\\n";
+        print $out uc($_) while <$in>;
+        close $out;
+        print "wrote $snp_file.out\\n";
+        warn "done\\n";
+        exit(0);
+    """,
+    "die.pl": 'die "bad input\\n";',
+    "exit.pl": "exit(3);",
+    "crash.pl": "kill 'KILL', $$;",
+    "hang.pl": "sleep 30;",
+    "state.pl": "my %seen; $seen{x}++; print $seen{x};",
+    "globals.pl": "our $count; $count++; print $count;",
+    # Leaves a bareword handle open, for perl to flush at exit
+    "unclosed.pl": 'open(OUT, ">$ARGV[0]") or die; print OUT "abcd";',
+}
+
+
+@unittest.skipUnless(shutil.which("perl"), "perl not installed")
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        for name, body in SCRIPTS.items():
+            with open(self.path(name), 'w') as fh:
+                fh.write(body)
+        self.children = utils.ChildProcesses()
+        self.pool = MOD.PerlWorkerPool(
+            1, _utils=SimpleNamespace(CHILDREN=self.children)
+        )
+
+    def tearDown(self):
+        super().tearDown()
+        self.pool.close(_metrics=mock.Mock())
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+
+class TestPerlWorkerPool(ThisTestCase):
+    def test_scripts_share_one_interpreter(self):
+        for i in range(5):
+            snp_file = self.path("{}.vcf".format(i))
+            with open(snp_file, 'w') as fh:
+                fh.write("chr1\t{}\ta\n".format(i))
+
+            found = self.pool.run(self.path("filter.pl"), ["--snp-file", snp_file], 10)
+
+            self.assertEqual(found, "wrote {}.out\ndone\n".format(snp_file).encode())
+            with open(snp_file + ".out") as fh:
+                self.assertEqual(fh.read(), "CHR1\t{}\tA\n".format(i))
+        report = self.pool.report()
+        self.assertEqual(report["workers_started"], 1)
+        self.assertEqual(report["requests"], 5)
+        self.assertEqual(
+            report["startup_seconds_saved"], 4 * report["mean_startup_seconds"]
+        )
+
+    def test_file_scope_variables_start_clean(self):
+        for _ in range(3):
+            self.assertEqual(self.pool.run(self.path("state.pl"), [], 10), b"1")
+            self.assertEqual(self.pool.run(self.path("globals.pl"), [], 10), b"1")
+
+    def test_unclosed_handles_flushed_after_request(self):
+        for i in range(2):
+            out_file = self.path("{}.out".format(i))
+
+            self.pool.run(self.path("unclosed.pl"), [out_file], 10)
+
+            with open(out_file) as fh:
+                self.assertEqual(fh.read(), "abcd")
+        self.assertEqual(self.pool.workers_started, 1)
+
+    def test_failed_script_raises_and_worker_is_reused(self):
+        for script, message in (("die.pl", "bad input"), ("exit.pl", "exit status 3")):
+            with self.subTest(script=script):
+                with self.assertRaisesRegex(ValueError, message):
+                    self.pool.run(self.path(script), [], 10)
+        self.assertEqual(self.pool.run(self.path("state.pl"), [], 10), b"1")
+        self.assertEqual(self.pool.workers_started, 1)
+        self.assertEqual(self.pool.restarts, 0)
+
+    def test_crashed_or_timed_out_worker_replaced(self):
+        for script, timeout in (("crash.pl", 10), ("hang.pl", 0.2)):
+            with self.subTest(script=script):
+                with self.assertRaises(ValueError):
+                    self.pool.run(self.path(script), [], timeout)
+                self.assertEqual(self.pool.run(self.path("state.pl"), [], 10), b"1")
+        self.assertEqual(self.pool.restarts, 2)
+        self.assertEqual(self.pool.workers_started, 3)
+
+    def test_killed_group_kills_running_worker(self):
+        errors = []
+
+        def run():
+            with self.children.group("chr1-1-10.mpileup"):
+                try:
+                    self.pool.run(self.path("hang.pl"), [], 30)
+                except ValueError as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        deadline = time.monotonic() + 10
+        while not self.children._running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(
+            list(self.children._running.values()), ["chr1-1-10.mpileup"]
+        )
+
+        self.assertEqual(self.children.kill("chr1-1-10.mpileup"), 1)
+        thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.children._running, {})
+        # Other groups get a new worker
+        self.assertEqual(self.pool.run(self.path("state.pl"), [], 10), b"1")
+        self.assertEqual(self.pool.restarts, 1)
+
+    def test_request_to_killed_worker_raises_value_error(self):
+        worker = MOD.PerlWorker()
+        # Killed, e.g. with its group, before the request is sent
+        worker.process.kill()
+        worker.process.wait()
+
+        with self.assertRaisesRegex(ValueError, "exited unexpectedly"):
+            worker.call(self.path("state.pl"), [], 10)
+        self.assertFalse(worker.alive)
+        self.assertTrue(worker.process.stdin.closed)
+
+    def test_cancelled_group_not_run(self):
+        self.children.kill("chr1-1-10.mpileup")
+        with self.children.group("chr1-1-10.mpileup"):
+            with self.assertRaisesRegex(ValueError, "Cancelled"):
+                self.pool.run(self.path("state.pl"), [], 10)
+        self.assertEqual(self.pool.workers_started, 0)
+
+    def test_workers_limited_to_pool_size(self):
+        pool = MOD.PerlWorkerPool(2)
+        errors = []
+
+        def run():
+            try:
+                pool.run(self.path("state.pl"), [], 10)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        metrics = mock.Mock()
+        pool.close(_metrics=metrics)
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(pool.workers_started, 2)
+        metrics.add_summary.assert_called_once_with("perl_workers", pool.report())
+        self.assertEqual(pool.report()["requests"], 6)
+
+
+# __END__
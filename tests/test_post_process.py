@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import filecmp
+import os
+import shutil
+import tempfile
+import unittest
+
+from somaticsniper_tool import post_process as MOD
+from somaticsniper_tool.annotate import Annotate
+from somaticsniper_tool.high_confidence import NativeHighConfidence
+from somaticsniper_tool.snp_filter import NativeSnpFilter
+from somaticsniper_tool.vcf_batch import RecordBatch
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data", "region")
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.raw_vcf = os.path.join(self.tmpdir.name, "region.vcf")
+        self.mpileup = os.path.join(DATA_DIR, "region.indel.pileup")
+        shutil.copy(os.path.join(DATA_DIR, "region.vcf"), self.raw_vcf)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+
+class TestPostProcess(ThisTestCase):
+    CLASS_OBJ = MOD.PostProcess
+
+    def _staged(self, output_file, min_indel_score=50, indel_window=10, **kwargs):
+        NativeSnpFilter(
+            None,
+            None,
+            self.raw_vcf,
+            self.mpileup,
+            min_indel_score=min_indel_score,
+            indel_window=indel_window,
+        ).run()
+        snp_filter_output = "{}.SNPfilter".format(self.raw_vcf)
+        NativeHighConfidence(None, None, snp_filter_output, **kwargs).run()
+        with Annotate(output_file) as annotate:
+            annotate(self.raw_vcf, "{}.hc".format(snp_filter_output))
+
+    def test_output_matches_staged_pipeline(self):
+        cases = (
+            {},
+            {"min_somatic_score": 60, "min_mapping_quality": 50},
+            {"min_indel_score": 0, "indel_window": 5},
+        )
+        for kwargs in cases:
+            with self.subTest(kwargs=kwargs):
+                staged = os.path.join(self.tmpdir.name, "staged.vcf")
+                fused = os.path.join(self.tmpdir.name, "fused.vcf")
+                self._staged(staged, **kwargs)
+                found = self.CLASS_OBJ(self.mpileup, **kwargs)(self.raw_vcf, fused)
+                self.assertEqual(found, fused)
+                self.assertTrue(filecmp.cmp(staged, fused, shallow=False))
+
+    def test_no_intermediate_files_written(self):
+        fused = os.path.join(self.tmpdir.name, "fused.vcf")
+        self.CLASS_OBJ(self.mpileup)(self.raw_vcf, fused)
+        self.assertEqual(
+            sorted(os.listdir(self.tmpdir.name)), ["fused.vcf", "region.vcf"]
+        )
+
+
+class Test_high_confidence_stage(unittest.TestCase):
+    def test_failed_records_not_rescored(self):
+        record = b"\t".join(
+            [b"chr1", b"1", b".", b"A", b"G", b".", b".", b".", b"MQ:SSC"]
+            + [b"60:.", b"60:60\n"]
+        )
+        high_confidence = NativeHighConfidence(None, None, "in.vcf")
+        batch = RecordBatch(record * 2)
+        tagged = [(batch, [False, True])]
+        found = list(MOD.high_confidence_stage(tagged, high_confidence))
+        self.assertEqual(found, [(batch, [False, True])])
+
+
+# __END__
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+from somaticsniper_tool import metrics
+from somaticsniper_tool import region_planner as MOD
+from somaticsniper_tool.bgzf import BgzfWriter
+
+WINDOW = 1 << MOD.WINDOW_SHIFT
+
+
+def bgzf_bytes(data):
+    fh = io.BytesIO()
+    with BgzfWriter(fh) as writer:
+        writer.write(data)
+    return fh.getvalue()
+
+
+def bam_header(refs):
+    """Uncompressed BAM header of (name, length) references."""
+    text = b"@HD\tVN:1.6\n"
+    parts = [MOD.BAM_MAGIC, struct.pack("<i", len(text)), text]
+    parts.append(struct.pack("<i", len(refs)))
+    for name, length in refs:
+        encoded = name.encode() + b"\0"
+        parts.append(struct.pack("<i", len(encoded)) + encoded)
+        parts.append(struct.pack("<i", length))
+    return b"".join(parts)
+
+
+def chunks(*pairs):
+    return struct.pack("<i", len(pairs)) + b"".join(
+        struct.pack("<QQ", *pair) for pair in pairs
+    )
+
+
+def bai_bytes(refs):
+    """BAI of refs as (window offsets, end offset, mapped) in block offsets."""
+    parts = [MOD.BAI_MAGIC, struct.pack("<i", len(refs))]
+    for offsets, end, mapped in refs:
+        first = next(o for o in offsets if o)
+        parts.append(struct.pack("<i", 2))
+        parts.append(struct.pack("<I", 4681) + chunks((first << 16, end << 16)))
+        parts.append(
+            struct.pack("<I", MOD.pseudo_bin(MOD.BAI_DEPTH))
+            + chunks((first << 16, end << 16), (mapped, 0))
+        )
+        parts.append(struct.pack("<i", len(offsets)))
+        parts.extend(struct.pack("<Q", o << 16) for o in offsets)
+    return b"".join(parts)
+
+
+def csi_bytes(refs, min_shift=MOD.WINDOW_SHIFT, depth=5):
+    """BGZF compressed CSI of refs as in bai_bytes, leaf bins per window."""
+    first_leaf = ((1 << 3 * depth) - 1) // 7
+    parts = [
+        MOD.CSI_MAGIC,
+        struct.pack("<iiii", min_shift, depth, 0, len(refs)),
+    ]
+    for offsets, end, mapped in refs:
+        bins = [
+            (first_leaf + window, offset)
+            for window, offset in enumerate(offsets)
+            if offset
+        ]
+        parts.append(struct.pack("<i", len(bins) + 1))
+        for bin_id, offset in bins:
+            parts.append(
+                struct.pack("<IQ", bin_id, offset << 16)
+                + chunks((offset << 16, end << 16))
+            )
+        parts.append(
+            struct.pack("<IQ", MOD.pseudo_bin(depth), 0)
+            + chunks((bins[0][1] << 16, end << 16), (mapped, 0))
+        )
+    return bgzf_bytes(b"".join(parts))
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def write(self, name, data):
+        with open(self.path(name), 'wb') as fh:
+            fh.write(data)
+        return self.path(name)
+
+
+class Test_read_density(ThisTestCase):
+    # 100, 0, 200 and 600 bytes of reads in four windows, 90 mapped reads
+    INDEX = [([100, 200, 200, 400], 1000, 90), ([0, 1000, 1100], 1200, 10)]
+
+    def setUp(self):
+        super().setUp()
+        self.bam = self.write(
+            "sample.bam", bgzf_bytes(bam_header([("chr1", 4 * WINDOW), ("chr2", 10)]))
+        )
+
+    def test_bai_window_bytes_scaled_to_mapped_reads(self):
+        self.write("sample.bam.bai", bai_bytes(self.INDEX))
+
+        found = MOD.read_density(self.bam)
+
+        self.assertEqual(found, {"chr1": [10, 0, 20, 60], "chr2": [0, 5, 5]})
+
+    def test_csi_matches_bai(self):
+        self.write("sample.bam.csi", csi_bytes(self.INDEX))
+
+        found = MOD.read_density(self.bam)
+
+        self.assertEqual(found, {"chr1": [10, 0, 20, 60], "chr2": [0, 5, 5]})
+
+    def test_csi_windows_rebinned(self):
+        self.write("sample.bam.csi", csi_bytes(self.INDEX, min_shift=13))
+
+        found = MOD.read_density(self.bam)
+
+        self.assertEqual(found["chr1"], [10, 80])
+
+    def test_missing_index_raises(self):
+        with self.assertRaises(ValueError):
+            MOD.read_density(self.bam)
+
+
+class Test_plan_regions(ThisTestCase):
+    def test_regions_hold_equal_reads(self):
+        contigs = [("chr1", 5 * WINDOW - 7), ("chr2", 2 * WINDOW), ("chr3", WINDOW)]
+        density = {"chr1": [10] * 5, "chr2": [25, 25], "chr3": [0]}
+
+        found = MOD.plan_regions(contigs, density, 4)
+
+        self.assertEqual(
+            found,
+            [
+                ("chr1", 1, 3 * WINDOW),
+                ("chr1", 3 * WINDOW + 1, 5 * WINDOW - 7),
+                ("chr2", 1, WINDOW),
+                ("chr2", WINDOW + 1, 2 * WINDOW),
+            ],
+        )
+
+    def test_small_tail_merged_into_previous_region(self):
+        found = MOD.plan_regions([("chr1", 3 * WINDOW)], {"chr1": [30, 2, 2]}, 2)
+
+        self.assertEqual(found, [("chr1", 1, 3 * WINDOW)])
+
+    def test_no_reads_raises(self):
+        with self.assertRaises(ValueError):
+            MOD.plan_regions([("chr1", WINDOW)], {}, 2)
+
+
+class Test_plan_bam_regions(ThisTestCase):
+    def setUp(self):
+        super().setUp()
+        refs = [("chr1", 4 * WINDOW), ("HLA-A", WINDOW)]
+        self.fai = self.path("ref.fa.fai")
+        with open(self.fai, 'w') as fh:
+            fh.writelines("{}\t{}\t6\t60\t61\n".format(*ref) for ref in refs)
+        self.bams = [
+            self.write(name, bgzf_bytes(bam_header(refs)))
+            for name in ("normal.bam", "tumor.bam")
+        ]
+        # Normal reads in the first half of chr1, tumor reads in the second
+        self.write(
+            "normal.bam.bai", bai_bytes([([100, 200, 300, 300], 300, 20), ([1], 9, 5)])
+        )
+        self.write(
+            "tumor.bai", bai_bytes([([100, 100, 100, 200], 300, 20), ([1], 9, 5)])
+        )
+
+        self.metrics = metrics.RunMetrics()
+
+    def test_normal_and_tumor_reads_summed(self):
+        with self.assertLogs(MOD.logger, "WARNING"):
+            found = MOD.plan_bam_regions(
+                self.fai, self.bams, 2, skip_dash_contigs=True, _metrics=self.metrics
+            )
+
+        self.assertEqual(
+            found, [("chr1", 1, 2 * WINDOW), ("chr1", 2 * WINDOW + 1, 4 * WINDOW)]
+        )
+
+    def test_dash_contig_with_reads_raises(self):
+        with self.assertRaisesRegex(ValueError, "HLA-A"):
+            MOD.plan_bam_regions(self.fai, self.bams, 2, _metrics=self.metrics)
+        self.assertEqual(self.metrics.summaries, {})
+
+    def test_skipped_contigs_counted_in_summary(self):
+        with self.assertLogs(MOD.logger, "WARNING"):
+            MOD.plan_bam_regions(
+                self.fai, self.bams, 2, skip_dash_contigs=True, _metrics=self.metrics
+            )
+
+        self.assertEqual(
+            self.metrics.summaries["region_planner"],
+            {"regions": 2, "skipped_contigs": 1},
+        )
+
+    def test_dash_contig_without_reads_not_skipped(self):
+        self.write(
+            "normal.bam.bai", bai_bytes([([100, 200, 300, 300], 300, 20), ([1], 1, 0)])
+        )
+        self.write(
+            "tumor.bai", bai_bytes([([100, 100, 100, 200], 300, 20), ([1], 1, 0)])
+        )
+        found = MOD.plan_bam_regions(self.fai, self.bams, 2, _metrics=self.metrics)
+
+        self.assertEqual(len(found), 2)
+        self.assertEqual(self.metrics.summaries["region_planner"]["skipped_contigs"], 0)
+
+    def test_regions_split_to_max_region_size(self):
+        found = MOD.plan_bam_regions(
+            self.fai,
+            self.bams,
+            2,
+            max_region_size=WINDOW,
+            skip_dash_contigs=True,
+            _metrics=self.metrics,
+        )
+
+        self.assertEqual(
+            found, [("chr1", i * WINDOW + 1, (i + 1) * WINDOW) for i in range(4)]
+        )
+
+
+# __END__
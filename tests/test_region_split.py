@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import tempfile
+import unittest
+
+from somaticsniper_tool import region_split as MOD
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def _write(self, name, lines):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as fh:
+            fh.write("".join(lines))
+        return path
+
+
+class Test_parse_region(ThisTestCase):
+    def test_region_parsed_from_name(self):
+        found = MOD.parse_region("/foo/chr1-1-248956422.mpileup")
+        self.assertEqual(found, ("chr1", 1, 248956422))
+
+    def test_name_without_range_raises(self):
+        with self.assertRaises(ValueError):
+            MOD.parse_region("/foo/chrUn.mpileup")
+
+
+class Test_plan_sub_regions(ThisTestCase):
+    def test_small_region_not_split(self):
+        found = MOD.plan_sub_regions(("chr1", 1, 100), 100)
+        self.assertEqual(found, [("chr1", 1, 100)])
+
+    def test_balanced_contiguous_sub_regions(self):
+        found = MOD.plan_sub_regions(("chr1", 1, 250), 100)
+        expected = [("chr1", 1, 84), ("chr1", 85, 168), ("chr1", 169, 250)]
+        self.assertEqual(found, expected)
+
+    def test_sub_region_names_round_trip(self):
+        for region in MOD.plan_sub_regions(("chr1", 11, 1000), 300):
+            with self.subTest(region=region):
+                self.assertEqual(MOD.parse_region(MOD.sub_region_name(region)), region)
+
+
+class Test_split_mpileup(ThisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lines = ["chr1\t{}\tA\t1\t.\tI\n".format(pos) for pos in range(1, 201, 5)]
+        self.mpileup = self._write("chr1-1-200.mpileup", self.lines)
+        self.out_dir = os.path.join(self.tmpdir.name, "split")
+
+    def _positions(self, path):
+        with open(path) as fh:
+            return [int(line.split("\t")[1]) for line in fh]
+
+    def test_small_region_returned_as_is(self):
+        found = MOD.split_mpileup(self.mpileup, 200, self.out_dir)
+        self.assertEqual(found, [self.mpileup])
+
+    def test_sub_region_files_named_by_range(self):
+        found = MOD.split_mpileup(self.mpileup, 100, self.out_dir)
+        expected = [
+            os.path.join(self.out_dir, "chr1-1-100.mpileup"),
+            os.path.join(self.out_dir, "chr1-101-200.mpileup"),
+        ]
+        self.assertEqual(found, expected)
+
+    def test_lines_partitioned_with_indel_window_overlap(self):
+        first, second = MOD.split_mpileup(self.mpileup, 100, self.out_dir)
+        self.assertEqual(self._positions(first), list(range(1, 111, 5)))
+        self.assertEqual(self._positions(second), list(range(91, 201, 5)))
+
+    def test_overlap_follows_indel_window(self):
+        first, second = MOD.split_mpileup(
+            self.mpileup, 100, self.out_dir, indel_window=20
+        )
+        self.assertEqual(self._positions(first), list(range(1, 121, 5)))
+        self.assertEqual(self._positions(second), list(range(81, 201, 5)))
+
+
+class Test_stitch_outputs(ThisTestCase):
+    def test_header_once_and_inner_edges_clipped(self):
+        header = ["##fileformat=VCFv4.1\n", "#CHROM\n"]
+        first = self._write(
+            "a.vcf", header + ["chr1\t{}\tx\n".format(p) for p in (1, 50, 100, 101)]
+        )
+        second = self._write(
+            "b.vcf", header + ["chr1\t{}\tx\n".format(p) for p in (100, 101, 250)]
+        )
+        out_fh = io.BytesIO()
+        MOD.stitch_outputs(
+            ["chr1-1-100.mpileup", "chr1-101-200.mpileup"], [first, second], out_fh
+        )
+        found = out_fh.getvalue().decode().splitlines()
+        self.assertEqual(found[:2], ["##fileformat=VCFv4.1", "#CHROM"])
+        positions = [int(line.split("\t")[1]) for line in found[2:]]
+        self.assertEqual(positions, [1, 50, 100, 101, 250])
+
+
+# __END__
@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
 
+import os
+import stat
+import tempfile
+import threading
 import unittest
 from types import SimpleNamespace
 from unittest import mock
@@ -12,6 +16,8 @@ class ThisTestCase(unittest.TestCase):
         super().setUp()
 
         self.mocks = SimpleNamespace(
+            open=mock.MagicMock(),
+            os=mock.MagicMock(spec_set=MOD.os),
             tempfile=mock.MagicMock(spec_set=MOD.tempfile),
             utils=mock.MagicMock(spec_set=MOD.utils),
         )
@@ -73,8 +79,104 @@ class Test_SamtoolsView(ThisTestCase):
             _di=self.mocks,
         ):
             self.mocks.utils.run_subprocess_command.assert_called_once_with(
-                expected_cmd_str, self.timeout, stdout=self.temp_file_mock
+                expected_cmd_str,
+                self.timeout,
+                stdout=self.temp_file_mock,
+                stream_output=True,
             )
 
 
+class Test_SamtoolsMpileup(ThisTestCase):
+    CLASS_OBJ = MOD.SamtoolsMpileup
+
+    def setUp(self):
+        super().setUp()
+        self.mpileup = self.CLASS_OBJ(
+            3600,
+            "samtools",
+            "/path/to/ref.fa",
+            "/path/to/normal.bam",
+            "/path/to/tumor.bam",
+            "chr1:1-20",
+            "planned/chr1-1-20.mpileup",
+            _utils=self.mocks.utils,
+            _di=self.mocks,
+        )
+
+    def test_mpileup_written_to_temp_file_then_renamed(self):
+        found = self.mpileup.run()
+
+        self.assertEqual(found, "planned/chr1-1-20.mpileup")
+        self.mocks.open.assert_called_once_with("planned/chr1-1-20.mpileup.tmp", 'wb')
+        self.mocks.utils.run_subprocess_command.assert_called_once_with(
+            "samtools mpileup -f /path/to/ref.fa -r chr1:1-20 "
+            "/path/to/normal.bam /path/to/tumor.bam",
+            3600,
+            stdout=self.mocks.open.return_value.__enter__.return_value,
+            stream_output=True,
+        )
+        self.mocks.os.replace.assert_called_once_with(
+            "planned/chr1-1-20.mpileup.tmp", "planned/chr1-1-20.mpileup"
+        )
+
+    def test_failed_mpileup_not_renamed(self):
+        self.mocks.utils.run_subprocess_command.side_effect = ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            self.mpileup.run()
+
+        self.mocks.os.replace.assert_not_called()
+
+
+class Test_SamtoolsViewStream(unittest.TestCase):
+    CLASS_OBJ = MOD.SamtoolsViewStream
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # Stand-in for "samtools view -b <bam> <region>" that emits the bam
+        self.samtools = os.path.join(self.tmpdir.name, "samtools")
+        with open(self.samtools, 'w') as fh:
+            fh.write('#!/bin/sh\ncat "$3"\n')
+        os.chmod(self.samtools, stat.S_IRWXU)
+        self.bam_file = os.path.join(self.tmpdir.name, "file.bam")
+        self.content = os.urandom(3 * MOD.SamtoolsViewStream.CHUNK_SIZE + 17)
+        with open(self.bam_file, 'wb') as fh:
+            fh.write(self.content)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def test_view_streamed_through_named_pipe(self):
+        received = []
+        with self.CLASS_OBJ(10, self.samtools, self.bam_file, "chr1:1-20") as view:
+            self.assertTrue(stat.S_ISFIFO(os.stat(view).st_mode))
+            reader = threading.Thread(
+                target=lambda: received.append(open(view, 'rb').read())
+            )
+            reader.start()
+            reader.join(10)
+            stream = view
+        self.assertEqual(received, [self.content])
+        self.assertFalse(os.path.exists(stream))
+
+    def test_bytes_streamed_reported(self):
+        view = self.CLASS_OBJ(10, self.samtools, self.bam_file, "chr1:1-20")
+        with view as fifo:
+            with open(fifo, 'rb') as fh:
+                fh.read()
+        self.assertEqual(view.bytes_streamed, len(self.content))
+
+    def test_unread_stream_raises_instead_of_hanging(self):
+        with self.assertRaises(ValueError):
+            with self.CLASS_OBJ(10, self.samtools, self.bam_file, "chr1:1-20"):
+                pass
+
+    def test_unread_stream_does_not_mask_caller_exception(self):
+        with self.assertRaises(KeyError):
+            with self.CLASS_OBJ(10, self.samtools, self.bam_file, "chr1:1-20"):
+                raise KeyError("sniper failed")
+
+
 # __END__
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from somaticsniper_tool import scheduler as MOD
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mocks = SimpleNamespace(os=mock.MagicMock(spec_set=MOD.os))
+        self.sizes = {}
+        self.mocks.os.path.getsize.side_effect = self._getsize
+
+    def _getsize(self, path):
+        try:
+            return self.sizes[path]
+        except KeyError:
+            raise FileNotFoundError(path)
+
+
+class Test_region_length(ThisTestCase):
+    def test_length_parsed_from_name(self):
+        found = MOD.region_length("/foo/chr1-1-248956422.mpileup")
+        self.assertEqual(found, 248956422)
+
+    def test_unparseable_name_is_zero(self):
+        self.assertEqual(MOD.region_length("/foo/unplaced.mpileup"), 0)
+
+
+class Test_estimate_region_cost(ThisTestCase):
+    def test_size_and_length(self):
+        self.sizes["chr2-1-100.mpileup"] = 42
+        found = MOD.estimate_region_cost("chr2-1-100.mpileup", _di=self.mocks)
+        self.assertEqual(found, (42, 100))
+
+    def test_missing_file_falls_back_to_length(self):
+        found = MOD.estimate_region_cost("chr2-1-100.mpileup", _di=self.mocks)
+        self.assertEqual(found, (0, 100))
+
+
+class Test_order_regions(ThisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mpileups = [
+            "chrY-1-50.mpileup",
+            "chr1-1-200.mpileup",
+            "chr2-1-100.mpileup",
+        ]
+
+    def test_input_order_kept(self):
+        found = MOD.order_regions(self.mpileups, 'input', _di=self.mocks)
+        self.assertEqual(found, self.mpileups)
+
+    def test_longest_first_by_length(self):
+        found = MOD.order_regions(self.mpileups, 'longest-first', _di=self.mocks)
+        self.assertEqual(
+            found, ["chr1-1-200.mpileup", "chr2-1-100.mpileup", "chrY-1-50.mpileup"]
+        )
+
+    def test_longest_first_prefers_mpileup_size(self):
+        self.sizes.update({"chrY-1-50.mpileup": 1000, "chr1-1-200.mpileup": 10})
+        found = MOD.order_regions(self.mpileups, 'longest-first', _di=self.mocks)
+        self.assertEqual(
+            found, ["chrY-1-50.mpileup", "chr1-1-200.mpileup", "chr2-1-100.mpileup"]
+        )
+
+
+# __END__
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+from somaticsniper_tool import sniper_cache as MOD
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def _file(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+
+class Test_cache_key(ThisTestCase):
+    def test_key_changes_with_region_inputs_and_params(self):
+        bam = self._file("normal.bam", "a")
+        base = MOD.cache_key("chr1:1-2", {"normal_bam": bam}, {"map_q": 1})
+        self.assertEqual(
+            base, MOD.cache_key("chr1:1-2", {"normal_bam": bam}, {"map_q": 1})
+        )
+        self.assertNotEqual(
+            base, MOD.cache_key("chr1:1-3", {"normal_bam": bam}, {"map_q": 1})
+        )
+        self.assertNotEqual(
+            base, MOD.cache_key("chr1:1-2", {"normal_bam": bam}, {"map_q": 2})
+        )
+        self._file("normal.bam", "ab")
+        self.assertNotEqual(
+            base, MOD.cache_key("chr1:1-2", {"normal_bam": bam}, {"map_q": 1})
+        )
+
+
+class TestSniperCache(ThisTestCase):
+    def test_get_after_put_copies_entry(self):
+        cache = MOD.SniperCache(self.cache_dir, 100)
+        cache.put("k", self._file("out.vcf", "calls"))
+        dest = os.path.join(self.tmpdir.name, "restored.vcf")
+        self.assertTrue(cache.get("k", dest))
+        with open(dest) as fh:
+            self.assertEqual(fh.read(), "calls")
+
+    def test_miss(self):
+        cache = MOD.SniperCache(self.cache_dir, 100)
+        self.assertFalse(cache.get("k", os.path.join(self.tmpdir.name, "x.vcf")))
+
+    def test_least_recently_used_entry_evicted(self):
+        cache = MOD.SniperCache(self.cache_dir, 10)
+        cache.put("a", self._file("a.vcf", "aaaa"))
+        cache.put("b", self._file("b.vcf", "bbbb"))
+        os.utime(cache.entry_path("a"), ns=(1, 1))
+        os.utime(cache.entry_path("b"), ns=(2, 2))
+        # Hit on a makes b the least recently used
+        cache.get("a", os.path.join(self.tmpdir.name, "restored.vcf"))
+        cache.put("c", self._file("c.vcf", "cccc"))
+        found = sorted(os.listdir(self.cache_dir))
+        self.assertEqual(found, ["a.vcf", "c.vcf"])
+
+
+# __END__
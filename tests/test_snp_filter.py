@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
 
+import asyncio
+import filecmp
+import os
+import shlex
+import shutil
+import tempfile
 import unittest
 from types import SimpleNamespace
 from unittest import mock
@@ -29,6 +35,8 @@ class TestSnpFilter(ThisTestCase):
             "snpfilter": self.snpfilter,
             "vcf_file": self.snp_file,
             "indel_mpileup_file": self.indel_file,
+            "min_indel_score": MOD.MIN_INDEL_SCORE,
+            "indel_window": MOD.INDEL_WINDOW,
         }
         found = self.CLASS_OBJ(
             self.timeout, self.snpfilter, self.snp_file, self.indel_file
@@ -49,8 +57,216 @@ class TestSnpFilter(ThisTestCase):
         )
         snpfilter.run(_utils=self.mocks.utils)
         self.mocks.utils.run_subprocess_command.assert_called_once_with(
-            expected, self.timeout
+            expected, self.timeout, stream_output=True
         )
 
+    def test_only_options_differing_from_defaults_passed(self):
+        cases = (
+            ({}, []),
+            ({"min_indel_score": 30}, ["--min-indel-score", "30"]),
+            ({"indel_window": 5}, ["--indel-win-size", "5"]),
+            (
+                {"min_indel_score": 30, "indel_window": 5},
+                ["--min-indel-score", "30", "--indel-win-size", "5"],
+            ),
+        )
+        for kwargs, expected in cases:
+            with self.subTest(**kwargs):
+                snpfilter = self.CLASS_OBJ(
+                    self.timeout,
+                    self.snpfilter,
+                    self.snp_file,
+                    self.indel_file,
+                    **kwargs,
+                )
+                args = snpfilter.build_args()
+                self.assertEqual(args[5:], expected)
+                self.assertEqual(shlex.split(snpfilter.build_command())[1:], args)
+
+    def test_run_async_runs_command_in_snpfilter_stage(self):
+        runner = mock.Mock()
+        runner.run.return_value = asyncio.sleep(0)
+        snpfilter = self.CLASS_OBJ(
+            self.timeout, self.snpfilter, self.snp_file, self.indel_file
+        )
+        asyncio.run(snpfilter.run_async(runner))
+        runner.run.assert_called_once_with(
+            snpfilter.build_command(),
+            self.timeout,
+            stage="snpfilter",
+            stream_output=True,
+        )
+
+    def test_pool_runs_script_with_command_args(self):
+        pool = mock.Mock()
+        snpfilter = self.CLASS_OBJ(
+            self.timeout, self.snpfilter, self.snp_file, self.indel_file
+        )
+        with mock.patch.object(self.CLASS_OBJ, "pool", pool):
+            snpfilter.run(_utils=self.mocks.utils)
+
+        self.mocks.utils.run_subprocess_command.assert_not_called()
+        script, *args = shlex.split(snpfilter.build_command())[1:]
+        pool.run.assert_called_once_with(script, args, self.timeout)
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data", "region")
+# Installed by the Dockerfile; see data/region/regenerate.sh
+SNPFILTER_PL = os.environ.get("SNPFILTER_PL", "/scripts/snpfilter.pl")
+
+
+class TestIndelIndex(ThisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pileup = os.path.join(DATA_DIR, "region.indel.pileup")
+        self.index = MOD.IndelIndex.from_pileup(self.pileup, min_score=0)
+
+    def test_only_star_reference_lines_indexed(self):
+        expected = {b"chr1": [10200], b"chr2": [20519]}
+        found = {k: list(v) for k, v in self.index.positions.items()}
+        self.assertEqual(found, expected)
+
+    def test_indels_below_min_score_not_indexed(self):
+        cases = (
+            (MOD.MIN_INDEL_SCORE, {b"chr2": [20519]}),
+            (47, {b"chr1": [10200], b"chr2": [20519]}),
+            (121, {}),
+        )
+        for min_score, expected in cases:
+            with self.subTest(min_score=min_score):
+                index = MOD.IndelIndex.from_pileup(self.pileup, min_score=min_score)
+                found = {k: list(v) for k, v in index.positions.items()}
+                self.assertEqual(found, expected)
+
+    def test_near_is_inclusive_of_window_edges(self):
+        cases = (
+            (b"chr1", 10190, True),
+            (b"chr1", 10210, True),
+            (b"chr1", 10189, False),
+            (b"chr1", 10211, False),
+            (b"chr2", 10200, False),
+            (b"chr3", 10200, False),
+        )
+        for chrom, pos, expected in cases:
+            with self.subTest(chrom=chrom, pos=pos):
+                self.assertEqual(self.index.near(chrom, pos, 10), expected)
+
+    def test_near_positions_matches_near(self):
+        positions = list(range(10180, 10220)) + list(range(20500, 20540))
+        for chrom in (b"chr1", b"chr2", b"chr3"):
+            with self.subTest(chrom=chrom):
+                expected = [self.index.near(chrom, pos, 10) for pos in positions]
+                found = self.index.near_positions(chrom, positions, 10)
+                self.assertEqual(list(found), expected)
+
+
+class TestNativeSnpFilter(ThisTestCase):
+    CLASS_OBJ = MOD.NativeSnpFilter
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.vcf_file = os.path.join(self.tmpdir.name, "region.vcf")
+        self.indel_file = os.path.join(DATA_DIR, "region.indel.pileup")
+        shutil.copy(os.path.join(DATA_DIR, "region.vcf"), self.vcf_file)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def test_output_file_matches_perl_naming(self):
+        found = self.CLASS_OBJ(3600, "snpfilter.pl", self.vcf_file, self.indel_file)
+        self.assertEqual(found.output_file, "{}.SNPfilter".format(self.vcf_file))
+
+    def test_output_is_byte_identical_to_fixture(self):
+        snp_filter = self.CLASS_OBJ(
+            3600, "snpfilter.pl", self.vcf_file, self.indel_file
+        )
+        snp_filter.run()
+        expected = os.path.join(DATA_DIR, "region.vcf.SNPfilter")
+        self.assertTrue(filecmp.cmp(snp_filter.output_file, expected, shallow=False))
+
+    def test_run_matches_batch_mask(self):
+        with open(self.vcf_file, 'ab') as fh:
+            # Records without an integer position, kept by both
+            fh.write(b"chr1\t.\t.\tA\tG\n\nchr1\n")
+            # Out of order contigs, and a record of only CHROM and POS
+            fh.write(b"chr1\t10195\t.\tA\tG\nchr2\t20509\n")
+        indels = MOD.IndelIndex.from_pileup(self.indel_file, min_score=0)
+        with open(self.vcf_file, 'rb') as fh:
+            records = [line for line in fh if not line.startswith(b"#")]
+        batch = MOD.RecordBatch(b"".join(records))
+        kept = [
+            line
+            for line, keep in zip(records, self.CLASS_OBJ.mask(batch, indels))
+            if keep
+        ]
+
+        snp_filter = self.CLASS_OBJ(
+            3600, "snpfilter.pl", self.vcf_file, self.indel_file, min_indel_score=0
+        )
+        snp_filter.run()
+
+        with open(snp_filter.output_file, 'rb') as fh:
+            found = [line for line in fh if not line.startswith(b"#")]
+        self.assertEqual(found, kept)
+        self.assertIn(b"chr1\t.\t.\tA\tG\n", found)
+        self.assertNotIn(b"chr2\t20509\n", found)
+
+    def test_min_indel_score_and_window_select_dropped_records(self):
+        cases = (
+            ({}, [(b"chr2", b"20509")]),
+            (
+                {"min_indel_score": 0},
+                [
+                    (b"chr1", b"10190"),
+                    (b"chr1", b"10195"),
+                    (b"chr1", b"10210"),
+                    (b"chr2", b"20509"),
+                ],
+            ),
+            ({"min_indel_score": 0, "indel_window": 5}, [(b"chr1", b"10195")]),
+            ({"indel_window": 11}, [(b"chr2", b"20509"), (b"chr2", b"20530")]),
+        )
+        with open(self.vcf_file, 'rb') as fh:
+            records = [line.split(b"\t")[:2] for line in fh if line[:1] != b"#"]
+        for kwargs, dropped in cases:
+            with self.subTest(**kwargs):
+                snp_filter = self.CLASS_OBJ(
+                    3600, "snpfilter.pl", self.vcf_file, self.indel_file, **kwargs
+                )
+                snp_filter.run()
+                with open(snp_filter.output_file, 'rb') as fh:
+                    kept = [line.split(b"\t")[:2] for line in fh if line[:1] != b"#"]
+                found = [tuple(r) for r in records if r not in kept]
+                self.assertEqual(found, dropped)
+
+    @unittest.skipUnless(os.path.exists(SNPFILTER_PL), "snpfilter.pl not installed")
+    def test_fixture_is_perl_script_output(self):
+        snp_filter = MOD.SnpFilter(3600, SNPFILTER_PL, self.vcf_file, self.indel_file)
+        snp_filter.run()
+        expected = os.path.join(DATA_DIR, "region.vcf.SNPfilter")
+        found = "{}.SNPfilter".format(self.vcf_file)
+        self.assertTrue(filecmp.cmp(found, expected, shallow=False))
+
+    @unittest.skipUnless(os.path.exists(SNPFILTER_PL), "snpfilter.pl not installed")
+    def test_output_is_byte_identical_to_perl_script(self):
+        # The perl script must also accept the options passed when not default
+        for kwargs in ({}, {"min_indel_score": 0, "indel_window": 5}):
+            with self.subTest(**kwargs):
+                snp_filter = self.CLASS_OBJ(
+                    3600, SNPFILTER_PL, self.vcf_file, self.indel_file, **kwargs
+                )
+                snp_filter.run()
+                native_output = "{}.native".format(snp_filter.output_file)
+                os.rename(snp_filter.output_file, native_output)
+
+                MOD.SnpFilter(
+                    3600, SNPFILTER_PL, self.vcf_file, self.indel_file, **kwargs
+                ).run()
+                self.assertTrue(
+                    filecmp.cmp(snp_filter.output_file, native_output, shallow=False)
+                )
+
 
 # __END__
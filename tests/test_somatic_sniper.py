@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import os
+import tempfile
 import unittest
 from collections import namedtuple
 from types import SimpleNamespace
@@ -105,8 +107,82 @@ class Test_SomaticSniper(ThisTestCase):
         self.mocks.UTILS.run_subprocess_command.return_value = subprocess_return
         output_file = obj.run(normal_bam, tumor_bam, _utils=self.mocks.UTILS)
         self.mocks.UTILS.run_subprocess_command.assert_called_once_with(
-            expected_cmd, self.input_args['timeout'], stdout=MOD.PIPE, stderr=MOD.PIPE
+            expected_cmd, self.input_args['timeout'], stream_output=True
         )
 
+    def test_cache_key_is_none_without_cache(self):
+        obj = self.CLASS_OBJ("output")
+        self.assertIsNone(obj.cache_key("chr1:1-2", "normal.bam", "tumor.bam"))
+
+
+class Test_SomaticSniper_cache(ThisTestCase):
+
+    CLASS_OBJ = MOD.SomaticSniper
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        for name in ("normal.bam", "tumor.bam", "ref.fa"):
+            with open(os.path.join(self.tmpdir.name, name), 'w') as fh:
+                fh.write(name)
+        self.CLASS_OBJ._initialize_args(
+            somaticsniper_bin="bam-somaticsniper",
+            map_q=1,
+            flags=[],
+            reference_path=os.path.join(self.tmpdir.name, "ref.fa"),
+        )
+        self.mocks = SimpleNamespace(UTILS=mock.MagicMock(spec_set=MOD.utils))
+        self.CLASS_OBJ.cache = MOD.sniper_cache.SniperCache(
+            os.path.join(self.tmpdir.name, "cache"), 1 << 20
+        )
+        self.normal_bam = os.path.join(self.tmpdir.name, "normal.bam")
+        self.tumor_bam = os.path.join(self.tmpdir.name, "tumor.bam")
+        self.output = os.path.join(self.tmpdir.name, "chr1-1-2")
+
+    def tearDown(self):
+        super().tearDown()
+        self.CLASS_OBJ._initialize_args()
+        self.CLASS_OBJ.cache = None
+        self.tmpdir.cleanup()
+
+    def _run(self):
+        obj = self.CLASS_OBJ(self.output)
+
+        def write_output(*args, **kwargs):
+            with open(obj.output_file, 'w') as fh:
+                fh.write("#CHROM\n")
+            return MOD.utils.PopenReturn(stdout='', stderr='')
+
+        self.mocks.UTILS.run_subprocess_command.side_effect = write_output
+        key = obj.cache_key("chr1:1-2", self.normal_bam, self.tumor_bam)
+        if obj.restore(key):
+            return obj.output_file
+        return obj.run(
+            "normal.view", "tumor.view", cache_key=key, _utils=self.mocks.UTILS
+        )
+
+    def test_second_run_is_cache_hit(self):
+        self._run()
+        os.remove("{}.vcf".format(self.output))
+        found = self._run()
+        self.assertEqual(self.mocks.UTILS.run_subprocess_command.call_count, 1)
+        with open(found) as fh:
+            self.assertEqual(fh.read(), "#CHROM\n")
+
+    def test_changed_params_miss(self):
+        self._run()
+        self.CLASS_OBJ.map_q = 99
+        self._run()
+        self.assertEqual(self.mocks.UTILS.run_subprocess_command.call_count, 2)
+
+    def test_run_does_not_restore(self):
+        self._run()
+        obj = self.CLASS_OBJ(self.output)
+        key = obj.cache_key("chr1:1-2", self.normal_bam, self.tumor_bam)
+        with mock.patch.object(obj, "restore") as restore:
+            obj.run("normal.view", "tumor.view", cache_key=key, _utils=self.mocks.UTILS)
+        restore.assert_not_called()
+        self.assertEqual(self.mocks.UTILS.run_subprocess_command.call_count, 2)
+
 
 # __END__
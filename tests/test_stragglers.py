@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from somaticsniper_tool import stragglers as MOD
+from somaticsniper_tool import utils
+
+HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def region_workflow(slow):
+    """Workflow writing one record at its region's start, sleeping for slow."""
+
+    def fn(mpileup, **kwargs):
+        basename = os.path.basename(mpileup)[: -len(".mpileup")]
+        if basename == slow:
+            utils.run_subprocess_command("sleep 30", None)
+        chrom, start, _ = basename.split("-")
+        output = "{}.annotated.vcf".format(basename)
+        with open(output, 'w') as fh:
+            fh.write(HEADER + "{}\t{}\t.\tA\tG\t.\t.\t.\n".format(chrom, start))
+        return output
+
+    return fn
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        self.mpileups = []
+        for chrom in ("chr1", "chr2", "chr3", "chr4"):
+            self.mpileups.append("{}-1-400.mpileup".format(chrom))
+            with open(self.mpileups[-1], 'w') as fh:
+                fh.writelines(
+                    "{}\t{}\tA\t1\t.\tI\n".format(chrom, pos) for pos in range(1, 401)
+                )
+
+    def tearDown(self):
+        super().tearDown()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+        utils.CHILDREN.reset()
+
+    def run_regions(self, fn, factor=2):
+        results = {}
+        with ThreadPoolExecutor(max_workers=4) as executor, MOD.StragglerMonitor(
+            executor, fn, {}, factor, "split", poll_seconds=0.05
+        ) as monitor:
+            futures = {executor.submit(monitor.run, m): m for m in self.mpileups}
+            for future in as_completed(futures):
+                results[futures[future]] = monitor.result(futures[future], future)
+        return results
+
+
+class TestStragglerMonitor(ThisTestCase):
+    def test_split_wins_and_original_killed(self):
+        start = time.monotonic()
+        with self.assertLogs(MOD.logger, "WARNING"):
+            found = self.run_regions(region_workflow("chr4-1-400"))
+
+        self.assertLess(time.monotonic() - start, 20)
+        self.assertEqual(found["chr1-1-400.mpileup"], "chr1-1-400.annotated.vcf")
+        self.assertEqual(found["chr4-1-400.mpileup"], "chr4-1-400.split.annotated.vcf")
+        with open(found["chr4-1-400.mpileup"]) as fh:
+            records = [line.split("\t")[:2] for line in fh if not line.startswith("#")]
+        self.assertEqual(records, [["chr4", str(pos)] for pos in (1, 101, 201, 301)])
+
+    def test_regions_without_stragglers_not_split(self):
+        found = self.run_regions(region_workflow(None), factor=100)
+
+        self.assertEqual(
+            found, {m: m.replace(".mpileup", ".annotated.vcf") for m in self.mpileups}
+        )
+        self.assertFalse(os.path.exists("split"))
+
+
+# __END__
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import struct
+import tempfile
+import unittest
+
+from somaticsniper_tool import tabix as MOD
+
+
+def parse_index(data: bytes) -> dict:
+    """Parse uncompressed .tbi data into names, config, bins and linear index."""
+    assert data[:4] == MOD.MAGIC
+    n_ref, *conf, l_nm = struct.unpack_from("<8i", data, 4)
+    offset = 36
+    names = data[offset : offset + l_nm].split(b"\0")[:-1]
+    offset += l_nm
+    contigs = {}
+    for name in names:
+        (n_bin,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        bins = {}
+        for _ in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from("<Ii", data, offset)
+            offset += 8
+            bins[bin_id] = [
+                struct.unpack_from("<QQ", data, offset + 16 * i) for i in range(n_chunk)
+            ]
+            offset += 16 * n_chunk
+        (n_intv,) = struct.unpack_from("<i", data, offset)
+        linear = list(struct.unpack_from("<{}Q".format(n_intv), data, offset + 4))
+        offset += 4 + 8 * n_intv
+        contigs[name] = bins, linear
+    assert offset == len(data) and len(names) == n_ref
+    return {"conf": tuple(conf), "contigs": contigs}
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+
+class Test_reg2bin(ThisTestCase):
+    def test_bins(self):
+        for beg, end, expected in (
+            (0, 1, 4681),
+            (0, 1 << 14, 4681),
+            ((1 << 14) - 1, (1 << 14) + 1, 585),
+            (1 << 14, (1 << 14) + 1, 4682),
+            (0, 1 << 29, 0),
+        ):
+            with self.subTest(beg=beg, end=end):
+                self.assertEqual(MOD.reg2bin(beg, end), expected)
+
+    def test_pseudo_bin(self):
+        self.assertEqual(MOD.PSEUDO_BIN, 37450)
+
+
+class TestTabixIndex(ThisTestCase):
+    def test_index_written_as_tabix_vcf(self):
+        index = MOD.TabixIndex()
+        # Adjacent records in one bin share a chunk
+        index.add(b"chr1", 99, 100, 10 << 16, 10 << 16 | 30)
+        index.add(b"chr1", 199, 200, 10 << 16 | 30, 10 << 16 | 60)
+        # A record in the third 16 kb window, in another block
+        index.add(b"chr1", 40000, 40002, 50 << 16, 50 << 16 | 25)
+        index.add(b"chr2", 9, 10, 50 << 16 | 25, 90 << 16)
+        path = os.path.join(self.tmpdir.name, "out.vcf.gz.tbi")
+        index.write(path)
+
+        with open(path, 'rb') as fh:
+            found = parse_index(gzip.decompress(fh.read()))
+        self.assertEqual(found["conf"], (2, 1, 2, 0, ord("#"), 0))
+        self.assertEqual(list(found["contigs"]), [b"chr1", b"chr2"])
+
+        bins, linear = found["contigs"][b"chr1"]
+        self.assertEqual(
+            bins,
+            {
+                4681: [(10 << 16, 10 << 16 | 60)],
+                4683: [(50 << 16, 50 << 16 | 25)],
+                MOD.PSEUDO_BIN: [(10 << 16, 50 << 16 | 25), (3, 0)],
+            },
+        )
+        self.assertEqual(linear, [10 << 16, 10 << 16, 50 << 16])
+
+        bins, linear = found["contigs"][b"chr2"]
+        self.assertEqual(
+            bins,
+            {
+                4681: [(50 << 16 | 25, 90 << 16)],
+                MOD.PSEUDO_BIN: [(50 << 16 | 25, 90 << 16), (1, 0)],
+            },
+        )
+        self.assertEqual(linear, [50 << 16 | 25])
+
+
+# __END__
@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
 
+import io
+import os
+import tempfile
+import time
 import unittest
 from types import SimpleNamespace
 from unittest import mock
@@ -123,6 +127,7 @@ class Test_merge_outputs(ThisTestCase):
     def setUp(self):
         super().setUp()
         self.mocks = SimpleNamespace(open=mock.MagicMock(spec_set=open))
+        self.mocks.open.side_effect = lambda *args: io.BytesIO()
 
     def test_open_called_on_input_files(self):
         input_files = ['foo', 'bar', 'baz']
@@ -130,7 +135,290 @@ class Test_merge_outputs(ThisTestCase):
         MOD.merge_outputs(input_files, mock.Mock(), _di=self.mocks)
         for f in input_files:
             with self.subTest(f=f):
-                self.mocks.open.assert_any_call(f)
+                self.mocks.open.assert_any_call(f, 'rb')
+
+
+class Test_merge_outputs_ordering(ThisTestCase):
+    HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\n"
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    def _vcf(self, name, records, header=HEADER):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as fh:
+            fh.write(header)
+            fh.writelines("{}\t{}\tx\n".format(c, p) for c, p in records)
+        return path
+
+    def _merge(self, files, **kwargs):
+        out_fh = io.BytesIO()
+        MOD.merge_outputs(files, out_fh, **kwargs)
+        return out_fh.getvalue().decode().splitlines()
+
+    def test_records_merged_in_contig_order_and_position(self):
+        files = [
+            self._vcf("chr2.vcf", [("chr2", 5), ("chr2", 50)]),
+            self._vcf("chr10.vcf", [("chr10", 1)]),
+            self._vcf("chr1b.vcf", [("chr1", 100), ("chr1", 200)]),
+            self._vcf("chr1a.vcf", [("chr1", 7), ("chr1", 150)]),
+        ]
+        order = {"chr1": 0, "chr2": 1, "chr10": 2}
+        merged = self._merge(files, contig_order=order)
+        found = [line.split("\t")[:2] for line in merged]
+        expected = [
+            ["chr1", "7"],
+            ["chr1", "100"],
+            ["chr1", "150"],
+            ["chr1", "200"],
+            ["chr2", "5"],
+            ["chr2", "50"],
+            ["chr10", "1"],
+        ]
+        self.assertEqual(found[2:], expected)
+
+    def test_header_taken_from_first_file_only(self):
+        files = [
+            self._vcf("a.vcf", [("chr1", 1)]),
+            self._vcf("b.vcf", [("chr1", 2)], header="##other\n#CHROM\n"),
+        ]
+        found = self._merge(files, buffer_size=1)
+        self.assertEqual(found[:2], ["##fileformat=VCFv4.1", "#CHROM\tPOS"])
+        self.assertEqual(len(found), 4)
+
+    def test_unknown_contigs_sorted_after_known(self):
+        files = [
+            self._vcf("a.vcf", [("chrUn_b", 1)]),
+            self._vcf("b.vcf", [("chrUn_a", 9)]),
+            self._vcf("c.vcf", [("chrX", 3)]),
+        ]
+        merged = self._merge(files, contig_order={"chrX": 0})
+        found = [line.split("\t")[0] for line in merged]
+        self.assertEqual(found[2:], ["chrX", "chrUn_a", "chrUn_b"])
+
+    def test_overlapping_inputs_interleaved(self):
+        files = [
+            self._vcf("a.vcf", [("chr1", 1), ("chr1", 30), ("chr2", 4)]),
+            self._vcf("b.vcf", [("chr1", 20), ("chr1", 30)]),
+            self._vcf("c.vcf", []),
+            self._vcf("d.vcf", [("chr3", 1), ("chr3", 9)]),
+            self._vcf("e.vcf", [("chr3", 9)]),
+            self._vcf("f.vcf", [("chr0", 5)]),
+        ]
+        order = {"chr0": 0, "chr1": 1, "chr2": 2, "chr3": 3}
+        for buffer_size in (1, 8, MOD.MERGE_BUFFER_SIZE):
+            with self.subTest(buffer_size=buffer_size):
+                merged = self._merge(files, contig_order=order, buffer_size=buffer_size)
+                found = [line.split("\t")[:2] for line in merged[2:]]
+                self.assertEqual(
+                    found,
+                    [["chr0", "5"], ["chr1", "1"], ["chr1", "20"], ["chr1", "30"]]
+                    + [["chr1", "30"], ["chr2", "4"], ["chr3", "1"], ["chr3", "9"]]
+                    + [["chr3", "9"]],
+                )
+
+    def test_disjoint_inputs_copied_in_order(self):
+        files = [
+            self._vcf("b.vcf", [("chr1", 300), ("chr1", 400)]),
+            self._vcf("a.vcf", [("chr1", 100), ("chr1", 200)], header="##a\n"),
+        ]
+        # An unterminated last record is ended before the next input
+        with open(files[0], 'a') as fh:
+            fh.write("chr1\t500\tx")
+        merged = self._merge(files, contig_order={"chr1": 0}, buffer_size=4)
+        found = [line.split("\t")[1] for line in merged[2:]]
+        self.assertEqual(found, ["100", "200", "300", "400", "500"])
+
+    def test_blank_lines_skipped(self):
+        files = [
+            self._vcf("a.vcf", [("chr1", 10), ("chr1", 30)]),
+            self._vcf("b.vcf", [("chr1", 20), ("chr1", 40)]),
+            self._vcf("c.vcf", [("chr2", 1)]),
+            self._vcf("d.vcf", []),
+        ]
+        # Leading, inner and trailing blank lines, and a blank-only input
+        for path, blanks in zip(files, ("\n{}\n\n", "{}\n", "\n\n{}\n", "\n\n")):
+            with open(path) as fh:
+                header, records = fh.read().split("#CHROM\tPOS\n")
+            with open(path, 'w') as fh:
+                fh.write(header + "#CHROM\tPOS\n")
+                fh.write(blanks.format(records.replace("\n", "\n\n", 1)))
+        order = {"chr1": 0, "chr2": 1}
+        for buffer_size in (1, 8, MOD.MERGE_BUFFER_SIZE):
+            with self.subTest(buffer_size=buffer_size):
+                merged = self._merge(files, contig_order=order, buffer_size=buffer_size)
+                found = [line.split("\t")[:2] for line in merged[2:] if line]
+                self.assertEqual(
+                    found,
+                    [["chr1", "10"], ["chr1", "20"], ["chr1", "30"], ["chr1", "40"]]
+                    + [["chr2", "1"]],
+                )
+                # Merged groups drop blank lines
+                self.assertNotIn("", merged[2 : merged.index("chr1\t40\tx")])
+
+
+class Test_header_size(ThisTestCase):
+    def test_header_lines_counted(self):
+        header = b"##fileformat=VCFv4.1\n#CHROM\tPOS\n"
+        for data in (header + b"chr1\t1\n", header, b"chr1\t1\n#x\n", b""):
+            for chunk_size in (1, 5, 1 << 20):
+                with self.subTest(data=data, chunk_size=chunk_size):
+                    expected = len(header) if data.startswith(b"#") else 0
+                    found = MOD.header_size(io.BytesIO(data), chunk_size)
+                    self.assertEqual(found, expected)
+
+
+class Test_load_contig_order(ThisTestCase):
+    def test_order_from_fai(self):
+        with tempfile.NamedTemporaryFile('w', suffix=".fai") as fh:
+            fh.write("chr1\t248956422\t112\t70\t71\nchr2\t242193529\t1\t70\t71\n")
+            fh.flush()
+            self.assertEqual(MOD.load_contig_order(fh.name), {"chr1": 0, "chr2": 1})
+
+    def test_missing_fai_is_empty(self):
+        self.assertEqual(MOD.load_contig_order("/does/not/exist.fai"), {})
+
+
+class TestOutputTail(ThisTestCase):
+    def test_lines_split_across_chunks_and_tail_bounded(self):
+        tail = MOD.OutputTail("prog stderr", max_lines=2)
+        with self.assertLogs(MOD.logger, level="DEBUG") as logs:
+            tail.feed(b"one\ntw")
+            tail.feed(b"o\nthree")
+            tail.close()
+        self.assertEqual(tail.text(), "two\nthree\n")
+        self.assertEqual(len(logs.output), 3)
+        self.assertIn("prog stderr: one", logs.output[0])
+
+    def test_long_lines_kept_in_pieces(self):
+        tail = MOD.OutputTail("prog stdout", max_lines=10, max_line_bytes=4)
+        tail.feed(b"abcdefghij")
+        tail.feed(b"kl\n")
+        self.assertEqual(list(tail.lines), ["abcd\n", "efgh\n", "ijkl\n"])
+
+
+class Test_run_subprocess_command_stream_output(ThisTestCase):
+    def test_returns_tails_of_output(self):
+        found = MOD.run_subprocess_command(
+            "sh -c 'seq 1 1000; echo err >&2'", 10, stream_output=True
+        )
+        self.assertEqual(
+            found.stdout.splitlines(), [str(i) for i in range(801, 1001)]
+        )
+        self.assertEqual(found.stderr, "err\n")
+
+    def test_redirected_stdout_left_alone(self):
+        with tempfile.TemporaryFile() as fh:
+            found = MOD.run_subprocess_command(
+                "echo out", 10, stdout=fh, stream_output=True
+            )
+            fh.seek(0)
+            self.assertEqual(fh.read(), b"out\n")
+        self.assertIsNone(found.stdout)
+        self.assertEqual(found.stderr, "")
+
+    def test_nonzero_exit_raises_with_stderr_tail(self):
+        with self.assertRaises(ValueError) as e:
+            MOD.run_subprocess_command(
+                "sh -c 'seq 1 500 >&2; echo last >&2; exit 1'", 10, stream_output=True
+            )
+        lines = str(e.exception).splitlines()
+        self.assertEqual(len(lines), MOD.TAIL_LINES)
+        self.assertEqual(lines[-1], "last")
+
+    def test_timeout_kills_and_raises(self):
+        with self.assertRaises(ValueError):
+            MOD.run_subprocess_command("sleep 10", 0.2, stream_output=True)
+
+
+class TestRusagePopen(ThisTestCase):
+    def test_rusage_kept_after_wait(self):
+        p = MOD.RusagePopen(["true"])
+        p.wait()
+        self.assertEqual(p.returncode, 0)
+        self.assertIsNotNone(p.rusage)
+        self.assertGreaterEqual(p.rusage.ru_maxrss, 0)
+
+    def test_rusage_kept_and_child_forgotten_after_poll(self):
+        with MOD.CHILDREN.group("chr1"):
+            p = MOD.RusagePopen(["true"])
+        deadline = time.monotonic() + 10
+        while p.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(p.returncode, 0)
+        self.assertIsNotNone(p.rusage)
+        self.assertNotIn(p, MOD.CHILDREN._running)
+        self.assertEqual(MOD.CHILDREN.kill("chr1"), 0)
+        MOD.CHILDREN.reset()
+
+    def test_poll_of_running_child_returns_none(self):
+        p = MOD.RusagePopen(["sleep", "30"])
+        self.addCleanup(p.wait)
+        self.addCleanup(p.kill)
+
+        self.assertIsNone(p.poll())
+        self.assertIn(p, MOD.CHILDREN._running)
+
+    def test_rusage_kept_after_communicate(self):
+        p = MOD.RusagePopen(
+            ["sh", "-c", "echo out; exit 3"], stdout=MOD.subprocess.PIPE
+        )
+        stdout, _ = p.communicate(timeout=10)
+
+        self.assertEqual((stdout, p.returncode), (b"out\n", 3))
+        self.assertIsNotNone(p.rusage)
+        self.assertNotIn(p, MOD.CHILDREN._running)
+
+    def test_wait_timeout_raises_then_killed_child_reaped(self):
+        p = MOD.RusagePopen(["sleep", "30"])
+
+        with self.assertRaises(MOD.subprocess.TimeoutExpired):
+            p.wait(0.05)
+        p.kill()
+
+        self.assertEqual(p.wait(10), -9)
+        self.assertIsNotNone(p.rusage)
+
+
+class TestChildProcesses(ThisTestCase):
+    def tearDown(self):
+        super().tearDown()
+        MOD.CHILDREN.reset()
+
+    def start(self, group):
+        with MOD.CHILDREN.group(group):
+            return MOD.RusagePopen(["sleep", "30"])
+
+    def test_kill_group_kills_only_its_children(self):
+        first, second = self.start("chr1"), self.start("chr2")
+
+        killed = MOD.CHILDREN.kill("chr1")
+
+        self.assertEqual(killed, 1)
+        self.assertEqual(first.wait(10), -9)
+        self.assertIsNone(second.poll())
+        with self.assertRaises(ValueError):
+            self.start("chr1")
+        MOD.CHILDREN.kill()
+        self.assertEqual(second.wait(10), -9)
+        with self.assertRaises(ValueError):
+            self.start("chr3")
+
+    def test_reaped_children_forgotten(self):
+        with MOD.CHILDREN.group("chr1"):
+            MOD.RusagePopen(["true"]).wait()
+
+        self.assertEqual(MOD.CHILDREN.kill("chr1"), 0)
+        MOD.CHILDREN.reset()
+        p = self.start("chr1")
+        p.kill()
+        self.assertEqual(p.wait(10), -9)
 
 
 # __END__
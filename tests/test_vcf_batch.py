@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+
+from somaticsniper_tool import vcf_batch as MOD
+
+
+class ThisTestCase(unittest.TestCase):
+    HEADER = [
+        b"##fileformat=VCFv4.1\n",
+        b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR\n",
+    ]
+    RECORDS = [
+        b"chr1\t100\t.\tA\tG\t.\t.\tDP=3\tGT:SSC:MQ\t0/0:.:60\t0/1:45:38\n",
+        b"chr1\t200\t.\tC\tT\t.\t.\t.\tGT:MQ\t0/0:60\t0/1:52\r\n",
+        b"chr2\t7\t.\tG\tA\t.\tPASS\t.\tGT:SSC:MQ\t0/0:.:60\t0/1:61:60",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.batch = MOD.RecordBatch(b"".join(self.RECORDS))
+
+
+class TestRecordBatch(ThisTestCase):
+    def test_columns_match_split(self):
+        for i, record in enumerate(self.RECORDS):
+            fields = record.rstrip(b"\r\n").split(b"\t")
+            with self.subTest(i=i):
+                self.assertEqual(self.batch.line(i), record)
+                self.assertEqual(self.batch.pos[i], int(fields[MOD.POS]))
+                for column in range(MOD.TUMOR + 1):
+                    self.assertEqual(
+                        self.batch.column(i, column), fields[column], column
+                    )
+
+    def test_key_matches_bytes_key(self):
+        self.assertIn(self.batch.key(1), {(b"chr1", 200, b"C", b"T")})
+
+    def test_sample_values(self):
+        self.assertEqual(self.batch.sample_values(b"MQ"), [b"38", b"52", b"60"])
+        self.assertEqual(self.batch.sample_values(b"SSC"), [b"45", None, b"61"])
+        self.assertEqual(
+            self.batch.sample_values(b"SSC", MOD.NORMAL, rows=[2, 0]), [b".", b"."]
+        )
+
+    def test_sample_values_of_short_samples(self):
+        batch = MOD.RecordBatch(
+            b"chr1\t1\t.\tA\tG\t.\t.\t.\tGT:SSC:MQ\t0/0\t0/1:50\n"
+            b"chr1\t2\t.\tA\tG\t.\t.\t.\tGT:SSC:MQ\t0/0\t0/1:50:60\n"
+        )
+        self.assertEqual(batch.sample_values(b"MQ"), [None, b"60"])
+
+    def test_short_records(self):
+        batch = MOD.RecordBatch(b"chr1\tx\n\nchr1\t5\t.\tA\n")
+        self.assertEqual(list(batch.pos), [-1, -1, 5])
+        self.assertEqual(batch.column(2, MOD.REF), b"A")
+        self.assertEqual(batch.key(2), (b"chr1", 5, b"A", b""))
+        self.assertEqual(batch.sample_values(b"MQ"), [None] * 3)
+
+    def test_uneven_columns(self):
+        batch = MOD.RecordBatch(
+            b"chr1\t1\t.\tA\tG\t.\t.\t.\tGT\t0/0\t0/1\tX\n"
+            b"chr2\t2\t.\tC\tT\t.\t.\t.\tGT\t0/0\n"
+        )
+        self.assertEqual(
+            list(batch.keys()), [(b"chr1", 1, b"A", b"G"), (b"chr2", 2, b"C", b"T")]
+        )
+        self.assertEqual(batch.column(0, MOD.TUMOR), b"0/1\tX")
+        self.assertEqual(batch.column(1, MOD.NORMAL), b"0/0")
+        self.assertEqual(batch.column(1, MOD.TUMOR), b"")
+
+    def test_write_replaces_filter_only(self):
+        out_fh = io.BytesIO()
+        self.batch.write(out_fh, filters=[b"LOH", b"REJECT", b"LOH"])
+        expected = [
+            b"\t".join(fields[:6] + [b"LOH" if i != 1 else b"REJECT"] + fields[7:])
+            for i, fields in enumerate(r.split(b"\t") for r in self.RECORDS)
+        ]
+        self.assertEqual(out_fh.getvalue(), b"".join(expected))
+
+    def test_write_keeps_selected_records(self):
+        for keep in ([True, False, True], [False, True, True], [False] * 3):
+            with self.subTest(keep=keep):
+                out_fh = io.BytesIO()
+                self.batch.write(out_fh, keep=keep)
+                expected = [r for r, k in zip(self.RECORDS, keep) if k]
+                self.assertEqual(out_fh.getvalue(), b"".join(expected))
+
+    def test_write_without_filter_column_raises(self):
+        batch = MOD.RecordBatch(b"chr1\t5\t.\tA\n")
+        with self.assertRaises(ValueError):
+            batch.write(io.BytesIO(), filters=[b"LOH"])
+
+
+class TestVcfReader(ThisTestCase):
+    def test_batches_cover_all_records(self):
+        data = b"".join(self.HEADER + self.RECORDS)
+        for batch_bytes in (1, 16, 64, 1 << 20):
+            with self.subTest(batch_bytes=batch_bytes):
+                reader = MOD.VcfReader(io.BytesIO(data), batch_bytes)
+                self.assertEqual(reader.headers, self.HEADER)
+                lines = [
+                    bytes(batch.line(i)) for batch in reader for i in range(len(batch))
+                ]
+                self.assertEqual(lines, self.RECORDS)
+
+    def test_header_only(self):
+        reader = MOD.VcfReader(io.BytesIO(b"".join(self.HEADER)))
+        self.assertEqual(reader.headers, self.HEADER)
+        self.assertEqual(list(reader), [])
+
+
+# __END__
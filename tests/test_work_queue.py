@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+from collections import Counter
+
+from somaticsniper_tool import work_queue as MOD
+
+REGIONS = ["chr{}-1-100.mpileup".format(i) for i in range(1, 13)]
+
+
+def annotate_region(mpileup):
+    """Stand-in workflow, crashing its worker the first time it sees chr3."""
+    if mpileup.startswith("chr3-") and not os.path.exists("crashed"):
+        open("crashed", 'w').close()
+        os._exit(1)
+    time.sleep(0.02)
+    output = mpileup.replace(".mpileup", ".annotated.vcf")
+    with open(output, 'a') as fh:
+        fh.write("{}\n".format(os.getpid()))
+    return output
+
+
+def serve(queue_dir):
+    queue = MOD.WorkQueue(queue_dir, lease_seconds=0.5)
+    run = queue.wait_for_run(poll_seconds=0.02)
+    os.chdir(run["work_dir"])
+    MOD.QueueWorker(
+        queue, run["run_id"], annotate_region, threads=2, poll_seconds=0.02
+    ).serve()
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue_dir = os.path.join(self.tmpdir.name, "queue")
+        self.queue = MOD.WorkQueue(self.queue_dir, lease_seconds=0.5)
+        self.run = {"run_id": "run1", "work_dir": self.tmpdir.name}
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+
+class TestWorkQueue(ThisTestCase):
+    def test_tasks_claimed_once_in_order(self):
+        tasks = self.queue.publish(self.run, REGIONS[:2])
+
+        first, second = self.queue.claim(), self.queue.claim()
+
+        self.assertEqual([first[1], second[1]], REGIONS[:2])
+        self.assertEqual(sorted(tasks), [first[0], second[0]])
+        self.assertIsNone(self.queue.claim())
+        self.queue.post(first[0], first[1], result="a.vcf")
+        self.queue.post(second[0], second[1], error="boom")
+        self.assertEqual(
+            sorted(self.queue.results(tasks, poll_seconds=0)),
+            [(REGIONS[0], "a.vcf", None), (REGIONS[1], None, "boom")],
+        )
+        self.assertEqual(self.queue.list_tasks(MOD.CLAIMED), [])
+
+    def test_stale_claims_requeued_then_failed(self):
+        tasks = self.queue.publish(self.run, REGIONS[:1])
+        self.queue.lease_seconds = 0
+        attempts = Counter()
+
+        for _ in range(2):
+            task, _ = self.queue.claim()
+            with self.assertLogs(MOD.logger, "WARNING"):
+                self.queue.requeue_stale(attempts, max_attempts=3)
+            self.assertEqual(self.queue.list_tasks(MOD.PENDING), [task])
+        self.queue.claim()
+        self.queue.requeue_stale(attempts, max_attempts=3)
+
+        ((mpileup, result, error),) = self.queue.results(tasks, poll_seconds=0)
+        self.assertEqual(mpileup, REGIONS[0])
+        self.assertIn("Claimed 3 times", error)
+
+    def test_cancel_drops_pending_tasks(self):
+        self.queue.publish(self.run, REGIONS[:3])
+        self.queue.claim()
+
+        self.assertEqual(self.queue.cancel("run1"), 2)
+        self.assertTrue(self.queue.cancelled("run1"))
+        self.assertFalse(self.queue.cancelled("run2"))
+
+    def test_stopped_run_not_served(self):
+        self.queue.publish(self.run, REGIONS[:1])
+        self.queue.stop("run1")
+
+        self.assertTrue(self.queue.stopped("run1"))
+        self.queue.publish(dict(self.run, run_id="run2"), REGIONS[:1])
+        self.assertEqual(self.queue.wait_for_run(poll_seconds=0)["run_id"], "run2")
+
+    def test_live_run_not_published_over(self):
+        tasks = self.queue.publish(self.run, REGIONS[:2])
+        self.queue.claim()
+
+        with self.assertRaisesRegex(ValueError, "Run run1 .* is not over"):
+            self.queue.publish(dict(self.run, run_id="run2"), REGIONS[2:3])
+        self.assertEqual(self.queue.live_run(), "run1")
+        self.assertEqual(sorted(self.queue.list_tasks(MOD.PENDING)), sorted(tasks)[1:])
+        self.assertEqual(len(self.queue.list_tasks(MOD.CLAIMED)), 1)
+
+        # Coordinator died, leaving run.json untouched past the lease
+        run_file = self.queue.path(MOD.RUN_FILE)
+        stale = time.time() - self.queue.lease_seconds
+        os.utime(run_file, (stale, stale))
+        self.assertIsNone(self.queue.live_run())
+        self.queue.renew_run()
+        self.assertEqual(self.queue.live_run(), "run1")
+        os.utime(run_file, (stale, stale))
+        self.queue.publish(dict(self.run, run_id="run2"), REGIONS[2:3])
+        self.assertEqual(self.queue.live_run(), "run2")
+
+
+class TestQueueWorker(ThisTestCase):
+    def test_worker_processes_share_regions(self):
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(target=serve, args=(self.queue_dir,)) for _ in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        tasks = self.queue.publish(self.run, REGIONS)
+
+        with self.assertLogs(MOD.logger, "WARNING"):
+            found = list(self.queue.results(tasks, poll_seconds=0.02))
+        self.queue.stop("run1")
+        for worker in workers:
+            worker.join(10)
+
+        self.assertEqual(sorted(m for m, _, _ in found), sorted(REGIONS))
+        self.assertTrue(all(error is None for _, _, error in found))
+        # The crashed worker's region was requeued to another
+        self.assertEqual(sorted(w.exitcode for w in workers), [0, 0, 1])
+        for _, result, _ in found:
+            self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, result)))
+
+
+# __END__
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from somaticsniper_tool import worker as MOD
+from somaticsniper_tool.multi_somaticsniper import process_argv
+
+
+class ThisTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mocks = SimpleNamespace(
+            QUEUE=mock.MagicMock(spec_set=MOD.WorkQueue),
+            WORKER=mock.MagicMock(spec_set=MOD.QueueWorker),
+            OS=mock.MagicMock(spec_set=MOD.os),
+        )
+        self.mocks.OS.path = os.path
+        self.mocks.OS.sep = os.sep
+        run_args = process_argv(
+            [
+                "--thread-count=4",
+                "--mpileup=chr1-2-3.mpileup",
+                "--reference-path=/foo/bar/ref.fa",
+                "--tumor-bam=/foo/bar/tumor.bam",
+                "--normal-bam=normal.bam",
+                "--queue-dir=/shared/queue",
+                "--samtools=samtools",
+                "--somaticsniper=bin/bam-somaticsniper",
+            ]
+        )
+        self.run = dict(run_args._asdict(), run_id="run1", work_dir="/shared/run")
+        queue = self.mocks.QUEUE.return_value
+        queue.wait_for_run.return_value = self.run
+        self.mocks.WORKER.return_value.serve.return_value = 3
+
+    def run_worker(self, argv):
+        with mock.patch.object(MOD, "configure_somaticsniper") as configure:
+            found = MOD.run_worker(
+                MOD.setup_parser().parse_args(argv),
+                _queue=self.mocks.QUEUE,
+                _worker=self.mocks.WORKER,
+                _os=self.mocks.OS,
+            )
+        configure.assert_called_once()
+        self.configure = configure
+        return found
+
+
+class Test_run_worker(ThisTestCase):
+    def test_regions_run_in_run_work_dir(self):
+        found = self.run_worker(["--queue-dir", "queue"])
+
+        self.assertEqual(found, 3)
+        self.mocks.OS.chdir.assert_not_called()
+        queue = self.mocks.QUEUE.return_value
+        self.assertEqual(queue.lease_seconds, self.run["queue_lease_seconds"])
+        args, kwargs = self.mocks.WORKER.call_args
+        self.assertEqual(args[:2], (queue, "run1"))
+        self.assertEqual(kwargs["threads"], 4)
+        region = args[2]
+        self.assertEqual(region.func, MOD.run_region)
+        self.assertEqual(region.keywords["work_dir"], "/shared/run")
+        self.assertEqual(region.keywords["tumor_bam"], "/foo/bar/tumor.bam")
+        self.assertEqual(region.keywords["normal_bam"], "/shared/run/normal.bam")
+        # Commands without a directory are looked up on PATH
+        self.assertEqual(region.keywords["samtools"], "samtools")
+        run_args = self.configure.call_args[0][0]
+        self.assertEqual(
+            run_args.somaticsniper_bin, "/shared/run/bin/bam-somaticsniper"
+        )
+
+    def test_thread_count_overrides_run(self):
+        self.run_worker(["--queue-dir", "queue", "--thread-count", "16"])
+
+        self.assertEqual(self.mocks.WORKER.call_args[1]["threads"], 16)
+
+
+class Test_run_region(ThisTestCase):
+    def test_mpileup_and_outputs_in_work_dir(self):
+        with mock.patch.object(MOD, "multithread_somaticsniper") as region:
+            MOD.run_region("chr1-2-3.mpileup", "/shared/run", timeout=60)
+
+        region.assert_called_once_with(
+            "/shared/run/chr1-2-3.mpileup", output_dir="/shared/run", timeout=60
+        )
+
+
+# __END__